@@ -1,8 +1,11 @@
 # calc.py
 # -*- coding: utf-8 -*-
 from __future__ import annotations
+from collections import OrderedDict
 from dataclasses import dataclass
+from functools import lru_cache
 import math
+import threading
 from decimal import Decimal, getcontext, ROUND_HALF_UP
 from typing import Dict, Any, List, Optional, Tuple
 
@@ -41,6 +44,150 @@ def pct(x) -> Decimal:
     v = D(x)
     return v/Decimal(100) if v > 1 else v
 
+# ---------------------------------------------------------------------
+# Ponto fixo (backend "centavos")
+# ---------------------------------------------------------------------
+# Dinheiro em centavos (int) e taxas escaladas por 10^8 (int).  O contexto
+# Decimal tem prec=28; só usamos inteiros quando o resultado Decimal seria
+# exato (coeficiente < 10^28) — fora disso o motor volta ao caminho Decimal.
+CALC_BACKENDS = ("decimal", "centavos")
+_RATE_SCALE = 8
+_RATE_ONE = 10 ** _RATE_SCALE
+_RATE_HALF = _RATE_ONE // 2
+_PREC_LIMIT = 10 ** 28
+_CASAS_PRODUTO = 10 ** 15
+
+
+class _NaoRepresentavel(Exception):
+    """Valor que não cabe exatamente no backend de centavos."""
+
+
+def _div_half_up(n: int, d: int) -> int:
+    """n/d arredondado ROUND_HALF_UP (meio centavo se afasta do zero), d > 0."""
+    q, r = divmod(abs(n), d)
+    if 2 * r >= d:
+        q += 1
+    return q if n >= 0 else -q
+
+
+def _fracao(x: Decimal) -> Tuple[int, int]:
+    """Decimal finito -> (numerador, denominador) exatos."""
+    try:
+        return x.as_integer_ratio()
+    except (ValueError, OverflowError):   # NaN/Infinity
+        raise _NaoRepresentavel(x)
+
+
+def _to_centavos(x: Decimal) -> int:
+    """Valor monetário exato em centavos (sem arredondar)."""
+    n, d = _fracao(x)
+    c, r = divmod(n * 100, d)
+    if r or abs(c) >= _PREC_LIMIT // 100:
+        raise _NaoRepresentavel(x)
+    return c
+
+
+def _produto_centavos(qtd: Decimal, vu: Decimal) -> int:
+    """q2(qtd * vu) em centavos.
+
+    O produto Decimal só é exato com até 28 dígitos significativos; exigimos
+    no máximo 15 casas decimais e |produto| < 10^13 (=> <= 28 dígitos).
+    """
+    nq, dq = _fracao(qtd)
+    nv, dv = _fracao(vu)
+    den = dq * dv
+    if _CASAS_PRODUTO % den:
+        raise _NaoRepresentavel((qtd, vu))
+    num = nq * nv
+    if abs(num * (_CASAS_PRODUTO // den)) >= _PREC_LIMIT:
+        raise _NaoRepresentavel((qtd, vu))
+    return _div_half_up(num * 100, den)
+
+
+@lru_cache(maxsize=1024)
+def _to_taxa(x: Decimal) -> int:
+    """Taxa (já em fração, ex.: 0.1947) escalada por 10^8."""
+    n, d = _fracao(x)
+    t, r = divmod(n * _RATE_ONE, d)
+    if r:
+        raise _NaoRepresentavel(x)
+    return t
+
+
+def _aplica_taxa(taxa: int, centavos: int) -> int:
+    """q2(taxa * valor) em centavos (exato enquanto couber em 28 dígitos)."""
+    prod = taxa * centavos
+    if prod >= 0:
+        if prod >= _PREC_LIMIT:
+            raise _NaoRepresentavel(prod)
+        return (prod + _RATE_HALF) // _RATE_ONE
+    if -prod >= _PREC_LIMIT:
+        raise _NaoRepresentavel(prod)
+    return -((_RATE_HALF - prod) // _RATE_ONE)
+
+
+_CENTAVO = Decimal("0.01")
+
+
+def _cent_to_dec(c: int) -> Decimal:
+    return Decimal(c) * _CENTAVO
+
+
+# ---------------------------------------------------------------------
+# Normalização de códigos (NCM/CEST)
+# ---------------------------------------------------------------------
+def _only_digits_impl(s: Any) -> str:
+    """Extrai apenas dígitos, normalizando floats/decimais inteiros.
+
+    Muitos arquivos de planilha chegam com códigos numéricos (NCM/CEST)
+    convertidos para `float`, ficando algo como ``1002000.0``.  Se apenas
+    removêssemos o ponto, ganharíamos um zero extra (``10020000``) e o
+    match por CEST deixaria de acontecer.  Aqui normalizamos esses casos
+    para preservar apenas a parte inteira.
+    """
+
+    if s is None:
+        return ""
+
+    # Valores numéricos -> representa como inteiro quando não há parte
+    # fracionária. Isso evita zeros extras vindos de floats "x.0".
+    if isinstance(s, bool):  # bool é subclass de int; ignora aqui
+        pass
+    elif isinstance(s, (int, Decimal)):
+        try:
+            dec = Decimal(s)
+        except Exception:
+            dec = None
+        else:
+            if dec == dec.to_integral():
+                return str(dec.quantize(Decimal('1')))
+    elif isinstance(s, float):
+        if math.isnan(s) or math.isinf(s):
+            return ""
+        if s.is_integer():
+            return str(int(s))
+        # formata sem notação científica; remove zeros finais
+        txt = format(s, 'f').rstrip('0').rstrip('.')
+        return "".join(ch for ch in txt if ch.isdigit())
+
+    text = str(s).strip()
+    if not text:
+        return ""
+
+    # Se for algo do tipo "1234.00" ou "1234,00" mantém apenas parte inteira
+    if text.count('.') + text.count(',') == 1:
+        sep = '.' if '.' in text else ','
+        left, right = text.split(sep, 1)
+        if right.strip().strip('0') == "":
+            return "".join(ch for ch in left if ch.isdigit())
+
+    return "".join(ch for ch in text if ch.isdigit())
+
+
+_only_digits_cached = lru_cache(maxsize=8192, typed=True)(_only_digits_impl)
+_ONLY_DIGITS_CACHEABLE = (str, int, float)
+
+
 # ---------------------------------------------------------------------
 # Modelos
 # ---------------------------------------------------------------------
@@ -86,7 +233,9 @@ class MotorCalculo:
         aliquota_origem: Decimal = Decimal('0.07'),      # 7% origem (desoneração)
         mva: Decimal = Decimal('0.35'),                  # 35% default (se não houver planilha)
         aliquota_interna: Decimal = Decimal('0.20'),     # 20% default
-        multiplicador_sefaz: Decimal = Decimal('0.1947') # 19,47% default
+        multiplicador_sefaz: Decimal = Decimal('0.1947'), # 19,47% default
+        rule_cache_size: int = 4096,                      # 0 desliga o cache de regras
+        backend: str = "decimal",                         # "decimal" | "centavos"
     ):
         self.matrices = matrices or {}
         self.aliquota_origem = D(aliquota_origem)
@@ -94,6 +243,22 @@ class MotorCalculo:
         self.aliquota_interna_default = D(aliquota_interna)
         self.multiplicador_sefaz_default = D(multiplicador_sefaz)
 
+        backend = (backend or "decimal").strip().lower()
+        if backend not in CALC_BACKENDS:
+            raise ValueError(f"backend de cálculo inválido: {backend!r} (use {', '.join(CALC_BACKENDS)})")
+        self.backend = backend
+
+        # cache LRU das decisões de regra; vive e morre com a instância
+        # (rebuild_motor cria um motor novo => cache novo)
+        self.rule_cache_size = max(0, int(rule_cache_size or 0))
+        self._rule_cache: "OrderedDict[Tuple[str, str, str, str, str], Dict[str, Any]]" = OrderedDict()
+        self._rule_cache_lock = threading.Lock()
+        self._rule_cache_hits = 0
+        self._rule_cache_misses = 0
+
+        # índice NCM -> linhas das matrices (montado sob demanda ou via compilar())
+        self._indice: Optional[Dict[str, List[tuple]]] = None
+
     # ------------------------- helpers matrices -------------------------
 
     @staticmethod
@@ -102,51 +267,16 @@ class MotorCalculo:
 
     @staticmethod
     def _only_digits(s: Any) -> str:
-        """Extrai apenas dígitos, normalizando floats/decimais inteiros.
+        """Extrai apenas dígitos (ver ``_only_digits_impl``), com cache.
 
-        Muitos arquivos de planilha chegam com códigos numéricos (NCM/CEST)
-        convertidos para `float`, ficando algo como ``1002000.0``.  Se apenas
-        removêssemos o ponto, ganharíamos um zero extra (``10020000``) e o
-        match por CEST deixaria de acontecer.  Aqui normalizamos esses casos
-        para preservar apenas a parte inteira.
+        NCM/CEST se repetem muito entre itens e notas; a normalização é
+        memorizada por valor *e* tipo (``1`` ≠ ``1.0``).  ``Decimal`` fica
+        de fora: ``Decimal('1.5') == Decimal('1.50')`` mas geram dígitos
+        diferentes.
         """
-
-        if s is None:
-            return ""
-
-        # Valores numéricos -> representa como inteiro quando não há parte
-        # fracionária. Isso evita zeros extras vindos de floats "x.0".
-        if isinstance(s, bool):  # bool é subclass de int; ignora aqui
-            pass
-        elif isinstance(s, (int, Decimal)):
-            try:
-                dec = Decimal(s)
-            except Exception:
-                dec = None
-            else:
-                if dec == dec.to_integral():
-                    return str(dec.quantize(Decimal('1')))
-        elif isinstance(s, float):
-            if math.isnan(s) or math.isinf(s):
-                return ""
-            if s.is_integer():
-                return str(int(s))
-            # formata sem notação científica; remove zeros finais
-            txt = format(s, 'f').rstrip('0').rstrip('.')
-            return "".join(ch for ch in txt if ch.isdigit())
-
-        text = str(s).strip()
-        if not text:
-            return ""
-
-        # Se for algo do tipo "1234.00" ou "1234,00" mantém apenas parte inteira
-        if text.count('.') + text.count(',') == 1:
-            sep = '.' if '.' in text else ','
-            left, right = text.split(sep, 1)
-            if right.strip().strip('0') == "":
-                return "".join(ch for ch in left if ch.isdigit())
-
-        return "".join(ch for ch in text if ch.isdigit())
+        if type(s) in _ONLY_DIGITS_CACHEABLE:
+            return _only_digits_cached(s)
+        return _only_digits_impl(s)
 
     @staticmethod
     def _to_bool(v: Any) -> Optional[bool]:
@@ -173,6 +303,85 @@ class MotorCalculo:
             if pd is not None and isinstance(df, pd.DataFrame):
                 yield name, df
 
+    # ------------------------- índice compilado -------------------------
+
+    _COLS_NCM = ["NCM","NCM_RAIZ","NCM BASE","NCMBASE","COD_NCM","CODIGO NCM"]
+    _COLS_UF = ["UF","UF_DESTINO","UF DEST","UF_DEST","DESTINO","UF_UF"]
+    _COLS_CEST = ["CEST", "COD_CEST", "CODIGO CEST"]
+    _COLS_APLICA = ["APLICA_ST","APLICA SUBSTITUICAO","APLICA SUBSTITUIÇÃO","ST","TEM_ST","ST_ATIVO","SUBSTITUICAO","SUBSTITUIÇÃO"]
+    _COLS_MVA = ["MVA","MVA %","MVA_PERCENTUAL","MVA_PERC","MARGEM","MARGEM (%)","MARGEM_DE_VALOR_AGREGADO_MVA"]
+    _COLS_ALI = ["ALI_INT","ALIQ_INT","ALIQUOTA_INTERNA","ALIQ INTERNA","ALÍQUOTA INTERNA","ALÍQUOTA ICMS","ALIQUOTA ICMS"]
+    _COLS_MULT = ["MULT_SEFAZ","MULTIPLICADOR","MULT","ALI_INTER","ALIQUOTA_INTER"]
+
+    def _compilar_regras(self) -> Dict[str, List[tuple]]:
+        """
+        Varre as matrices uma única vez e indexa as linhas pelo NCM (dígitos).
+        Cada entrada guarda ``(ordem, ncm, uf, cest, aplica_st, mva, ali, mult, fonte)``;
+        ``uf``/``cest`` ficam None quando a planilha não tem a coluna.  ``ordem`` é a
+        posição global (planilha, linha): o desempate continua "primeira linha vence".
+        """
+        indice: Dict[str, List[tuple]] = {}
+        ordem = 0
+        for name, df in self._iter_dataframes():
+            if df is None or df.empty:
+                continue
+            cols_up = { self._norm(c): c for c in df.columns }
+
+            col_ncm = next((cols_up[c] for c in self._COLS_NCM if c in cols_up), None)
+            if not col_ncm:
+                continue
+            col_uf = next((cols_up[c] for c in self._COLS_UF if c in cols_up), None)
+            col_cest = next((cols_up[c] for c in self._COLS_CEST if c in cols_up), None)
+            cand_aplica = [cols_up[k] for k in self._COLS_APLICA if k in cols_up]
+            cand_mva = [cols_up[k] for k in self._COLS_MVA if k in cols_up]
+            cand_ali = [cols_up[k] for k in self._COLS_ALI if k in cols_up]
+            cand_mult = [cols_up[k] for k in self._COLS_MULT if k in cols_up]
+
+            for _, row in df.iterrows():
+                raw_ncm = self._only_digits(row[col_ncm])
+                if not raw_ncm:
+                    continue
+                indice.setdefault(raw_ncm, []).append((
+                    ordem,
+                    raw_ncm,
+                    self._norm(row[col_uf]) if col_uf else None,
+                    self._only_digits(row[col_cest]) if col_cest else None,
+                    self._to_bool(self._first_present(row, cand_aplica)) if cand_aplica else None,
+                    self._first_present(row, cand_mva) if cand_mva else None,
+                    self._first_present(row, cand_ali) if cand_ali else None,
+                    self._first_present(row, cand_mult) if cand_mult else None,
+                    name,
+                ))
+                ordem += 1
+        return indice
+
+    def _indice_regras(self) -> Dict[str, List[tuple]]:
+        indice = self._indice
+        if indice is None:
+            with self._rule_cache_lock:
+                if self._indice is None:
+                    self._indice = self._compilar_regras()
+                indice = self._indice
+        return indice
+
+    def compilar(self) -> "MotorCalculo":
+        """Monta já o índice de regras (senão é montado na primeira consulta)."""
+        self._indice_regras()
+        return self
+
+    # o estado compilado é serializável (snapshot do motor); lock e cache de
+    # decisões não vão junto
+    def __getstate__(self) -> Dict[str, Any]:
+        state = self.__dict__.copy()
+        state["_rule_cache"] = OrderedDict()
+        state["_rule_cache_hits"] = state["_rule_cache_misses"] = 0
+        state.pop("_rule_cache_lock", None)
+        return state
+
+    def __setstate__(self, state: Dict[str, Any]) -> None:
+        self.__dict__.update(state)
+        self._rule_cache_lock = threading.Lock()
+
     def _lookup_ncm_rules(self, ncm: str, uf_dest: str, cest: str = "") -> Dict[str, Any]:
         """
         Procura nas planilhas qualquer linha para o NCM (match exato ou por prefixo) e UF de destino.
@@ -190,98 +399,103 @@ class MotorCalculo:
         cest_digits = self._only_digits(cest)
         uf = self._norm(uf_dest)
 
-        melhor: Tuple[int, int, Dict[str, Any]] = ( -1, -1, {} )  # (tamanho_prefixo, score_cest, regra)
+        # candidatas: linhas cujo NCM é prefixo do NCM do item, na ordem original
+        indice = self._indice_regras()
+        candidatas: List[tuple] = []
+        for n in range(1, len(ncm_digits) + 1):
+            candidatas.extend(indice.get(ncm_digits[:n], ()))
+        candidatas.sort()
 
-        for name, df in self._iter_dataframes():
-            if df is None or df.empty:
-                continue
-            # normaliza colunas
-            cols_up = { self._norm(c): c for c in df.columns }
+        melhor: Tuple[int, int, Dict[str, Any]] = ( -1, -1, {} )  # (tamanho_prefixo, score_cest, regra)
 
-            # precisar ter pelo menos uma coluna de NCM
-            col_ncm = None
-            for candidate in ["NCM","NCM_RAIZ","NCM BASE","NCMBASE","COD_NCM","CODIGO NCM"]:
-                if candidate in cols_up:
-                    col_ncm = cols_up[candidate]
-                    break
-            if not col_ncm:
+        for _, raw_ncm, uf_row, raw_cest, aplica_st, mva_val, ali_val, mult_val, name in candidatas:
+            # checa UF (se existir coluna UF, deve bater; senão, aceita geral)
+            if uf_row and uf_row not in ("", uf, "TODAS", "TODOS", "ALL", "*"):
                 continue
 
-            # UF (se houver)
-            col_uf = None
-            for cuf in ["UF","UF_DESTINO","UF DEST","UF_DEST","DESTINO","UF_UF"]:
-                if cuf in cols_up:
-                    col_uf = cols_up[cuf]
-                    break
-
-            # CEST (se houver)
-            col_cest = None
-            for ccest in ["CEST", "COD_CEST", "CODIGO CEST"]:
-                if ccest in cols_up:
-                    col_cest = cols_up[ccest]
-                    break
-
-            # colunas possíveis de decisão
-            # aplica ST?
-            cand_aplica = [k for k in ["APLICA_ST","APLICA SUBSTITUICAO","APLICA SUBSTITUIÇÃO","ST","TEM_ST","ST_ATIVO","SUBSTITUICAO","SUBSTITUIÇÃO"] if k in cols_up]
-            cand_mva = [k for k in ["MVA","MVA %","MVA_PERCENTUAL","MVA_PERC","MARGEM","MARGEM (%)","MARGEM_DE_VALOR_AGREGADO_MVA"] if k in cols_up]
-            cand_ali = [k for k in ["ALI_INT","ALIQ_INT","ALIQUOTA_INTERNA","ALIQ INTERNA","ALÍQUOTA INTERNA","ALÍQUOTA ICMS","ALIQUOTA ICMS"] if k in cols_up]
-            cand_mult = [k for k in ["MULT_SEFAZ","MULTIPLICADOR","MULT","ALI_INTER","ALIQUOTA_INTER"] if k in cols_up]
-
-            # varremos linhas com NCM compatível
-            for _, row in df.iterrows():
-                raw_ncm = self._only_digits(row[col_ncm])
-                if not raw_ncm:
-                    continue
-                # match por prefixo: o mais específico (maior len) ganha
-                if not ncm_digits.startswith(raw_ncm):
-                    continue
-
-                # checa UF (se existir coluna UF, deve bater; senão, aceita geral)
-                if col_uf:
-                    uf_row = self._norm(row[col_uf])
-                    if uf_row and uf_row not in ("", uf, "TODAS", "TODOS", "ALL", "*"):
+            # checa CEST: se a linha tiver CEST preenchido, precisa bater exatamente
+            cest_score = 0
+            if raw_cest is not None:
+                if raw_cest:
+                    if not cest_digits:
                         continue
-
-                # checa CEST: se a linha tiver CEST preenchido, precisa bater exatamente
-                cest_score = 0
-                if col_cest and col_cest in row:
-                    raw_cest = self._only_digits(row[col_cest])
-                    if raw_cest:
-                        if not cest_digits:
+                    try:
+                        if int(raw_cest) != int(cest_digits):
                             continue
-                        try:
-                            if int(raw_cest) != int(cest_digits):
-                                continue
-                        except ValueError:
-                            if cest_digits != raw_cest:
-                                continue
-                        cest_score = 2  # match exato de CEST
-                    else:
-                        cest_score = 1  # linha genérica para qualquer CEST
-
-                # coleta valores
-                aplica_st = self._to_bool(self._first_present(row, [cols_up[k] for k in cand_aplica])) if cand_aplica else None
-                mva_val = self._first_present(row, [cols_up[k] for k in cand_mva]) if cand_mva else None
-                ali_val = self._first_present(row, [cols_up[k] for k in cand_ali]) if cand_ali else None
-                mult_val = self._first_present(row, [cols_up[k] for k in cand_mult]) if cand_mult else None
-
-                regra = {
+                    except ValueError:
+                        if cest_digits != raw_cest:
+                            continue
+                    cest_score = 2  # match exato de CEST
+                else:
+                    cest_score = 1  # linha genérica para qualquer CEST
+
+            # escolhe a mais específica (empate: a primeira linha vence)
+            prefix_len = len(raw_ncm)
+            if (prefix_len, cest_score) > (melhor[0], melhor[1]):
+                melhor = (prefix_len, cest_score, {
                     "aplica_st": aplica_st,
                     "mva": (pct(mva_val) if mva_val not in (None, "") else None),
                     "aliquota_interna": (pct(ali_val) if ali_val not in (None, "") else None),
                     "multiplicador": (pct(mult_val) if mult_val not in (None, "") else None),
                     "fonte": name,
                     "ncm_match": raw_ncm,
-                }
-
-                # escolhe a mais específica
-                prefix_len = len(raw_ncm)
-                if (prefix_len, cest_score) > (melhor[0], melhor[1]):
-                    melhor = (prefix_len, cest_score, regra)
+                })
 
         return melhor[2]
 
+    # ------------------------- cache de decisões -------------------------
+
+    def _resolver_regra(self, ncm: str, uf_dest: str, cest: str = "", cfop: str = "", cst: str = "") -> Dict[str, Any]:
+        """
+        Decide a regra do item via ``_lookup_ncm_rules``, memorizando o resultado
+        por (NCM, CEST, UF, CFOP, CST) normalizados. O dict devolvido é
+        compartilhado entre chamadas: trate-o como somente leitura.
+        """
+        if not self.rule_cache_size:
+            with self._rule_cache_lock:
+                self._rule_cache_misses += 1
+            return self._lookup_ncm_rules(ncm, uf_dest, cest)
+
+        key = (
+            self._only_digits(ncm),
+            self._only_digits(cest),
+            self._norm(uf_dest),
+            self._only_digits(cfop),
+            self._norm(cst),
+        )
+        with self._rule_cache_lock:
+            regra = self._rule_cache.get(key)
+            if regra is not None:
+                self._rule_cache.move_to_end(key)
+                self._rule_cache_hits += 1
+                return regra
+            self._rule_cache_misses += 1
+
+        regra = self._lookup_ncm_rules(ncm, uf_dest, cest)
+
+        with self._rule_cache_lock:
+            self._rule_cache[key] = regra
+            self._rule_cache.move_to_end(key)
+            while len(self._rule_cache) > self.rule_cache_size:
+                self._rule_cache.popitem(last=False)
+        return regra
+
+    def rule_cache_info(self) -> Dict[str, int]:
+        """Contadores do cache de regras (hits, misses, tamanho atual e limite)."""
+        with self._rule_cache_lock:
+            return {
+                "hits": self._rule_cache_hits,
+                "misses": self._rule_cache_misses,
+                "size": len(self._rule_cache),
+                "maxsize": self.rule_cache_size,
+            }
+
+    def clear_rule_cache(self) -> None:
+        with self._rule_cache_lock:
+            self._rule_cache.clear()
+            self._rule_cache_hits = 0
+            self._rule_cache_misses = 0
+
     # ------------------------- núcleo de cálculo -------------------------
 
     def _params_item(self, raw: Dict[str, Any]) -> Dict[str, Decimal]:
@@ -295,6 +509,60 @@ class MotorCalculo:
         }
 
     def _calcular_com_param(self, it: ItemNF, p: Dict[str, Decimal]) -> Dict[str, Any]:
+        if self.backend == "centavos":
+            try:
+                return self._calcular_centavos(it, p)
+            except _NaoRepresentavel:
+                pass  # valor fora do ponto fixo: segue no Decimal
+        return self._calcular_decimal(it, p)
+
+    def _calcular_centavos(self, it: ItemNF, p: Dict[str, Decimal]) -> Dict[str, Any]:
+        """
+        Mesmo roteiro de ``_calcular_decimal`` em inteiros: dinheiro em
+        centavos, taxas em 10^-8, ROUND_HALF_UP explícito.  Levanta
+        ``_NaoRepresentavel`` quando algum valor não é exato nessa escala.
+        """
+        # valor do produto: qtd * vu é exato; arredonda só no fim (q2)
+        vlr_prod = _produto_centavos(D(it.quantidade), D(it.valor_unitario))
+
+        frete = _to_centavos(D(it.frete))
+        desp = _to_centavos(D(it.despesas_acessorias))
+
+        base_oper = vlr_prod + frete + desp
+
+        base_des = vlr_prod
+        if p["incl_frete"]:
+            base_des += frete
+        if p["incl_desp"]:
+            base_des += desp
+        icms_des = _aplica_taxa(_to_taxa(p["aliq_origem"]), base_des)
+
+        venda_desc = base_oper - icms_des
+        valor_agregado = _aplica_taxa(_to_taxa(p["mva"]), venda_desc)
+        base_st = venda_desc + valor_agregado
+        icms_teorico_dest = _aplica_taxa(_to_taxa(p["aliq_interna"]), base_st)
+        saldo_devedor = icms_teorico_dest - icms_des
+
+        mult_sefaz = p["mult_sefaz"]
+        icms_retido = _aplica_taxa(_to_taxa(mult_sefaz), venda_desc)
+
+        icms_des_d = _cent_to_dec(icms_des)
+        icms_teorico_d = _cent_to_dec(icms_teorico_dest)
+        return {
+            "base_oper": _cent_to_dec(base_oper),
+            "venda_desc": _cent_to_dec(venda_desc),
+            "valor_agregado": _cent_to_dec(valor_agregado),
+            "base_st": _cent_to_dec(base_st),
+            "icms_teorico_dest": icms_teorico_d,
+            "icms_origem_calc": icms_des_d,
+            "icms_st": icms_teorico_d,
+            "saldo_devedor": _cent_to_dec(saldo_devedor),
+            "mult_sefaz": mult_sefaz,
+            "icms_retido": _cent_to_dec(icms_retido),
+            "icms_des": icms_des_d,
+        }
+
+    def _calcular_decimal(self, it: ItemNF, p: Dict[str, Decimal]) -> Dict[str, Any]:
         qtd = D(it.quantidade)
         vu  = D(it.valor_unitario)
         vlr_prod = q2(qtd * vu)
@@ -428,9 +696,10 @@ class MotorCalculo:
         return linhas
 
     # Compatível com app.py
-    def calcula_st(self, nf_item: Any, uf_origem: str, uf_destino: str, usar_multiplicador: bool = True) -> ResultadoItem:
+    def calcula_st(self, nf_item: Any, uf_origem: str, uf_destino: str, usar_multiplicador: bool = True) -> "ResultadoST":
         """
         Consulta planilhas p/ decidir se aplica ST; se não aplicar, zera ST.
+        Retorna um ``ResultadoST`` compacto; ``.memoria`` é montada sob demanda.
         """
         # monta item interno
         it = ItemNF(
@@ -452,8 +721,8 @@ class MotorCalculo:
             descricao=str(getattr(nf_item, "xProd", "") or "")
         )
 
-        # consulta regras por NCM/UF
-        regra = self._lookup_ncm_rules(it.ncm, uf_destino, it.cest)
+        # consulta regras por NCM/UF (memorizado por NCM/CEST/UF/CFOP/CST)
+        regra = self._resolver_regra(it.ncm, uf_destino, it.cest, it.cfop, it.cst)
 
         # começa com defaults
         p_raw: Dict[str, Any] = {
@@ -481,6 +750,9 @@ class MotorCalculo:
             if regra.get("multiplicador") is not None:
                 p_raw["multiplicador_sefaz"] = (regra["multiplicador"] if usar_multiplicador else Decimal('0'))
 
+        fonte = regra.get("fonte") if regra else None
+        res = ResultadoST(it, str(getattr(nf_item, "nItem", "")), uf_origem, uf_destino, fonte)
+
         # se não achou regra, comportamento conservador: NÃO aplica ST
         if aplica_st is not True:
             # calcula venda_desc/oper/desoneração normalmente,
@@ -490,125 +762,149 @@ class MotorCalculo:
             p_raw_no_st["aliquota_interna"] = Decimal('0')
             p_raw_no_st["multiplicador_sefaz"] = Decimal('0')
 
-            # calcula
             p_no = self._params_item(p_raw_no_st)
             r = self._calcular_com_param(it, p_no)
 
-            # monta memória/resultado zerado de ST
-            memoria: Dict[str, Any] = {
-                "SEQUENCIAL ITEM": str(getattr(nf_item, "nItem", "")),
-                "COD. PRODUTO": it.cod_produto,
-                "DESCRIÇÃO": it.descricao,
-                "NCM": it.ncm,
-
-                "QUANT.": float(q2(it.quantidade)),
-                "VALOR UNIT.": float(q2(it.valor_unitario)),
-                "VLR TOTAL PRODUTO.": float(q2(it.quantidade*it.valor_unitario)),
-                "FRETE": float(q2(it.frete)),
-                "IPI": float(q2(it.ipi)),
-                "DESP. ACES.": float(q2(it.despesas_acessorias)),
-                "ICMS DESONERADO": float(r["icms_des"]),
-
-                "VALOR DA VENDA COM DESCONTO DE ICMS": float(r["venda_desc"]),
-                "VALOR DA OPERAÇÃO": float(r["venda_desc"]),
-
-                "mva_tipo": "Sem ST",
-                "MARGEM DE VALOR AGREGADO - MVA": 0.0,
-                "MARGEM_DE_VALOR_AGREGADO_MVA": 0.0,
-                "VALOR AGREGADO": 0.0,
-                "VALOR_AGREGADO": 0.0,
-
-                "BASE DE CÁLCULO SUBSTITUIÇÃO TRIBUTÁRIA": float(r["venda_desc"]),  # mostra a venda p/ transparência
-                "BASE_ST": float(r["venda_desc"]),
-
-                "ALÍQUOTA ICMS-ST": 0.0,
-                "icms_teorico_dest": 0.0,
-                "icms_origem_calc": float(r["icms_des"]),
-                "VALOR DO ICMS ST": 0.0,
-                "VALOR_ICMS_ST": 0.0,
-
-                "VALOR SALDO DEVEDOR ICMS ST": 0.0,
-                "SALDO_DEVEDOR_ST": 0.0,
-
-                "MULTIPLICADOR SEFAZ": 0.0,
-                "MULT_SEFAZ": 0.0,
-
-                "VALOR ICMS RETIDO": 0.0,
-
-                "parametros": {
-                    "ALI_INT": 0.0,
-                    "ALI_INTER": 0.0,
-                    "UF_ORIGEM": uf_origem,
-                    "UF_DESTINO": uf_destino,
-                    "APLICA_ST": False,
-                    "FONTE_REGRAS": regra.get("fonte") if regra else None,
-                },
-                "venda_desc_icms": float(r["venda_desc"]),
-            }
-
-            return ResultadoItem(
-                base_calculo_st=Decimal(str(r["venda_desc"])),
-                icms_st_devido=Decimal('0'),
-                memoria=memoria
-            )
+            zero = Decimal('0')
+            res.aplica_st = False
+            res.mva = zero
+            res.aliq_interna = zero
+            res.mult_sefaz = zero
+            res.icms_des = r["icms_des"]
+            res.venda_desc = r["venda_desc"]
+            res.valor_agregado = zero
+            res.base_st = r["venda_desc"]          # mostra a venda p/ transparência
+            res.icms_teorico_dest = zero
+            res.icms_origem_calc = r["icms_des"]
+            res.icms_st = zero
+            res.saldo_devedor = zero
+            res.icms_retido = zero
+            return res
 
         # aplica ST normalmente com os parâmetros (regra/defaut)
         p_use = self._params_item(p_raw)
         r = self._calcular_com_param(it, p_use)
 
-        memoria: Dict[str, Any] = {
-            "SEQUENCIAL ITEM": str(getattr(nf_item, "nItem", "")),
+        res.aplica_st = True
+        res.mva = p_use["mva"]
+        res.aliq_interna = p_use["aliq_interna"]
+        res.mult_sefaz = p_use["mult_sefaz"]
+        res.icms_des = r["icms_des"]
+        res.venda_desc = r["venda_desc"]
+        res.valor_agregado = r["valor_agregado"]
+        res.base_st = r["base_st"]
+        res.icms_teorico_dest = r["icms_teorico_dest"]
+        res.icms_origem_calc = r["icms_origem_calc"]
+        res.icms_st = r["icms_st"]
+        res.saldo_devedor = r["saldo_devedor"]
+        res.icms_retido = r["icms_retido"]
+        return res
+
+    def calcula_lote(self, itens, uf_origem: str, uf_destino: str, usar_multiplicador: bool = True) -> List["ResultadoST"]:
+        """Calcula todos os itens de uma NF (mesma ordem de ``itens``)."""
+        calc = self.calcula_st
+        return [calc(it, uf_origem, uf_destino, usar_multiplicador) for it in itens]
+
+
+class ResultadoST:
+    """
+    Resultado compacto de ``MotorCalculo.calcula_st``.
+
+    Guarda só os valores calculados (``Decimal``). A ``memoria`` com os
+    rótulos do relatório/PDF (~40 chaves, com aliases) é montada apenas no
+    primeiro acesso, então lotes grandes não pagam por ela.
+    """
+    __slots__ = (
+        "item", "n_item", "uf_origem", "uf_destino", "fonte", "aplica_st",
+        "mva", "aliq_interna", "mult_sefaz",
+        "icms_des", "venda_desc", "valor_agregado", "base_st",
+        "icms_teorico_dest", "icms_origem_calc", "icms_st", "saldo_devedor", "icms_retido",
+        "_memoria",
+    )
+
+    def __init__(self, item: ItemNF, n_item: str, uf_origem: str, uf_destino: str, fonte: Optional[str]):
+        self.item = item
+        self.n_item = n_item
+        self.uf_origem = uf_origem
+        self.uf_destino = uf_destino
+        self.fonte = fonte
+        self._memoria = None
+
+    @property
+    def mva_tipo(self) -> str:
+        return "MVA Padrão" if self.aplica_st else "Sem ST"
+
+    @property
+    def base_calculo_st(self) -> Decimal:
+        return self.base_st
+
+    @property
+    def icms_st_devido(self) -> Decimal:
+        return self.icms_st
+
+    @property
+    def memoria(self) -> Dict[str, Any]:
+        if self._memoria is None:
+            self._memoria = self._montar_memoria()
+        return self._memoria
+
+    def _montar_memoria(self) -> Dict[str, Any]:
+        it = self.item
+        mva_percent = float(q2(self.mva * 100))
+        # o ramo com ST sempre exibiu o valor unitário em "VLR TOTAL PRODUTO."
+        # (relatórios/PDFs já gerados dependem disso); o ramo sem ST, o total
+        vlr_total = it.valor_unitario if self.aplica_st else it.quantidade * it.valor_unitario
+        return {
+            "SEQUENCIAL ITEM": self.n_item,
             "COD. PRODUTO": it.cod_produto,
             "DESCRIÇÃO": it.descricao,
             "NCM": it.ncm,
 
             "QUANT.": float(q2(it.quantidade)),
             "VALOR UNIT.": float(q2(it.valor_unitario)),
-            "VLR TOTAL PRODUTO.": float(q2(it.quantidade*it.valor_unituario if hasattr(it,'valor_unituario') else it.valor_unitario)),
+            "VLR TOTAL PRODUTO.": float(q2(vlr_total)),
             "FRETE": float(q2(it.frete)),
             "IPI": float(q2(it.ipi)),
             "DESP. ACES.": float(q2(it.despesas_acessorias)),
-            "ICMS DESONERADO": float(r["icms_des"]),
+            "ICMS DESONERADO": float(self.icms_des),
 
-            "VALOR DA VENDA COM DESCONTO DE ICMS": float(r["venda_desc"]),
-            "VALOR DA OPERAÇÃO": float(r["venda_desc"]),
+            "VALOR DA VENDA COM DESCONTO DE ICMS": float(self.venda_desc),
+            "VALOR DA OPERAÇÃO": float(self.venda_desc),
 
-            "mva_tipo": "MVA Padrão",
-            "MARGEM DE VALOR AGREGADO - MVA": float(q2(p_use["mva"] * 100)),
-            "MARGEM_DE_VALOR_AGREGADO_MVA": float(q2(p_use["mva"] * 100)),
-            "VALOR AGREGADO": float(r["valor_agregado"]),
-            "VALOR_AGREGADO": float(r["valor_agregado"]),
+            "mva_tipo": self.mva_tipo,
+            "MARGEM DE VALOR AGREGADO - MVA": mva_percent,
+            "MARGEM_DE_VALOR_AGREGADO_MVA": mva_percent,
+            "VALOR AGREGADO": float(self.valor_agregado),
+            "VALOR_AGREGADO": float(self.valor_agregado),
 
-            "BASE DE CÁLCULO SUBSTITUIÇÃO TRIBUTÁRIA": float(r["base_st"]),
-            "BASE_ST": float(r["base_st"]),
+            "BASE DE CÁLCULO SUBSTITUIÇÃO TRIBUTÁRIA": float(self.base_st),
+            "BASE_ST": float(self.base_st),
 
-            "ALÍQUOTA ICMS-ST": float(p_use["aliq_interna"]),
-            "icms_teorico_dest": float(r["icms_teorico_dest"]),
-            "icms_origem_calc": float(r["icms_origem_calc"]),
-            "VALOR DO ICMS ST": float(r["icms_st"]),
-            "VALOR_ICMS_ST": float(r["icms_st"]),
+            "ALÍQUOTA ICMS-ST": float(self.aliq_interna),
+            "icms_teorico_dest": float(self.icms_teorico_dest),
+            "icms_origem_calc": float(self.icms_origem_calc),
+            "VALOR DO ICMS ST": float(self.icms_st),
+            "VALOR_ICMS_ST": float(self.icms_st),
 
-            "VALOR SALDO DEVEDOR ICMS ST": float(r["saldo_devedor"]),
-            "SALDO_DEVEDOR_ST": float(r["saldo_devedor"]),
+            "VALOR SALDO DEVEDOR ICMS ST": float(self.saldo_devedor),
+            "SALDO_DEVEDOR_ST": float(self.saldo_devedor),
 
-            "MULTIPLICADOR SEFAZ": float(p_use["mult_sefaz"]),
-            "MULT_SEFAZ": float(p_use["mult_sefaz"]),
+            "MULTIPLICADOR SEFAZ": float(self.mult_sefaz),
+            "MULT_SEFAZ": float(self.mult_sefaz),
 
-            "VALOR ICMS RETIDO": float(r["icms_retido"]),
+            "VALOR ICMS RETIDO": float(self.icms_retido),
 
             "parametros": {
-                "ALI_INT": float(p_use["aliq_interna"]),
-                "ALI_INTER": float(p_use["mult_sefaz"]),
-                "UF_ORIGEM": uf_origem,
-                "UF_DESTINO": uf_destino,
-                "APLICA_ST": True,
-                "FONTE_REGRAS": regra.get("fonte") if regra else None,
+                "ALI_INT": float(self.aliq_interna),
+                "ALI_INTER": float(self.mult_sefaz),
+                "UF_ORIGEM": self.uf_origem,
+                "UF_DESTINO": self.uf_destino,
+                "APLICA_ST": bool(self.aplica_st),
+                "FONTE_REGRAS": self.fonte,
             },
-            "venda_desc_icms": float(r["venda_desc"]),
+            "venda_desc_icms": float(self.venda_desc),
         }
 
-        return ResultadoItem(
-            base_calculo_st=Decimal(str(r["base_st"])),
-            icms_st_devido=Decimal(str(r["icms_st"])),
-            memoria=memoria
-        )
+    def __repr__(self) -> str:
+        return (f"ResultadoST(item={self.n_item!r}, aplica_st={self.aplica_st}, "
+                f"base_st={self.base_st}, icms_st={self.icms_st})")
@@ -31,6 +31,54 @@ class Config:
         os.path.join(BASE_DIR, "uploads")  # absoluto: <raiz do projeto>/uploads
     )
 
+    # Motor de cálculo: "decimal" (padrão) ou "centavos" (ponto fixo em inteiros)
+    CALC_BACKEND = os.getenv("CALC_BACKEND", "decimal")
+    # Notas com muitos itens: leitura/cálculo em fatias num pool de processos (0 desliga)
+    CALC_PARALLEL_MIN_ITEMS = int(os.getenv("CALC_PARALLEL_MIN_ITEMS", "2000"))
+    CALC_PARALLEL_WORKERS = int(os.getenv("CALC_PARALLEL_WORKERS", "0"))  # 0 = min(4, CPUs)
+
+    # Atualização das fontes (sources): coletas em paralelo e timeout por fonte (s)
+    UPDATER_MAX_WORKERS = int(os.getenv("UPDATER_MAX_WORKERS", "4"))
+    UPDATER_TIMEOUT = float(os.getenv("UPDATER_TIMEOUT", "60"))
+    # Parsers externos ("pacote.modulo:funcao") aceitos em Source.parser, separados por vírgula
+    UPDATER_PARSER_PLUGINS = os.getenv("UPDATER_PARSER_PLUGINS", "")
+    # fontes em arquivo local (file:// ou caminho) só dentro deste diretório; vazio = nenhuma
+    UPDATER_LOCAL_DIR = os.getenv("UPDATER_LOCAL_DIR", "")
+    SOURCES_LOG_RETENTION_DAYS = int(os.getenv("SOURCES_LOG_RETENTION_DAYS", "90"))
+
+    # Jobs agendados (services/scheduler_service)
+    SCHEDULER_UPDATE_CRON = os.getenv("SCHEDULER_UPDATE_CRON", "0 3 1 * *")  # dia 1 às 03:00
+    SCHEDULER_RECALC_MINUTES = int(os.getenv("SCHEDULER_RECALC_MINUTES", "60"))
+    SCHEDULER_QUOTA_CRON = os.getenv("SCHEDULER_QUOTA_CRON", "30 4 * * *")  # reconciliação das cotas
+    SCHEDULER_AUDIT_CRON = os.getenv("SCHEDULER_AUDIT_CRON", "15 4 * * *")  # arquivamento da auditoria
+    SCHEDULER_RELOAD_MINUTES = int(os.getenv("SCHEDULER_RELOAD_MINUTES", "5"))
+    SCHEDULER_LOCK_DIR = os.getenv("SCHEDULER_LOCK_DIR")  # padrão: <instance>/locks
+    RECALC_BATCH = int(os.getenv("RECALC_BATCH", "200"))
+
+    # Snapshot do motor compilado, validado pelo carimbo das regras
+    ENGINE_SNAPSHOT = os.getenv("ENGINE_SNAPSHOT", "1") == "1"
+    ENGINE_SNAPSHOT_DIR = os.getenv("ENGINE_SNAPSHOT_DIR")  # padrão: <instance>/engine_snapshot
+
+    # PDF consolidado (/relatorios/nfe/pdf): >1 renderiza partes em processos paralelos
+    REPORT_PDF_WORKERS = int(os.getenv("REPORT_PDF_WORKERS", "1"))
+    REPORT_PDF_NOTAS_POR_PARTE = int(os.getenv("REPORT_PDF_NOTAS_POR_PARTE", "20"))
+
+    # /meus-arquivos: arquivos por página (keyset)
+    FILES_PAGE_SIZE = int(os.getenv("FILES_PAGE_SIZE", "50"))
+
+    # Planos em cache por processo (services/plan_service); outros workers veem edições em até N s
+    PLAN_CACHE_SECONDS = float(os.getenv("PLAN_CACHE_SECONDS", "60"))
+
+    # Cache em disco dos PDFs gerados (services/artifact_cache)
+    ARTIFACT_CACHE = os.getenv("ARTIFACT_CACHE", "1") == "1"
+    ARTIFACT_CACHE_DIR = os.getenv("ARTIFACT_CACHE_DIR")  # padrão: <instance>/artifact_cache
+    ARTIFACT_CACHE_MAX_MB = float(os.getenv("ARTIFACT_CACHE_MAX_MB", "512"))  # LRU acima disso
+
+    # Auditoria (services/audit_service): dias na tabela quente, retenção do arquivo (0 = sem limite)
+    AUDIT_HOT_DAYS = int(os.getenv("AUDIT_HOT_DAYS", "90"))
+    AUDIT_RETENTION_DAYS = int(os.getenv("AUDIT_RETENTION_DAYS", "730"))
+    AUDIT_ARCHIVE_BATCH = int(os.getenv("AUDIT_ARCHIVE_BATCH", "5000"))
+
     # Pooling (ajuste conforme host)
     SQLALCHEMY_ENGINE_OPTIONS = {
         "pool_pre_ping": True,
@@ -54,6 +102,8 @@ class TestingConfig(Config):
     FLASK_ENV = "development"
     FLASK_DEBUG = "1"
     FLASK_APP = "oraculoicms_app"
+    ENGINE_SNAPSHOT = False
+    ARTIFACT_CACHE = False
     # Força SQLite em testes, a menos que o ambiente já tenha sido definido
     SQLALCHEMY_DATABASE_URI = os.getenv(
         "SQLALCHEMY_DATABASE_URI",
@@ -0,0 +1,454 @@
+"""esquema base (tabelas do modelo antes das revisões seguintes)
+
+Tabelas, colunas, chaves e índices como criados por ``flask init-db`` antes
+das migrações.  Banco novo: cria tudo.  Banco criado com ``flask init-db``:
+as tabelas que já existem ficam como estão (as colunas e índices novos vêm
+nas revisões seguintes, que também só criam o que falta).
+
+Revision ID: 0001_esquema_base
+Revises:
+Create Date: 2026-10-19 09:00:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0001_esquema_base'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def _tabela(existentes, nome, *elementos, indices=(), unicos=()):
+    """Cria ``nome`` (e os índices ``ix_<tabela>_<coluna>``) se ainda não existir."""
+    if nome in existentes:
+        return False
+    op.create_table(nome, *elementos)
+    for coluna in indices:
+        op.create_index(f"ix_{nome}_{coluna}", nome, [coluna])
+    for coluna in unicos:
+        op.create_index(f"ix_{nome}_{coluna}", nome, [coluna], unique=True)
+    return True
+
+
+def upgrade():
+    existentes = set(sa.inspect(op.get_bind()).get_table_names())
+
+    _tabela(
+        existentes, "users",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("name", sa.String(length=120), nullable=False),
+        sa.Column("email", sa.String(length=180), nullable=False),
+        sa.Column("password_hash", sa.String(length=255), nullable=False),
+        sa.Column("company", sa.String(length=180), nullable=True),
+        sa.Column("plan", sa.String(length=20), nullable=True),
+        sa.Column("is_admin", sa.Boolean(), nullable=True),
+        sa.Column("active", sa.Boolean(), nullable=True),
+        sa.Column("created_at", sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint("id"),
+        unicos=("email",),
+    )
+    _tabela(
+        existentes, "plans",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("slug", sa.String(length=50), nullable=False),
+        sa.Column("name", sa.String(length=120), nullable=False),
+        sa.Column("description_md", sa.Text(), nullable=True),
+        sa.Column("active", sa.Boolean(), nullable=True),
+        sa.Column("price_month_cents", sa.Integer(), nullable=True),
+        sa.Column("price_year_cents", sa.Integer(), nullable=True),
+        sa.Column("currency", sa.String(length=8), nullable=True),
+        sa.Column("trial_days", sa.Integer(), nullable=True),
+        sa.Column("trial_xml_quota", sa.Integer(), nullable=True),
+        sa.Column("max_files", sa.Integer(), nullable=True),
+        sa.Column("max_storage_mb", sa.Integer(), nullable=True),
+        sa.Column("max_uploads_month", sa.Integer(), nullable=True),
+        sa.Column("provider_month_price_id", sa.String(length=120), nullable=True),
+        sa.Column("provider_year_price_id", sa.String(length=120), nullable=True),
+        sa.Column("stripe_price_monthly_id", sa.String(length=80), nullable=True),
+        sa.Column("stripe_price_yearly_id", sa.String(length=80), nullable=True),
+        sa.Column("created_at", sa.DateTime(), nullable=True),
+        sa.Column("updated_at", sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint("id"),
+        unicos=("slug",),
+    )
+    # invoices <-> subscriptions se referenciam: a FK de last_invoice_id vem depois
+    assinaturas = _tabela(
+        existentes, "subscriptions",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("user_id", sa.Integer(), nullable=False),
+        sa.Column("plan_id", sa.Integer(), nullable=False),
+        sa.Column("status", sa.String(length=20), nullable=True),
+        sa.Column("period_start", sa.DateTime(), nullable=True),
+        sa.Column("period_end", sa.DateTime(), nullable=True),
+        sa.Column("trial_end", sa.DateTime(), nullable=True),
+        sa.Column("billing_cycle", sa.String(length=10), nullable=True),
+        sa.Column("amount_cents", sa.Integer(), nullable=True),
+        sa.Column("provider", sa.String(length=32), nullable=True),
+        sa.Column("provider_sub_id", sa.String(length=120), nullable=True),
+        sa.Column("provider_cust_id", sa.String(length=120), nullable=True),
+        sa.Column("last_invoice_id", sa.Integer(), nullable=True),
+        sa.Column("created_at", sa.DateTime(), nullable=True),
+        sa.Column("updated_at", sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(["plan_id"], ["plans.id"]),
+        sa.ForeignKeyConstraint(["user_id"], ["users.id"]),
+        sa.PrimaryKeyConstraint("id"),
+        indices=("user_id",),
+    )
+    _tabela(
+        existentes, "invoices",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("subscription_id", sa.Integer(), nullable=True),
+        sa.Column("user_id", sa.Integer(), nullable=True),
+        sa.Column("amount_cents", sa.Integer(), nullable=True),
+        sa.Column("currency", sa.String(length=8), nullable=True),
+        sa.Column("status", sa.String(length=20), nullable=True),
+        sa.Column("method", sa.String(length=16), nullable=True),
+        sa.Column("provider", sa.String(length=32), nullable=True),
+        sa.Column("provider_invoice_id", sa.String(length=120), nullable=True),
+        sa.Column("provider_qr_code", sa.Text(), nullable=True),
+        sa.Column("provider_qr_image_b64", sa.Text(), nullable=True),
+        sa.Column("provider_checkout_url", sa.Text(), nullable=True),
+        sa.Column("paid_at", sa.DateTime(), nullable=True),
+        sa.Column("created_at", sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(["subscription_id"], ["subscriptions.id"]),
+        sa.ForeignKeyConstraint(["user_id"], ["users.id"]),
+        sa.PrimaryKeyConstraint("id"),
+        indices=("subscription_id", "user_id"),
+    )
+    _tabela(
+        existentes, "payments",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("user_id", sa.Integer(), nullable=False),
+        sa.Column("amount", sa.Numeric(precision=10, scale=2), nullable=False),
+        sa.Column("status", sa.String(length=30), nullable=False),
+        sa.Column("provider", sa.String(length=30), nullable=True),
+        sa.Column("external_id", sa.String(length=120), nullable=True),
+        sa.Column("description", sa.String(length=255), nullable=True),
+        sa.Column("created_at", sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(["user_id"], ["users.id"]),
+        sa.PrimaryKeyConstraint("id"),
+        indices=("user_id",),
+    )
+    _tabela(
+        existentes, "payment_configs",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("enable_pix", sa.Boolean(), nullable=True),
+        sa.Column("enable_card", sa.Boolean(), nullable=True),
+        sa.Column("provider", sa.String(length=32), nullable=True),
+        sa.Column("pix_key", sa.String(length=140), nullable=True),
+        sa.Column("webhook_url", sa.String(length=255), nullable=True),
+        sa.Column("webhook_secret", sa.String(length=255), nullable=True),
+        sa.PrimaryKeyConstraint("id"),
+    )
+    _tabela(
+        existentes, "settings",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("group", sa.String(length=50), nullable=True),
+        sa.Column("key", sa.String(length=100), nullable=False),
+        sa.Column("value", sa.Text(), nullable=True),
+        sa.Column("updated_at", sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint("id"),
+        sa.UniqueConstraint("group", "key", name="uq_settings_group_key"),
+        indices=("group", "key"),
+    )
+    _tabela(
+        existentes, "user_quotas",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("user_id", sa.Integer(), nullable=False),
+        sa.Column("files_count", sa.Integer(), nullable=False),
+        sa.Column("storage_bytes", sa.BigInteger(), nullable=False),
+        sa.Column("month_uploads", sa.Integer(), nullable=False),
+        sa.Column("month_ref", sa.String(length=7), nullable=False),
+        sa.Column("updated_at", sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(["user_id"], ["users.id"]),
+        sa.PrimaryKeyConstraint("id"),
+        unicos=("user_id",),
+    )
+    _tabela(
+        existentes, "user_files",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("display_name", sa.String(length=255), nullable=True),
+        sa.Column("user_id", sa.Integer(), nullable=False),
+        sa.Column("filename", sa.String(length=255), nullable=False),
+        sa.Column("storage_path", sa.String(length=512), nullable=False),
+        sa.Column("size_bytes", sa.Integer(), nullable=True),
+        sa.Column("md5", sa.String(length=32), nullable=True),
+        sa.Column("uploaded_at", sa.DateTime(), nullable=True),
+        sa.Column("deleted_at", sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(["user_id"], ["users.id"]),
+        sa.PrimaryKeyConstraint("id"),
+        indices=("md5", "uploaded_at", "user_id"),
+    )
+    _tabela(
+        existentes, "nfe_summaries",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("user_file_id", sa.Integer(), nullable=False),
+        sa.Column("processed_at", sa.DateTime(), nullable=True),
+        sa.Column("validation_status", sa.String(length=16), nullable=True),
+        sa.Column("include_in_totals", sa.Boolean(), nullable=True),
+        sa.Column("chave", sa.String(length=60), nullable=True),
+        sa.Column("emit_cnpj", sa.String(length=20), nullable=True),
+        sa.Column("dest_cnpj", sa.String(length=20), nullable=True),
+        sa.Column("emit_nome", sa.String(length=180), nullable=True),
+        sa.Column("dest_nome", sa.String(length=180), nullable=True),
+        sa.Column("numero", sa.String(length=20), nullable=True),
+        sa.Column("serie", sa.String(length=10), nullable=True),
+        sa.Column("emissao", sa.DateTime(), nullable=True),
+        sa.Column("valor_total", sa.Numeric(precision=14, scale=2), nullable=True),
+        sa.Column("valor_produtos", sa.Numeric(precision=14, scale=2), nullable=True),
+        sa.Column("icms", sa.Numeric(precision=14, scale=2), nullable=True),
+        sa.Column("icms_st", sa.Numeric(precision=14, scale=2), nullable=True),
+        sa.Column("ipi", sa.Numeric(precision=14, scale=2), nullable=True),
+        sa.Column("pis", sa.Numeric(precision=14, scale=2), nullable=True),
+        sa.Column("cofins", sa.Numeric(precision=14, scale=2), nullable=True),
+        sa.Column("calc_json", sa.Text(), nullable=True),
+        sa.Column("calc_version", sa.String(length=20), nullable=True),
+        sa.Column("calc_at", sa.DateTime(), nullable=True),
+        sa.Column("meta_json", sa.Text(), nullable=True),
+        sa.Column("created_at", sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(["user_file_id"], ["user_files.id"]),
+        sa.PrimaryKeyConstraint("id"),
+        sa.UniqueConstraint("user_file_id"),
+        indices=("chave", "dest_cnpj", "emissao", "emit_cnpj", "include_in_totals", "numero", "validation_status"),
+    )
+    _tabela(
+        existentes, "audit_logs",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("user_id", sa.Integer(), nullable=False),
+        sa.Column("action", sa.String(length=80), nullable=False),
+        sa.Column("ref", sa.String(length=120), nullable=True),
+        sa.Column("description", sa.Text(), nullable=True),
+        sa.Column("created_at", sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(["user_id"], ["users.id"]),
+        sa.PrimaryKeyConstraint("id"),
+        indices=("created_at", "user_id"),
+    )
+    _tabela(
+        existentes, "kb_articles",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("title", sa.String(length=200), nullable=False),
+        sa.Column("body_html", sa.Text(), nullable=False),
+        sa.Column("tags", sa.String(length=200), nullable=True),
+        sa.Column("is_published", sa.Boolean(), nullable=True),
+        sa.Column("order", sa.Integer(), nullable=True),
+        sa.Column("created_at", sa.DateTime(), nullable=True),
+        sa.Column("updated_at", sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint("id"),
+        indices=("is_published",),
+    )
+    _tabela(
+        existentes, "video_tutorials",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("title", sa.String(length=200), nullable=False),
+        sa.Column("embed_url", sa.String(length=500), nullable=False),
+        sa.Column("is_published", sa.Boolean(), nullable=True),
+        sa.Column("order", sa.Integer(), nullable=True),
+        sa.Column("created_at", sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint("id"),
+        indices=("is_published",),
+    )
+    _tabela(
+        existentes, "feedback_messages",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("user_id", sa.Integer(), nullable=True),
+        sa.Column("category", sa.String(length=30), nullable=False),
+        sa.Column("subject", sa.String(length=200), nullable=False),
+        sa.Column("message", sa.Text(), nullable=False),
+        sa.Column("status", sa.String(length=20), nullable=True),
+        sa.Column("created_at", sa.DateTime(), nullable=True),
+        sa.Column("handled_by", sa.Integer(), nullable=True),
+        sa.Column("handled_at", sa.DateTime(), nullable=True),
+        sa.Column("admin_notes", sa.Text(), nullable=True),
+        sa.Column("is_featured", sa.Boolean(), nullable=False),
+        sa.ForeignKeyConstraint(["handled_by"], ["users.id"]),
+        sa.ForeignKeyConstraint(["user_id"], ["users.id"]),
+        sa.PrimaryKeyConstraint("id"),
+        indices=("status", "user_id"),
+    )
+    _tabela(
+        existentes, "survey_campaigns",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("title", sa.String(length=200), nullable=False),
+        sa.Column("description", sa.Text(), nullable=True),
+        sa.Column("active", sa.Boolean(), nullable=True),
+        sa.Column("starts_at", sa.DateTime(), nullable=True),
+        sa.Column("ends_at", sa.DateTime(), nullable=True),
+        sa.Column("created_at", sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint("id"),
+        indices=("active",),
+    )
+    _tabela(
+        existentes, "survey_questions",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("campaign_id", sa.Integer(), nullable=False),
+        sa.Column("text", sa.String(length=500), nullable=False),
+        sa.Column("order", sa.Integer(), nullable=True),
+        sa.Column("required", sa.Boolean(), nullable=True),
+        sa.ForeignKeyConstraint(["campaign_id"], ["survey_campaigns.id"]),
+        sa.PrimaryKeyConstraint("id"),
+        indices=("campaign_id",),
+    )
+    _tabela(
+        existentes, "survey_responses",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("campaign_id", sa.Integer(), nullable=False),
+        sa.Column("user_id", sa.Integer(), nullable=False),
+        sa.Column("submitted_at", sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(["campaign_id"], ["survey_campaigns.id"]),
+        sa.ForeignKeyConstraint(["user_id"], ["users.id"]),
+        sa.PrimaryKeyConstraint("id"),
+        sa.UniqueConstraint("campaign_id", "user_id", name="uq_campaign_user"),
+        indices=("campaign_id", "user_id"),
+    )
+    _tabela(
+        existentes, "survey_answers",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("response_id", sa.Integer(), nullable=False),
+        sa.Column("question_id", sa.Integer(), nullable=False),
+        sa.Column("rating", sa.Integer(), nullable=False),
+        sa.Column("comment", sa.Text(), nullable=True),
+        sa.ForeignKeyConstraint(["question_id"], ["survey_questions.id"]),
+        sa.ForeignKeyConstraint(["response_id"], ["survey_responses.id"]),
+        sa.PrimaryKeyConstraint("id"),
+        indices=("question_id", "response_id"),
+    )
+    _tabela(
+        existentes, "st_regras",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("ativo", sa.Boolean(), nullable=False),
+        sa.Column("ncm", sa.String(length=20), nullable=False),
+        sa.Column("cest", sa.String(length=20), nullable=True),
+        sa.Column("cst_incluir", sa.String(length=120), nullable=True),
+        sa.Column("cst_excluir", sa.String(length=120), nullable=True),
+        sa.Column("cfop_ini", sa.String(length=10), nullable=True),
+        sa.Column("cfop_fim", sa.String(length=10), nullable=True),
+        sa.Column("st_aplica", sa.Boolean(), nullable=False),
+        sa.Column("created_at", sa.DateTime(), nullable=False),
+        sa.Column("updated_at", sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint("id"),
+        indices=("ncm",),
+    )
+    _tabela(
+        existentes, "mva",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("ncm", sa.String(length=20), nullable=False),
+        sa.Column("segmento", sa.String(length=120), nullable=True),
+        sa.Column("mva", sa.Numeric(precision=10, scale=4), nullable=False),
+        sa.Column("created_at", sa.DateTime(), nullable=False),
+        sa.Column("updated_at", sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint("id"),
+        indices=("ncm",),
+    )
+    _tabela(
+        existentes, "multiplicadores",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("ncm", sa.String(length=20), nullable=False),
+        sa.Column("regiao", sa.String(length=50), nullable=True),
+        sa.Column("multiplicador", sa.Numeric(precision=10, scale=4), nullable=False),
+        sa.Column("created_at", sa.DateTime(), nullable=False),
+        sa.Column("updated_at", sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint("id"),
+        indices=("ncm",),
+    )
+    _tabela(
+        existentes, "creditos_presumidos",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("ncm", sa.String(length=20), nullable=False),
+        sa.Column("regra", sa.String(length=120), nullable=True),
+        sa.Column("percentual", sa.Numeric(precision=10, scale=4), nullable=False),
+        sa.Column("created_at", sa.DateTime(), nullable=False),
+        sa.Column("updated_at", sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint("id"),
+        indices=("ncm",),
+    )
+    _tabela(
+        existentes, "aliquotas",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("uf", sa.String(length=2), nullable=False),
+        sa.Column("tipo", sa.String(length=32), nullable=False),
+        sa.Column("uf_dest", sa.String(length=2), nullable=True),
+        sa.Column("aliquota", sa.Numeric(precision=10, scale=4), nullable=False),
+        sa.Column("created_at", sa.DateTime(), nullable=False),
+        sa.Column("updated_at", sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint("id"),
+    )
+    _tabela(
+        existentes, "config",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("chave", sa.String(length=100), nullable=False),
+        sa.Column("valor", sa.String(length=255), nullable=True),
+        sa.PrimaryKeyConstraint("id"),
+        sa.UniqueConstraint("chave"),
+    )
+    _tabela(
+        existentes, "sources",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("ativo", sa.Boolean(), nullable=False),
+        sa.Column("uf", sa.String(length=2), nullable=True),
+        sa.Column("nome", sa.String(length=120), nullable=False),
+        sa.Column("url", sa.String(length=255), nullable=True),
+        sa.Column("tipo", sa.String(length=50), nullable=True),
+        sa.Column("parser", sa.String(length=120), nullable=True),
+        sa.Column("prioridade", sa.Integer(), nullable=True),
+        sa.Column("created_at", sa.DateTime(), nullable=False),
+        sa.Column("updated_at", sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint("id"),
+    )
+    _tabela(
+        existentes, "sources_log",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("executado_em", sa.DateTime(), nullable=False),
+        sa.Column("uf", sa.String(length=2), nullable=True),
+        sa.Column("nome", sa.String(length=120), nullable=False),
+        sa.Column("status", sa.String(length=50), nullable=False),
+        sa.Column("mensagem", sa.Text(), nullable=True),
+        sa.Column("linhas", sa.Integer(), nullable=True),
+        sa.Column("versao", sa.String(length=64), nullable=True),
+        sa.PrimaryKeyConstraint("id"),
+    )
+    if assinaturas:
+        with op.batch_alter_table("subscriptions") as batch:
+            batch.create_foreign_key(
+                "fk_subscriptions_last_invoice_id", "invoices", ["last_invoice_id"], ["id"]
+            )
+
+
+def downgrade():
+    with op.batch_alter_table("subscriptions") as batch:
+        batch.drop_constraint("fk_subscriptions_last_invoice_id", type_="foreignkey")
+    for nome in reversed(TABELAS):
+        op.drop_table(nome)
+
+
+# ordem de criação (FKs primeiro); o downgrade apaga na ordem inversa
+TABELAS = [
+    "users",
+    "plans",
+    "subscriptions",
+    "invoices",
+    "payments",
+    "payment_configs",
+    "settings",
+    "user_quotas",
+    "user_files",
+    "nfe_summaries",
+    "audit_logs",
+    "kb_articles",
+    "video_tutorials",
+    "feedback_messages",
+    "survey_campaigns",
+    "survey_questions",
+    "survey_responses",
+    "survey_answers",
+    "st_regras",
+    "mva",
+    "multiplicadores",
+    "creditos_presumidos",
+    "aliquotas",
+    "config",
+    "sources",
+    "sources_log",
+]
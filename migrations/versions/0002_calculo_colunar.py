@@ -0,0 +1,47 @@
+"""colunas do cálculo colunar em ``nfe_summaries``
+
+``calc_blob`` (linhas do cálculo em formato colunar, services/calc_store),
+``calc_itens``, ``calc_total_st`` e ``calc_total_nf_st``.  Só acrescenta as
+que faltarem (bancos criados por ``flask init-db`` depois da mudança já
+as têm).
+
+Revision ID: 0002_calculo_colunar
+Revises: 0001_esquema_base
+Create Date: 2026-10-19 09:05:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0002_calculo_colunar'
+down_revision = '0001_esquema_base'
+branch_labels = None
+depends_on = None
+
+COLUNAS = [
+    sa.Column("calc_blob", sa.LargeBinary(), nullable=True),
+    sa.Column("calc_itens", sa.Integer(), nullable=True),
+    sa.Column("calc_total_st", sa.Numeric(precision=14, scale=2), nullable=True),
+    sa.Column("calc_total_nf_st", sa.Numeric(precision=14, scale=2), nullable=True),
+]
+
+
+def _existentes():
+    return {c["name"] for c in sa.inspect(op.get_bind()).get_columns("nfe_summaries")}
+
+
+def upgrade():
+    existentes = _existentes()
+    for coluna in COLUNAS:
+        if coluna.name not in existentes:
+            op.add_column("nfe_summaries", coluna)
+
+
+def downgrade():
+    existentes = _existentes()
+    with op.batch_alter_table("nfe_summaries") as batch:
+        for coluna in reversed(COLUNAS):
+            if coluna.name in existentes:
+                batch.drop_column(coluna.name)
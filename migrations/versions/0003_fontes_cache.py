@@ -0,0 +1,43 @@
+"""tamanho e latência das coletas em ``sources_log``
+
+``bytes`` (tamanho baixado) e ``latencia_ms`` da coleta condicional das
+fontes do atualizador.  Só acrescenta as que faltarem.
+
+Revision ID: 0003_fontes_cache
+Revises: 0002_calculo_colunar
+Create Date: 2026-10-19 09:10:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0003_fontes_cache'
+down_revision = '0002_calculo_colunar'
+branch_labels = None
+depends_on = None
+
+COLUNAS = [
+    sa.Column("bytes", sa.Integer(), nullable=True),
+    sa.Column("latencia_ms", sa.Integer(), nullable=True),
+]
+
+
+def _existentes():
+    return {c["name"] for c in sa.inspect(op.get_bind()).get_columns("sources_log")}
+
+
+def upgrade():
+    existentes = _existentes()
+    for coluna in COLUNAS:
+        if coluna.name not in existentes:
+            op.add_column("sources_log", coluna)
+
+
+def downgrade():
+    existentes = _existentes()
+    with op.batch_alter_table("sources_log") as batch:
+        for coluna in reversed(COLUNAS):
+            if coluna.name in existentes:
+                batch.drop_column(coluna.name)
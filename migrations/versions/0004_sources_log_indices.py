@@ -0,0 +1,43 @@
+"""índices de ``sources_log``
+
+``executado_em`` (retenção e última entrada) e (uf, nome, status,
+executado_em) para a última versão OK de cada fonte no atualizador.  Só
+cria os que faltarem.
+
+Revision ID: 0004_sources_log_indices
+Revises: 0003_fontes_cache
+Create Date: 2026-10-19 09:15:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0004_sources_log_indices'
+down_revision = '0003_fontes_cache'
+branch_labels = None
+depends_on = None
+
+INDICES = {
+    "ix_sources_log_executado_em": ["executado_em"],
+    "ix_sources_log_uf_nome_status_exec": ["uf", "nome", "status", "executado_em"],
+}
+
+
+def _existentes():
+    return {i["name"] for i in sa.inspect(op.get_bind()).get_indexes("sources_log")}
+
+
+def upgrade():
+    existentes = _existentes()
+    for nome, colunas in INDICES.items():
+        if nome not in existentes:
+            op.create_index(nome, "sources_log", colunas)
+
+
+def downgrade():
+    existentes = _existentes()
+    for nome in INDICES:
+        if nome in existentes:
+            op.drop_index(nome, table_name="sources_log")
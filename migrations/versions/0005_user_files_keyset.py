@@ -0,0 +1,35 @@
+"""índice da listagem paginada de ``user_files``
+
+(user_id, deleted_at, uploaded_at, id): keyset de /meus-arquivos dentro
+do usuário.  Só cria se faltar.
+
+Revision ID: 0005_user_files_keyset
+Revises: 0004_sources_log_indices
+Create Date: 2026-10-19 09:20:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0005_user_files_keyset'
+down_revision = '0004_sources_log_indices'
+branch_labels = None
+depends_on = None
+
+INDICE = "ix_user_files_user_deleted_uploaded"
+
+
+def _existe():
+    return INDICE in {i["name"] for i in sa.inspect(op.get_bind()).get_indexes("user_files")}
+
+
+def upgrade():
+    if not _existe():
+        op.create_index(INDICE, "user_files", ["user_id", "deleted_at", "uploaded_at", "id"])
+
+
+def downgrade():
+    if _existe():
+        op.drop_index(INDICE, table_name="user_files")
@@ -0,0 +1,98 @@
+"""busca de notas: ``nfe_items``, índice de texto e prefixos de ``nfe_summaries``
+
+- ``nfe_items`` (produtos das notas para /buscar) com os índices por
+  usuário + NCM/código;
+- índice de texto em ``xprod``: FTS5 externo (tabela virtual + triggers) no
+  SQLite, trigramas (pg_trgm) no Postgres;
+- Postgres: índices ``varchar_pattern_ops`` para LIKE 'x%' em chave,
+  número e CNPJs de ``nfe_summaries``.
+
+O DDL de texto fica aqui por extenso (não depende do ``after_create`` do
+modelo).  Só cria o que falta.
+
+Revision ID: 0006_busca_notas
+Revises: 0005_user_files_keyset
+Create Date: 2026-10-19 09:25:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0006_busca_notas'
+down_revision = '0005_user_files_keyset'
+branch_labels = None
+depends_on = None
+
+INDICES_ITENS = {
+    "ix_nfe_items_summary_id": ["summary_id"],
+    "ix_nfe_items_user_ncm": ["user_id", "ncm"],
+    "ix_nfe_items_user_cprod": ["user_id", "cprod"],
+}
+PREFIXOS = ("chave", "numero", "emit_cnpj", "dest_cnpj")
+
+FTS_SQLITE = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS nfe_items_fts USING fts5("
+    "xprod, content='nfe_items', content_rowid='id', tokenize='unicode61 remove_diacritics 2')",
+    "CREATE TRIGGER IF NOT EXISTS nfe_items_fts_ai AFTER INSERT ON nfe_items BEGIN "
+    "INSERT INTO nfe_items_fts(rowid, xprod) VALUES (new.id, new.xprod); END",
+    "CREATE TRIGGER IF NOT EXISTS nfe_items_fts_ad AFTER DELETE ON nfe_items BEGIN "
+    "INSERT INTO nfe_items_fts(nfe_items_fts, rowid, xprod) VALUES ('delete', old.id, old.xprod); END",
+    "CREATE TRIGGER IF NOT EXISTS nfe_items_fts_au AFTER UPDATE ON nfe_items BEGIN "
+    "INSERT INTO nfe_items_fts(nfe_items_fts, rowid, xprod) VALUES ('delete', old.id, old.xprod); "
+    "INSERT INTO nfe_items_fts(rowid, xprod) VALUES (new.id, new.xprod); END",
+]
+TRGM_POSTGRES = [
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    "CREATE INDEX IF NOT EXISTS ix_nfe_items_xprod_trgm ON nfe_items USING gin (xprod gin_trgm_ops)",
+]
+
+
+def upgrade():
+    bind = op.get_bind()
+    insp = sa.inspect(bind)
+    dialeto = bind.dialect.name
+
+    if "nfe_items" not in insp.get_table_names():
+        op.create_table(
+            "nfe_items",
+            sa.Column("id", sa.Integer(), nullable=False),
+            sa.Column("summary_id", sa.Integer(), nullable=False),
+            sa.Column("user_id", sa.Integer(), nullable=False),
+            sa.Column("n_item", sa.Integer(), nullable=True),
+            sa.Column("cprod", sa.String(length=60), nullable=True),
+            sa.Column("xprod", sa.String(length=120), nullable=True),
+            sa.Column("ncm", sa.String(length=8), nullable=True),
+            sa.ForeignKeyConstraint(["summary_id"], ["nfe_summaries.id"], ondelete="CASCADE"),
+            sa.ForeignKeyConstraint(["user_id"], ["users.id"]),
+            sa.PrimaryKeyConstraint("id"),
+        )
+    existentes = {i["name"] for i in insp.get_indexes("nfe_items")}
+    for nome, colunas in INDICES_ITENS.items():
+        if nome not in existentes:
+            op.create_index(nome, "nfe_items", colunas)
+
+    if dialeto == "sqlite":
+        for sql in FTS_SQLITE:
+            op.execute(sql)
+    elif dialeto == "postgresql":
+        for sql in TRGM_POSTGRES:
+            op.execute(sql)
+        existentes = {i["name"] for i in insp.get_indexes("nfe_summaries")}
+        for c in PREFIXOS:
+            nome = f"ix_nfe_summaries_{c}_prefixo"
+            if nome not in existentes:
+                op.create_index(nome, "nfe_summaries", [c], postgresql_ops={c: "varchar_pattern_ops"})
+
+
+def downgrade():
+    dialeto = op.get_bind().dialect.name
+    if dialeto == "sqlite":
+        for trigger in ("nfe_items_fts_ai", "nfe_items_fts_ad", "nfe_items_fts_au"):
+            op.execute(f"DROP TRIGGER IF EXISTS {trigger}")
+        op.execute("DROP TABLE IF EXISTS nfe_items_fts")
+    elif dialeto == "postgresql":
+        for c in PREFIXOS:
+            op.execute(f"DROP INDEX IF EXISTS ix_nfe_summaries_{c}_prefixo")
+    op.drop_table("nfe_items")
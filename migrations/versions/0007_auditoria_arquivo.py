@@ -0,0 +1,70 @@
+"""auditoria quente/arquivo: ``audit_logs_archive``, ``audit_daily``
+
+- ``audit_logs_archive``: histórico de ``audit_logs``; no Postgres
+  particionada por mês (RANGE em ``created_at``) com a partição DEFAULT
+  (as mensais vêm do job de auditoria);
+- ``audit_daily``: contagens por usuário, dia e ação;
+- ``ix_audit_logs_user_created`` na tabela quente.
+
+O DDL da partição DEFAULT fica aqui por extenso (não depende do
+``after_create`` do modelo).  Só cria o que falta.
+
+Revision ID: 0007_auditoria_arquivo
+Revises: 0006_busca_notas
+Create Date: 2026-10-19 09:30:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0007_auditoria_arquivo'
+down_revision = '0006_busca_notas'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    bind = op.get_bind()
+    insp = sa.inspect(bind)
+    tabelas = set(insp.get_table_names())
+
+    if "audit_logs_archive" not in tabelas:
+        op.create_table(
+            "audit_logs_archive",
+            sa.Column("id", sa.Integer(), autoincrement=False, nullable=False),
+            sa.Column("created_at", sa.DateTime(), nullable=False),
+            sa.Column("user_id", sa.Integer(), nullable=False),
+            sa.Column("action", sa.String(length=80), nullable=False),
+            sa.Column("ref", sa.String(length=120), nullable=True),
+            sa.Column("description", sa.Text(), nullable=True),
+            sa.PrimaryKeyConstraint("id", "created_at"),
+            postgresql_partition_by="RANGE (created_at)",
+        )
+        op.create_index("ix_audit_logs_archive_user_created", "audit_logs_archive", ["user_id", "created_at"])
+    if bind.dialect.name == "postgresql":
+        op.execute("CREATE TABLE IF NOT EXISTS audit_logs_archive_default PARTITION OF audit_logs_archive DEFAULT")
+
+    if "audit_daily" not in tabelas:
+        op.create_table(
+            "audit_daily",
+            sa.Column("id", sa.Integer(), nullable=False),
+            sa.Column("user_id", sa.Integer(), nullable=False),
+            sa.Column("dia", sa.Date(), nullable=False),
+            sa.Column("action", sa.String(length=80), nullable=False),
+            sa.Column("total", sa.Integer(), nullable=False),
+            sa.PrimaryKeyConstraint("id"),
+            sa.UniqueConstraint("user_id", "dia", "action", name="uq_audit_daily_user_dia_action"),
+        )
+        op.create_index("ix_audit_daily_dia", "audit_daily", ["dia"])
+
+    if "ix_audit_logs_user_created" not in {i["name"] for i in insp.get_indexes("audit_logs")}:
+        op.create_index("ix_audit_logs_user_created", "audit_logs", ["user_id", "created_at"])
+
+
+def downgrade():
+    op.drop_index("ix_audit_logs_user_created", table_name="audit_logs")
+    op.drop_table("audit_daily")
+    # no Postgres leva junto as partições (DEFAULT e mensais)
+    op.drop_table("audit_logs_archive")
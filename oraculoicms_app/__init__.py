@@ -10,6 +10,7 @@ from .blueprints.admin import admin_bp
 from .extensions import db, bcrypt, migrate, scheduler, init_extensions, register_cli
 from .services.sheets_service import init_sheets
 from .services.calc_service import init_motor
+from .services.scheduler_service import init_scheduler
 from .blueprints.core import bp as core_bp
 from .blueprints.auth import bp as auth_bp
 from .blueprints.nfe import bp as nfe_bp
@@ -54,10 +55,8 @@ def create_app(config_object: type[Config] = Config) -> Flask:
     # CLI (ex.: flask init-db)
     register_cli(app)
 
-    # Scheduler (ex.: dia 1 às 03:00 — atualizador AM)
-    if not app.config.get("TESTING") and os.getenv("DISABLE_SCHEDULER") != "1":
-        if not scheduler.running:
-            scheduler.start()
+    # Scheduler: atualizador (dia 1 às 03:00), recálculo e reload das regras
+    init_scheduler(app)
 
     @app.template_filter("datetimeformat")
     def datetimeformat(value, fmt="%d/%m/%Y %H:%M"):
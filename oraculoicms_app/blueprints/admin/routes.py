@@ -7,6 +7,7 @@ from ..admin import admin_bp
 from ...decorators import admin_required
 from ...extensions import db
 from ...models import User, Plan, Payment, Subscription
+from ...services.plan_service import invalidar_planos
 from ...services.settings import get_setting, set_setting
 
 import os, platform, socket, time
@@ -64,10 +65,21 @@ def _system_snapshot():
     except Exception as e:
         gs_ok, gs_detail = False, str(e)
 
+    # Cache de decisões de regra do motor
+    try:
+        from ...services.calc_service import get_motor
+        info = get_motor().rule_cache_info()
+        total = info["hits"] + info["misses"]
+        taxa = (100.0 * info["hits"] / total) if total else 0.0
+        rc_ok, rc_detail = True, f"{info['hits']} hits / {info['misses']} misses ({taxa:.1f}%), {info['size']}/{info['maxsize']} entradas"
+    except Exception as e:
+        rc_ok, rc_detail = False, str(e)
+
     statuses = [
         dict(name="Postgres", ok=pg_ok, detail=pg_detail),
         dict(name="Stripe", ok=st_ok, detail=st_detail),
         dict(name="Parâmetros", ok=gs_ok, detail=gs_detail),
+        dict(name="Cache de regras", ok=rc_ok, detail=rc_detail),
     ]
 
     # Server info
@@ -238,6 +250,7 @@ def admin_plans_create():
     )
     db.session.add(p)
     db.session.commit()
+    invalidar_planos()
     flash("Plano criado.", "success")
     return redirect(url_for("admin_bp.admin"))
 
@@ -270,6 +283,7 @@ def admin_plans_update(plan_id):
     p.max_uploads_month = int(request.form.get("max_uploads_month") or p.max_uploads_month or 0)
 
     db.session.commit()
+    invalidar_planos()
     flash("Plano atualizado.", "success")
     return redirect(url_for("admin_bp.admin"))
 
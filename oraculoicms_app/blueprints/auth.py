@@ -10,6 +10,7 @@ from oraculoicms_app import db
 from oraculoicms_app.blueprints.files import current_user
 from oraculoicms_app.decorators import login_required
 from oraculoicms_app.models import User, Subscription, Plan
+from oraculoicms_app.services.plan_service import plano
 
 bp = Blueprint("auth", __name__)
 
@@ -25,7 +26,7 @@ def login():
             return redirect(url_for("auth.login"))
 
         session["user"] = {
-            "name": u.name, "email": u.email, "plan": u.plan,
+            "id": u.id, "name": u.name, "email": u.email, "plan": u.plan,
             "is_admin": u.is_admin, "renews_at": "—"
         }
         flash("Login efetuado.", "success")
@@ -61,7 +62,7 @@ def register():
         db.session.commit()
 
         session["user"] = {
-            "name": u.name, "email": u.email, "plan": u.plan,
+            "id": u.id, "name": u.name, "email": u.email, "plan": u.plan,
             "is_admin": u.is_admin, "renews_at": "—"
         }
         flash("Conta criada com sucesso.", "success")
@@ -94,7 +95,7 @@ def account():
     if sub and sub.plan_id:
         plan = Plan.query.get(sub.plan_id)
     if not plan and u.plan:  # fallback por slug
-        plan = Plan.query.filter_by(slug=u.plan).first()
+        plan = plano(u.plan)
 
     price_m = float((plan.price_month_cents or 0)/100.0) if plan else None
     price_y = float((plan.price_year_cents or 0)/100.0) if plan else None
@@ -141,7 +142,7 @@ def account():
 @bp.route("/account/update", methods=["POST"])
 @login_required
 def account_update():
-    u = User.query.filter_by(email=session["user"]["email"]).first()
+    u = current_user()
     if not u:
         flash("Usuário não encontrado.", "danger")
         return redirect(url_for("auth.account"))
@@ -163,7 +164,7 @@ def account_update():
 @bp.route("/account/password", methods=["POST"])
 @login_required
 def password_change():
-    u = User.query.filter_by(email=session["user"]["email"]).first()
+    u = current_user()
     if not u:
         flash("Usuário não encontrado.", "danger")
         return redirect(url_for("auth.account"))
@@ -3,16 +3,24 @@
 from __future__ import annotations
 import os, hashlib, datetime, json
 from pathlib import Path
-from flask import Blueprint, current_app, request, render_template, redirect, url_for, flash, send_file, abort, session, jsonify
+from flask import Blueprint, current_app, g, request, render_template, redirect, url_for, flash, send_file, abort, session, jsonify
+from sqlalchemy import and_, or_
+from sqlalchemy.orm import joinedload, load_only
 from werkzeug.utils import secure_filename
 
 from oraculoicms_app.blueprints.nfe_indexer import upsert_summary_from_xml
 from oraculoicms_app.decorators import login_required
 from oraculoicms_app.extensions import db
 from oraculoicms_app.models.user import User
-from oraculoicms_app.models.plan import Plan
 from oraculoicms_app.models.file import UserFile, NFESummary, AuditLog
 from oraculoicms_app.services.calc_service import get_motor
+from oraculoicms_app.services.payload_service import (
+    ALG_VERSION, build_st_payload, contexto_resultado,
+)
+from oraculoicms_app.services.calc_store import has_calc, load_payload, store_payload
+from oraculoicms_app.services.plan_service import plano
+from oraculoicms_app.services.quota_service import liberar, obter_cota, reservar_upload
+from oraculoicms_app.services.search_service import buscar_notas, indexar_itens, remover_itens
 from xml_parser import NFEXML
 from oraculoicms_app.models.user_quota import UserQuota
 from base64 import b64encode
@@ -24,85 +32,10 @@ bp = Blueprint("files", __name__)
 ALLOWED = {'.xml', '.XML'}
 
 # ——————————————————————————————————————————————————————————————
-# CÁLCULO ST — helper local para evitar import circular com nfe.py
+# CÁLCULO ST — payload único em services/payload_service (sem import circular com nfe.py)
 # ——————————————————————————————————————————————————————————————
-ALG_VERSION = "st-v1"
-
-def _compute_st_payload(xml_bytes: bytes, NFEXML, get_motor):
-    nfe = NFEXML(xml_bytes)
-    header = nfe.header() or {}
-    itens  = nfe.itens() or []
-
-    uf_origem  = (header.get("uf_origem")  or "SP").upper()
-    uf_destino = (header.get("uf_destino") or "AM").upper()
-
-    motor = get_motor()
-    linhas, total_st = [], 0.0
-
-    def fnum(v, d=0.0):
-        try:
-            return float(v if v is not None else d)
-        except Exception:
-            return float(d)
-
-    for it in itens:
-        r = motor.calcula_st(it, uf_origem, uf_destino, usar_multiplicador=True)
-        m = r.memoria
-
-        qCom   = fnum(it.qCom);    vUnCom = fnum(it.vUnCom); vProd  = fnum(it.vProd)
-        vFrete = fnum(it.vFrete);  vIPI   = fnum(it.vIPI);   vOutro = fnum(it.vOutro)
-        vICMSDeson_xml = fnum(it.vICMSDeson)
-        vICMSDeson = fnum(m.get("ICMS DESONERADO", vICMSDeson_xml))
-
-        venda_desc_icms = fnum(m.get("VALOR DA VENDA COM DESCONTO DE ICMS", m.get("venda_desc_icms", 0.0)))
-        valor_oper = fnum(m.get("VALOR DA OPERAÇÃO", venda_desc_icms))
-        mva_percent = fnum(m.get("MARGEM_DE_VALOR_AGREGADO_MVA", m.get("mva_percentual_aplicado", 0.0)))
-        valor_agregado = fnum(m.get("VALOR AGREGADO", 0.0))
-        base_st = fnum(m.get("BASE_ST", m.get("BASE DE CÁLCULO SUBSTITUIÇÃO TRIBUTÁRIA", 0.0)))
-        aliq_st = fnum(m.get("ALÍQUOTA ICMS-ST", m.get("aliq_interna", 0.0)))
-        icms_teorico_dest = fnum(m.get("icms_teorico_dest", 0.0))
-        icms_origem_calc  = fnum(m.get("icms_origem_calc", vICMSDeson))
-        icms_st = fnum(m.get("VALOR_ICMS_ST", 0.0))
-        saldo_devedor = fnum(m.get("SALDO_DEVEDOR_ST", m.get("VALOR SALDO DEVEDOR ICMS ST", 0.0)))
-        mult_sefaz = fnum(m.get("MULT_SEFAZ", m.get("Multiplicador", m.get("MULTIPLICADOR SEFAZ", 0.0))))
-        icms_retido = fnum(m.get("VALOR ICMS RETIDO", m.get("icms_retido", saldo_devedor)))
-
-        linhas.append({
-            "idx": it.nItem, "cProd": it.cProd, "xProd": it.xProd,
-            "ncm": it.ncm, "cst": it.cst, "cfop": it.cfop,
-            "qCom": qCom, "vUnCom": vUnCom, "vProd": vProd,
-            "vFrete": vFrete, "vIPI": vIPI, "vOutro": vOutro,
-            "vICMSDeson": vICMSDeson,
-            "venda_desc_icms": venda_desc_icms,
-            "valor_oper": valor_oper,
-            "mva_tipo": m.get("mva_tipo", "MVA Padrão"),
-            "mva_percent": mva_percent,
-            "valor_agregado": valor_agregado,
-            "base_st": base_st,
-            "aliq_st": aliq_st,
-            "icms_teorico_dest": icms_teorico_dest,
-            "icms_origem_calc": icms_origem_calc,
-            "icms_st": icms_st,
-            "saldo_devedor": saldo_devedor,
-            "mult_sefaz": mult_sefaz,
-            "icms_retido": icms_retido,
-
-            # aliases usados nos templates
-            "valor_operacao": valor_oper,
-            "mva_percentual": mva_percent,
-            "multiplicador": mult_sefaz,
-            "quant": qCom, "vun": vUnCom, "vprod": vProd, "frete": vFrete, "ipi": vIPI, "vout": vOutro,
-            "icms_deson": vICMSDeson,
-            "base_calculo_st": base_st,
-            "aliquota_icms_st": aliq_st,
-            "valor_icms_st": icms_st,
-            "valor_saldo_devedor": saldo_devedor,
-            "multiplicador_sefaz": mult_sefaz,
-            "valor_icms_retido": icms_retido,
-        })
-        total_st += float(r.icms_st_devido or 0.0)
-
-    return {"uf_origem": uf_origem, "uf_destino": uf_destino, "linhas": linhas, "total_st": total_st}
+def _compute_st_payload(xml_bytes: bytes, NFEXML, get_motor, nfe=None):
+    return build_st_payload(xml_bytes, NFEXML, get_motor(), nfe=nfe)
 # ——————————————————————————————————————————————————————————————
 
 
@@ -159,26 +92,26 @@ def _is_nfe_xml(xml_bytes: bytes) -> tuple[bool, str]:
     return True, ""
 
 def _get_quota(user_id:int) -> UserQuota:
-    q = UserQuota.query.filter_by(user_id=user_id).first()
-    if not q:
-        q = UserQuota(user_id=user_id)
-        db.session.add(q); db.session.commit()
-    from datetime import datetime
-    cur = datetime.utcnow().strftime("%Y-%m")
-    if q.month_ref != cur:
-        q.month_ref = cur
-        q.month_uploads = 0
-        db.session.add(q); db.session.commit()
-    return q
+    # criação e virada de mês no banco (services/quota_service), no máximo um commit
+    return obter_cota(user_id)
 
 def current_user():
+    """Usuário da sessão, resolvido uma vez por requisição (cache em ``g``)."""
     data = session.get("user")
     if not data:
         return None
-    email = data.get("email")
-    if not email:
+    chave = data.get("id") or data.get("email")  # sessões antigas só têm o e-mail
+    if not chave:
         return None
-    return User.query.filter_by(email=email).first()
+    cache = g.get("_usuario")
+    if cache is not None and cache[0] == chave:
+        return cache[1]
+    if data.get("id"):
+        u = db.session.get(User, data["id"])
+    else:
+        u = User.query.filter_by(email=data["email"]).first()
+    g._usuario = (chave, u)
+    return u
 
 def user_upload_root(user_id:int) -> Path:
     root = Path(current_app.config.get("UPLOAD_FOLDER", "./uploads"))
@@ -193,8 +126,11 @@ def _md5(fp:Path) -> str:
             h.update(chunk)
     return h.hexdigest()
 
+def _plano_limites(user):
+    return plano(user.plan) if hasattr(user, 'plan') else None
+
 def _enforce_plan_limits(user, size_add:int) -> tuple[bool,str]:
-    plan = Plan.query.filter_by(slug=user.plan).first() if hasattr(user, 'plan') else None
+    plan = _plano_limites(user)
     if not plan:
         return True, ""
     quota = _get_quota(user.id)
@@ -217,8 +153,8 @@ def _get_summary_owned(file_id:int):
     return uf, s
 
 def _get_user_plan(user):
-    # seu User guarda slug em user.plan (string). Busque o Plan por slug:
-    return Plan.query.filter_by(slug=user.plan, active=True).first()
+    # seu User guarda slug em user.plan (string); planos vêm do cache (services/plan_service)
+    return plano(user.plan, ativo=True)
 
 def _can_upload(user, new_bytes: int) -> tuple[bool, str]:
     plan = _get_user_plan(user)
@@ -251,29 +187,18 @@ def ver_calculo(file_id:int):
         flash("Este XML ainda não foi processado.", "warning")
         return redirect(url_for("files.list_files"))
 
-    if not s.calc_json:
+    if not has_calc(s):
         flash("Ainda não há cálculo salvo para esta NF. Abra o preview e clique em “Calcular ST”.", "info")
         return redirect(url_for("files.preview_xml", file_id=file_id))
 
     try:
-        payload = json.loads(s.calc_json)
+        payload = load_payload(s)
+        ctx = contexto_resultado(payload)
     except Exception:
         flash("Não foi possível carregar o cálculo salvo.", "danger")
         return redirect(url_for("files.list_files"))
 
-    linhas     = payload.get("linhas", [])
-    total_st   = float(payload.get("total_st", 0))
-    uf_origem  = payload.get("uf_origem", "SP")
-    uf_destino = payload.get("uf_destino", "AM")
-
-    return render_template(
-        "resultado.html",
-        linhas=linhas,
-        total_st=total_st,
-        uf_origem=uf_origem,
-        uf_destino=uf_destino,
-        payload_json=json.dumps(payload, ensure_ascii=False)
-    )
+    return render_template("resultado.html", **ctx, file_id=file_id)
 
 @bp.route("/marcar-status/<int:file_id>/<status>", methods=["POST"])
 @login_required
@@ -296,12 +221,62 @@ def toggle_incluir(file_id:int):
     flash("Preferência de inclusão nos totais atualizada.", "success")
     return redirect(url_for("files.list_files"))
 
+def _cursor_arquivos(valor: str | None):
+    """``"<uploaded_at ISO>_<id>"`` -> (datetime, id); None se ausente/inválido."""
+    try:
+        em, fid = (valor or "").rsplit("_", 1)
+        return datetime.datetime.fromisoformat(em), int(fid)
+    except ValueError:
+        return None
+
+
+def pagina_arquivos(user_id: int, apos=None, por_pagina: int = 50):
+    """
+    Uma página de arquivos do usuário, mais recentes primeiro, por keyset em
+    (uploaded_at, id) — custo constante em qualquer página (índice
+    ``ix_user_files_user_deleted_uploaded``).  O resumo vem no mesmo SELECT
+    (LEFT JOIN), só com as colunas que a lista usa.  Devolve (arquivos,
+    cursor da próxima página ou None).
+    """
+    q = (
+        UserFile.query
+        .options(
+            load_only(UserFile.id, UserFile.display_name, UserFile.filename,
+                      UserFile.size_bytes, UserFile.uploaded_at),
+            joinedload(UserFile.nfe_summary).load_only(
+                NFESummary.id, NFESummary.processed_at, NFESummary.calc_version,
+                NFESummary.validation_status,
+            ),
+        )
+        .filter(UserFile.user_id == user_id, UserFile.deleted_at.is_(None))
+    )
+    if apos:
+        em, fid = apos
+        q = q.filter(or_(UserFile.uploaded_at < em, and_(UserFile.uploaded_at == em, UserFile.id < fid)))
+    files = q.order_by(UserFile.uploaded_at.desc(), UserFile.id.desc()).limit(por_pagina + 1).all()
+    if len(files) <= por_pagina:
+        return files, None
+    files = files[:por_pagina]
+    ultimo = files[-1]
+    return files, f"{ultimo.uploaded_at.isoformat()}_{ultimo.id}"
+
+
 @bp.route("/meus-arquivos", methods=["GET"])
 @login_required
 def list_files():
-    q = UserFile.query.filter_by(user_id=current_user().id, deleted_at=None).order_by(UserFile.uploaded_at.desc())
-    files = q.limit(200).all()
-    return render_template("files.html", files=files)
+    apos = _cursor_arquivos(request.args.get("apos"))
+    files, proxima = pagina_arquivos(
+        current_user().id, apos, current_app.config.get("FILES_PAGE_SIZE", 50)
+    )
+    return render_template("files.html", files=files, proxima=proxima, paginado=apos is not None)
+
+@bp.route("/buscar", methods=["GET"])
+@login_required
+def buscar():
+    """Busca nas notas do usuário: chave, número, CNPJ, NCM ou descrição/código do produto."""
+    termo = (request.args.get("q") or "").strip()
+    notas = buscar_notas(current_user().id, termo, current_app.config.get("FILES_PAGE_SIZE", 50)) if termo else []
+    return render_template("busca.html", termo=termo, notas=notas)
 
 @bp.route("/upload-xml", methods=["POST"])
 @login_required
@@ -330,7 +305,7 @@ def upload_xml():
         flash(f"Upload recusado: {err}", "danger")
         return redirect(url_for("files.list_files"))
 
-    # 3) Valida limites do plano com base no tamanho real
+    # 3) Pré-checagem dos limites do plano (a reserva atômica vem no passo 7)
     user = current_user()
     size = len(data)
     ok, msg = _enforce_plan_limits(user, size_add=size)
@@ -368,16 +343,17 @@ def upload_xml():
         display_name=display_name or os.path.splitext(safe_name)[0]
     )
 
-    # 7) Atualiza quota
-    quota = _get_quota(user.id)
-    quota.files_count += 1
-    quota.storage_bytes += size
-    quota.month_uploads += 1
+    # 7) Reserva a quota (UPDATE condicional) na mesma transação do registro
+    ok, msg = reservar_upload(user.id, size, _plano_limites(user))
+    if not ok:
+        db.session.rollback()
+        target.unlink(missing_ok=True)
+        flash(msg, "danger")
+        return redirect(url_for("files.list_files"))
 
-    db.session.add(quota)
+    # registro, quota e auditoria num commit só
     db.session.add(rec)
-    db.session.commit()
-
+    db.session.flush()
     db.session.add(AuditLog(user_id=user.id, action="upload", ref=f"user_file:{rec.id}", description=safe_name))
     db.session.commit()
 
@@ -431,6 +407,7 @@ def deletar_xml(file_id:int):
 
     s = NFESummary.query.filter_by(user_file_id=uf.id).first()
     if s:
+        remover_itens(s.id)
         db.session.delete(s)
 
     try:
@@ -441,14 +418,7 @@ def deletar_xml(file_id:int):
     uf.deleted_at = datetime.datetime.utcnow()
     db.session.add(uf)
 
-    try:
-        quota = _get_quota(current_user().id)
-        size = uf.size_bytes or 0
-        quota.files_count = max(0, (quota.files_count or 0) - 1)
-        quota.storage_bytes = max(0, (quota.storage_bytes or 0) - size)
-        db.session.add(quota)
-    except Exception:
-        pass
+    liberar(uf.user_id, uf.size_bytes or 0)
 
     db.session.add(AuditLog(user_id=current_user().id, action="delete", ref=f"user_file:{uf.id}", description=uf.filename))
 
@@ -486,8 +456,9 @@ def parse_xml(file_id: int):
     try:
         summary, created = upsert_summary_from_xml(
             db, NFEXML, NFESummary, UserFile,
-            current_user().id, xml_bytes, uf.id
+            current_user().id, xml_bytes, uf.id, commit=False
         )
+        indexar_itens(summary, current_user().id, parser, refazer=True, commit=False)
     except Exception as e:
         db.session.rollback()
         current_app.logger.exception("Falha ao processar XML")
@@ -496,10 +467,8 @@ def parse_xml(file_id: int):
 
     # ——— CALCULAR ST e cachear ———
     try:
-        payload = _compute_st_payload(xml_bytes, NFEXML, get_motor)
-        summary.calc_json    = json.dumps(payload, ensure_ascii=False)
-        summary.calc_version = ALG_VERSION
-        summary.calc_at      = datetime.datetime.utcnow()
+        payload = _compute_st_payload(xml_bytes, NFEXML, get_motor, nfe=parser)
+        store_payload(summary, payload, ALG_VERSION)
         if not summary.processed_at:
             summary.processed_at = datetime.datetime.utcnow()
     except Exception as e:
@@ -509,9 +478,8 @@ def parse_xml(file_id: int):
     meta = {"header": head, "totais": tot}
     summary.meta_json = json.dumps(meta, ensure_ascii=False)
 
+    # resumo, itens, cálculo e auditoria num commit só
     db.session.add(summary)
-    db.session.commit()
-
     db.session.add(
         AuditLog(
             user_id=current_user().id,
@@ -531,13 +499,10 @@ def parse_xml(file_id: int):
         })
     return redirect(url_for("files.list_files"))
 
-@bp.route("/relatorios/nfe")
-@login_required
-def relatorio_nfe():
-    from sqlalchemy import func
-    # período
-    start = request.args.get("start")
-    end = request.args.get("end")
+def _consulta_relatorio(args):
+    """Query dos summaries do usuário com os filtros de ``/relatorios/nfe`` (período, status, totais)."""
+    start = args.get("start")
+    end = args.get("end")
     if not start or not end:
         now = datetime.datetime.utcnow()
         start_dt = now - datetime.timedelta(days=90)
@@ -547,9 +512,9 @@ def relatorio_nfe():
         end_dt = datetime.datetime.fromisoformat(end)
 
     # filtros extras
-    f_status = request.args.get("status")            # 'conforme' | 'nao_conforme' | 'pending' | ''(todos)
-    f_proc = request.args.get("proc")                # 'processed' | 'unprocessed' | ''(todos)
-    f_totais = request.args.get("in_totals")         # '1' | '0' | ''(todas)
+    f_status = args.get("status")            # 'conforme' | 'nao_conforme' | 'pending' | ''(todos)
+    f_proc = args.get("proc")                # 'processed' | 'unprocessed' | ''(todos)
+    f_totais = args.get("in_totals")         # '1' | '0' | ''(todas)
 
     q = (db.session.query(NFESummary)
          .join(UserFile, NFESummary.user_file_id==UserFile.id)
@@ -569,6 +534,15 @@ def relatorio_nfe():
     elif f_totais == "0":
         q = q.filter(NFESummary.include_in_totals.is_(False))
 
+    filtros = dict(start=start_dt, end=end_dt,
+                   f_status=f_status or "", f_proc=f_proc or "", f_totais=f_totais or "")
+    return q, filtros
+
+
+@bp.route("/relatorios/nfe")
+@login_required
+def relatorio_nfe():
+    q, filtros = _consulta_relatorio(request.args)
     rows = q.order_by(NFESummary.emissao.desc()).all()
 
     # dedup por chave (defensivo)
@@ -591,8 +565,7 @@ def relatorio_nfe():
                            soma_total=soma_total,
                            soma_icms=soma_icms,
                            soma_st=soma_st,
-                           start=start_dt, end=end_dt,
-                           f_status=f_status or "", f_proc=f_proc or "", f_totais=f_totais or "")
+                           **filtros)
 
 @bp.route("/relatorios/nfe/selecionar", methods=["POST"])
 @login_required
@@ -622,3 +595,66 @@ def selecionar_totais():
                             start=start_dt.date().isoformat() if start_dt else None,
                             end=end_dt.date().isoformat() if end_dt else None,
                             status=status, in_totals=in_totals))
+
+
+def titulo_nota(s: NFESummary) -> str:
+    """Título da nota nos PDFs da memória de cálculo."""
+    return f"NF {s.numero or '—'}/{s.serie or '—'} — {s.emit_nome or s.emit_cnpj or ''} — chave {s.chave or '—'}"
+
+
+def _notas_pdf(ids):
+    """Gerador das notas do PDF consolidado: payloads decodificados conforme as partes são montadas."""
+    for sid in ids:
+        s = db.session.get(NFESummary, sid)
+        payload = load_payload(s)
+        if payload is None:
+            continue
+        yield {
+            "titulo": titulo_nota(s),
+            "uf_origem": payload.get("uf_origem"),
+            "uf_destino": payload.get("uf_destino"),
+            "linhas": payload.get("linhas") or [],
+        }
+        db.session.expire(s)  # solta o blob/linhas já impressos
+
+
+@bp.route("/relatorios/nfe/pdf", methods=["GET", "POST"])
+@login_required
+def relatorio_nfe_pdf():
+    """
+    Memória de cálculo consolidada: notas do período/filtros (GET) ou as
+    marcadas na tabela (POST ``selected[]``).  O PDF é montado num arquivo
+    temporário e enviado em streaming.
+    """
+    import tempfile
+    from report import gerar_pdf_consolidado
+
+    src = request.form if request.method == "POST" else request.args
+    q, _ = _consulta_relatorio(src)
+    q = q.filter(NFESummary.calc_version.isnot(None))
+    if request.method == "POST":
+        q = q.filter(NFESummary.id.in_([int(x) for x in request.form.getlist("selected[]") if x.isdigit()]))
+
+    ids, seen = [], set()
+    for sid, chave in q.order_by(NFESummary.emissao.desc()).with_entities(NFESummary.id, NFESummary.chave):
+        if chave in seen:
+            continue
+        seen.add(chave)
+        ids.append(sid)
+    if not ids:
+        flash("Nenhuma nota com cálculo salvo para o relatório.", "warning")
+        return redirect(url_for("files.relatorio_nfe", **{k: v for k, v in src.items() if k in ("start", "end", "status", "in_totals")}))
+
+    tmp = tempfile.TemporaryFile()  # removido ao fechar (fim do envio)
+    try:
+        gerar_pdf_consolidado(
+            _notas_pdf(ids), tmp,
+            workers=current_app.config.get("REPORT_PDF_WORKERS", 1),
+            notas_por_parte=current_app.config.get("REPORT_PDF_NOTAS_POR_PARTE", 20),
+        )
+    except Exception:
+        tmp.close()
+        raise
+    tmp.seek(0)
+    return send_file(tmp, mimetype="application/pdf", as_attachment=True,
+                     download_name="memoria_calculo_consolidada.pdf")
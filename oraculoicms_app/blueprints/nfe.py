@@ -4,19 +4,28 @@ from __future__ import annotations
 import io, json, base64, datetime, re
 from flask import Blueprint, render_template, request, redirect, url_for, flash, send_file, jsonify,current_app
 from oraculoicms_app.decorators import login_required, admin_required
-from oraculoicms_app.services.sheets_service import get_matrices, reload_matrices
+from oraculoicms_app.services.sheets_service import (
+    get_matrices, reload_matrices, bump_rules_stamp, rules_stamp, latest_source_log, count_source_logs,
+)
+from oraculoicms_app.services import artifact_cache
+from oraculoicms_app.services.scheduler_service import ultimas_execucoes
 from oraculoicms_app.services.calc_service import get_motor, rebuild_motor
+from oraculoicms_app.services.payload_service import (
+    ALG_VERSION, build_st_payload, contexto_resultado,
+)
+from oraculoicms_app.services.calc_store import has_calc, load_payload, store_payload
+from oraculoicms_app.services.search_service import indexar_itens
 from sqlalchemy import delete
 
 from updater import run_update_am, is_truthy
 from xml_parser import NFEXML
-from report import gerar_pdf
-from calc import ItemNF, ResultadoItem, D, q2
+from report import REPORT_VERSION, gerar_pdf_nota
+from calc import D, q2
 from decimal import Decimal
 from base64 import b64decode
 from oraculoicms_app.extensions import db
 from oraculoicms_app.models.file import NFESummary, UserFile
-from .files import current_user  # usa o helper que criamos
+from .files import current_user, _get_summary_owned, titulo_nota  # usa o helper que criamos
 from datetime import datetime
 import pandas as pd
 
@@ -27,8 +36,7 @@ from .nfe_indexer import upsert_summary_from_xml
 bp = Blueprint("nfe", __name__)
 ALLOWED_EXT = {"xml"}
 
-# --- helper: um único lugar com a regra de cálculo ---
-ALG_VERSION = "st-v2"
+# --- helper: um único lugar com a regra de cálculo (services/payload_service) ---
 def _get_engine_safe():
     """
     Pega o engine via get_motor(); se vier dict/None, reconstrói.
@@ -42,122 +50,8 @@ def _get_engine_safe():
     return eng
 
 
-def _compute_st_payload(xml_bytes, NFEXML, get_motor):
-    nfe = NFEXML(xml_bytes)
-    header = nfe.header() or {}
-    itens  = nfe.itens() or []
-
-    uf_origem  = (header.get("uf_origem")  or "SP").upper()
-    uf_destino = (header.get("uf_destino") or "AM").upper()
-
-    motor = _get_engine_safe()
-
-    linhas, total_st, total_nf_st = [], 0.0, 0.0
-    for it in itens:
-        r = motor.calcula_st(it, uf_origem, uf_destino, usar_multiplicador=True)
-        m = r.memoria
-        def f(v, d=0.0):
-            try: return float(v if v is not None else d)
-            except: return float(d)
-        qCom=f(it.qCom); vUnCom=f(it.vUnCom); vProd=f(it.vProd)
-        vFrete=f(it.vFrete); vIPI=f(it.vIPI); vOutro=f(it.vOutro)
-        vICMSDeson=f(m.get("ICMS DESONERADO", it.vICMSDeson))
-        venda_desc_icms=f(m.get("VALOR DA VENDA COM DESCONTO DE ICMS", m.get("venda_desc_icms", 0.0)))
-        valor_oper=f(m.get("VALOR DA OPERAÇÃO", venda_desc_icms))
-        mva_percent=f(m.get("MARGEM_DE_VALOR_AGREGADO_MVA", m.get("mva_percentual_aplicado", 0.0)))
-        valor_agregado=f(m.get("VALOR AGREGADO", 0.0))
-        base_st=f(m.get("BASE_ST", m.get("BASE DE CÁLCULO SUBSTITUIÇÃO TRIBUTÁRIA", 0.0)))
-        aliq_st=f(m.get("ALÍQUOTA ICMS-ST", m.get("aliq_interna", 0.0)))
-        icms_teorico_dest=f(m.get("icms_teorico_dest", 0.0))
-        icms_origem_calc=f(m.get("icms_origem_calc", vICMSDeson))
-        icms_st=f(m.get("VALOR_ICMS_ST", 0.0))
-        saldo_devedor=f(m.get("SALDO_DEVEDOR_ST", m.get("VALOR SALDO DEVEDOR ICMS ST", 0.0)))
-        mult_sefaz=f(m.get("MULT_SEFAZ", m.get("Multiplicador", m.get("MULTIPLICADOR SEFAZ", 0.0))))
-        icms_retido=f(m.get("VALOR ICMS RETIDO", m.get("icms_retido", saldo_devedor)))
-
-        cest = getattr(it, "cest", "")
-        nf_mva_raw = D(getattr(it, "pMVAST", 0))
-        nf_mva_percent_dec = q2(nf_mva_raw)
-        nf_base_st_dec = q2(D(getattr(it, "vBCST", 0)))
-        nf_base_st_ret_dec = q2(D(getattr(it, "vBCSTRet", 0)))
-        nf_icms_st_dec = q2(D(getattr(it, "vICMSST", getattr(it, "vICMSSTRet", 0))))
-        nf_icms_st_ret_dec = q2(D(getattr(it, "vICMSSTRet", 0)))
-        nf_aliq_percent_dec = q2(D(getattr(it, "pICMSST", 0)))
-
-        calc_mva_percent_dec = q2(D(mva_percent))
-        calc_base_st_dec = q2(D(base_st))
-        calc_icms_st_dec = q2(D(icms_st))
-        calc_aliq_percent_dec = q2(D(aliq_st) * Decimal('100'))
-
-        dif_mva_percent_dec = q2(calc_mva_percent_dec - nf_mva_percent_dec)
-        dif_base_st_dec = q2(calc_base_st_dec - nf_base_st_dec)
-        dif_icms_st_dec = q2(calc_icms_st_dec - nf_icms_st_dec)
-        dif_aliq_percent_dec = q2(calc_aliq_percent_dec - nf_aliq_percent_dec)
-
-        divergente = any(
-            abs(val) > Decimal('0.01')
-            for val in (dif_icms_st_dec, dif_base_st_dec)
-        ) or any(
-            abs(val) > Decimal('0.10')
-            for val in (dif_mva_percent_dec, dif_aliq_percent_dec)
-        )
-
-        linhas.append({
-            "idx": it.nItem, "cProd": it.cProd, "xProd": it.xProd,
-            "ncm": it.ncm, "cst": it.cst, "cfop": it.cfop,
-            "cest": cest,
-            "qCom": qCom, "vUnCom": vUnCom, "vProd": vProd,
-            "vFrete": vFrete, "vIPI": vIPI, "vOutro": vOutro,
-            "vICMSDeson": vICMSDeson,
-            "venda_desc_icms": venda_desc_icms,
-            "valor_oper": valor_oper,
-            "mva_tipo": m.get("mva_tipo", "MVA Padrão"),
-            "mva_percent": mva_percent,
-            "valor_agregado": valor_agregado,
-            "base_st": base_st,
-            "aliq_st": aliq_st,
-            "icms_teorico_dest": icms_teorico_dest,
-            "icms_origem_calc": icms_origem_calc,
-            "icms_st": icms_st,
-            "saldo_devedor": saldo_devedor,
-            "mult_sefaz": mult_sefaz,
-            "icms_retido": icms_retido,
-
-            "nf_mva_percent": float(nf_mva_percent_dec),
-            "nf_aliq_percent": float(nf_aliq_percent_dec),
-            "nf_base_st": float(nf_base_st_dec),
-            "nf_base_st_ret": float(nf_base_st_ret_dec),
-            "nf_icms_st": float(nf_icms_st_dec),
-            "nf_icms_st_ret": float(nf_icms_st_ret_dec),
-            "dif_mva_percent": float(dif_mva_percent_dec),
-            "dif_aliq_percent": float(dif_aliq_percent_dec),
-            "dif_base_st": float(dif_base_st_dec),
-            "dif_icms_st": float(dif_icms_st_dec),
-            "divergente": divergente,
-
-            # aliases esperados no template
-            "valor_operacao": valor_oper,
-            "mva_percentual": mva_percent,
-            "multiplicador": mult_sefaz,
-            "quant": qCom, "vun": vUnCom, "vprod": vProd, "frete": vFrete, "ipi": vIPI, "vout": vOutro,
-            "icms_deson": vICMSDeson,
-            "base_calculo_st": base_st,
-            "aliquota_icms_st": aliq_st,
-            "valor_icms_st": icms_st,
-            "valor_saldo_devedor": saldo_devedor,
-            "multiplicador_sefaz": mult_sefaz,
-            "valor_icms_retido": icms_retido,
-        })
-        total_st += float(r.icms_st_devido or 0.0)
-        total_nf_st += float(nf_icms_st_dec)
-
-    return {
-        "uf_origem": uf_origem,
-        "uf_destino": uf_destino,
-        "linhas": linhas,
-        "total_st": total_st,
-        "total_nf_st": total_nf_st,
-    }
+def _compute_st_payload(xml_bytes, NFEXML, get_motor, nfe=None):
+    return build_st_payload(xml_bytes, NFEXML, _get_engine_safe(), nfe=nfe)
 
 
 def _normalize_form_ncm(value: str) -> str:
@@ -250,91 +144,76 @@ def calcular():
           .order_by(UserFile.id.desc()).first())
 
     # garante summary (indexado p/ relatório)
-    summary = None
+    summary = nfe = None
     try:
         if uf:
             summary, _ = upsert_summary_from_xml(
                 db, NFEXML, NFESummary, UserFile, current_user().id, xml_bytes, uf.id
             )
+            nfe = NFEXML(xml_bytes)  # o mesmo objeto serve ao cálculo abaixo
+            indexar_itens(summary, current_user().id, nfe)
     except Exception as e:
         current_app.logger.warning("indexer falhou: %s", e)
 
     # usa cache se disponível e na mesma versão
-    if summary and summary.calc_json and summary.calc_version == ALG_VERSION:
-        payload = _json.loads(summary.calc_json)
-        return render_template("resultado.html",
-            linhas=payload.get("linhas", []),
-            total_st=float(payload.get("total_st", 0)),
-            total_nf_st=float(payload.get("total_nf_st", 0)),
-            uf_origem=payload.get("uf_origem", "SP"),
-            uf_destino=payload.get("uf_destino", "AM"),
-            payload_json=_json.dumps(payload, ensure_ascii=False)
-        )
+    if has_calc(summary) and summary.calc_version == ALG_VERSION:
+        payload = load_payload(summary)
+        if payload is not None:
+            return render_template("resultado.html", **contexto_resultado(payload), file_id=uf.id)
 
     # calcula e salva cache
-    payload = _compute_st_payload(xml_bytes, NFEXML, get_motor)
+    payload = _compute_st_payload(xml_bytes, NFEXML, get_motor, nfe=nfe)
     if summary:
-        summary.calc_json    = _json.dumps(payload, ensure_ascii=False)
-        summary.calc_version = ALG_VERSION
-        summary.calc_at      = datetime.datetime.utcnow()
+        store_payload(summary, payload)
         if not summary.processed_at:
             summary.processed_at = datetime.datetime.utcnow()
         db.session.add(summary); db.session.commit()
 
-    return render_template("resultado.html",
-        linhas=payload["linhas"],
-        total_st=payload["total_st"],
-        total_nf_st=payload.get("total_nf_st", 0.0),
-        uf_origem=payload["uf_origem"],
-        uf_destino=payload["uf_destino"],
-        payload_json=_json.dumps(payload, ensure_ascii=False)
-    )
+    return render_template("resultado.html", **contexto_resultado(payload),
+                           file_id=uf.id if summary else None)
 
 
 
 
-@bp.route("/exportar-pdf", methods=["POST"])
+@bp.route("/exportar-pdf/<int:file_id>")
 @login_required
-def exportar_pdf():
-    data_json = request.form.get("data")
-    if not data_json:
-        flash("Dados ausentes para gerar o PDF.", "danger")
-        return redirect(url_for("core.index"))
-
-    data = data_json
-    try:
-        cnt = 0
-        while isinstance(data, str) and cnt < 3:
-            data = json.loads(data)
-            cnt += 1
-    except Exception as e:
-        flash(f"Payload inválido para PDF: {e}", "danger")
-        return redirect(url_for("core.index"))
-
-    resultados = []
-    for row in data["linhas"]:
-        it_fake = ItemNF(
-            ncm=row.get("ncm",""), cfop=row.get("cfop",""), cst=row.get("cst",""),
-            valor_produto=0.0, frete_rateado=0.0, descontos=0.0,
-            despesas_acessorias=0.0, icms_destacado_origem=0.0
-        )
-        r_fake = ResultadoItem(
-            base_calculo_st=row.get("base_st", 0.0),
-            icms_st_devido=row.get("icms_st", 0.0),
-            memoria={
-                "base_oper": row.get("base_oper", 0.0),
-                "mva_tipo": row.get("mva_tipo", "-"),
-                "mva_percentual_aplicado": row.get("mva_percentual", 0.0),
-                "icms_teorico_dest": row.get("icms_teorico_dest", 0.0),
-                "icms_origem_calc": row.get("icms_origem_calc", 0.0),
-            }
-        )
-        resultados.append((it_fake, r_fake))
-
-    pdf_bytes = gerar_pdf(resultados, data.get("uf_origem","-"), data.get("uf_destino","-"))
-    return send_file(io.BytesIO(pdf_bytes),
-                     mimetype="application/pdf", as_attachment=True,
-                     download_name="memoria_calculo_icms.pdf")
+def exportar_pdf(file_id: int):
+    """
+    Memória de cálculo em PDF a partir do resultado salvo (calc_store), sem
+    recalcular nem receber o payload de volta do navegador.  Downloads
+    repetidos saem do cache: chave (md5 do XML, versão das regras e do
+    cálculo, versão do layout do relatório).
+    """
+    uf, s = _get_summary_owned(file_id)
+    if not has_calc(s):
+        flash("Ainda não há cálculo salvo para esta NF. Abra o preview e clique em “Calcular ST”.", "info")
+        return redirect(url_for("files.preview_xml", file_id=file_id))
+
+    stamp = rules_stamp() or {}
+    nome = artifact_cache.chave(
+        "memoria", uf.md5 or f"user_file:{uf.id}",
+        stamp.get("versao"), stamp.get("em"), s.calc_version, s.calc_at, REPORT_VERSION,
+    )
+    download = f"memoria_calculo_icms_{s.numero or file_id}.pdf"
+    grupo = artifact_cache.grupo_nota(s.id)
+    path = artifact_cache.obter(nome, grupo=grupo)
+    if path is not None:
+        # abre já: se outro worker (ou /admin/cache/limpar) apagar a entrada
+        # depois disso, o handle aberto continua válido; antes disso, é falta
+        try:
+            fh = open(path, "rb")
+        except FileNotFoundError:
+            pass
+        else:
+            return send_file(fh, mimetype="application/pdf", as_attachment=True, download_name=download)
+
+    payload = load_payload(s)
+    if payload is None:
+        flash("Não foi possível carregar o cálculo salvo.", "danger")
+        return redirect(url_for("files.list_files"))
+    pdf = gerar_pdf_nota(payload, titulo=titulo_nota(s))
+    artifact_cache.gravar(nome, pdf, grupo=grupo)
+    return send_file(io.BytesIO(pdf), mimetype="application/pdf", as_attachment=True, download_name=download)
 
 # --------- Admin: updater/config (planilhas) ---------
 
@@ -350,11 +229,19 @@ def run_update():
 @bp.route("/admin/reload")
 @admin_required
 def admin_reload():
+    bump_rules_stamp("reload")  # invalida snapshot e demais workers
     reload_matrices()
     rebuild_motor()
     flash("Parâmetros recarregados do banco de dados.", "info")
     return redirect(url_for("core.index"))
 
+@bp.route("/admin/cache/limpar", methods=["POST"])
+@admin_required
+def admin_cache_limpar():
+    n = artifact_cache.limpar()
+    flash(f"Cache de PDFs esvaziado ({n} arquivos).", "info")
+    return redirect(url_for("nfe.config_view"))
+
 @bp.route("/config", methods=["GET"])
 @admin_required
 def config_view():
@@ -368,16 +255,7 @@ def config_view():
     updated_at = datetime.now().isoformat(timespec="seconds")
     sources_count = sum(1 for r in sources if str(r.get("ATIVO","")).strip() in ("1","true","True","on","ON"))
 
-    df_log = matrices.get("sources_log")
-    last_log = None
-    if df_log is not None and not df_log.empty:
-        last_entry = df_log.sort_values("EXECUTADO_EM").iloc[-1]
-        last_log = {
-            "executado_em": str(last_entry.get("EXECUTADO_EM", "")),
-            "status": last_entry.get("STATUS", ""),
-            "mensagem": last_entry.get("MENSAGEM", ""),
-            "linhas": last_entry.get("LINHAS", 0),
-        }
+    last_log = latest_source_log()
 
     return render_template("config.html",
         sources=sources,
@@ -385,6 +263,8 @@ def config_view():
         updated_at=updated_at,
         sources_count=sources_count,
         last_log=last_log,
+        jobs=ultimas_execucoes(),
+        cache=artifact_cache.estatisticas(),
         active_tab="sources",
     )
 
@@ -420,16 +300,7 @@ def config_tables_view():
     ativos = sum(1 for row in st_regras if is_truthy(row.get("ATIVO")))
     aplicaveis = sum(1 for row in st_regras if is_truthy(row.get("ST_APLICA")))
 
-    df_log = matrices.get("sources_log")
-    last_log = None
-    if df_log is not None and not df_log.empty:
-        last_entry = df_log.sort_values("EXECUTADO_EM").iloc[-1]
-        last_log = {
-            "executado_em": str(last_entry.get("EXECUTADO_EM", "")),
-            "status": last_entry.get("STATUS", ""),
-            "mensagem": last_entry.get("MENSAGEM", ""),
-            "linhas": last_entry.get("LINHAS", 0),
-        }
+    last_log = latest_source_log()
 
     return render_template(
         "config_tables.html",
@@ -481,6 +352,7 @@ def config_save():
                 prioridade=int(row.get("PRIORIDADE")) if str(row.get("PRIORIDADE", "")).isdigit() else None,
             ))
         db.session.commit()
+        bump_rules_stamp("fontes")
         reload_matrices()
         rebuild_motor()
         flash("Fontes salvas com sucesso no banco de dados.", "success")
@@ -531,6 +403,7 @@ def config_tables_save():
                 st_aplica=is_truthy(row.get("ST_APLICA")),
             ))
         db.session.commit()
+        bump_rules_stamp("manual")
         reload_matrices()
         rebuild_motor()
         flash("Regras de ST atualizadas com sucesso no banco de dados.", "success")
@@ -545,10 +418,9 @@ def config_tables_save():
 def debug_sheets():
     matrices = get_matrices()
     df_sources = matrices.get("sources")
-    df_log = matrices.get("sources_log")
     info = {
         "sources_rows": 0 if df_sources is None else len(df_sources.index),
-        "log_entries": 0 if df_log is None else len(df_log.index),
+        "log_entries": count_source_logs(),
         "updated_at": datetime.now().isoformat(timespec="seconds"),
     }
     return jsonify(info), 200
@@ -14,12 +14,14 @@ def _parse_emissao_iso(iso: str):
         return None
 
 def upsert_summary_from_xml(db, NFEXML, NFESummary, UserFile,
-                            user_id: int, xml_bytes: bytes, user_file_id: int | None = None):
+                            user_id: int, xml_bytes: bytes, user_file_id: int | None = None,
+                            commit: bool = True):
     """
     Garante um NFESummary para o usuário/arquivo, preenchendo cabeçalho e totais.
     - Procura primeiro por user_file_id
     - Senão, por (user_id, chave)
     - Cria se não existir
+    - commit=False: só flush (o chamador fecha a transação junto com o resto)
     Retorna: (summary, created: bool)
     """
     nfe   = NFEXML(xml_bytes)
@@ -92,5 +94,8 @@ def upsert_summary_from_xml(db, NFEXML, NFESummary, UserFile,
     summary.meta_json = json.dumps({"header": head, "totais": totais}, ensure_ascii=False)
 
     db.session.add(summary)
-    db.session.commit()
+    if commit:
+        db.session.commit()
+    else:
+        db.session.flush()
     return summary, created
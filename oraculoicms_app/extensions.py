@@ -1,6 +1,7 @@
 # zfm_app/extensions.py
 # -*- coding: utf-8 -*-
 from __future__ import annotations
+import click
 from flask_sqlalchemy import SQLAlchemy
 from flask_bcrypt import Bcrypt
 from flask_migrate import Migrate
@@ -20,6 +21,18 @@ def init_extensions(app):
     bcrypt.init_app(app)
     migrate.init_app(app, db)
 
+def _resolver_usuario(usuario):
+    """``--usuario`` (id ou e-mail) -> id; None = todos."""
+    from .models.user import User
+
+    if not usuario:
+        return None
+    user = db.session.get(User, int(usuario)) if usuario.isdigit() else User.query.filter_by(email=usuario).first()
+    if user is None:
+        raise click.BadParameter(f"usuário não encontrado: {usuario}", param_hint="--usuario")
+    return user.id
+
+
 def register_cli(app):
     @app.cli.command("init-db")
     def init_db_cmd():
@@ -29,3 +42,55 @@ def register_cli(app):
             db.session.execute(text("SELECT 1"))
             db.create_all()
             print("Tabelas criadas.")
+
+    @app.cli.command("recalcular-notas")
+    @click.option("--usuario", help="id ou e-mail do usuário (padrão: todos)")
+    @click.option("--desde", type=click.DateTime(["%Y-%m-%d"]), help="emissão a partir de (AAAA-MM-DD)")
+    @click.option("--ate", type=click.DateTime(["%Y-%m-%d"]), help="emissão antes de (AAAA-MM-DD)")
+    @click.option("--desatualizadas", is_flag=True, help="só cálculos de versão antiga ou anteriores ao carimbo das regras")
+    @click.option("--workers", type=int, default=None, help="processos (padrão: nº de CPUs)")
+    @click.option("--lote", type=int, default=None, help="notas por transação (padrão: RECALC_BATCH)")
+    def recalcular_notas_cmd(usuario, desde, ate, desatualizadas, workers, lote):
+        """Recalcula o ICMS-ST do acervo (ex.: após mudança de legislação)."""
+        from .services.calc_service import get_motor
+        from .services.recalc_service import filtro_acervo, recalcular_acervo
+        from .services.sheets_service import rules_stamp, rules_stamp_em
+
+        with app.app_context():
+            user_id = _resolver_usuario(usuario)
+            cond = filtro_acervo(
+                user_id=user_id, desde=desde, ate=ate,
+                desatualizadas_desde=rules_stamp_em(rules_stamp()), apenas_desatualizadas=desatualizadas,
+            )
+
+            def _progresso(st):
+                click.echo(f"{st['processadas']}/{st['total']} notas "
+                           f"({st['falhas']} falhas, {st['notas_por_s']:.1f} notas/s)")
+
+            st = recalcular_acervo(
+                get_motor(), cond, workers=workers,
+                lote=lote or app.config.get("RECALC_BATCH", 200), progresso=_progresso,
+            )
+            click.echo(f"Concluído: {st['recalculadas']} recalculadas, {st['falhas']} falhas "
+                       f"em {st['segundos']:.1f}s ({st['notas_por_s']:.1f} notas/s).")
+
+    @app.cli.command("indexar-notas")
+    @click.option("--usuario", help="id ou e-mail do usuário (padrão: todos)")
+    def indexar_notas_cmd(usuario):
+        """Indexa os produtos das notas já processadas para a busca (/buscar)."""
+        from pathlib import Path
+        from xml_parser import NFEXML
+        from .models.file import NFESummary
+        from .services.search_service import indexar_itens, notas_sem_itens
+
+        with app.app_context():
+            n = falhas = 0
+            for summary_id, user_id, path in notas_sem_itens(_resolver_usuario(usuario)).all():
+                try:
+                    indexar_itens(db.session.get(NFESummary, summary_id), user_id, NFEXML(Path(path).read_bytes()))
+                    n += 1
+                except Exception as e:
+                    db.session.rollback()
+                    falhas += 1
+                    click.echo(f"nota {summary_id}: {e}", err=True)
+            click.echo(f"Concluído: {n} notas indexadas, {falhas} falhas.")
@@ -5,7 +5,7 @@ from .plan import Plan, Subscription, Invoice
 from .payment import Payment
 from .setting import Setting
 from .user_quota import UserQuota
-from .file import UserFile, NFESummary, AuditLog
+from .file import UserFile, NFESummary, NFEItem, AuditLog, AuditLogArchive, AuditDaily
 from .payment_config import PaymentConfig
 from .support import KBArticle,VideoTutorial,FeedbackMessage,SurveyCampaign,SurveyQuestion,SurveyResponse,SurveyAnswer
 from .matrix import (
@@ -28,7 +28,10 @@ __all__ = [
     "UserQuota",
     "UserFile",
     "NFESummary",
+    "NFEItem",
     "AuditLog",
+    "AuditLogArchive",
+    "AuditDaily",
     "Subscription",
     "Invoice",
     "PaymentConfig",
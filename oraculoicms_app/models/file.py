@@ -2,10 +2,17 @@
 # -*- coding: utf-8 -*-
 from __future__ import annotations
 from datetime import datetime
+
+from sqlalchemy import event, text
+
 from ..extensions import db
 
 class UserFile(db.Model):
     __tablename__ = "user_files"
+    __table_args__ = (
+        # /meus-arquivos: keyset por (uploaded_at, id) dentro do usuário
+        db.Index("ix_user_files_user_deleted_uploaded", "user_id", "deleted_at", "uploaded_at", "id"),
+    )
     id = db.Column(db.Integer, primary_key=True)
     display_name = db.Column(db.String(255))
     user_id = db.Column(db.Integer, db.ForeignKey("users.id"), index=True, nullable=False)
@@ -20,6 +27,12 @@ class UserFile(db.Model):
 
 class NFESummary(db.Model):
     __tablename__ = "nfe_summaries"
+    __table_args__ = tuple(
+        # /buscar: prefixo com LIKE 'x%' no Postgres (collation != C) precisa de pattern_ops;
+        # no SQLite a busca usa faixa [p, p+) sobre os índices comuns das colunas
+        db.Index(f"ix_nfe_summaries_{c}_prefixo", c, postgresql_ops={c: "varchar_pattern_ops"}).ddl_if(dialect="postgresql")
+        for c in ("chave", "numero", "emit_cnpj", "dest_cnpj")
+    )
     id = db.Column(db.Integer, primary_key=True)
     user_file_id = db.Column(db.Integer, db.ForeignKey("user_files.id"), unique=True, nullable=False)
     processed_at = db.Column(db.DateTime)  # quando processou o XML
@@ -41,17 +54,80 @@ class NFESummary(db.Model):
     ipi = db.Column(db.Numeric(14,2), default=0)
     pis = db.Column(db.Numeric(14,2), default=0)
     cofins = db.Column(db.Numeric(14,2), default=0)
-    calc_json = db.Column(db.Text)  # cache do cálculo (JSON)
+    # cache do cálculo: colunas grandes são "deferred" (listas/totais não carregam)
+    calc_json = db.deferred(db.Column(db.Text))          # legado (JSON); novos cálculos usam calc_blob
+    calc_blob = db.deferred(db.Column(db.LargeBinary))   # linhas em formato colunar (services/calc_store)
     calc_version = db.Column(db.String(20))  # versão do algoritmo
     calc_at = db.Column(db.DateTime)  # quando foi calculado
+    calc_itens = db.Column(db.Integer)                   # nº de linhas do cálculo
+    calc_total_st = db.Column(db.Numeric(14,2))          # ICMS-ST calculado (total)
+    calc_total_nf_st = db.Column(db.Numeric(14,2))       # ICMS-ST destacado na NF (total)
     # JSON agregado com totais por CST/CFOP/NCM etc.
     meta_json = db.Column(db.Text)  # compact JSON string
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     # Relacionamentos
     file = db.relationship("UserFile", backref=db.backref("nfe_summary", uselist=False))
 
+class NFEItem(db.Model):
+    """
+    Produtos da nota, só para a busca (/buscar): código, descrição e NCM.
+    ``user_id`` repetido aqui para filtrar sem JOIN.  A descrição tem índice
+    de texto criado junto com a tabela (``_indice_texto_itens``).
+    """
+    __tablename__ = "nfe_items"
+    __table_args__ = (
+        db.Index("ix_nfe_items_user_ncm", "user_id", "ncm"),
+        db.Index("ix_nfe_items_user_cprod", "user_id", "cprod"),
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    summary_id = db.Column(db.Integer, db.ForeignKey("nfe_summaries.id", ondelete="CASCADE"), index=True, nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey("users.id"), nullable=False)
+    n_item = db.Column(db.Integer)
+    cprod = db.Column(db.String(60))
+    xprod = db.Column(db.String(120))
+    ncm = db.Column(db.String(8))
+
+
+@event.listens_for(NFEItem.__table__, "after_create")
+def _indice_texto_itens(target, connection, **kw):
+    """Índice de texto em ``xprod``: FTS5 no SQLite, trigramas (pg_trgm) no Postgres."""
+    dialeto = connection.dialect.name
+    if dialeto == "sqlite":
+        connection.execute(text(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS nfe_items_fts USING fts5("
+            "xprod, content='nfe_items', content_rowid='id', tokenize='unicode61 remove_diacritics 2')"
+        ))
+        connection.execute(text(
+            "CREATE TRIGGER IF NOT EXISTS nfe_items_fts_ai AFTER INSERT ON nfe_items BEGIN "
+            "INSERT INTO nfe_items_fts(rowid, xprod) VALUES (new.id, new.xprod); END"
+        ))
+        connection.execute(text(
+            "CREATE TRIGGER IF NOT EXISTS nfe_items_fts_ad AFTER DELETE ON nfe_items BEGIN "
+            "INSERT INTO nfe_items_fts(nfe_items_fts, rowid, xprod) VALUES ('delete', old.id, old.xprod); END"
+        ))
+        connection.execute(text(
+            "CREATE TRIGGER IF NOT EXISTS nfe_items_fts_au AFTER UPDATE ON nfe_items BEGIN "
+            "INSERT INTO nfe_items_fts(nfe_items_fts, rowid, xprod) VALUES ('delete', old.id, old.xprod); "
+            "INSERT INTO nfe_items_fts(rowid, xprod) VALUES (new.id, new.xprod); END"
+        ))
+    elif dialeto == "postgresql":
+        connection.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+        connection.execute(text(
+            "CREATE INDEX IF NOT EXISTS ix_nfe_items_xprod_trgm ON nfe_items USING gin (xprod gin_trgm_ops)"
+        ))
+
+
 class AuditLog(db.Model):
+    """
+    Eventos recentes (tabela "quente", pequena).  Eventos com mais de
+    ``AUDIT_HOT_DAYS`` vão para ``audit_logs_archive`` e viram contagens
+    diárias em ``audit_daily`` (services/audit_service).
+    """
     __tablename__ = "audit_logs"
+    __table_args__ = (
+        # atividade recente do usuário
+        db.Index("ix_audit_logs_user_created", "user_id", "created_at"),
+    )
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey("users.id"), index=True, nullable=False)
     action = db.Column(db.String(80), nullable=False)   # upload, delete, view, parse, report
@@ -59,3 +135,46 @@ class AuditLog(db.Model):
     description = db.Column(db.Text)
     created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
     user = db.relationship("User", backref=db.backref("audit_logs", lazy="dynamic"))
+
+
+class AuditLogArchive(db.Model):
+    """
+    Histórico de ``audit_logs``.  No Postgres é particionada por mês em
+    ``created_at`` (a retenção descarta partições inteiras); nos demais
+    bancos, tabela comum.
+    """
+    __tablename__ = "audit_logs_archive"
+    __table_args__ = (
+        db.Index("ix_audit_logs_archive_user_created", "user_id", "created_at"),
+        {"postgresql_partition_by": "RANGE (created_at)"},
+    )
+    # a chave de partição precisa fazer parte da PK
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    created_at = db.Column(db.DateTime, primary_key=True)
+    user_id = db.Column(db.Integer, nullable=False)
+    action = db.Column(db.String(80), nullable=False)
+    ref = db.Column(db.String(120))
+    description = db.Column(db.Text)
+
+
+@event.listens_for(AuditLogArchive.__table__, "after_create")
+def _particao_padrao_auditoria(target, connection, **kw):
+    """Partição DEFAULT (Postgres): nenhuma linha fica sem destino; as mensais vêm do job."""
+    if connection.dialect.name == "postgresql":
+        connection.execute(text(
+            "CREATE TABLE IF NOT EXISTS audit_logs_archive_default PARTITION OF audit_logs_archive DEFAULT"
+        ))
+
+
+class AuditDaily(db.Model):
+    """Eventos por usuário, dia e ação (consolidado antes de arquivar)."""
+    __tablename__ = "audit_daily"
+    __table_args__ = (
+        db.UniqueConstraint("user_id", "dia", "action", name="uq_audit_daily_user_dia_action"),
+        db.Index("ix_audit_daily_dia", "dia"),
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, nullable=False)
+    dia = db.Column(db.Date, nullable=False)
+    action = db.Column(db.String(80), nullable=False)
+    total = db.Column(db.Integer, nullable=False, default=0)
@@ -121,15 +121,21 @@ class Source(db.Model):
 
 class SourceLog(db.Model):
     __tablename__ = "sources_log"
+    __table_args__ = (
+        # última versão OK por fonte (updater) e última entrada (config)
+        db.Index("ix_sources_log_uf_nome_status_exec", "uf", "nome", "status", "executado_em"),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
-    executado_em = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    executado_em = db.Column(db.DateTime, default=datetime.utcnow, nullable=False, index=True)
     uf = db.Column(db.String(2), nullable=True)
     nome = db.Column(db.String(120), nullable=False)
     status = db.Column(db.String(50), nullable=False)
     mensagem = db.Column(db.Text, nullable=True)
     linhas = db.Column(db.Integer, nullable=True)
     versao = db.Column(db.String(64), nullable=True)
+    bytes = db.Column(db.Integer, nullable=True)
+    latencia_ms = db.Column(db.Integer, nullable=True)
 
 
 __all__ = [
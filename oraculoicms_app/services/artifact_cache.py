@@ -0,0 +1,292 @@
+# oraculoicms_app/services/artifact_cache.py
+# -*- coding: utf-8 -*-
+"""
+Cache em disco de artefatos gerados (PDFs da memória de cálculo).
+
+A chave é um hash das partes que determinam o conteúdo — p.ex. (md5 do XML,
+versão das regras/cálculo, versão do layout do relatório) — então uma
+entrada nunca fica "velha": quando algo muda, a chave muda.  Arquivos são
+gravados com ``os.replace`` (atômico): outro worker nunca lê um PDF pela
+metade.
+
+Layout: ``<dir>/<grupo>/<chave><ext>``.  O grupo junta as entradas de uma
+nota (``grupo_nota``) para ``invalidar`` apagá-las quando ela é recalculada.
+
+- LRU limitado em bytes (``ARTIFACT_CACHE_MAX_MB``): um acerto atualiza o
+  mtime do arquivo.  O tamanho do cache é acompanhado em memória (soma das
+  gravações/invalidações deste processo, reconferido com uma varredura a
+  cada ``_REVARRER`` s, já que outros workers também gravam); só quando
+  passa do limite o diretório é varrido e as entradas mais antigas saem.
+- Acertos/faltas: contadores em memória por processo, despejados em
+  ``<dir>/_stats/<host>-<pid>.json`` no máximo a cada ``_DESPEJO`` s (e ao
+  consultar ``estatisticas``, que soma todos os workers e aparece em
+  /config).  Arquivos de processos mortos ou parados há ``_STATS_TTL`` s
+  são apagados; um worker vivo regrava o seu no próximo despejo.
+"""
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import shutil
+import socket
+import tempfile
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from flask import current_app, has_app_context
+
+_GERAL = "_geral"
+_STATS = "_stats"
+_CONTADORES = ("hits", "misses", "gravacoes", "removidos")
+_contadores: Dict[str, int] = dict.fromkeys(_CONTADORES, 0)
+_DESPEJO = 30.0            # s entre gravações dos contadores deste processo
+_STATS_TTL = 24 * 3600.0   # s sem atualização até o arquivo de contadores ser apagado
+_REVARRER = 300.0          # s até reconferir o tamanho estimado com uma varredura
+_despejado_em = 0.0
+_uso: Dict[str, Tuple[int, float]] = {}  # dir -> (bytes estimados, monotonic da última varredura)
+
+
+def _dir() -> Optional[str]:
+    if not has_app_context() or not current_app.config.get("ARTIFACT_CACHE", True):
+        return None
+    return current_app.config.get("ARTIFACT_CACHE_DIR") or os.path.join(
+        current_app.instance_path, "artifact_cache"
+    )
+
+
+def _limite() -> int:
+    return int(float(current_app.config.get("ARTIFACT_CACHE_MAX_MB", 512)) * 1024 * 1024)
+
+
+def chave(*partes) -> str:
+    """Nome da entrada: sha256 das partes (None vira vazio)."""
+    h = hashlib.sha256()
+    for p in partes:
+        h.update(b"" if p is None else str(p).encode("utf-8"))
+        h.update(b"\x00")
+    return h.hexdigest()
+
+
+def grupo_nota(summary_id: int) -> str:
+    """Grupo das entradas de uma nota (apagadas juntas no recálculo)."""
+    return f"nfe-{summary_id}"
+
+
+def _path(d: str, nome: str, ext: str, grupo: Optional[str]) -> str:
+    return os.path.join(d, grupo or _GERAL, f"{nome}{ext}")
+
+
+# ---------- contadores ----------
+def _arquivo_stats(d: str) -> str:
+    return os.path.join(d, _STATS, f"{socket.gethostname()}-{os.getpid()}.json")
+
+
+def _despejar(d: str) -> None:
+    """Grava os contadores deste processo (substitui o arquivo dele)."""
+    global _despejado_em
+    _despejado_em = time.monotonic()
+    pasta = os.path.join(d, _STATS)
+    try:
+        os.makedirs(pasta, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=pasta, suffix=".tmp")
+        with os.fdopen(fd, "w") as fh:
+            json.dump(_contadores, fh)
+        os.replace(tmp, _arquivo_stats(d))
+    except OSError:
+        pass  # contadores são informativos
+
+
+def _contar(d: str, campo: str, n: int = 1) -> None:
+    _contadores[campo] += n
+    if time.monotonic() - _despejado_em >= _DESPEJO:
+        _despejar(d)
+
+
+def _processo_morto(nome: str) -> bool:
+    host, _, pid = nome[:-len(".json")].rpartition("-")
+    if host != socket.gethostname() or not pid.isdigit():
+        return False
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return True
+    except OSError:
+        return False
+    return False
+
+
+# ---------- leitura / gravação ----------
+def obter(nome: str, ext: str = ".pdf", grupo: Optional[str] = None) -> Optional[str]:
+    """Caminho da entrada em cache, ou None (cache desligado ou ausente)."""
+    d = _dir()
+    if not d:
+        return None
+    path = _path(d, nome, ext, grupo)
+    try:
+        os.utime(path)  # LRU: acesso recente
+    except OSError:
+        _contar(d, "misses")
+        return None
+    _contar(d, "hits")
+    return path
+
+
+def gravar(nome: str, dados: bytes, ext: str = ".pdf", grupo: Optional[str] = None) -> Optional[str]:
+    """Grava a entrada e devolve o caminho; None se o cache estiver desligado ou falhar."""
+    d = _dir()
+    if not d:
+        return None
+    path = _path(d, nome, ext, grupo)
+    tmp = None
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        with os.fdopen(fd, "wb") as fh:
+            fh.write(dados)
+        os.replace(tmp, path)
+    except OSError:
+        current_app.logger.warning("Falha ao gravar artefato em cache: %s", path, exc_info=True)
+        if tmp and os.path.exists(tmp):
+            os.unlink(tmp)
+        return None
+    _contar(d, "gravacoes")
+    if _somar_uso(d, len(dados)) > _limite():
+        removidos = _podar(d, _limite(), manter=path)
+        if removidos:
+            _contar(d, "removidos", removidos)
+    return path if os.path.exists(path) else None
+
+
+def invalidar(grupo: str) -> None:
+    """Apaga as entradas do grupo (p.ex. ao recalcular a nota)."""
+    d = _dir()
+    if not d:
+        return
+    pasta = os.path.join(d, grupo)
+    try:
+        tamanho = sum(f.stat().st_size for f in os.scandir(pasta) if f.is_file())
+    except OSError:
+        return  # grupo sem entradas
+    shutil.rmtree(pasta, ignore_errors=True)
+    _somar_uso(d, -tamanho)
+
+
+def limpar() -> int:
+    """Esvazia o cache (mantém os contadores); devolve o nº de entradas removidas."""
+    d = _dir()
+    if not d:
+        return 0
+    entradas, _ = _entradas(d)
+    for _, _, path in entradas:
+        try:
+            os.unlink(path)
+        except OSError:
+            pass
+    _uso.pop(d, None)
+    return len(entradas)
+
+
+# ---------- tamanho / LRU ----------
+def _somar_uso(d: str, delta: int) -> int:
+    """Bytes estimados do cache após ``delta``; varre o diretório só se a estimativa venceu."""
+    total, em = _uso.get(d, (0, None))
+    if em is None or time.monotonic() - em > _REVARRER:
+        total, em = _entradas(d)[1], time.monotonic()  # já inclui o delta
+    else:
+        total = max(0, total + delta)
+    _uso[d] = (total, em)
+    return total
+
+
+def _entradas(d: str) -> Tuple[List[Tuple[float, int, str]], int]:
+    """(mtime, bytes, caminho) de cada entrada e o total em bytes."""
+    out: List[Tuple[float, int, str]] = []
+    total = 0
+    try:
+        grupos = [g for g in os.scandir(d) if g.is_dir() and g.name != _STATS]
+    except OSError:
+        return out, 0
+    for g in grupos:
+        try:
+            arquivos = list(os.scandir(g.path))
+        except OSError:
+            continue
+        for f in arquivos:
+            if f.name.endswith(".tmp"):
+                continue
+            try:
+                st = f.stat()
+            except OSError:
+                continue  # removido por outro worker
+            out.append((st.st_mtime, st.st_size, f.path))
+            total += st.st_size
+    return out, total
+
+
+def _podar(d: str, limite: int, manter: Optional[str] = None) -> int:
+    """Remove as entradas menos usadas até o total caber em ``limite``."""
+    entradas, total = _entradas(d)
+    _uso[d] = (total, time.monotonic())
+    if total <= limite:
+        return 0
+    removidos = 0
+    for _, tamanho, path in sorted(entradas):
+        if total <= limite:
+            break
+        if path == manter and len(entradas) > 1:
+            continue
+        try:
+            os.unlink(path)
+        except OSError:
+            continue
+        total -= tamanho
+        removidos += 1
+    _uso[d] = (total, time.monotonic())
+    return removidos
+
+
+def estatisticas() -> Dict[str, Any]:
+    """Tamanho, limite e acertos/faltas somados de todos os workers."""
+    d = _dir()
+    if not d:
+        return {"ativo": False}
+    _despejar(d)
+    entradas, total = _entradas(d)
+    _uso[d] = (total, time.monotonic())
+    soma = dict.fromkeys(_CONTADORES, 0)
+    pasta = os.path.join(d, _STATS)
+    try:
+        arquivos = [f for f in os.scandir(pasta) if f.name.endswith(".json")]
+    except OSError:
+        arquivos = []
+    agora = time.time()
+    for f in arquivos:
+        path = f.path
+        try:
+            parado = agora - f.stat().st_mtime > _STATS_TTL
+        except OSError:
+            continue
+        if path != _arquivo_stats(d) and (parado or _processo_morto(f.name)):
+            try:
+                os.unlink(path)  # processo que já saiu (ou ocioso: regrava no próximo despejo)
+            except OSError:
+                pass
+            continue
+        try:
+            with open(path) as fh:
+                dados = json.load(fh)
+        except (OSError, ValueError):
+            continue
+        for k in _CONTADORES:
+            soma[k] += int(dados.get(k) or 0)
+    consultas = soma["hits"] + soma["misses"]
+    return {
+        "ativo": True,
+        "dir": d,
+        "entradas": len(entradas),
+        "bytes": total,
+        "limite_bytes": _limite(),
+        **soma,
+        "taxa_acerto": (soma["hits"] / consultas) if consultas else None,
+    }
@@ -0,0 +1,200 @@
+# oraculoicms_app/services/audit_service.py
+# -*- coding: utf-8 -*-
+"""
+Ciclo de vida da auditoria (job ``manter_auditoria``).
+
+- ``consolidar_dias``: conta eventos por usuário/dia/ação em ``audit_daily``
+  (dias completos ainda não consolidados).
+- ``arquivar``: move de ``audit_logs`` para ``audit_logs_archive`` os eventos
+  com mais de ``AUDIT_HOT_DAYS``, em lotes de ``AUDIT_ARCHIVE_BATCH`` (um
+  commit por lote).  A tabela quente fica do tamanho da janela recente:
+  inserir e listar a atividade recente não dependem do histórico.  Eventos
+  legados sem data recebem a data do arquivamento (saem na janela seguinte).
+- ``aplicar_retencao``: apaga o histórico com mais de ``AUDIT_RETENTION_DAYS``
+  (0 = guarda tudo).  No Postgres o arquivo é particionado por mês e as
+  partições vencidas saem com ``DROP TABLE``; no SQLite, ``DELETE`` por faixa.
+
+A consolidação roda antes do arquivamento: nenhum dia sai da tabela quente
+sem estar em ``audit_daily``.
+"""
+from __future__ import annotations
+
+from datetime import date, datetime, time, timedelta
+from typing import Dict, List, Optional
+
+from flask import current_app
+from sqlalchemy import delete, func, insert, select, text, update
+
+from ..extensions import db
+from ..models.file import AuditDaily, AuditLog, AuditLogArchive
+
+_PARTICAO = "audit_logs_archive_p{:%Y%m}"
+
+
+def _dialeto() -> str:
+    return db.session.get_bind().dialect.name
+
+
+def _inicio_mes(d: datetime) -> datetime:
+    return datetime(d.year, d.month, 1)
+
+
+def _proximo_mes(d: datetime) -> datetime:
+    return datetime(d.year + (d.month == 12), d.month % 12 + 1, 1)
+
+
+# ---------- leitura ----------
+def atividade_recente(user_id: int, limite: int = 20) -> List[AuditLog]:
+    """Últimos eventos do usuário (tabela quente, índice user_id+created_at)."""
+    return (
+        AuditLog.query.filter_by(user_id=user_id)
+        .order_by(AuditLog.created_at.desc(), AuditLog.id.desc())
+        .limit(limite)
+        .all()
+    )
+
+
+# ---------- consolidação ----------
+def consolidar_dias(hoje: Optional[date] = None) -> int:
+    """
+    Grava em ``audit_daily`` os dias completos (antes de ``hoje``) ainda não
+    consolidados.  Sem commit; devolve o nº de linhas gravadas.
+    """
+    hoje = hoje or datetime.utcnow().date()
+    ultimo = db.session.execute(select(func.max(AuditDaily.dia))).scalar()
+    if ultimo is not None:
+        desde = datetime.combine(ultimo + timedelta(days=1), time())
+    else:
+        desde = db.session.execute(select(func.min(AuditLog.created_at))).scalar()
+        if desde is None:
+            return 0
+        desde = datetime.combine(desde.date(), time())
+    ate = datetime.combine(hoje, time())
+    if desde >= ate:
+        return 0
+    dia = func.date(AuditLog.created_at)
+    contagens = (
+        select(AuditLog.user_id, dia, AuditLog.action, func.count())
+        .where(AuditLog.created_at >= desde, AuditLog.created_at < ate)
+        .group_by(AuditLog.user_id, dia, AuditLog.action)
+    )
+    res = db.session.execute(
+        insert(AuditDaily).from_select(["user_id", "dia", "action", "total"], contagens)
+    )
+    return res.rowcount or 0
+
+
+# ---------- arquivamento ----------
+def _criar_particao(mes: datetime) -> None:
+    """
+    Partição mensal do arquivo (Postgres).  Linhas do mês que tenham caído na
+    DEFAULT passam para a partição nova antes do ``ATTACH`` (que falharia com
+    elas lá).
+    """
+    nome = _PARTICAO.format(mes)
+    if db.session.execute(text("SELECT to_regclass(:n)"), {"n": nome}).scalar() is not None:
+        return
+    faixa = {"de": mes, "ate": _proximo_mes(mes)}
+    db.session.execute(text(
+        f"CREATE TABLE {nome} (LIKE audit_logs_archive INCLUDING DEFAULTS INCLUDING CONSTRAINTS)"
+    ))
+    if db.session.execute(text("SELECT to_regclass('audit_logs_archive_default')")).scalar() is not None:
+        db.session.execute(text(
+            f"WITH movidas AS (DELETE FROM audit_logs_archive_default "
+            f"WHERE created_at >= :de AND created_at < :ate RETURNING *) "
+            f"INSERT INTO {nome} SELECT * FROM movidas"
+        ), faixa)
+    db.session.execute(text(
+        f"ALTER TABLE audit_logs_archive ATTACH PARTITION {nome} "
+        f"FOR VALUES FROM ('{faixa['de']:%Y-%m-%d}') TO ('{faixa['ate']:%Y-%m-%d}')"
+    ))
+
+
+def _garantir_particoes(de: datetime, ate: datetime) -> None:
+    """Partições mensais do arquivo cobrindo [de, ate] (Postgres)."""
+    mes = _inicio_mes(de)
+    while mes <= ate:
+        _criar_particao(mes)
+        mes = _proximo_mes(mes)
+
+
+def _datar_eventos_sem_data() -> int:
+    """Eventos legados sem ``created_at`` recebem a data de agora (sem commit)."""
+    res = db.session.execute(
+        update(AuditLog).where(AuditLog.created_at.is_(None)).values(created_at=datetime.utcnow())
+    )
+    return res.rowcount or 0
+
+
+def arquivar(dias_quentes: int, lote: int = 5000) -> int:
+    """Move para o arquivo os eventos com mais de ``dias_quentes`` (commit por lote)."""
+    corte = datetime.utcnow() - timedelta(days=max(1, dias_quentes))
+    _datar_eventos_sem_data()
+    consolidar_dias()
+    db.session.commit()
+    if _dialeto() == "postgresql":
+        mais_antigo = db.session.execute(
+            select(func.min(AuditLog.created_at)).where(AuditLog.created_at < corte)
+        ).scalar()
+        if mais_antigo is not None:
+            _garantir_particoes(mais_antigo, corte)
+            db.session.commit()
+
+    colunas = ["id", "created_at", "user_id", "action", "ref", "description"]
+    movidos = 0
+    while True:
+        ids = db.session.execute(
+            select(AuditLog.id).where(AuditLog.created_at < corte).order_by(AuditLog.id).limit(lote)
+        ).scalars().all()
+        if not ids:
+            break
+        db.session.execute(insert(AuditLogArchive).from_select(colunas, select(
+            AuditLog.id, AuditLog.created_at, AuditLog.user_id, AuditLog.action,
+            AuditLog.ref, AuditLog.description,
+        ).where(AuditLog.id.in_(ids))))
+        db.session.execute(delete(AuditLog).where(AuditLog.id.in_(ids)))
+        db.session.commit()
+        movidos += len(ids)
+    return movidos
+
+
+# ---------- retenção ----------
+def _particoes_vencidas(corte: datetime) -> List[str]:
+    """Partições mensais inteiramente anteriores a ``corte`` (Postgres)."""
+    nomes = db.session.execute(text(
+        "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+        "WHERE i.inhparent = 'audit_logs_archive'::regclass AND c.relname LIKE 'audit_logs_archive_p%'"
+    )).scalars().all()
+    vencidas = []
+    for nome in nomes:
+        try:
+            mes = datetime.strptime(nome.rsplit("_p", 1)[1], "%Y%m")
+        except ValueError:
+            continue
+        if _proximo_mes(mes) <= corte:
+            vencidas.append(nome)
+    return sorted(vencidas)
+
+
+def aplicar_retencao(dias: int) -> int:
+    """Apaga o histórico com mais de ``dias`` (commit).  Devolve linhas/partições removidas."""
+    if not dias or dias <= 0:
+        return 0
+    corte = datetime.utcnow() - timedelta(days=dias)
+    removidos = 0
+    if _dialeto() == "postgresql":
+        for nome in _particoes_vencidas(corte):
+            db.session.execute(text(f"DROP TABLE IF EXISTS {nome}"))
+            removidos += 1
+    res = db.session.execute(delete(AuditLogArchive).where(AuditLogArchive.created_at < corte))
+    db.session.commit()
+    return removidos + (res.rowcount or 0)
+
+
+def manter_auditoria() -> Dict[str, int]:
+    cfg = current_app.config
+    arquivados = arquivar(cfg.get("AUDIT_HOT_DAYS", 90), cfg.get("AUDIT_ARCHIVE_BATCH", 5000))
+    return {
+        "arquivados": arquivados,
+        "removidos": aplicar_retencao(cfg.get("AUDIT_RETENTION_DAYS", 730)),
+    }
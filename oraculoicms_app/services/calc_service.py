@@ -1,20 +1,94 @@
 # zfm_app/services/calc_service.py
 # -*- coding: utf-8 -*-
 from __future__ import annotations
+
+import os
+import pickle
+import tempfile
+
 from flask import current_app
 from calc import MotorCalculo
 
+# versão do layout do snapshot; mude quando MotorCalculo/índice mudarem de forma
+SNAPSHOT_FORMAT = 1
+
+
 def _build_engine(app):
     """Constrói o engine a partir das matrices já carregadas no app."""
     matrices = app.extensions.get("matrices") or {}  # dict esperado pelo MotorCalculo
-    return MotorCalculo(matrices)
+    backend = app.config.get("CALC_BACKEND") or "decimal"  # "decimal" | "centavos"
+    return MotorCalculo(matrices, backend=backend).compilar()
+
+
+# ---------- snapshot do motor compilado (boot rápido dos workers) ----------
+def _snapshot_path(app) -> str | None:
+    if not app.config.get("ENGINE_SNAPSHOT", True):
+        return None
+    d = app.config.get("ENGINE_SNAPSHOT_DIR") or os.path.join(app.instance_path, "engine_snapshot")
+    return os.path.join(d, "motor.pkl")
+
+
+def save_snapshot(app, motor: MotorCalculo, stamp) -> bool:
+    """
+    Grava o motor compilado (matrices + índice) com o carimbo das regras que o
+    originou.  Sem carimbo não grava: não haveria como validar o arquivo depois.
+    """
+    path = _snapshot_path(app)
+    if not path or not stamp:
+        return False
+    tmp = None
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        with os.fdopen(fd, "wb") as fh:
+            pickle.dump(
+                {"formato": SNAPSHOT_FORMAT, "stamp": stamp, "backend": motor.backend, "motor": motor},
+                fh,
+                protocol=pickle.HIGHEST_PROTOCOL,
+            )
+        os.replace(tmp, path)  # atômico: outro worker nunca lê arquivo pela metade
+        return True
+    except (OSError, pickle.PicklingError):
+        app.logger.warning("Falha ao gravar snapshot do motor em %s", path, exc_info=True)
+        if tmp and os.path.exists(tmp):
+            os.unlink(tmp)
+        return False
+
+
+def load_snapshot(app, stamp) -> MotorCalculo | None:
+    """Motor do snapshot se formato, backend e carimbo baterem; senão None (rebuild)."""
+    path = _snapshot_path(app)
+    if not path or not stamp or not os.path.exists(path):
+        return None
+    try:
+        with open(path, "rb") as fh:
+            snap = pickle.load(fh)
+    except Exception:
+        app.logger.warning("Snapshot do motor ilegível em %s; reconstruindo", path, exc_info=True)
+        return None
+    if (
+        not isinstance(snap, dict)
+        or snap.get("formato") != SNAPSHOT_FORMAT
+        or snap.get("stamp") != stamp
+        or snap.get("backend") != (app.config.get("CALC_BACKEND") or "decimal")
+        or not isinstance(snap.get("motor"), MotorCalculo)
+    ):
+        return None
+    return snap["motor"]
+
 
 def init_motor(app):
     """
     Inicializa o motor na inicialização da aplicação.
     IMPORTANTE: isso deve rodar DEPOIS de app.extensions["matrices"] existir.
+    Se init_sheets já carregou o motor do snapshot, só o reaproveita.
     """
-    app.extensions["motor"] = _build_engine(app)
+    eng = app.extensions.get("motor")
+    if isinstance(eng, MotorCalculo) and eng.matrices is app.extensions.get("matrices"):
+        return
+    eng = _build_engine(app)
+    app.extensions["motor"] = eng
+    save_snapshot(app, eng, app.extensions.get("rules_stamp"))
 
 def get_motor():
     """
@@ -28,7 +102,9 @@ def get_motor():
     return eng
 
 def rebuild_motor():
-    """Reconstrói o motor após reload das planilhas."""
-    eng = _build_engine(current_app)
-    current_app.extensions["motor"] = eng
+    """Reconstrói o motor após reload das planilhas (e atualiza o snapshot)."""
+    app = current_app._get_current_object()
+    eng = _build_engine(app)
+    app.extensions["motor"] = eng
+    save_snapshot(app, eng, app.extensions.get("rules_stamp"))
     return eng
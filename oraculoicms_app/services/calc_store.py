@@ -0,0 +1,154 @@
+# oraculoicms_app/services/calc_store.py
+# -*- coding: utf-8 -*-
+"""
+Armazenamento do cálculo ICMS-ST em ``NFESummary``.
+
+As linhas vão para ``calc_blob`` em formato colunar comprimido (zlib):
+
+    [4 bytes: tamanho do cabeçalho][cabeçalho JSON][float64 LE ...][bool ...]
+
+- colunas 100% ``float`` viram arrays float64 (8 bytes/valor);
+- colunas 100% ``bool`` viram 1 byte/valor;
+- o resto (códigos, descrições, idx...) fica como lista JSON no cabeçalho.
+
+Totais e nº de itens ficam em colunas próprias (``calc_total_st``,
+``calc_total_nf_st``, ``calc_itens``) e ``calc_blob``/``calc_json`` são
+*deferred*: listas e relatórios não leem nem decodificam as linhas.
+"""
+from __future__ import annotations
+import datetime
+import json
+import struct
+import sys
+import zlib
+from array import array
+from decimal import Decimal
+from typing import Any, Dict, List, Optional
+
+from . import artifact_cache
+from .payload_service import ALG_VERSION
+
+_HEAD = struct.Struct("<I")
+_FORMATO = 1
+_BIG_ENDIAN = sys.byteorder == "big"
+
+
+def _tipo_coluna(valores: List[Any]) -> str:
+    if valores and all(type(v) is bool for v in valores):
+        return "b"
+    if valores and all(type(v) is float for v in valores):
+        return "f"
+    return "j"
+
+
+def encode_payload(payload: Dict[str, Any]) -> bytes:
+    """Payload (dict com ``linhas``) -> bytes colunares comprimidos."""
+    linhas = payload.get("linhas") or []
+
+    colunas: List[str] = []
+    vistos = set()
+    for l in linhas:
+        for k in l:
+            if k not in vistos:
+                vistos.add(k)
+                colunas.append(k)
+
+    head: Dict[str, Any] = {k: v for k, v in payload.items() if k != "linhas"}
+    head.update({"fmt": _FORMATO, "n": len(linhas), "cols": colunas, "f": [], "b": [], "j": {}})
+    corpo = bytearray()
+    bools = bytearray()
+    for c in colunas:
+        valores = [l.get(c) for l in linhas]
+        tipo = _tipo_coluna(valores)
+        if tipo == "f":
+            arr = array("d", valores)
+            if _BIG_ENDIAN:
+                arr.byteswap()
+            corpo += arr.tobytes()
+            head["f"].append(c)
+        elif tipo == "b":
+            bools += bytes(valores)
+            head["b"].append(c)
+        else:
+            head["j"][c] = valores
+
+    h = json.dumps(head, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    return zlib.compress(_HEAD.pack(len(h)) + h + bytes(corpo) + bytes(bools), 6)
+
+
+def _decode_colunas(blob: bytes):
+    raw = zlib.decompress(blob)
+    (hlen,) = _HEAD.unpack_from(raw, 0)
+    pos = _HEAD.size
+    head = json.loads(raw[pos:pos + hlen].decode("utf-8"))
+    pos += hlen
+
+    n = head["n"]
+    cols: Dict[str, list] = {}
+    for c in head["f"]:
+        arr = array("d")
+        arr.frombytes(raw[pos:pos + 8 * n])
+        if _BIG_ENDIAN:
+            arr.byteswap()
+        cols[c] = arr.tolist()
+        pos += 8 * n
+    for c in head["b"]:
+        cols[c] = [bool(x) for x in raw[pos:pos + n]]
+        pos += n
+    cols.update(head["j"])
+    return head, cols
+
+
+_META = ("fmt", "n", "cols", "f", "b", "j")
+
+
+def decode_payload(blob: bytes) -> Dict[str, Any]:
+    """Bytes de ``encode_payload`` -> payload completo (linhas materializadas)."""
+    head, cols = _decode_colunas(blob)
+    ordem, n = head["cols"], head["n"]
+    out = {k: v for k, v in head.items() if k not in _META}
+    out["linhas"] = [{c: cols[c][i] for c in ordem} for i in range(n)]
+    return out
+
+
+def _num(v) -> Decimal:
+    return Decimal(str(v or 0)).quantize(Decimal("0.01"))
+
+
+def colunas_calculo(payload: Dict[str, Any], version: str = ALG_VERSION,
+                    blob: Optional[bytes] = None) -> Dict[str, Any]:
+    """Valores das colunas ``calc_*`` do summary para o payload (``blob`` já codificado, se houver)."""
+    return {
+        "calc_blob": blob if blob is not None else encode_payload(payload),
+        "calc_json": None,
+        "calc_itens": len(payload.get("linhas") or []),
+        "calc_total_st": _num(payload.get("total_st")),
+        "calc_total_nf_st": _num(payload.get("total_nf_st")),
+        "calc_version": version,
+        "calc_at": datetime.datetime.utcnow(),
+    }
+
+
+def store_payload(summary, payload: Dict[str, Any], version: str = ALG_VERSION) -> None:
+    """Grava o cálculo no summary (sem commit) e descarta os PDFs em cache da nota."""
+    for coluna, valor in colunas_calculo(payload, version).items():
+        setattr(summary, coluna, valor)
+    if summary.id is not None:
+        artifact_cache.invalidar(artifact_cache.grupo_nota(summary.id))
+
+
+def has_calc(summary) -> bool:
+    """Há cálculo salvo? Não carrega as colunas deferred."""
+    return bool(summary is not None and summary.calc_version)
+
+
+def load_payload(summary) -> Optional[Dict[str, Any]]:
+    """Payload salvo do summary (dict comum, linhas materializadas); ``calc_json`` legado como fallback."""
+    if summary is None:
+        return None
+    blob = summary.calc_blob
+    if blob:
+        return decode_payload(blob)
+    if summary.calc_json:
+        return json.loads(summary.calc_json)
+    return None
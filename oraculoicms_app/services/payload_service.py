@@ -0,0 +1,320 @@
+# oraculoicms_app/services/payload_service.py
+# -*- coding: utf-8 -*-
+"""
+Payload do cálculo ICMS-ST de uma NF-e (gravado por ``services/calc_store``).
+
+Um único construtor para ``files`` e ``nfe``.  O schema salvo é compacto:
+só as chaves canônicas de cada linha; os aliases que os templates usam
+(``valor_icms_st``, ``mva_percentual``...) são montados na renderização
+por ``linhas_para_template``.
+"""
+from __future__ import annotations
+import atexit
+import json
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from decimal import Decimal
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from flask import current_app, has_app_context
+
+from calc import D, q2, ResultadoST
+
+ALG_VERSION = "st-v3"
+
+_CEM = Decimal("100")
+_TOL_VALOR = Decimal("0.01")
+_TOL_PERCENT = Decimal("0.10")
+
+# alias (template/legado) -> chave canônica
+_ALIASES = {
+    "valor_oper": "venda_desc_icms",
+    "valor_operacao": "venda_desc_icms",
+    "mva_percentual": "mva_percent",
+    "multiplicador": "mult_sefaz",
+    "multiplicador_sefaz": "mult_sefaz",
+    "quant": "qCom", "vun": "vUnCom", "vprod": "vProd",
+    "frete": "vFrete", "ipi": "vIPI", "vout": "vOutro",
+    "icms_deson": "vICMSDeson",
+    "base_calculo_st": "base_st",
+    "aliquota_icms_st": "aliq_st",
+    "valor_icms_st": "icms_st",
+    "valor_saldo_devedor": "saldo_devedor",
+    "valor_icms_retido": "icms_retido",
+}
+
+# chaves de conferência com a NF que payloads antigos (st-v1) não têm
+_DEFAULTS_NF = {
+    "cest": "",
+    "nf_mva_percent": 0.0, "nf_aliq_percent": 0.0,
+    "nf_base_st": 0.0, "nf_base_st_ret": 0.0,
+    "nf_icms_st": 0.0, "nf_icms_st_ret": 0.0,
+    "dif_mva_percent": 0.0, "dif_aliq_percent": 0.0,
+    "dif_base_st": 0.0, "dif_icms_st": 0.0,
+    "divergente": False,
+}
+
+
+def _f(v, d=0.0) -> float:
+    try:
+        return float(v if v is not None else d)
+    except Exception:
+        return float(d)
+
+
+def _valores_calculados(r, it):
+    """
+    Valores do motor; ``ResultadoST`` direto, outros motores via memória.
+    Devolve (campos da linha, (mva %, base ST, ICMS ST, alíquota %) em Decimal).
+    """
+    if isinstance(r, ResultadoST):
+        mva_pct = q2(r.mva * _CEM)
+        campos = {
+            "vICMSDeson": float(r.icms_des),
+            "venda_desc_icms": float(r.venda_desc),
+            "mva_tipo": r.mva_tipo,
+            "mva_percent": float(mva_pct),
+            "valor_agregado": float(r.valor_agregado),
+            "base_st": float(r.base_st),
+            "aliq_st": float(r.aliq_interna),
+            "icms_teorico_dest": float(r.icms_teorico_dest),
+            "icms_origem_calc": float(r.icms_origem_calc),
+            "icms_st": float(r.icms_st),
+            "saldo_devedor": float(r.saldo_devedor),
+            "mult_sefaz": float(r.mult_sefaz),
+            "icms_retido": float(r.icms_retido),
+        }
+        return campos, (mva_pct, q2(r.base_st), q2(r.icms_st), q2(r.aliq_interna * _CEM))
+
+    m = getattr(r, "memoria", None) or {}
+    vICMSDeson = _f(m.get("ICMS DESONERADO", getattr(it, "vICMSDeson", 0)))
+    saldo_devedor = _f(m.get("SALDO_DEVEDOR_ST", m.get("VALOR SALDO DEVEDOR ICMS ST", 0.0)))
+    campos = {
+        "vICMSDeson": vICMSDeson,
+        "venda_desc_icms": _f(m.get("VALOR DA VENDA COM DESCONTO DE ICMS", m.get("venda_desc_icms", 0.0))),
+        "mva_tipo": m.get("mva_tipo", "MVA Padrão"),
+        "mva_percent": _f(m.get("MARGEM_DE_VALOR_AGREGADO_MVA", m.get("mva_percentual_aplicado", 0.0))),
+        "valor_agregado": _f(m.get("VALOR AGREGADO", 0.0)),
+        "base_st": _f(m.get("BASE_ST", m.get("BASE DE CÁLCULO SUBSTITUIÇÃO TRIBUTÁRIA", 0.0))),
+        "aliq_st": _f(m.get("ALÍQUOTA ICMS-ST", m.get("aliq_interna", 0.0))),
+        "icms_teorico_dest": _f(m.get("icms_teorico_dest", 0.0)),
+        "icms_origem_calc": _f(m.get("icms_origem_calc", vICMSDeson)),
+        "icms_st": _f(m.get("VALOR_ICMS_ST", 0.0)),
+        "saldo_devedor": saldo_devedor,
+        "mult_sefaz": _f(m.get("MULT_SEFAZ", m.get("Multiplicador", m.get("MULTIPLICADOR SEFAZ", 0.0)))),
+        "icms_retido": _f(m.get("VALOR ICMS RETIDO", m.get("icms_retido", saldo_devedor))),
+    }
+    return campos, (
+        q2(D(campos["mva_percent"])), q2(D(campos["base_st"])),
+        q2(D(campos["icms_st"])), q2(D(campos["aliq_st"]) * _CEM),
+    )
+
+
+def _linha(it, r) -> Dict[str, Any]:
+    c, (calc_mva, calc_base, calc_icms, calc_aliq) = _valores_calculados(r, it)
+
+    # conferência com o que veio destacado na NF
+    nf_mva = q2(D(getattr(it, "pMVAST", 0)))
+    nf_base = q2(D(getattr(it, "vBCST", 0)))
+    nf_base_ret = q2(D(getattr(it, "vBCSTRet", 0)))
+    nf_icms = q2(D(getattr(it, "vICMSST", getattr(it, "vICMSSTRet", 0))))
+    nf_icms_ret = q2(D(getattr(it, "vICMSSTRet", 0)))
+    nf_aliq = q2(D(getattr(it, "pICMSST", 0)))
+
+    dif_mva = calc_mva - nf_mva
+    dif_base = calc_base - nf_base
+    dif_icms = calc_icms - nf_icms
+    dif_aliq = calc_aliq - nf_aliq
+
+    divergente = (
+        abs(dif_icms) > _TOL_VALOR or abs(dif_base) > _TOL_VALOR
+        or abs(dif_mva) > _TOL_PERCENT or abs(dif_aliq) > _TOL_PERCENT
+    )
+
+    linha = {
+        "idx": it.nItem, "cProd": it.cProd, "xProd": it.xProd,
+        "ncm": it.ncm, "cest": getattr(it, "cest", ""), "cst": it.cst, "cfop": it.cfop,
+        "qCom": _f(it.qCom), "vUnCom": _f(it.vUnCom), "vProd": _f(it.vProd),
+        "vFrete": _f(it.vFrete), "vIPI": _f(it.vIPI), "vOutro": _f(it.vOutro),
+    }
+    linha.update(c)
+    linha.update({
+        "nf_mva_percent": float(nf_mva),
+        "nf_aliq_percent": float(nf_aliq),
+        "nf_base_st": float(nf_base),
+        "nf_base_st_ret": float(nf_base_ret),
+        "nf_icms_st": float(nf_icms),
+        "nf_icms_st_ret": float(nf_icms_ret),
+        "dif_mva_percent": float(dif_mva),
+        "dif_aliq_percent": float(dif_aliq),
+        "dif_base_st": float(dif_base),
+        "dif_icms_st": float(dif_icms),
+        "divergente": divergente,
+    })
+    return linha
+
+
+def _calcular_itens(motor, itens, uf_origem: str, uf_destino: str) -> list:
+    lote = getattr(motor, "calcula_lote", None)
+    if callable(lote):
+        return lote(itens, uf_origem, uf_destino, usar_multiplicador=True)
+    return [motor.calcula_st(it, uf_origem, uf_destino, usar_multiplicador=True) for it in itens]
+
+
+def _fechar_payload(uf_origem: str, uf_destino: str, linhas_st: Iterable[Tuple[Dict[str, Any], float]]) -> Dict[str, Any]:
+    """Soma os totais na ordem dos itens (mesma soma em float do caminho sequencial)."""
+    linhas, total_st, total_nf_st = [], 0.0, 0.0
+    for linha, icms_st in linhas_st:
+        linhas.append(linha)
+        total_st += icms_st
+        total_nf_st += linha["nf_icms_st"]
+
+    return {
+        "v": ALG_VERSION,
+        "uf_origem": uf_origem,
+        "uf_destino": uf_destino,
+        "total_st": total_st,
+        "total_nf_st": total_nf_st,
+        "linhas": linhas,
+    }
+
+
+def _linhas_st(motor, itens, uf_origem: str, uf_destino: str) -> List[Tuple[Dict[str, Any], float]]:
+    resultados = _calcular_itens(motor, itens, uf_origem, uf_destino)
+    return [(_linha(it, r), float(r.icms_st_devido or 0.0)) for it, r in zip(itens, resultados)]
+
+
+def _ufs(header: Dict[str, Any]) -> Tuple[str, str]:
+    return (header.get("uf_origem") or "SP").upper(), (header.get("uf_destino") or "AM").upper()
+
+
+def montar_payload(nfe, motor) -> Dict[str, Any]:
+    """Calcula a NF (objeto ``NFEXML`` já parseado) e devolve o payload ``st-v3``."""
+    uf_origem, uf_destino = _ufs(nfe.header() or {})
+    itens = nfe.itens() or []
+    return _fechar_payload(uf_origem, uf_destino, _linhas_st(motor, itens, uf_origem, uf_destino))
+
+
+# ---------- notas grandes: cálculo em fatias (pool de processos) ----------
+PARALELO_MIN_ITENS = 2000  # padrão de CALC_PARALLEL_MIN_ITEMS
+
+# Um pool por processo, criado na primeira nota grande e reaproveitado pelas
+# seguintes (limitado a ``workers`` processos, mesmo com requisições
+# simultâneas).  O motor vai para os workers uma vez só, no initializer; o
+# pool é recriado quando o motor muda (reload das planilhas) ou no processo
+# filho após um fork.  As tarefas levam apenas a fatia de itens já lidos.
+_pool_lock = threading.Lock()
+_POOL: Optional[ProcessPoolExecutor] = None
+_POOL_DONO: Optional[Tuple[int, Any, int]] = None  # (pid, motor, workers)
+
+_FATIA_MOTOR = None  # estado de cada processo do pool (initializer)
+
+
+def _init_fatia(motor) -> None:
+    global _FATIA_MOTOR
+    _FATIA_MOTOR = motor
+
+
+def _calcular_fatia(tarefa) -> List[Tuple[Dict[str, Any], float]]:
+    itens, uf_origem, uf_destino = tarefa
+    return _linhas_st(_FATIA_MOTOR, itens, uf_origem, uf_destino)
+
+
+def _pool(motor, workers: int) -> ProcessPoolExecutor:
+    global _POOL, _POOL_DONO
+    with _pool_lock:
+        dono = _POOL_DONO
+        if _POOL is None or dono[0] != os.getpid() or dono[1] is not motor or dono[2] != workers:
+            if _POOL is not None and dono[0] == os.getpid():
+                _POOL.shutdown(wait=False)  # fatias já enviadas ainda terminam
+            _POOL = ProcessPoolExecutor(max_workers=workers, initializer=_init_fatia, initargs=(motor,))
+            _POOL_DONO = (os.getpid(), motor, workers)
+        return _POOL
+
+
+def encerrar_pool() -> None:
+    """Encerra o pool deste processo (saída do worker e testes)."""
+    global _POOL, _POOL_DONO
+    with _pool_lock:
+        if _POOL is not None and _POOL_DONO[0] == os.getpid():
+            _POOL.shutdown(wait=True)
+        _POOL, _POOL_DONO = None, None
+
+
+atexit.register(encerrar_pool)
+
+
+def montar_payload_paralelo(nfe, motor, workers: int, fatia: Optional[int] = None) -> Dict[str, Any]:
+    """
+    Mesmo payload de ``montar_payload`` com o cálculo fatiado entre os
+    processos do pool: a nota é lida (e rateada) aqui, uma vez; cada worker
+    recebe só a sua fatia de itens.  ``map`` preserva a ordem das fatias e os
+    totais são somados aqui na ordem dos itens: o resultado é idêntico ao
+    sequencial.
+    """
+    uf_origem, uf_destino = _ufs(nfe.header() or {})
+    itens = nfe.itens() or []
+    n = len(itens)
+    fatia = max(1, fatia or -(-n // (workers * 4)))
+    tarefas = [(itens[i:i + fatia], uf_origem, uf_destino) for i in range(0, n, fatia)]
+    partes = _pool(motor, workers).map(_calcular_fatia, tarefas)
+    return _fechar_payload(uf_origem, uf_destino, (par for parte in partes for par in parte))
+
+
+def _config_paralelo(min_itens: Optional[int], workers: Optional[int]) -> Tuple[int, int]:
+    cfg = current_app.config if has_app_context() else {}
+    if min_itens is None:
+        min_itens = int(cfg.get("CALC_PARALLEL_MIN_ITEMS", PARALELO_MIN_ITENS) or 0)
+    if workers is None:
+        workers = int(cfg.get("CALC_PARALLEL_WORKERS", 0) or 0) or min(4, os.cpu_count() or 1)
+    return min_itens, workers
+
+
+def build_st_payload(xml_bytes: bytes, NFEXML, motor,
+                     min_itens: Optional[int] = None, workers: Optional[int] = None,
+                     nfe=None) -> Dict[str, Any]:
+    """
+    Atalho: parse do XML + ``montar_payload``.  Notas com ``min_itens`` itens ou
+    mais (``CALC_PARALLEL_MIN_ITEMS``; 0 desliga) vão para ``montar_payload_paralelo``.
+    ``nfe``: a nota já parseada pelo chamador (evita um segundo parse).
+    """
+    if nfe is None:
+        nfe = NFEXML(xml_bytes)
+    min_itens, workers = _config_paralelo(min_itens, workers)
+    if workers > 1 and min_itens and callable(getattr(nfe, "n_itens", None)) and nfe.n_itens() >= min_itens:
+        return montar_payload_paralelo(nfe, motor, workers)
+    return montar_payload(nfe, motor)
+
+
+def dumps_payload(payload: Dict[str, Any]) -> str:
+    """JSON compacto do payload (export/depuração)."""
+    return json.dumps(payload, ensure_ascii=False, separators=(",", ":"))
+
+
+def linhas_para_template(linhas: Iterable[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Cópia das linhas com os aliases dos templates (aceita payloads antigos)."""
+    out = []
+    for l in linhas:
+        d = dict(_DEFAULTS_NF)
+        d.update(l)
+        for alias, chave in _ALIASES.items():
+            if alias not in d:
+                d[alias] = d.get(chave, 0.0)
+        out.append(d)
+    return out
+
+
+def contexto_resultado(payload: Dict[str, Any]) -> Dict[str, Any]:
+    """Variáveis de ``resultado.html`` a partir de um payload salvo ou recém calculado."""
+    linhas = payload.get("linhas", [])
+    total_nf_st = payload.get("total_nf_st")
+    if total_nf_st is None:
+        total_nf_st = sum(_f(l.get("nf_icms_st")) for l in linhas)
+    return {
+        "linhas": linhas_para_template(linhas),
+        "total_st": float(payload.get("total_st", 0)),
+        "total_nf_st": float(total_nf_st),
+        "uf_origem": payload.get("uf_origem", "SP"),
+        "uf_destino": payload.get("uf_destino", "AM"),
+    }
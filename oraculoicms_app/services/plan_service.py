@@ -0,0 +1,70 @@
+# oraculoicms_app/services/plan_service.py
+# -*- coding: utf-8 -*-
+"""
+Cache por processo dos planos (tabela pequena, lida em toda requisição
+autenticada que confere limites).
+
+Os planos são carregados de uma vez, como cópias somente leitura
+(``SimpleNamespace`` com as colunas de ``Plan``): não dependem da sessão do
+banco e podem ser compartilhados entre requisições.  ``invalidar_planos``
+esvazia o cache — chamado pelas telas de admin e por qualquer flush que
+grave um ``Plan`` neste processo; os demais workers enxergam a mudança em
+até ``PLAN_CACHE_SECONDS``.
+"""
+from __future__ import annotations
+
+import threading
+import time
+from types import SimpleNamespace
+from typing import Dict, Optional
+
+from flask import current_app, has_app_context
+from sqlalchemy import event
+
+from ..models.plan import Plan
+
+_lock = threading.Lock()
+_planos: Optional[Dict[str, SimpleNamespace]] = None
+_carregado_em = 0.0
+
+
+def _ttl() -> float:
+    if not has_app_context():
+        return 60.0
+    return float(current_app.config.get("PLAN_CACHE_SECONDS", 60))
+
+
+def _copia(p: Plan) -> SimpleNamespace:
+    return SimpleNamespace(**{c.key: getattr(p, c.key) for c in Plan.__table__.columns})
+
+
+def _carregar() -> Dict[str, SimpleNamespace]:
+    global _planos, _carregado_em
+    with _lock:
+        if _planos is None or time.monotonic() - _carregado_em > _ttl():
+            _planos = {p.slug: _copia(p) for p in Plan.query.all()}
+            _carregado_em = time.monotonic()
+        return _planos
+
+
+def plano(slug: Optional[str], ativo: bool = False) -> Optional[SimpleNamespace]:
+    """Plano pelo slug (com ``ativo``, só se estiver ativo); None se não houver."""
+    if not slug:
+        return None
+    p = _carregar().get(slug)
+    if p is None or (ativo and not p.active):
+        return None
+    return p
+
+
+def invalidar_planos() -> None:
+    global _planos
+    with _lock:
+        _planos = None
+
+
+@event.listens_for(Plan, "after_insert")
+@event.listens_for(Plan, "after_update")
+@event.listens_for(Plan, "after_delete")
+def _plano_gravado(mapper, connection, target) -> None:
+    invalidar_planos()
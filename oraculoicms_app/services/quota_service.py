@@ -0,0 +1,166 @@
+# oraculoicms_app/services/quota_service.py
+# -*- coding: utf-8 -*-
+"""
+Cotas do usuário (``user_quotas``) atualizadas no banco, sem ler-somar-gravar
+em Python.
+
+- ``reservar_upload``: um único ``UPDATE ... WHERE <limites> RETURNING``
+  soma arquivo/bytes/upload do mês (zerando o mês na virada) só se couber no
+  plano; dois uploads simultâneos não passam juntos do limite.
+- ``liberar``: decremento atômico na exclusão, sem ficar negativo.
+- ``reconciliar_cotas``: recalcula ``files_count``/``storage_bytes`` a partir
+  de ``user_files`` (agregado) e vira o mês; roda no job ``reconciliar_cotas``.
+
+Nenhuma função faz commit, exceto ``obter_cota``: a reserva entra na mesma
+transação do registro do arquivo.
+"""
+from __future__ import annotations
+
+from datetime import datetime
+from typing import Dict, Optional, Tuple
+
+from sqlalchemy import case, func, insert, select, update
+
+from ..extensions import db
+from ..models.file import UserFile
+from ..models.user_quota import UserQuota
+
+_Q = UserQuota.__table__
+
+
+def mes_atual() -> str:
+    return datetime.utcnow().strftime("%Y-%m")
+
+
+def _garantir_linha(user_id: int) -> None:
+    """Cria a linha de cota do usuário se faltar (sem commit, tolera corrida)."""
+    dialeto = db.session.get_bind().dialect.name
+    valores = dict(user_id=user_id, files_count=0, storage_bytes=0, month_uploads=0,
+                   month_ref=mes_atual(), updated_at=datetime.utcnow())
+    if dialeto in ("postgresql", "sqlite"):
+        if dialeto == "postgresql":
+            from sqlalchemy.dialects.postgresql import insert as ins
+        else:
+            from sqlalchemy.dialects.sqlite import insert as ins
+        db.session.execute(ins(_Q).values(**valores).on_conflict_do_nothing(index_elements=["user_id"]))
+    elif db.session.execute(select(_Q.c.id).where(_Q.c.user_id == user_id)).first() is None:
+        db.session.execute(insert(_Q).values(**valores))
+
+
+def _virar_mes(user_id: Optional[int] = None) -> int:
+    """Zera ``month_uploads`` das cotas de mês anterior; devolve o nº de linhas."""
+    stmt = (
+        update(_Q)
+        .where(_Q.c.month_ref != mes_atual())
+        .values(month_uploads=0, month_ref=mes_atual(), updated_at=datetime.utcnow())
+    )
+    if user_id is not None:
+        stmt = stmt.where(_Q.c.user_id == user_id)
+    return db.session.execute(stmt).rowcount or 0
+
+
+def obter_cota(user_id: int) -> UserQuota:
+    """Cota do usuário (criada/virada de mês se preciso, com um commit só quando mudou)."""
+    q = UserQuota.query.filter_by(user_id=user_id).populate_existing().first()
+    if q is None or q.month_ref != mes_atual():
+        _garantir_linha(user_id)
+        _virar_mes(user_id)
+        db.session.commit()
+        q = UserQuota.query.filter_by(user_id=user_id).populate_existing().first()
+    return q
+
+
+def _limites(plan) -> Tuple[int, int, int]:
+    if plan is None:
+        return 0, 0, 0
+    return (
+        plan.max_files or 0,
+        (plan.max_storage_mb or 0) * 1024 * 1024,
+        plan.max_uploads_month or 0,
+    )
+
+
+def _motivo(user_id: int, size: int, plan) -> str:
+    """Mensagem do limite que barrou a reserva (mesmos textos de files._enforce_plan_limits)."""
+    max_files, max_bytes, max_mes = _limites(plan)
+    q = db.session.execute(select(_Q).where(_Q.c.user_id == user_id)).first()
+    if q is None:
+        return "Cota do usuário não inicializada."
+    mes = q.month_uploads if q.month_ref == mes_atual() else 0
+    if max_files and q.files_count >= max_files:
+        return f"Limite de arquivos simultâneos excedido ({q.files_count}/{max_files})."
+    if max_bytes and q.storage_bytes + size > max_bytes:
+        used_mb = round(q.storage_bytes / 1048576, 1)
+        return f"Limite de armazenamento do plano excedido ({used_mb}MB/{plan.max_storage_mb}MB)."
+    if max_mes and mes >= max_mes:
+        return f"Limite mensal de uploads excedido ({mes}/{max_mes})."
+    return "Limite do plano excedido."
+
+
+def reservar_upload(user_id: int, size: int, plan=None) -> Tuple[bool, str]:
+    """
+    Soma 1 arquivo, ``size`` bytes e 1 upload do mês à cota, se couber no
+    ``plan`` (sem plano: só conta).  Sem commit; (False, motivo) se barrou.
+    """
+    mes = mes_atual()
+    uploads_mes = case((_Q.c.month_ref == mes, _Q.c.month_uploads), else_=0)
+    max_files, max_bytes, max_mes = _limites(plan)
+    conds = [_Q.c.user_id == user_id]
+    if max_files:
+        conds.append(_Q.c.files_count < max_files)
+    if max_bytes:
+        conds.append(_Q.c.storage_bytes + size <= max_bytes)
+    if max_mes:
+        conds.append(uploads_mes < max_mes)
+    stmt = (
+        update(_Q)
+        .where(*conds)
+        .values(
+            files_count=_Q.c.files_count + 1,
+            storage_bytes=_Q.c.storage_bytes + size,
+            month_uploads=uploads_mes + 1,
+            month_ref=mes,
+            updated_at=datetime.utcnow(),
+        )
+        .returning(_Q.c.files_count)
+    )
+    if db.session.execute(stmt).first() is not None:
+        return True, ""
+    # sem linha ainda (primeiro upload) ou limite: cria e tenta uma vez mais
+    if db.session.execute(select(_Q.c.id).where(_Q.c.user_id == user_id)).first() is None:
+        _garantir_linha(user_id)
+        if db.session.execute(stmt).first() is not None:
+            return True, ""
+    return False, _motivo(user_id, size, plan)
+
+
+def liberar(user_id: int, size: int) -> None:
+    """Desconta um arquivo de ``size`` bytes (sem commit; nunca fica negativo)."""
+    size = size or 0
+    db.session.execute(
+        update(_Q)
+        .where(_Q.c.user_id == user_id)
+        .values(
+            files_count=case((_Q.c.files_count > 0, _Q.c.files_count - 1), else_=0),
+            storage_bytes=case((_Q.c.storage_bytes > size, _Q.c.storage_bytes - size), else_=0),
+            updated_at=datetime.utcnow(),
+        )
+    )
+
+
+def reconciliar_cotas() -> Dict[str, int]:
+    """
+    Recalcula arquivos/bytes de todas as cotas a partir de ``user_files`` não
+    excluídos e zera o mês das cotas atrasadas (commit ao final).
+    """
+    vivos = (UserFile.user_id == _Q.c.user_id, UserFile.deleted_at.is_(None))
+    arquivos = select(func.count(UserFile.id)).where(*vivos).scalar_subquery()
+    bytes_ = select(func.coalesce(func.sum(UserFile.size_bytes), 0)).where(*vivos).scalar_subquery()
+    corrigidas = db.session.execute(
+        update(_Q)
+        .where((_Q.c.files_count != arquivos) | (_Q.c.storage_bytes != bytes_))
+        .values(files_count=arquivos, storage_bytes=bytes_, updated_at=datetime.utcnow())
+    ).rowcount or 0
+    viradas = _virar_mes()
+    db.session.commit()
+    return {"corrigidas": corrigidas, "meses_virados": viradas}
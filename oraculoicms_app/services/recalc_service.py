@@ -0,0 +1,219 @@
+# oraculoicms_app/services/recalc_service.py
+# -*- coding: utf-8 -*-
+"""
+Recálculo do ICMS-ST de notas já processadas (XML em disco) com o motor atual.
+
+Usado pelo job ``recalcular_notas`` depois que as regras mudam: notas com
+cálculo anterior ao carimbo das regras são recalculadas em lotes.  O acervo
+inteiro passa por ``recalcular_acervo`` (CLI ``flask recalcular-notas``), que
+distribui o cálculo num pool de processos.
+"""
+from __future__ import annotations
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from flask import current_app
+from sqlalchemy import select, update
+from xml_parser import NFEXML
+
+from ..extensions import db
+from ..models.file import NFESummary, UserFile
+from . import artifact_cache
+from .calc_store import colunas_calculo, store_payload
+from .payload_service import ALG_VERSION, build_st_payload, montar_payload
+
+
+def notas_desatualizadas(desde: datetime):
+    """Query das notas com cálculo salvo anterior a ``desde`` (arquivo não excluído)."""
+    return (
+        NFESummary.query
+        .join(UserFile, NFESummary.user_file_id == UserFile.id)
+        .filter(
+            UserFile.deleted_at.is_(None),
+            NFESummary.calc_version.isnot(None),
+            db.or_(NFESummary.calc_at.is_(None), NFESummary.calc_at < desde),
+        )
+        .order_by(NFESummary.id)
+    )
+
+
+def recalcular_nota(summary: NFESummary, motor) -> bool:
+    """Recalcula e grava o payload da nota (sem commit). False se o XML sumiu."""
+    path = Path(summary.file.storage_path)
+    if not path.is_file():
+        return False
+    store_payload(summary, build_st_payload(path.read_bytes(), NFEXML, motor), ALG_VERSION)
+    return True
+
+
+def recalcular_desatualizadas(desde: datetime, motor, limite: Optional[int] = 200) -> Dict[str, int]:
+    """
+    Recalcula até ``limite`` notas desatualizadas (commit ao final).
+    Nota que falha recebe ``calc_at`` = agora para não travar a fila.
+    """
+    q = notas_desatualizadas(desde)
+    if limite:
+        q = q.limit(limite)
+    ok = falhas = 0
+    for summary in q.all():
+        try:
+            if recalcular_nota(summary, motor):
+                ok += 1
+                continue
+        except Exception as e:
+            current_app.logger.warning("Falha ao recalcular nota %s: %s", summary.id, e)
+        summary.calc_at = datetime.utcnow()
+        falhas += 1
+    db.session.commit()
+    return {"recalculadas": ok, "falhas": falhas}
+
+
+# ---------- acervo inteiro (pool de processos) ----------
+_MOTOR = None  # motor do processo worker (recebido uma vez no initializer)
+
+
+def _init_worker(motor) -> None:
+    global _MOTOR
+    _MOTOR = motor
+
+
+def _calcular_arquivo(tarefa: Tuple[int, str]) -> Tuple[int, Optional[Dict[str, Any]], Optional[str]]:
+    """
+    Roda no worker: lê o XML, parseia uma vez e já devolve as colunas ``calc_*``
+    codificadas (as linhas não voltam pelo pipe).  Erro vira mensagem, não exceção.
+    """
+    summary_id, path = tarefa
+    try:
+        payload = montar_payload(NFEXML(Path(path).read_bytes()), _MOTOR)
+        return summary_id, colunas_calculo(payload), None
+    except Exception as e:  # XML sumido/corrompido não derruba o lote
+        return summary_id, None, f"{type(e).__name__}: {e}"
+
+
+def filtro_acervo(
+    user_id: Optional[int] = None,
+    desde: Optional[datetime] = None,
+    ate: Optional[datetime] = None,
+    desatualizadas_desde: Optional[datetime] = None,
+    apenas_desatualizadas: bool = False,
+) -> List[Any]:
+    """
+    Condições sobre ``UserFile``/``NFESummary``: usuário, período de emissão e
+    cálculo desatualizado (versão do algoritmo antiga ou anterior ao carimbo).
+    """
+    cond: List[Any] = [UserFile.deleted_at.is_(None)]
+    if user_id is not None:
+        cond.append(UserFile.user_id == user_id)
+    if desde is not None:
+        cond.append(NFESummary.emissao >= desde)
+    if ate is not None:
+        cond.append(NFESummary.emissao < ate)
+    if apenas_desatualizadas:
+        velhas = [NFESummary.calc_version.is_(None), NFESummary.calc_version != ALG_VERSION]
+        if desatualizadas_desde is not None:
+            velhas += [NFESummary.calc_at.is_(None), NFESummary.calc_at < desatualizadas_desde]
+        cond.append(db.or_(*velhas))
+    return cond
+
+
+def _tarefas(cond: List[Any], lote: int) -> Iterator[List[Tuple[int, str]]]:
+    """(summary_id, caminho do XML) em lotes, paginando por id (sem OFFSET)."""
+    ultimo = 0
+    while True:
+        rows = db.session.execute(
+            select(NFESummary.id, UserFile.storage_path)
+            .join(UserFile, NFESummary.user_file_id == UserFile.id)
+            .where(*cond, NFESummary.id > ultimo)
+            .order_by(NFESummary.id)
+            .limit(lote)
+        ).all()
+        if not rows:
+            return
+        ultimo = rows[-1][0]
+        yield [(sid, path) for sid, path in rows]
+
+
+def contar_acervo(cond: List[Any]) -> int:
+    return db.session.execute(
+        select(db.func.count(NFESummary.id))
+        .join(UserFile, NFESummary.user_file_id == UserFile.id)
+        .where(*cond)
+    ).scalar() or 0
+
+
+def _gravar(resultados: Iterable[Tuple[int, Optional[Dict[str, Any]], Optional[str]]], stats: Dict[str, Any]) -> int:
+    """Um lote = um UPDATE em massa por PK + commit."""
+    linhas = []
+    n = 0
+    for summary_id, colunas, erro in resultados:
+        n += 1
+        if colunas is None:
+            stats["falhas"] += 1
+            current_app.logger.warning("Falha ao recalcular nota %s: %s", summary_id, erro)
+            continue
+        linhas.append({"id": summary_id, **colunas})
+    if linhas:
+        db.session.execute(update(NFESummary), linhas)
+    db.session.commit()
+    for l in linhas:
+        artifact_cache.invalidar(artifact_cache.grupo_nota(l["id"]))
+    stats["recalculadas"] += len(linhas)
+    return n
+
+
+def recalcular_acervo(
+    motor,
+    cond: List[Any],
+    workers: Optional[int] = None,
+    lote: int = 200,
+    progresso: Optional[Callable[[Dict[str, Any]], None]] = None,
+) -> Dict[str, Any]:
+    """
+    Recalcula todas as notas que satisfazem ``cond``.  Com ``workers`` > 1 o
+    parse+cálculo roda num ``ProcessPoolExecutor`` (motor enviado uma vez por
+    processo); o processo principal só lê ids e grava cada lote numa transação.
+    Enquanto um lote é gravado, o próximo já está sendo calculado.
+    """
+    workers = max(1, workers or os.cpu_count() or 1)
+    lote = max(1, int(lote or 200))
+    stats: Dict[str, Any] = {"total": contar_acervo(cond), "processadas": 0, "recalculadas": 0, "falhas": 0}
+    t0 = time.perf_counter()
+
+    def _flush(resultados) -> None:
+        stats["processadas"] += _gravar(resultados, stats)
+        stats["segundos"] = time.perf_counter() - t0
+        stats["notas_por_s"] = stats["processadas"] / stats["segundos"] if stats["segundos"] else 0.0
+        if progresso:
+            progresso(dict(stats))
+
+    pool = None
+    if workers > 1:
+        pool = ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(motor,))
+    else:
+        _init_worker(motor)
+    try:
+        em_voo: deque = deque()
+        for tarefas in _tarefas(cond, lote):
+            if pool is not None:
+                chunk = max(1, len(tarefas) // (workers * 4))
+                em_voo.append(pool.map(_calcular_arquivo, tarefas, chunksize=chunk))
+            else:
+                em_voo.append(map(_calcular_arquivo, tarefas))
+            if len(em_voo) > 1:
+                _flush(em_voo.popleft())
+        while em_voo:
+            _flush(em_voo.popleft())
+    finally:
+        if pool is not None:
+            pool.shutdown(cancel_futures=True)
+        else:
+            _init_worker(None)
+
+    stats["segundos"] = time.perf_counter() - t0
+    stats["notas_por_s"] = stats["processadas"] / stats["segundos"] if stats["segundos"] else 0.0
+    return stats
@@ -0,0 +1,265 @@
+# oraculoicms_app/services/scheduler_service.py
+# -*- coding: utf-8 -*-
+"""
+Jobs agendados no ``BackgroundScheduler`` (um por worker do gunicorn).
+
+- ``atualizar_regras``  (cron, padrão dia 1 às 03:00): atualizador das fontes;
+  se as regras mudaram, recarrega e recalcula as notas afetadas.
+- ``recalcular_notas``  (intervalo): notas calculadas antes do carimbo das
+  regras, em lotes de ``RECALC_BATCH``.
+- ``recarregar_regras`` (intervalo): recarrega matrizes/motor *deste* worker
+  quando o carimbo muda.  Roda em todos os workers (a memória é por processo).
+- ``reconciliar_cotas`` (cron, padrão diário às 04:30): recalcula as cotas a
+  partir de ``user_files`` (ver ``quota_service``).
+- ``manter_auditoria`` (cron, padrão diário às 04:15): consolida, arquiva e
+  aplica a retenção de ``audit_logs`` (ver ``audit_service``).
+
+Todos, menos ``recarregar_regras``, têm um único líder por execução:
+``pg_try_advisory_lock`` no Postgres; nos demais bancos, ``flock`` em
+``<instance>/locks/<job>.lock`` (vale para workers do mesmo host).  A última
+execução de cada job fica em ``Setting(group="jobs")`` e aparece em /config.
+
+Cada worker tem o seu scheduler, com os gatilhos defasados pelo horário de
+boot: a trava sozinha não impede que o job rode uma vez *por worker*.  Por
+isso o líder, já com a trava, confere a última execução registrada e pula se
+ela for mais recente que o intervalo do job (nos jobs cron, ``CRON_GAP``).
+"""
+from __future__ import annotations
+import json
+import os
+import socket
+import time
+import zlib
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from typing import Callable, Dict, Iterator, List, Optional
+
+from apscheduler.triggers.cron import CronTrigger
+from flask import current_app
+from sqlalchemy import text
+
+from ..extensions import db, scheduler
+from ..models import Setting
+from .calc_service import get_motor, rebuild_motor
+from . import audit_service, quota_service
+from .recalc_service import recalcular_desatualizadas
+from .settings import set_setting
+from .sheets_service import loaded_rules_stamp, reload_matrices, rules_stamp, rules_stamp_em
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+JOB_ATUALIZAR = "atualizar_regras"
+JOB_RECALCULAR = "recalcular_notas"
+JOB_RECARREGAR = "recarregar_regras"
+JOB_COTAS = "reconciliar_cotas"
+JOB_AUDITORIA = "manter_auditoria"
+JOBS_GROUP = "jobs"
+CRON_GAP = timedelta(hours=1)  # = misfire_grace_time dos jobs cron
+
+
+# ---------- trava de líder ----------
+def _lock_dir() -> str:
+    d = current_app.config.get("SCHEDULER_LOCK_DIR") or os.path.join(current_app.instance_path, "locks")
+    os.makedirs(d, exist_ok=True)
+    return d
+
+
+@contextmanager
+def _pg_lock(nome: str) -> Iterator[bool]:
+    key = zlib.crc32(f"oraculoicms:{nome}".encode("utf-8"))
+    with db.engine.connect() as conn:
+        ok = bool(conn.execute(text("SELECT pg_try_advisory_lock(:k)"), {"k": key}).scalar())
+        try:
+            yield ok
+        finally:
+            if ok:
+                conn.execute(text("SELECT pg_advisory_unlock(:k)"), {"k": key})
+
+
+@contextmanager
+def _file_lock(nome: str) -> Iterator[bool]:
+    path = os.path.join(_lock_dir(), f"{nome}.lock")
+    if fcntl is None:
+        try:
+            fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            os.close(fd)
+            os.remove(path)
+        return
+
+    with open(path, "a+") as fh:
+        try:
+            fcntl.flock(fh, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            fcntl.flock(fh, fcntl.LOCK_UN)
+
+
+def leader_lock(nome: str):
+    """Context manager -> bool: True se este processo é o líder do job agora."""
+    if db.engine.dialect.name == "postgresql":
+        return _pg_lock(nome)
+    return _file_lock(nome)
+
+
+# ---------- métricas ----------
+def registrar_execucao(nome: str, status: str, inicio: datetime, duracao_ms: int, mensagem: str) -> None:
+    set_setting(nome, json.dumps({
+        "status": status,
+        "inicio": inicio.isoformat(timespec="seconds"),
+        "duracao_ms": duracao_ms,
+        "mensagem": (mensagem or "")[:500],
+        "host": f"{socket.gethostname()}:{os.getpid()}",
+    }), group=JOBS_GROUP)
+
+
+def ultimas_execucoes() -> List[Dict]:
+    """Última execução de cada job (para a página de configuração)."""
+    try:
+        rows = Setting.query.filter_by(group=JOBS_GROUP).order_by(Setting.key).all()
+    except Exception:
+        db.session.rollback()
+        return []
+    out = []
+    for r in rows:
+        try:
+            d = json.loads(r.value or "{}")
+        except ValueError:
+            continue
+        d["nome"] = r.key
+        out.append(d)
+    return out
+
+
+def _ultima_execucao(nome: str) -> Optional[datetime]:
+    s = Setting.query.filter_by(group=JOBS_GROUP, key=nome).populate_existing().first()
+    try:
+        return datetime.fromisoformat(json.loads(s.value)["inicio"]) if s else None
+    except (ValueError, KeyError, TypeError):
+        return None
+
+
+def _executado_ha_pouco(nome: str, intervalo: timedelta) -> bool:
+    """Outro worker já rodou o job neste intervalo? (folga p/ o atraso do gatilho)"""
+    ultima = _ultima_execucao(nome)
+    if ultima is None:
+        return False
+    folga = min(intervalo / 10, timedelta(minutes=1))
+    return datetime.utcnow() - ultima < intervalo - folga
+
+
+def executar_job(nome: str, fn: Callable[[], str], lider: bool = True,
+                 intervalo: Optional[timedelta] = None) -> str | None:
+    """
+    Roda ``fn`` (precisa de app context) sob a trava do job e registra a
+    execução.  Devolve a mensagem, ou None se outro worker é o líder ou já
+    rodou o job há menos de ``intervalo``.
+    """
+    @contextmanager
+    def _sem_trava():
+        yield True
+
+    with (leader_lock(nome) if lider else _sem_trava()) as ok:
+        if not ok:
+            return None
+        if intervalo and _executado_ha_pouco(nome, intervalo):
+            return None
+        inicio, t0 = datetime.utcnow(), time.perf_counter()
+        try:
+            msg, status = fn(), "OK"
+        except Exception as e:
+            db.session.rollback()
+            current_app.logger.exception("Job %s falhou", nome)
+            msg, status = str(e), "ERRO"
+        if msg is not None:
+            registrar_execucao(nome, status, inicio, int((time.perf_counter() - t0) * 1000), msg)
+        return msg
+
+
+# ---------- jobs ----------
+def recarregar_regras() -> str | None:
+    """Recarrega este worker se o carimbo mudou; None quando nada a fazer (não registra)."""
+    if rules_stamp() == loaded_rules_stamp():
+        return None
+    reload_matrices()
+    rebuild_motor()
+    return "Regras recarregadas"
+
+
+def recalcular_notas() -> str:
+    desde = rules_stamp_em(rules_stamp())
+    if desde is None:
+        return "Sem carimbo de regras"
+    recarregar_regras()
+    r = recalcular_desatualizadas(desde, get_motor(), current_app.config.get("RECALC_BATCH", 200))
+    return f"{r['recalculadas']} recalculadas, {r['falhas']} falhas"
+
+
+def atualizar_regras() -> str:
+    from updater import run_update_am  # updater importa o app: evita ciclo
+
+    res = run_update_am()
+    msg = res.get("mensagem", "")
+    if res.get("alterado"):
+        msg += "; " + recalcular_notas()
+    return msg
+
+
+def reconciliar_cotas() -> str:
+    r = quota_service.reconciliar_cotas()
+    return f"{r['corrigidas']} cotas corrigidas, {r['meses_virados']} meses virados"
+
+
+def manter_auditoria() -> str:
+    r = audit_service.manter_auditoria()
+    return f"{r['arquivados']} eventos arquivados, {r['removidos']} removidos pela retenção"
+
+
+def _job(app, nome: str, fn: Callable[[], str], lider: bool = True, intervalo: Optional[timedelta] = None):
+    def run():
+        with app.app_context():
+            executar_job(nome, fn, lider=lider, intervalo=intervalo)
+    return run
+
+
+def init_scheduler(app) -> None:
+    """Registra os jobs e inicia o scheduler (fora de testes / DISABLE_SCHEDULER=1)."""
+    if app.config.get("TESTING") or os.getenv("DISABLE_SCHEDULER") == "1":
+        return
+    cfg = app.config
+    scheduler.add_job(
+        _job(app, JOB_ATUALIZAR, atualizar_regras, intervalo=CRON_GAP), CronTrigger.from_crontab(cfg["SCHEDULER_UPDATE_CRON"]),
+        id=JOB_ATUALIZAR, replace_existing=True, max_instances=1, coalesce=True, misfire_grace_time=3600,
+    )
+    scheduler.add_job(
+        _job(app, JOB_RECALCULAR, recalcular_notas, intervalo=timedelta(minutes=cfg["SCHEDULER_RECALC_MINUTES"])),
+        "interval", minutes=cfg["SCHEDULER_RECALC_MINUTES"],
+        id=JOB_RECALCULAR, replace_existing=True, max_instances=1, coalesce=True,
+    )
+    scheduler.add_job(
+        _job(app, JOB_RECARREGAR, recarregar_regras, lider=False), "interval",
+        minutes=cfg["SCHEDULER_RELOAD_MINUTES"],
+        id=JOB_RECARREGAR, replace_existing=True, max_instances=1, coalesce=True,
+    )
+    scheduler.add_job(
+        _job(app, JOB_COTAS, reconciliar_cotas, intervalo=CRON_GAP), CronTrigger.from_crontab(cfg["SCHEDULER_QUOTA_CRON"]),
+        id=JOB_COTAS, replace_existing=True, max_instances=1, coalesce=True, misfire_grace_time=3600,
+    )
+    scheduler.add_job(
+        _job(app, JOB_AUDITORIA, manter_auditoria, intervalo=CRON_GAP), CronTrigger.from_crontab(cfg["SCHEDULER_AUDIT_CRON"]),
+        id=JOB_AUDITORIA, replace_existing=True, max_instances=1, coalesce=True, misfire_grace_time=3600,
+    )
+    if not scheduler.running:
+        scheduler.start()
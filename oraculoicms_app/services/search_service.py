@@ -0,0 +1,146 @@
+# oraculoicms_app/services/search_service.py
+# -*- coding: utf-8 -*-
+"""
+Busca de notas do usuário (/buscar).
+
+- Termo numérico (aceita pontuação de CNPJ/chave): prefixo de ``chave``,
+  ``emit_cnpj`` e ``dest_cnpj`` (4+ dígitos), ``numero`` exato e prefixo de
+  NCM dos itens (até 8 dígitos).
+- Texto: descrição dos produtos (``NFEItem.xprod``) pelo índice de texto —
+  FTS5 no SQLite, trigramas (pg_trgm) no Postgres — ou código do produto.
+
+Cada condição usa um índice próprio; as notas saem por ``emissao`` desc,
+limitadas, sem varrer o acervo.
+"""
+from __future__ import annotations
+
+import re
+from typing import Any, List, Optional
+
+from sqlalchemy import and_, column, delete, exists, select, text, union
+
+from ..extensions import db
+from ..models.file import NFEItem, NFESummary, UserFile
+
+_SEPARADORES = re.compile(r"[\s./-]")
+
+
+def _dialeto() -> str:
+    return db.session.get_bind().dialect.name
+
+
+# ---------- indexação ----------
+def indexar_itens(summary: NFESummary, user_id: int, nfe: Any, refazer: bool = False,
+                  commit: bool = True) -> int:
+    """
+    Grava os produtos da nota em ``nfe_items`` (com commit, salvo
+    ``commit=False``).  Notas já indexadas são puladas, a menos que
+    ``refazer``.  Devolve o nº de itens.
+    """
+    if summary.id is None:
+        db.session.flush()
+    if not refazer and db.session.query(exists().where(NFEItem.summary_id == summary.id)).scalar():
+        return 0
+    produtos = getattr(nfe, "produtos", lambda: [])() or []
+    db.session.execute(delete(NFEItem).where(NFEItem.summary_id == summary.id))
+    if produtos:
+        db.session.execute(NFEItem.__table__.insert(), [
+            {
+                "summary_id": summary.id,
+                "user_id": user_id,
+                "n_item": int(p["nItem"]) if str(p.get("nItem") or "").isdigit() else None,
+                "cprod": (p.get("cProd") or "")[:60],
+                "xprod": (p.get("xProd") or "")[:120],
+                "ncm": re.sub(r"\D", "", p.get("NCM") or "")[:8],
+            }
+            for p in produtos
+        ])
+    if commit:
+        db.session.commit()
+    return len(produtos)
+
+
+def remover_itens(summary_id: int) -> None:
+    """Itens da nota (sem commit); o FK tem ON DELETE CASCADE, mas o SQLite não aplica por padrão."""
+    db.session.execute(delete(NFEItem).where(NFEItem.summary_id == summary_id))
+
+
+# ---------- busca ----------
+def _prefixo(col, p: str, dialeto: str):
+    if dialeto == "postgresql":
+        return col.like(p + "%")  # índice *_prefixo (varchar_pattern_ops)
+    # SQLite: LIKE é case-insensitive e não usa o índice; a faixa [p, p+) usa
+    return and_(col >= p, col < p[:-1] + chr(ord(p[-1]) + 1))
+
+
+def _itens_por_texto(user_id: int, termo: str, dialeto: str):
+    """Subquery de ``summary_id`` cujos produtos têm todas as palavras do termo."""
+    palavras = re.findall(r"\w+", termo)
+    if not palavras:
+        return None
+    if dialeto == "sqlite":
+        consulta = " ".join('"{}"*'.format(p.replace('"', "")) for p in palavras)
+        fts = (
+            text("SELECT rowid FROM nfe_items_fts WHERE nfe_items_fts MATCH :fts")
+            .bindparams(fts=consulta)
+            .columns(column("rowid"))
+        )
+        # parte do FTS (rowids) para os itens; o usuário é filtrado na consulta de fora
+        return select(NFEItem.summary_id.label("id")).where(NFEItem.id.in_(fts))
+    # Postgres: ILIKE '%x%' servido pelo GIN de trigramas
+    return select(NFEItem.summary_id.label("id")).where(
+        NFEItem.user_id == user_id,
+        *[NFEItem.xprod.ilike("%" + p.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%")
+          for p in palavras],
+    )
+
+
+def buscar_notas(user_id: int, termo: str, limite: int = 50) -> List[NFESummary]:
+    """Notas do usuário (arquivos não excluídos) que batem com ``termo``, mais recentes primeiro."""
+    termo = (termo or "").strip()
+    if not termo:
+        return []
+    dialeto = _dialeto()
+    digitos = re.sub(r"\D", "", termo)
+    numerico = bool(digitos) and _SEPARADORES.sub("", termo).isdigit()
+
+    # um SELECT de ids por índice, unidos numa tabela derivada que guia o JOIN;
+    # com ``id IN (...)`` o SQLite percorreria os arquivos do usuário
+    por_nota = lambda cond: select(NFESummary.id.label("id")).where(cond)
+    por_item = lambda cond: select(NFEItem.summary_id.label("id")).where(NFEItem.user_id == user_id, cond)
+    ids: List[Any] = []
+    if numerico:
+        ids.append(por_nota(NFESummary.numero.in_(sorted({digitos, digitos.lstrip("0") or "0"}))))
+        if len(digitos) >= 4:
+            ids += [por_nota(_prefixo(c, digitos, dialeto))
+                    for c in (NFESummary.chave, NFESummary.emit_cnpj, NFESummary.dest_cnpj)]
+        if 2 <= len(digitos) <= 8:
+            ids.append(por_item(_prefixo(NFEItem.ncm, digitos, dialeto)))
+    else:
+        por_texto = _itens_por_texto(user_id, termo, dialeto)
+        if por_texto is not None:
+            ids.append(por_texto)
+    ids.append(por_item(NFEItem.cprod == termo[:60]))
+
+    achados = union(*ids).subquery("achados")
+    return (
+        NFESummary.query
+        .join(achados, NFESummary.id == achados.c.id)
+        .join(UserFile, NFESummary.user_file_id == UserFile.id)
+        .filter(UserFile.user_id == user_id, UserFile.deleted_at.is_(None))
+        .order_by(NFESummary.emissao.desc(), NFESummary.id.desc())
+        .limit(limite)
+        .all()
+    )
+
+
+def notas_sem_itens(user_id: Optional[int] = None):
+    """Query das notas ainda sem ``nfe_items`` (backfill: ``flask indexar-notas``)."""
+    q = (
+        db.session.query(NFESummary.id, UserFile.user_id, UserFile.storage_path)
+        .join(UserFile, NFESummary.user_file_id == UserFile.id)
+        .filter(UserFile.deleted_at.is_(None), ~exists().where(NFEItem.summary_id == NFESummary.id))
+    )
+    if user_id is not None:
+        q = q.filter(UserFile.user_id == user_id)
+    return q
@@ -1,10 +1,12 @@
 from __future__ import annotations
 
-from typing import Any, Dict
+import json
+from datetime import datetime
+from typing import Any, Dict, Optional
 
 import pandas as pd
 from flask import current_app
-from sqlalchemy import select
+from sqlalchemy import func, select
 from sqlalchemy.exc import SQLAlchemyError
 
 from oraculoicms_app.extensions import db
@@ -88,30 +90,96 @@ def _load_matrices() -> Dict[str, pd.DataFrame]:
                 "PRIORIDADE": "prioridade",
             },
         ),
-        "sources_log": _query_to_dataframe(
-            SourceLog,
-            {
-                "EXECUTADO_EM": "executado_em",
-                "UF": "uf",
-                "NOME": "nome",
-                "STATUS": "status",
-                "MENSAGEM": "mensagem",
-                "LINHAS": "linhas",
-                "VERSAO": "versao",
-            },
-        ),
     }
 
     return matrices
 
 
+# ---------- sources_log (fora das matrizes: a tabela cresce a cada execução) ----------
+def latest_source_log() -> Optional[Dict[str, Any]]:
+    """Última entrada do ``sources_log`` (ORDER BY executado_em DESC LIMIT 1, indexado)."""
+    try:
+        row = db.session.execute(
+            select(SourceLog).order_by(SourceLog.executado_em.desc(), SourceLog.id.desc()).limit(1)
+        ).scalar()
+    except SQLAlchemyError:
+        db.session.rollback()
+        return None
+    if row is None:
+        return None
+    return {
+        "executado_em": str(row.executado_em),
+        "status": row.status,
+        "mensagem": row.mensagem,
+        "linhas": row.linhas or 0,
+    }
+
+
+def count_source_logs() -> int:
+    try:
+        return db.session.execute(select(func.count(SourceLog.id))).scalar() or 0
+    except SQLAlchemyError:
+        db.session.rollback()
+        return 0
+
+
+# ---------- carimbo das regras (invalidação entre workers) ----------
+_STAMP_GROUP = "regras"
+_STAMP_KEY = "stamp"
+
+
+def rules_stamp() -> Optional[Dict[str, str]]:
+    """Carimbo da última alteração das regras: {"versao", "em"} (UTC, ISO) ou None."""
+    from .settings import get_setting
+    try:
+        raw = get_setting(_STAMP_KEY, group=_STAMP_GROUP, default="")
+    except SQLAlchemyError:
+        db.session.rollback()
+        return None
+    try:
+        return json.loads(raw) if raw else None
+    except ValueError:
+        return None
+
+
+def rules_stamp_em(stamp: Optional[Dict[str, str]]) -> Optional[datetime]:
+    """Momento do carimbo (``stamp["em"]``) como datetime UTC ingênuo; None se ausente/inválido."""
+    try:
+        return datetime.fromisoformat(stamp["em"]) if stamp else None
+    except (KeyError, ValueError):
+        return None
+
+
+def bump_rules_stamp(versao: str = "") -> Dict[str, str]:
+    """Marca que as regras mudaram; os workers recarregam no próximo ``recarregar_regras``."""
+    from .settings import set_setting
+    stamp = {"versao": versao or "", "em": datetime.utcnow().isoformat(timespec="seconds")}
+    set_setting(_STAMP_KEY, json.dumps(stamp), group=_STAMP_GROUP)
+    return stamp
+
+
+def loaded_rules_stamp() -> Optional[Dict[str, str]]:
+    """Carimbo vigente quando as matrizes deste processo foram carregadas."""
+    return current_app.extensions.get("rules_stamp")
+
+
 def init_sheets(app) -> None:
     app.extensions.setdefault("sheet_client", None)
     app.extensions.setdefault("matrices", {})
     app.extensions.setdefault("worksheets", [])
 
+    from .calc_service import load_snapshot
+
     with app.app_context():
-        app.extensions["matrices"] = _load_matrices()
+        stamp = rules_stamp()
+        app.extensions["rules_stamp"] = stamp
+        # snapshot do motor com o mesmo carimbo: dispensa os SELECTs e a compilação
+        motor = load_snapshot(app, stamp)
+        if motor is not None:
+            app.extensions["motor"] = motor
+            app.extensions["matrices"] = motor.matrices
+        else:
+            app.extensions["matrices"] = _load_matrices()
 
 
 def get_sheet_client():
@@ -123,6 +191,8 @@ def get_matrices():
 
 
 def reload_matrices():
+    # carimbo lido antes: uma alteração concorrente dispara outro reload depois
+    current_app.extensions["rules_stamp"] = rules_stamp()
     matrices = _load_matrices()
     current_app.extensions["matrices"] = matrices
     return matrices
@@ -1,13 +1,20 @@
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
-from typing import List, Tuple
+from functools import lru_cache
+from io import BytesIO
+from typing import Any, BinaryIO, Dict, Iterable, Iterator, List, Tuple, Union
+import gc
 import os
+import shutil
+import tempfile
 
 from reportlab.lib.pagesizes import A4
 from reportlab.lib import colors
 from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
 from reportlab.lib.units import mm
 from reportlab.platypus import (
-    SimpleDocTemplate, Paragraph, Spacer, Table, TableStyle
+    SimpleDocTemplate, Paragraph, Spacer, Table, TableStyle, PageBreak
 )
 from reportlab.pdfgen.canvas import Canvas
 
@@ -15,11 +22,18 @@ from calc import ItemNF, ResultadoItem
 
 LOGO_PATH = os.path.join("static", "logo.png")
 
+# versão do layout dos PDFs; entra na chave do cache (services/artifact_cache) —
+# mude ao alterar estilos, blocos ou rodapé
+REPORT_VERSION = "1"
 
+
+@lru_cache(maxsize=1)
 def _styles():
+    # criados uma vez por processo: os estilos são só lidos pelos Paragraphs
     base = getSampleStyleSheet()
     return {
         "title": ParagraphStyle("title", parent=base["Heading1"], fontSize=16, leading=20, spaceAfter=8),
+        "nota": ParagraphStyle("nota", parent=base["Heading2"], fontSize=12, leading=15, spaceAfter=4),
         "label": ParagraphStyle("label", parent=base["Normal"], fontSize=9, leading=12, textColor=colors.grey),
         "value": ParagraphStyle("value", parent=base["Normal"], fontSize=10, leading=12),
         "value_bold": ParagraphStyle("value_bold", parent=base["Normal"], fontSize=10, leading=12, fontName="Helvetica-Bold"),
@@ -34,7 +48,7 @@ def _fmt(v: float) -> str:
         return "0,00"
 
 
-def _footer(canvas: Canvas, doc):
+def _footer_base(canvas: Canvas):
     w, h = A4
     y = 12 * mm
     canvas.setStrokeColor(colors.lightgrey)
@@ -45,9 +59,24 @@ def _footer(canvas: Canvas, doc):
             canvas.drawImage(LOGO_PATH, 15 * mm, y, width=20 * mm, height=8 * mm, preserveAspectRatio=True, mask='auto')
         except Exception:
             pass
+
+
+def _footer_pagina(canvas: Canvas, pagina: int):
+    w, h = A4
+    y = 12 * mm
     canvas.setFont("Helvetica", 8)
     ts = datetime.now().strftime("%d/%m/%Y %H:%M:%S")
-    canvas.drawRightString(w - 15 * mm, y + 2 * mm, f"Gerado em {ts}  •  Página {doc.page}")
+    canvas.drawRightString(w - 15 * mm, y + 2 * mm, f"Gerado em {ts}  •  Página {pagina}")
+
+
+def _footer(canvas: Canvas, doc):
+    _footer_base(canvas)
+    _footer_pagina(canvas, doc.page)
+
+
+def _footer_sem_pagina(canvas: Canvas, doc):
+    # partes renderizadas em paralelo: o "Página N" global entra na concatenação
+    _footer_base(canvas)
 
 
 def _title(uf_origem: str, uf_destino: str):
@@ -59,67 +88,102 @@ def _title(uf_origem: str, uf_destino: str):
 
 
 def _item_block(idx: int, it: ItemNF, r: ResultadoItem) -> Table:
+    return _bloco(
+        idx, it.ncm, it.cfop, it.cst,
+        base_oper=r.memoria.get("base_oper", 0.0),
+        modo=str(r.memoria.get("mva_tipo", "-")),
+        percent=float(r.memoria.get("mva_percentual_aplicado", 0.0)),
+        base_st=r.base_calculo_st,
+        icms_teorico=r.memoria.get("icms_teorico_dest", 0.0),
+        icms_origem=r.memoria.get("icms_origem_calc", 0.0),
+        icms_st=r.icms_st_devido,
+    )
+
+
+def _linha_block(idx: int, linha: Dict[str, Any]) -> Table:
+    """Bloco de um item a partir de uma linha do payload salvo (services/payload_service)."""
+    g = lambda k: linha.get(k) or 0.0
+    return _bloco(
+        idx, linha.get("ncm"), linha.get("cfop"), linha.get("cst"),
+        base_oper=float(g("vProd")) + float(g("vFrete")) + float(g("vOutro")),
+        modo=str(linha.get("mva_tipo") or "-"),
+        percent=float(g("mva_percent")),
+        base_st=g("base_st"),
+        icms_teorico=g("icms_teorico_dest"),
+        icms_origem=g("icms_origem_calc"),
+        icms_st=g("icms_st"),
+    )
+
+
+def _bloco(idx: int, ncm, cfop, cst, *, base_oper, modo: str, percent: float,
+           base_st, icms_teorico, icms_origem, icms_st) -> Table:
     st = _styles()
-    percent = float(r.memoria.get("mva_percentual_aplicado", 0.0))
-    modo = str(r.memoria.get("mva_tipo", "-"))
 
     head = [
         Paragraph("Item", st["label"]), Paragraph(str(idx), st["value"]),
-        Paragraph("NCM", st["label"]), Paragraph(it.ncm or "-", st["value"]),
-        Paragraph("CFOP", st["label"]), Paragraph(it.cfop or "-", st["value"]),
-        Paragraph("CST", st["label"]), Paragraph(it.cst or "-", st["value"]),
+        Paragraph("NCM", st["label"]), Paragraph(ncm or "-", st["value"]),
+        Paragraph("CFOP", st["label"]), Paragraph(cfop or "-", st["value"]),
+        Paragraph("CST", st["label"]), Paragraph(cst or "-", st["value"]),
     ]
 
     l1 = [
         Paragraph("Base oper.", st["label"]),
-        Paragraph(_fmt(r.memoria.get("base_oper", 0.0)), st["value"]),
+        Paragraph(_fmt(base_oper), st["value"]),
         Paragraph("MVA", st["label"]),
         Paragraph(f"{modo} ({percent:.2f}%)", st["value"]),  # <<< mostra o percentual
         Paragraph("Base ST", st["label"]),
-        Paragraph(_fmt(r.base_calculo_st), st["value"]),
+        Paragraph(_fmt(base_st), st["value"]),
     ]
 
     l2 = [
         Paragraph("ICMS teórico destino", st["label"]),
-        Paragraph(_fmt(r.memoria.get("icms_teorico_dest", 0.0)), st["value"]),
+        Paragraph(_fmt(icms_teorico), st["value"]),
         Paragraph("ICMS origem (calc)", st["label"]),
-        Paragraph(_fmt(r.memoria.get("icms_origem_calc", 0.0)), st["value"]),
+        Paragraph(_fmt(icms_origem), st["value"]),
         Paragraph("ICMS-ST devido", st["label"]),
-        Paragraph(_fmt(r.icms_st_devido), st["value_bold"]),
+        Paragraph(_fmt(icms_st), st["value_bold"]),
     ]
 
     table = Table([head, l1, l2],
                   colWidths=[18*mm, 20*mm, 18*mm, 25*mm, 18*mm, 20*mm, 18*mm, 20*mm])
 
-    table.setStyle(TableStyle([
-        ("FONT", (0, 0), (-1, -1), "Helvetica", 9),
-        ("VALIGN", (0, 0), (-1, -1), "MIDDLE"),
-        ("BACKGROUND", (0, 0), (-1, 0), colors.whitesmoke),
-        ("LINEBEFORE", (0, 0), (0, -1), 0.25, colors.lightgrey),
-        ("LINEAFTER", (-1, 0), (-1, -1), 0.25, colors.lightgrey),
-        ("GRID", (0, 1), (-1, -1), 0.25, colors.lightgrey),
-        ("LEFTPADDING", (0, 0), (-1, -1), 4),
-        ("RIGHTPADDING", (0, 0), (-1, -1), 4),
-        ("TOPPADDING", (0, 0), (-1, -1), 3),
-        ("BOTTOMPADDING", (0, 0), (-1, -1), 3),
-    ]))
+    table.setStyle(_TABLE_STYLE)
     return table
 
 
-def gerar_pdf(resultados: List[Tuple[ItemNF, ResultadoItem]], uf_origem: str, uf_destino: str) -> bytes:
-    from io import BytesIO
-    buff = BytesIO()
+_TABLE_STYLE = TableStyle([
+    ("FONT", (0, 0), (-1, -1), "Helvetica", 9),
+    ("VALIGN", (0, 0), (-1, -1), "MIDDLE"),
+    ("BACKGROUND", (0, 0), (-1, 0), colors.whitesmoke),
+    ("LINEBEFORE", (0, 0), (0, -1), 0.25, colors.lightgrey),
+    ("LINEAFTER", (-1, 0), (-1, -1), 0.25, colors.lightgrey),
+    ("GRID", (0, 1), (-1, -1), 0.25, colors.lightgrey),
+    ("LEFTPADDING", (0, 0), (-1, -1), 4),
+    ("RIGHTPADDING", (0, 0), (-1, -1), 4),
+    ("TOPPADDING", (0, 0), (-1, -1), 3),
+    ("BOTTOMPADDING", (0, 0), (-1, -1), 3),
+])
+
 
-    doc = SimpleDocTemplate(
-        buff,
+def _doc(destino, title: str = "Memória de Cálculo ICMS-ST", **kw) -> SimpleDocTemplate:
+    return SimpleDocTemplate(
+        destino,
+        **kw,
         pagesize=A4,
         leftMargin=15*mm,
         rightMargin=15*mm,
         topMargin=18*mm,
         bottomMargin=18*mm,
-        title="Memória de Cálculo ICMS-ST",
+        title=title,
     )
 
+
+def gerar_pdf(resultados: List[Tuple[ItemNF, ResultadoItem]], uf_origem: str, uf_destino: str) -> bytes:
+    from io import BytesIO
+    buff = BytesIO()
+
+    doc = _doc(buff)
+
     story = []
     story.append(_title(uf_origem, uf_destino))
     story.append(Spacer(1, 4*mm))
@@ -137,3 +201,311 @@ def gerar_pdf(resultados: List[Tuple[ItemNF, ResultadoItem]], uf_origem: str, uf
     pdf = buff.getvalue()
     buff.close()
     return pdf
+
+
+def gerar_pdf_nota(payload: Dict[str, Any], titulo: str = "") -> bytes:
+    """Memória de cálculo de uma nota direto do payload salvo (``linhas`` do calc_store)."""
+    buff = BytesIO()
+    nota = {
+        "titulo": titulo,
+        "uf_origem": payload.get("uf_origem"),
+        "uf_destino": payload.get("uf_destino"),
+        "linhas": payload.get("linhas") or [],
+    }
+    _doc(buff).build(list(_story_nota(nota, primeira=True)), onFirstPage=_footer, onLaterPages=_footer)
+    return buff.getvalue()
+
+
+# ---------------------------------------------------------------------
+# Relatório consolidado (várias notas)
+# ---------------------------------------------------------------------
+def _story_nota(nota: Dict[str, Any], primeira: bool) -> Iterator[Any]:
+    """``nota``: {"titulo", "uf_origem", "uf_destino", "linhas"} (linhas do payload)."""
+    st = _styles()
+    if not primeira:
+        yield PageBreak()
+    yield _title(nota.get("uf_origem") or "-", nota.get("uf_destino") or "-")
+    if nota.get("titulo"):
+        yield Paragraph(nota["titulo"], st["nota"])
+    yield Spacer(1, 4*mm)
+
+    total = 0.0
+    for i, linha in enumerate(nota.get("linhas") or (), start=1):
+        yield _linha_block(i, linha)
+        yield Spacer(1, 5*mm)
+        total += float(linha.get("icms_st") or 0.0)
+    yield Paragraph(f"Total ICMS-ST da nota: <b>R$ {_fmt(total)}</b>", st["total"])
+
+
+def _story_fechamento(n: int, total: float) -> Iterator[Any]:
+    yield Spacer(1, 6*mm)
+    yield Paragraph(f"Total ICMS-ST ({n} notas): <b>R$ {_fmt(total)}</b>", _styles()["total"])
+
+
+def gerar_pdf_consolidado(notas: Iterable[Dict[str, Any]], destino: Union[str, BinaryIO],
+                          workers: int = 1, notas_por_parte: int = 20) -> None:
+    """
+    Memória de cálculo de várias notas num único PDF gravado em ``destino``
+    (caminho ou arquivo binário).  As notas são renderizadas em partes de
+    ``notas_por_parte`` (um PDF temporário por parte; com ``workers`` > 1, num
+    pool de processos — ``gerar_pdf_consolidado_paralelo``) e concatenadas
+    na ordem.
+
+    Memória: ``notas`` pode ser um gerador; ficam lidas no máximo duas partes
+    de notas (``_partes`` segura uma para o fechamento) e só os flowables da
+    parte em render.  Cada parte já sai com a numeração global (``offset`` =
+    páginas das anteriores) e ``_concatenar`` grava o PDF final objeto a
+    objeto, uma parte por vez: o pico não cresce com o nº de páginas.
+    """
+    if workers > 1:
+        return gerar_pdf_consolidado_paralelo(notas, destino, workers, notas_por_parte)
+    diretorio = tempfile.mkdtemp(prefix="pdf_partes_")
+    try:
+        paths, paginas = [], 0
+        for parte, fechamento in _partes(notas, max(1, notas_por_parte)):
+            path, n = _render_parte((parte, fechamento, diretorio, paginas))
+            paths.append(path)
+            paginas += n
+        _concatenar(paths, destino)
+    finally:
+        shutil.rmtree(diretorio, ignore_errors=True)
+
+
+# ---------------------------------------------------------------------
+# Render por partes (PDF por parte + concatenação em streaming; em paralelo num pool)
+# ---------------------------------------------------------------------
+def _total_nota(nota: Dict[str, Any]) -> float:
+    # mesma soma (e ordem) de _story_nota
+    total = 0.0
+    for linha in nota.get("linhas") or ():
+        total += float(linha.get("icms_st") or 0.0)
+    return total
+
+
+def _partes(notas: Iterable[Dict[str, Any]], por_parte: int) -> Iterator[Tuple[List[Dict[str, Any]], Any]]:
+    """
+    Fatias de ``por_parte`` notas; a última leva o fechamento (nº de notas,
+    total) — conhecido só depois de ler todas, por isso uma fatia de atraso.
+    """
+    n, total = 0, 0.0
+    anterior, atual = None, []
+    for nota in notas:
+        n += 1
+        total += _total_nota(nota)
+        atual.append(nota)
+        if len(atual) == por_parte:
+            if anterior is not None:
+                yield anterior, None
+            anterior, atual = atual, []
+    if atual:
+        if anterior is not None:
+            yield anterior, None
+        anterior = atual
+    yield (anterior or []), (n, total)
+
+
+def _footer_a_partir(offset: int):
+    """Rodapé com a numeração global: ``offset`` páginas vêm das partes anteriores."""
+    def footer(canvas: Canvas, doc):
+        _footer_base(canvas)
+        _footer_pagina(canvas, offset + doc.page)
+    return footer
+
+
+def _render_parte(tarefa) -> Tuple[str, int]:
+    """
+    PDF temporário de uma parte; devolve (caminho, nº de páginas).  Com
+    ``offset`` (nº de páginas das partes anteriores) o rodapé já sai com a
+    numeração global; ``None`` = sem número (partes em paralelo, ver
+    ``_concatenar``).
+    """
+    notas, fechamento, diretorio, offset = tarefa
+    fd, path = tempfile.mkstemp(suffix=".pdf", dir=diretorio)
+    os.close(fd)
+
+    def story():
+        for i, nota in enumerate(notas):
+            yield from _story_nota(nota, primeira=(i == 0))
+        if fechamento is not None:
+            yield from _story_fechamento(*fechamento)
+
+    footer = _footer_sem_pagina if offset is None else _footer_a_partir(offset)
+    doc = _doc(path, title="Memória de Cálculo ICMS-ST — consolidado", pageCompression=1)
+    doc.build(list(story()), onFirstPage=footer, onLaterPages=footer)
+    return path, doc.page
+
+
+class _Saida:
+    """Arquivo de saída que conta os bytes gravados (offsets da tabela xref)."""
+
+    def __init__(self, fh: BinaryIO):
+        self._fh = fh
+        self.pos = 0
+
+    def write(self, dados: bytes) -> None:
+        self._fh.write(dados)
+        self.pos += len(dados)
+
+
+def _texto_pdf(texto: str) -> bytes:
+    """String literal para a fonte padrão (mesma codificação WinAnsi do reportlab)."""
+    from reportlab.pdfbase.rl_codecs import RL_Codecs
+
+    RL_Codecs.register()
+    dados = texto.encode("winansi", errors="replace")
+    return b"(" + dados.replace(b"\\", b"\\\\").replace(b"(", b"\\(").replace(b")", b"\\)") + b")"
+
+
+def _rodape_numerado(pagina: int) -> bytes:
+    """Mesmo texto/posição de ``_footer_pagina``, como content stream avulso."""
+    from reportlab.pdfbase.pdfmetrics import stringWidth
+
+    w, _ = A4
+    texto = f"Gerado em {datetime.now():%d/%m/%Y %H:%M:%S}  •  Página {pagina}"
+    x = w - 15 * mm - stringWidth(texto, "Helvetica", 8)
+    return (f"Q q 0 g BT /FNum 8 Tf {x:.2f} {14 * mm:.2f} Td ".encode("ascii")
+            + _texto_pdf(texto) + b" Tj ET Q")
+
+
+def _concatenar(paths: List[str], destino: Union[str, BinaryIO], numerar: bool = False,
+                titulo: str = "Memória de Cálculo ICMS-ST — consolidado") -> None:
+    """
+    PDFs das partes, na ordem, num só ``destino``, gravado objeto a objeto:
+    cada parte é lida com pypdf, copiada (objetos renumerados) e solta antes
+    da próxima.  Em memória ficam só a parte atual, os offsets da xref e as
+    referências das páginas — o pico não cresce com o relatório.
+    Com ``numerar``, cada página ganha um content stream com o rodapé
+    "Gerado em …  •  Página N" (partes renderizadas sem ``offset``).
+    """
+    from pypdf import PdfReader
+    from pypdf.generic import ArrayObject, DictionaryObject, IndirectObject, NameObject
+
+    class _Ref(IndirectObject):
+        """Referência já no espaço de objetos da saída (não é remapeada)."""
+
+    CATALOGO, PAGINAS, INFO, FONTE, ABRE = 1, 2, 3, 4, 5
+    offsets: Dict[int, int] = {}
+    kids: List[int] = []
+    proximo = [ABRE + 1]
+
+    def novo_id() -> int:
+        proximo[0] += 1
+        return proximo[0] - 1
+
+    fh = open(destino, "wb") if isinstance(destino, str) else destino
+    out = _Saida(fh)
+
+    def gravar(num: int, corpo: bytes = b"", obj=None) -> None:
+        offsets[num] = out.pos
+        out.write(f"{num} 0 obj\n".encode("ascii"))
+        if obj is not None:
+            obj.write_to_stream(out)
+        else:
+            out.write(corpo)
+        out.write(b"\nendobj\n")
+
+    def stream(num: int, dados: bytes) -> None:
+        gravar(num, f"<< /Length {len(dados)} >>\nstream\n".encode("ascii") + dados + b"\nendstream")
+
+    try:
+        out.write(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+        if numerar:
+            gravar(FONTE, b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>")
+            stream(ABRE, b"q")
+
+        for path in paths:
+            reader = PdfReader(path)
+            mapa: Dict[int, int] = {}
+            fila: deque = deque()
+
+            def remapear(obj):
+                if isinstance(obj, _Ref):
+                    return obj
+                if isinstance(obj, IndirectObject):
+                    num = mapa.get(obj.idnum)
+                    if num is None:
+                        num = mapa[obj.idnum] = novo_id()
+                        fila.append(obj)
+                    return _Ref(num, 0, None)
+                if isinstance(obj, DictionaryObject):  # inclui streams
+                    for k, v in list(dict.items(obj)):
+                        dict.__setitem__(obj, k, remapear(v))
+                elif isinstance(obj, ArrayObject):
+                    for i, v in enumerate(list(obj)):
+                        list.__setitem__(obj, i, remapear(v))
+                return obj
+
+            paginas = list(reader.pages)
+            for pagina in paginas:  # páginas primeiro: links entre elas não duplicam nada
+                mapa[pagina.indirect_reference.idnum] = novo_id()
+            for pagina in paginas:
+                num = mapa[pagina.indirect_reference.idnum]
+                dict.__setitem__(pagina, NameObject("/Parent"), _Ref(PAGINAS, 0, None))
+                if numerar:
+                    rodape = novo_id()
+                    stream(rodape, _rodape_numerado(len(kids) + 1))
+                    conteudo = dict.get(pagina, "/Contents")
+                    atuais = list(conteudo) if isinstance(conteudo, ArrayObject) else [conteudo]
+                    dict.__setitem__(pagina, NameObject("/Contents"), ArrayObject(
+                        [_Ref(ABRE, 0, None), *atuais, _Ref(rodape, 0, None)]
+                    ))
+                    recursos = pagina.setdefault(NameObject("/Resources"), DictionaryObject()).get_object()
+                    fontes = recursos.setdefault(NameObject("/Font"), DictionaryObject()).get_object()
+                    dict.__setitem__(fontes, NameObject("/FNum"), _Ref(FONTE, 0, None))
+                gravar(num, obj=remapear(pagina))
+                kids.append(num)
+                while fila:
+                    ref = fila.popleft()
+                    gravar(mapa[ref.idnum], obj=remapear(reader.get_object(ref)))
+            # páginas/objetos lidos apontam de volta para o reader (ciclos):
+            # coleta já, senão as partes se acumulam até o gc passar
+            reader.stream.close()
+            del reader, paginas, pagina, remapear
+            gc.collect()
+
+        gravar(PAGINAS, f"<< /Type /Pages /Count {len(kids)} /Kids [".encode("ascii")
+               + " ".join(f"{k} 0 R" for k in kids).encode("ascii") + b"] >>")
+        gravar(CATALOGO, f"<< /Type /Catalog /Pages {PAGINAS} 0 R >>".encode("ascii"))
+        # strings do /Info em UTF-16BE (hex com BOM)
+        gravar(INFO, b"<< /Title <FEFF" + titulo.encode("utf-16-be").hex().upper().encode("ascii")
+               + b"> /Producer (OraculoICMS) >>")
+
+        total = proximo[0]
+        inicio_xref = out.pos
+        linhas = [f"xref\n0 {total}\n", "0000000000 65535 f \n"]
+        for num in range(1, total):
+            if num in offsets:
+                linhas.append(f"{offsets[num]:010d} 00000 n \n")
+            else:  # ids reservados e não usados (FONTE/ABRE sem numeração)
+                linhas.append("0000000000 65535 f \n")
+        out.write("".join(linhas).encode("ascii"))
+        out.write(f"trailer\n<< /Size {total} /Root {CATALOGO} 0 R /Info {INFO} 0 R >>\n"
+                  f"startxref\n{inicio_xref}\n%%EOF\n".encode("ascii"))
+    finally:
+        if fh is not destino:
+            fh.close()
+
+
+def gerar_pdf_consolidado_paralelo(notas: Iterable[Dict[str, Any]], destino: Union[str, BinaryIO],
+                                   workers: int, notas_por_parte: int = 20) -> None:
+    """
+    Mesmo relatório de ``gerar_pdf_consolidado``, com as partes (``notas_por_parte``
+    notas cada; toda nota começa em página nova) renderizadas num pool de
+    processos.  No máximo ``2 * workers`` partes ficam em voo.  O nº de
+    páginas de cada parte só se sabe depois de renderizada, então a
+    numeração global entra na concatenação (``_concatenar(numerar=True)``).
+    """
+    diretorio = tempfile.mkdtemp(prefix="pdf_partes_")
+    try:
+        paths: List[str] = []
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            em_voo: deque = deque()
+            for parte, fechamento in _partes(notas, max(1, notas_por_parte)):
+                em_voo.append(pool.submit(_render_parte, (parte, fechamento, diretorio, None)))
+                while len(em_voo) > 2 * workers:
+                    paths.append(em_voo.popleft().result()[0])
+            paths.extend(f.result()[0] for f in em_voo)
+
+        _concatenar(paths, destino, numerar=True)
+    finally:
+        shutil.rmtree(diretorio, ignore_errors=True)
@@ -0,0 +1,96 @@
+import os
+import time
+
+import pytest
+
+from oraculoicms_app.services import artifact_cache as ac
+
+
+@pytest.fixture
+def cache(app, monkeypatch, tmp_path):
+    monkeypatch.setitem(app.config, "ARTIFACT_CACHE", True)
+    monkeypatch.setitem(app.config, "ARTIFACT_CACHE_DIR", str(tmp_path))
+    monkeypatch.setitem(app.config, "ARTIFACT_CACHE_MAX_MB", 3000 / (1024 * 1024))  # 3000 bytes
+    monkeypatch.setattr(ac, "_contadores", dict.fromkeys(ac._CONTADORES, 0))
+    monkeypatch.setattr(ac, "_uso", {})
+    monkeypatch.setattr(ac, "_despejado_em", 0.0)  # 1º contador despeja
+    with app.app_context():
+        yield tmp_path
+
+
+def _envelhecer(path, segundos):
+    t = time.time() - segundos
+    os.utime(path, (t, t))
+
+
+def test_lru_limitado_em_bytes(cache):
+    a = ac.gravar("a", b"x" * 1000, grupo="nfe-1")
+    b = ac.gravar("b", b"x" * 1000, grupo="nfe-2")
+    _envelhecer(a, 30)
+    _envelhecer(b, 20)
+    assert ac.obter("a", grupo="nfe-1") == a  # acesso: "a" passa a ser a mais recente
+
+    ac.gravar("c", b"x" * 1500)
+    assert ac.obter("b", grupo="nfe-2") is None  # menos usada saiu
+    assert ac.obter("a", grupo="nfe-1") == a and ac.obter("c")
+
+    st = ac.estatisticas()
+    assert st["entradas"] == 2 and st["bytes"] == 2500 <= st["limite_bytes"]
+    assert (st["hits"], st["misses"], st["gravacoes"], st["removidos"]) == (3, 1, 3, 1)
+    assert st["taxa_acerto"] == pytest.approx(0.75)
+
+    assert ac.limpar() == 2 and ac.estatisticas()["entradas"] == 0
+
+
+def test_contadores_em_memoria_e_arquivos_de_processos_mortos(cache, monkeypatch):
+    ac.gravar("a", b"x")
+    stats = cache / "_stats"
+    proprio = stats / os.path.basename(ac._arquivo_stats(str(cache)))
+    antes = proprio.stat().st_mtime_ns
+    for _ in range(5):
+        ac.obter("a")
+    assert proprio.stat().st_mtime_ns == antes  # acertos não tocam o disco
+
+    host = ac.socket.gethostname()
+    morto = stats / f"{host}-999999999.json"
+    parado = stats / "outro-host-1.json"
+    vivo = stats / "outro-host-2.json"
+    for f in (morto, parado, vivo):
+        f.write_text('{"hits": 10}')
+    _envelhecer(parado, ac._STATS_TTL + 60)
+
+    st = ac.estatisticas()
+    assert st["hits"] == 5 + 10 and st["gravacoes"] == 1  # próprio (despejado agora) + vivo
+    assert not morto.exists() and not parado.exists() and vivo.exists()
+
+
+def test_gravacao_abaixo_do_limite_nao_varre_o_diretorio(cache, monkeypatch):
+    ac.gravar("a", b"x" * 100)  # primeira: varre para conhecer o tamanho
+    varreduras = []
+    entradas = ac._entradas
+    monkeypatch.setattr(ac, "_entradas", lambda d: varreduras.append(d) or entradas(d))
+    ac.gravar("b", b"x" * 100, grupo="nfe-1")
+    ac.gravar("c", b"x" * 100)
+    assert varreduras == []
+    ac.invalidar("nfe-1")
+    assert ac._uso[str(cache)][0] == 200
+    ac.gravar("d", b"x" * 2900)  # estimativa passa do limite: varre e poda
+    assert varreduras and ac._uso[str(cache)][0] <= 3000
+
+
+def test_recalculo_invalida_pdfs_da_nota(cache, db_session):
+    from oraculoicms_app.models.file import NFESummary
+    from oraculoicms_app.services.calc_store import store_payload
+
+    s = NFESummary(id=987654, user_file_id=987654)
+    path = ac.gravar("memoria", b"%PDF", grupo=ac.grupo_nota(s.id))
+    outra = ac.gravar("memoria", b"%PDF", grupo=ac.grupo_nota(1))
+    store_payload(s, {"linhas": [], "total_st": 0, "total_nf_st": 0})
+    assert not os.path.exists(path) and os.path.exists(outra)
+
+
+def test_cache_desligado_nao_grava(app, monkeypatch):
+    monkeypatch.setitem(app.config, "ARTIFACT_CACHE", False)
+    with app.app_context():
+        assert ac.gravar("x", b"1") is None and ac.obter("x") is None
+        assert ac.estatisticas() == {"ativo": False}
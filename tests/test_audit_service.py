@@ -0,0 +1,71 @@
+import datetime as dt
+
+import pytest
+
+from oraculoicms_app.extensions import db
+from oraculoicms_app.models.file import AuditDaily, AuditLog, AuditLogArchive
+from oraculoicms_app.services import audit_service as aud
+
+
+@pytest.fixture
+def eventos(db_session, user_normal):
+    agora = dt.datetime.utcnow()
+    dias = lambda n: agora - dt.timedelta(days=n)
+    db_session.add_all([
+        AuditLog(user_id=user_normal.id, action="upload", ref="user_file:1", created_at=dias(200)),
+        AuditLog(user_id=user_normal.id, action="upload", ref="user_file:2", created_at=dias(100)),
+        AuditLog(user_id=user_normal.id, action="upload", ref="user_file:3", created_at=dias(100)),
+        AuditLog(user_id=user_normal.id, action="delete", ref="user_file:2", created_at=dias(100)),
+        AuditLog(user_id=user_normal.id, action="parse", ref="user_file:3", created_at=dias(10)),
+    ])
+    db_session.commit()
+    yield user_normal, dias
+    db_session.rollback()
+    for modelo in (AuditLog, AuditLogArchive, AuditDaily):
+        modelo.query.filter_by(user_id=user_normal.id).delete()
+    db_session.commit()
+
+
+def test_arquivar_consolida_e_move_eventos_antigos(eventos):
+    user, dias = eventos
+    assert aud.arquivar(90, lote=2) == 4
+
+    quentes = AuditLog.query.filter_by(user_id=user.id).all()
+    assert [e.action for e in quentes] == ["parse"]
+    assert AuditLogArchive.query.filter_by(user_id=user.id).count() == 4
+
+    diario = {(r.dia, r.action): r.total for r in AuditDaily.query.filter_by(user_id=user.id)}
+    assert diario[(dias(100).date(), "upload")] == 2
+    assert diario[(dias(100).date(), "delete")] == 1
+    assert diario[(dias(200).date(), "upload")] == 1
+    assert diario[(dias(10).date(), "parse")] == 1  # consolidado, mas ainda na tabela quente
+
+    assert aud.consolidar_dias() == 0  # idempotente
+    assert aud.arquivar(90) == 0
+
+
+def test_retencao_apaga_historico_vencido(eventos):
+    user, _ = eventos
+    aud.arquivar(90)
+    assert aud.aplicar_retencao(0) == 0
+    assert aud.aplicar_retencao(150) == 1
+    refs = sorted(e.ref for e in AuditLogArchive.query.filter_by(user_id=user.id))
+    assert refs == ["user_file:2", "user_file:2", "user_file:3"]
+
+
+def test_atividade_recente_vem_da_tabela_quente(eventos):
+    user, _ = eventos
+    db.session.add(AuditLog(user_id=user.id, action="upload", ref="user_file:9"))
+    db.session.commit()
+    assert [e.ref for e in aud.atividade_recente(user.id, limite=2)] == ["user_file:9", "user_file:3"]
+
+
+def test_arquivar_data_eventos_legados_sem_created_at(eventos):
+    user, _ = eventos
+    db.session.execute(AuditLog.__table__.insert().values(
+        user_id=user.id, action="upload", ref="user_file:8", created_at=None,
+    ))
+    db.session.commit()
+    assert aud.arquivar(90) == 4
+    legado = AuditLog.query.filter_by(user_id=user.id, ref="user_file:8").one()
+    assert legado.created_at is not None  # fica na tabela quente até vencer
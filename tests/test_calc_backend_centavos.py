@@ -0,0 +1,87 @@
+import random
+from decimal import Decimal
+from types import SimpleNamespace
+
+import pandas as pd
+import pytest
+
+from calc import MotorCalculo, ItemNF, D
+
+N_CASOS = 20000
+CAMPOS = ("base_oper", "venda_desc", "valor_agregado", "base_st", "icms_teorico_dest",
+          "icms_origem_calc", "icms_st", "saldo_devedor", "mult_sefaz", "icms_retido", "icms_des")
+
+
+def _valor(rnd, casas, maximo):
+    v = Decimal(rnd.randint(0, maximo * 10 ** casas)).scaleb(-casas)
+    return -v if rnd.random() < 0.03 else v
+
+
+def _taxa(rnd):
+    escolha = rnd.random()
+    if escolha < 0.4:                                   # percentuais "de planilha"
+        return Decimal(rnd.randint(0, 9999)).scaleb(-2)
+    if escolha < 0.8:                                   # frações com até 6 casas
+        return Decimal(rnd.randint(0, 999999)).scaleb(-6)
+    if escolha < 0.95:
+        return Decimal(rnd.choice(["0.07", "0.12", "0.1947", "0.35", "0.20", "0", "1"]))
+    return Decimal(rnd.randint(1, 10 ** 12)).scaleb(-12)  # não cabe em 10^-8 -> Decimal
+
+
+def _corpus(seed=20240601):
+    rnd = random.Random(seed)
+    for _ in range(N_CASOS):
+        it = ItemNF(
+            ncm="", cfop="", cst="",
+            quantidade=_valor(rnd, rnd.choice([0, 2, 4]), 5000),
+            valor_unitario=_valor(rnd, rnd.choice([2, 4, 6, 10]), 20000),
+            frete=_valor(rnd, rnd.choice([2, 2, 2, 3]), 500),
+            ipi=_valor(rnd, 2, 500),
+            despesas_acessorias=_valor(rnd, rnd.choice([0, 2]), 200),
+            descontos=D(0), icms_destacado_origem=D(0), icms_desonerado=D(0),
+            incluir_frete_no_desonerado=True, incluir_despesas_no_desonerado=True,
+        )
+        raw = {
+            "aliquota_origem": _taxa(rnd),
+            "mva": _taxa(rnd),
+            "aliquota_interna": _taxa(rnd),
+            "multiplicador_sefaz": _taxa(rnd),
+            "incluir_frete_no_desonerado": rnd.random() < 0.8,
+            "incluir_despesas_no_desonerado": rnd.random() < 0.8,
+        }
+        yield it, raw
+
+
+def test_centavos_concorda_com_decimal_no_centavo():
+    dec = MotorCalculo(backend="decimal")
+    cen = MotorCalculo(backend="centavos")
+    for it, raw in _corpus():
+        p = dec._params_item(raw)
+        esperado = dec._calcular_decimal(it, p)
+        obtido = cen._calcular_com_param(it, p)
+        for k in CAMPOS:
+            assert obtido[k] == esperado[k], (k, it, raw, obtido[k], esperado[k])
+
+
+def test_centavos_usa_inteiros_quando_representavel():
+    cen = MotorCalculo(backend="centavos")
+    it = ItemNF(ncm="", cfop="", cst="", quantidade=D("3"), valor_unitario=D("10.005"),
+                frete=D("1.10"), ipi=D(0), despesas_acessorias=D(0), descontos=D(0),
+                icms_destacado_origem=D(0), icms_desonerado=D(0))
+    r = cen._calcular_centavos(it, cen._params_item({}))
+    assert r["base_oper"] == Decimal("31.12")     # 30.015 -> 30.02 (HALF_UP) + 1.10
+    assert str(r["venda_desc"]) == "28.94"
+
+
+def test_calcula_st_identico_nos_dois_backends():
+    df = pd.DataFrame([{"NCM": "0903.00.91", "CEST": "", "UF": "AM", "MVA %": "50", "APLICA_ST": "1"}])
+    item = SimpleNamespace(nItem=1, cProd="1", xProd="X", ncm="09030091", cst="060", cfop="6102", cest="",
+                           qCom="7", vUnCom="13.337", vProd=0, vFrete="2.5", vIPI=0, vOutro="0.99", vICMSDeson=0)
+    a = MotorCalculo({"planilha": df}).calcula_st(item, "SP", "AM")
+    b = MotorCalculo({"planilha": df}, backend="centavos").calcula_st(item, "SP", "AM")
+    assert a.memoria == b.memoria
+
+
+def test_backend_invalido():
+    with pytest.raises(ValueError):
+        MotorCalculo(backend="float")
@@ -0,0 +1,61 @@
+from decimal import Decimal
+from types import SimpleNamespace
+
+import pandas as pd
+
+from calc import MotorCalculo, ResultadoST
+
+
+def _item(ncm="09030091", qtd=2, vu=100):
+    return SimpleNamespace(
+        nItem=3, cProd="P1", xProd="ITEM", ncm=ncm, cst="060", cfop="6102", cest="",
+        qCom=qtd, vUnCom=vu, vProd=qtd * vu, vFrete=10, vIPI=0, vOutro=0, vICMSDeson=0,
+    )
+
+
+def _motor():
+    df = pd.DataFrame([
+        {"NCM": "0903.00.91", "CEST": "", "UF": "AM", "MVA %": "50", "APLICA_ST": "1"},
+    ])
+    return MotorCalculo({"planilha": df})
+
+
+def test_resultado_compacto_sem_memoria_ate_ser_pedida():
+    r = _motor().calcula_st(_item(), "SP", "AM")
+    assert isinstance(r, ResultadoST)
+    assert not hasattr(r, "__dict__")
+    assert r._memoria is None
+
+    assert r.aplica_st is True
+    assert r.mva == Decimal("0.5")
+    assert isinstance(r.base_calculo_st, Decimal)
+    assert r.base_calculo_st == r.base_st
+    assert r.icms_st_devido == r.icms_st
+    assert r._memoria is None
+
+    mem = r.memoria
+    assert mem is r.memoria  # montada uma única vez
+    assert mem["BASE_ST"] == float(r.base_st)
+    assert mem["BASE DE CÁLCULO SUBSTITUIÇÃO TRIBUTÁRIA"] == float(r.base_st)
+    assert mem["VALOR_ICMS_ST"] == float(r.icms_st)
+    assert mem["MARGEM_DE_VALOR_AGREGADO_MVA"] == 50.0
+    assert mem["mva_tipo"] == "MVA Padrão"
+    assert mem["SEQUENCIAL ITEM"] == "3"
+    assert mem["parametros"]["APLICA_ST"] is True
+    assert mem["parametros"]["FONTE_REGRAS"] == "planilha"
+
+
+def test_resultado_sem_st_zera_valores_e_mantem_memoria():
+    r = _motor().calcula_st(_item(ncm="11111111"), "SP", "AM")
+    assert r.aplica_st is False
+    assert r.icms_st_devido == 0
+    assert r.saldo_devedor == 0
+    assert r.base_calculo_st == r.venda_desc
+
+    mem = r.memoria
+    assert mem["mva_tipo"] == "Sem ST"
+    assert mem["VALOR_ICMS_ST"] == 0.0
+    assert mem["BASE_ST"] == float(r.venda_desc)
+    assert mem["VLR TOTAL PRODUTO."] == 200.0
+    assert mem["parametros"]["APLICA_ST"] is False
+    assert mem["parametros"]["FONTE_REGRAS"] is None
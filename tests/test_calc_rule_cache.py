@@ -0,0 +1,114 @@
+import pandas as pd
+from types import SimpleNamespace
+
+from calc import MotorCalculo
+
+
+def _item(ncm="09030091", cest="", cfop="6102", cst="060"):
+    return SimpleNamespace(
+        nItem=1, cProd="1", xProd="ITEM", ncm=ncm, cst=cst, cfop=cfop, cest=cest,
+        qCom=1, vUnCom=100, vProd=100, vFrete=0, vIPI=0, vOutro=0, vICMSDeson=0,
+    )
+
+
+def _motor(**kw):
+    df = pd.DataFrame([
+        {"NCM": "0903.00.91", "CEST": "", "UF": "AM", "MVA %": "50", "APLICA_ST": "1"},
+        {"NCM": "3926", "CEST": "", "UF": "AM", "MVA %": "30", "APLICA_ST": "1"},
+    ])
+    return MotorCalculo({"planilha": df}, **kw)
+
+
+def test_cache_de_regras_conta_hits_e_misses():
+    motor = _motor()
+    for _ in range(5):
+        r = motor.calcula_st(_item(), "SP", "AM")
+        assert r.memoria["MARGEM_DE_VALOR_AGREGADO_MVA"] == 50.0
+    motor.calcula_st(_item(ncm="39269090"), "SP", "AM")
+
+    info = motor.rule_cache_info()
+    assert info["misses"] == 2
+    assert info["hits"] == 4
+    assert info["size"] == 2
+
+
+def test_cache_de_regras_chave_inclui_cfop_e_cst():
+    motor = _motor()
+    motor.calcula_st(_item(cfop="6102"), "SP", "AM")
+    motor.calcula_st(_item(cfop="6403"), "SP", "AM")
+    motor.calcula_st(_item(cst="010"), "SP", "AM")
+    assert motor.rule_cache_info()["misses"] == 3
+
+
+def test_cache_de_regras_e_limitado_lru():
+    motor = _motor(rule_cache_size=2)
+    motor.calcula_st(_item(ncm="09030091"), "SP", "AM")
+    motor.calcula_st(_item(ncm="39269090"), "SP", "AM")
+    motor.calcula_st(_item(ncm="09030091"), "SP", "AM")   # hit, vira o mais recente
+    motor.calcula_st(_item(ncm="39260000"), "SP", "AM")   # expulsa 39269090
+    motor.calcula_st(_item(ncm="09030091"), "SP", "AM")   # continua em cache
+
+    info = motor.rule_cache_info()
+    assert info["size"] == 2
+    assert info["hits"] == 2
+    assert info["misses"] == 3
+
+
+def test_cache_desligado_e_motor_novo_comecam_zerados():
+    motor = _motor(rule_cache_size=0)
+    motor.calcula_st(_item(), "SP", "AM")
+    motor.calcula_st(_item(), "SP", "AM")
+    assert motor.rule_cache_info() == {"hits": 0, "misses": 2, "size": 0, "maxsize": 0}
+
+    novo = _motor()
+    assert novo.rule_cache_info()["hits"] == 0 and novo.rule_cache_info()["size"] == 0
+
+
+def test_contadores_exatos_com_threads():
+    from concurrent.futures import ThreadPoolExecutor
+
+    for tamanho in (0, 8):
+        motor = _motor(rule_cache_size=tamanho)
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            list(pool.map(lambda _: motor._resolver_regra("09030091", "AM"), range(2000)))
+        info = motor.rule_cache_info()
+        assert info["hits"] + info["misses"] == 2000
+
+
+def test_only_digits_cache_distingue_tipos():
+    assert MotorCalculo._only_digits(1002000.0) == "1002000"
+    assert MotorCalculo._only_digits("1002000.0") == "1002000"
+    assert MotorCalculo._only_digits(True) == ""
+    assert MotorCalculo._only_digits(1) == "1"
+
+
+def test_indice_compilado_preserva_especificidade_e_desempate():
+    t1 = pd.DataFrame([
+        {"NCM": "3926", "CEST": "", "UF": "AM", "MVA %": "30"},
+        {"NCM": "39269090", "CEST": "2800100", "UF": "AM", "MVA %": "60"},
+        {"NCM": "392690", "CEST": "", "UF": "SP", "MVA %": "99"},   # outra UF
+        {"NCM": "392690", "CEST": "", "UF": "*", "MVA %": "40"},
+    ])
+    t2 = pd.DataFrame([{"NCM": "392690", "UF": "AM", "MVA %": "45"}])  # sem CEST: score menor
+    t3 = pd.DataFrame([{"NCM": "392690", "CEST": "", "UF": "AM", "MVA %": "41"}])  # empate: perde
+    motor = MotorCalculo({"t1": t1, "t2": t2, "t3": t3}, rule_cache_size=0)
+
+    r = motor._lookup_ncm_rules("39269090", "AM", "")
+    assert (r["fonte"], r["ncm_match"], float(r["mva"])) == ("t1", "392690", 0.40)
+    r = motor._lookup_ncm_rules("3926.90.90", "AM", "28.001.00")
+    assert float(r["mva"]) == 0.60
+    assert float(motor._lookup_ncm_rules("39261000", "AM")["mva"]) == 0.30
+    assert motor._lookup_ncm_rules("40000000", "AM") == {}
+
+
+def test_motor_compilado_sobrevive_ao_pickle():
+    import pickle
+
+    motor = _motor().compilar()
+    motor.calcula_st(_item(), "SP", "AM")
+    copia = pickle.loads(pickle.dumps(motor))
+
+    assert copia._indice == motor._indice
+    assert copia.rule_cache_info() == {"hits": 0, "misses": 0, "size": 0, "maxsize": 4096}
+    r = copia.calcula_st(_item(), "SP", "AM")
+    assert r.memoria["MARGEM_DE_VALOR_AGREGADO_MVA"] == 50.0
@@ -0,0 +1,81 @@
+import datetime as dt
+import json
+
+import pytest
+from sqlalchemy import inspect
+
+from oraculoicms_app.extensions import db
+from oraculoicms_app.models.file import UserFile, NFESummary
+from oraculoicms_app.services import calc_store
+from oraculoicms_app.services.payload_service import ALG_VERSION
+
+
+def _payload(n=3):
+    linhas = [{
+        "idx": str(i + 1), "cProd": f"P{i}", "xProd": "Produto ç", "ncm": "09030091", "cest": "",
+        "qCom": 1.0 + i, "base_st": 139.5 * (i + 1), "icms_st": 27.9, "nf_icms_st": 20.0 + i,
+        "mva_tipo": "MVA Padrão", "divergente": bool(i % 2),
+    } for i in range(n)]
+    return {"v": ALG_VERSION, "uf_origem": "SP", "uf_destino": "AM",
+            "total_st": 27.9 * n, "total_nf_st": sum(l["nf_icms_st"] for l in linhas), "linhas": linhas}
+
+
+def test_encode_decode_ida_e_volta():
+    p = _payload()
+    blob = calc_store.encode_payload(p)
+    assert calc_store.decode_payload(blob) == p
+    assert len(blob) < len(json.dumps(p))
+
+
+def test_encode_payload_vazio():
+    p = {"v": ALG_VERSION, "uf_origem": "SP", "uf_destino": "AM", "total_st": 0.0, "total_nf_st": 0.0, "linhas": []}
+    assert calc_store.decode_payload(calc_store.encode_payload(p)) == p
+
+
+@pytest.fixture
+def summary(db_session, user_normal, tmp_path):
+    xml = tmp_path / "n.xml"
+    xml.write_bytes(b"<NFe/>")
+    uf = UserFile(user_id=user_normal.id, filename="n.xml", storage_path=str(xml), size_bytes=6, md5="x" * 32)
+    db_session.add(uf); db_session.commit()
+    s = NFESummary(user_file_id=uf.id, chave="C1", processed_at=dt.datetime.utcnow())
+    db_session.add(s); db_session.commit()
+    yield s
+    db_session.rollback()
+    NFESummary.query.filter_by(user_file_id=uf.id).delete()
+    UserFile.query.filter_by(id=uf.id).delete()
+    db_session.commit()
+
+
+def test_store_e_load_no_summary(db_session, summary):
+    s = summary
+    assert calc_store.has_calc(s) is False
+    assert calc_store.load_payload(s) is None
+
+    p = _payload()
+    calc_store.store_payload(s, p)
+    db_session.commit()
+    assert s.calc_itens == 3
+    assert float(s.calc_total_st) == pytest.approx(83.7)
+    assert s.calc_json is None
+
+    sid = s.id
+    db_session.expire_all()
+    s = db_session.get(NFESummary, sid)
+    state = inspect(s)
+    assert "calc_blob" in state.unloaded and "calc_json" in state.unloaded  # deferred
+    assert calc_store.has_calc(s)
+    assert "calc_blob" in state.unloaded                                     # has_calc não carrega
+
+    payload = calc_store.load_payload(s)
+    assert type(payload) is dict
+    assert payload == p
+    assert json.loads(json.dumps(payload)) == p
+
+
+def test_load_payload_aceita_calc_json_legado(db_session, summary):
+    s = summary
+    s.calc_json = json.dumps(_payload(1))
+    s.calc_version = "st-v2"
+    db_session.commit()
+    assert calc_store.load_payload(s)["linhas"][0]["idx"] == "1"
@@ -191,6 +191,25 @@ def test_upload_xml_sucesso(logged_user_client, attach_plan_to_user, ensure_quot
     assert q and q.files_count >= 1 and q.storage_bytes >= len(make_minimal_valid_nfe_xml())
 
 
+def test_upload_xml_grava_arquivo_quota_e_auditoria_num_commit(logged_user_client, ensure_quota, temp_upload_folder):
+    from sqlalchemy import event
+    from sqlalchemy.orm import Session
+
+    commits = []
+    contar = lambda sess: commits.append(1)
+    event.listen(Session, "after_commit", contar)
+    try:
+        r = logged_user_client.post("/upload-xml", data={"xml": (io.BytesIO(make_minimal_valid_nfe_xml()), "um.xml")},
+                                    content_type="multipart/form-data")
+    finally:
+        event.remove(Session, "after_commit", contar)
+    assert r.status_code == 302
+    uf = UserFile.query.order_by(UserFile.id.desc()).first()
+    log = AuditLog.query.filter_by(ref=f"user_file:{uf.id}", action="upload").one()
+    assert log.user_id == uf.user_id
+    assert len(commits) == 1
+
+
 def test_upload_xml_formato_invalido(logged_user_client, temp_upload_folder):
     file_data = {
         "xml": (io.BytesIO(b"not an xml"), "arquivo.txt")
@@ -229,7 +248,7 @@ def test_parse_xml_cria_summary_e_calculo(logged_user_client, temp_upload_folder
     monkeypatch.setattr(files_mod, "get_motor", fake_get_motor_factory())
 
     # Implementa o upsert: cria ou devolve summary ligado ao UF
-    def _fake_upsert(db_, NFEXML_, NFESummary_, UserFile_, uid, xml_bytes, user_file_id):
+    def _fake_upsert(db_, NFEXML_, NFESummary_, UserFile_, uid, xml_bytes, user_file_id, **kw):
         s = NFESummary.query.filter_by(user_file_id=user_file_id).first()
         created = False
         if not s:
@@ -263,7 +282,7 @@ def test_parse_xml_ajax_retorna_json(logged_user_client, temp_upload_folder, ens
     monkeypatch.setattr(files_mod, "NFEXML", FakeNFEXML)
     monkeypatch.setattr(files_mod, "get_motor", fake_get_motor_factory())
 
-    def _fake_upsert(db_, NFEXML_, NFESummary_, UserFile_, uid, xml_bytes, user_file_id):
+    def _fake_upsert(db_, NFEXML_, NFESummary_, UserFile_, uid, xml_bytes, user_file_id, **kw):
         s = NFESummary.query.filter_by(user_file_id=user_file_id).first()
         if not s:
             s = NFESummary(user_file_id=user_file_id, chave="Y1", validation_status="pending", include_in_totals=True)
@@ -388,3 +407,138 @@ def test_selecionar_totais_aplica_marcacao(logged_user_client, temp_upload_folde
     s2_r = NFESummary.query.get(s2.id)
     #assert s1_r.include_in_totals is False
    # assert s2_r.include_in_totals is True
+
+
+def test_relatorio_nfe_pdf_consolidado(logged_user_client, temp_upload_folder):
+    from oraculoicms_app.services.calc_store import store_payload
+
+    with logged_user_client.session_transaction() as sess:
+        user_id = sess["user"]["id"]
+    uf1 = _cria_userfile_para_usuario(user_id, temp_upload_folder)
+    uf2 = UserFile(user_id=user_id, filename="b.xml", storage_path=uf1.storage_path, size_bytes=1, md5="abd")
+    db.session.add(uf2); db.session.commit()
+    agora = dt.datetime.utcnow()
+    linhas = [{"idx": str(i), "ncm": "09030091", "cfop": "6102", "cst": "060", "vProd": 100.0,
+               "mva_tipo": "MVA Padrão", "mva_percent": 50.0, "base_st": 139.5, "icms_st": 27.9,
+               "nf_icms_st": 0.0} for i in range(1, 41)]
+    s1 = NFESummary(user_file_id=uf1.id, chave="PDF1", emissao=agora, numero="1", serie="1")
+    s2 = NFESummary(user_file_id=uf2.id, chave="PDF2", emissao=agora)   # sem cálculo: fica de fora
+    store_payload(s1, {"uf_origem": "SP", "uf_destino": "AM", "total_st": 27.9 * 40,
+                       "total_nf_st": 0.0, "linhas": linhas})
+    db.session.add_all([s1, s2]); db.session.commit()
+
+    try:
+        r = logged_user_client.get("/relatorios/nfe/pdf")
+        assert r.status_code == 200
+        assert r.mimetype == "application/pdf"
+        pdf = r.get_data()
+        assert pdf.startswith(b"%PDF") and pdf.count(b"/Type /Page\n") >= 2
+
+        r = logged_user_client.post("/relatorios/nfe/pdf", data={"selected[]": [str(s2.id)]})
+        assert r.status_code == 302  # nenhuma nota calculada na seleção
+    finally:
+        db.session.rollback()
+        NFESummary.query.filter(NFESummary.id.in_([s1.id, s2.id])).delete(synchronize_session=False)
+        UserFile.query.filter(UserFile.id.in_([uf1.id, uf2.id])).delete(synchronize_session=False)
+        db.session.commit()
+
+
+def test_gerar_pdf_consolidado_consome_notas_sob_demanda(tmp_path):
+    import report
+
+    lidas = []
+
+    def notas():
+        for n in range(3):
+            lidas.append(n)
+            yield {"titulo": f"NF {n}", "uf_origem": "SP", "uf_destino": "AM",
+                   "linhas": [{"ncm": "1", "icms_st": 1.0}] * 30}
+
+    partes = report._partes(notas(), 1)
+    assert next(partes)[0][0]["titulo"] == "NF 0"
+    assert lidas == [0, 1]  # só a parte seguinte foi lida (fechamento vai na última)
+
+    destino = tmp_path / "c.pdf"
+    report.gerar_pdf_consolidado(notas(), str(destino))
+    assert destino.read_bytes().startswith(b"%PDF")
+    assert report._styles() is report._styles()
+
+
+def test_meus_arquivos_keyset_com_resumo_no_mesmo_select(logged_user_client, app, monkeypatch):
+    import re
+    from sqlalchemy import event
+
+    with logged_user_client.session_transaction() as sess:
+        user_id = sess["user"]["id"]
+    base = dt.datetime(2024, 5, 1, 12, 0)
+    ufs = [UserFile(user_id=user_id, filename=f"k{i}.xml", display_name=f"KEYSET-{i}", storage_path="/tmp/x",
+                    size_bytes=1, uploaded_at=base - dt.timedelta(minutes=i // 2))  # pares com o mesmo instante
+           for i in range(5)]
+    db.session.add_all(ufs); db.session.commit()
+    db.session.add_all([NFESummary(user_file_id=uf.id, chave=f"KS{uf.id}", calc_version="x") for uf in ufs])
+    db.session.commit()
+    monkeypatch.setitem(app.config, "FILES_PAGE_SIZE", 2)
+
+    selects = []
+    def _conta(conn, cursor, statement, *a):
+        if statement.lstrip().upper().startswith("SELECT") and "user_files" in statement:
+            selects.append(statement)
+    event.listen(db.engine, "before_cursor_execute", _conta)
+    try:
+        vistos, url = [], "/meus-arquivos"
+        while url:
+            selects.clear()
+            r = logged_user_client.get(url)
+            assert r.status_code == 200
+            html = r.get_data(as_text=True)
+            vistos += [int(i) for i in dict.fromkeys(re.findall(r"KEYSET-(\d)", html))]
+            assert sum("nfe_summaries" in s for s in selects) == 1  # sem lazy load por linha
+            assert "calc_blob" not in " ".join(selects)
+            m = [l for l in html.splitlines() if "apos=" in l]
+            url = m[0].split('href="', 1)[1].split('"', 1)[0].replace("&amp;", "&") if m else None
+        assert vistos == [1, 0, 3, 2, 4]  # uploaded_at desc; empate -> id desc
+    finally:
+        event.remove(db.engine, "before_cursor_execute", _conta)
+        ids = [uf.id for uf in ufs]
+        NFESummary.query.filter(NFESummary.user_file_id.in_(ids)).delete(synchronize_session=False)
+        UserFile.query.filter(UserFile.id.in_(ids)).delete(synchronize_session=False)
+        db.session.commit()
+
+
+@pytest.mark.skipif(not os.getenv("BENCH"), reason="benchmark: rode com BENCH=1")
+def test_bench_meus_arquivos_muitos_arquivos(app, db_session, user_normal):
+    import time
+
+    n = 30000
+    base = dt.datetime(2020, 1, 1)
+    db_session.execute(UserFile.__table__.insert(), [
+        {"user_id": user_normal.id, "filename": f"b{i}.xml", "storage_path": "/tmp/x", "size_bytes": 1,
+         "uploaded_at": base + dt.timedelta(seconds=i)} for i in range(n)
+    ])
+    db_session.commit()
+    try:
+        cursor, paginas, t0 = None, 0, time.perf_counter()
+        for _ in range(20):
+            files, proxima = files_mod.pagina_arquivos(user_normal.id, files_mod._cursor_arquivos(cursor))
+            paginas += 1
+            cursor = proxima
+        ms = (time.perf_counter() - t0) * 1000 / paginas
+        print(f"\n/meus-arquivos com {n} arquivos: {ms:.1f} ms por página")
+        assert ms < 100
+    finally:
+        UserFile.query.filter_by(user_id=user_normal.id).delete()
+        db_session.commit()
+
+
+def test_current_user_resolvido_uma_vez_por_requisicao(app, user_normal, user_admin, monkeypatch):
+    chamadas = []
+    get_original = db.session.get
+    monkeypatch.setattr(db.session, "get", lambda *a, **k: chamadas.append(a) or get_original(*a, **k))
+    with app.test_request_context("/"):
+        session["user"] = {"id": user_normal.id, "email": user_normal.email}
+        assert files_mod.current_user().id == user_normal.id
+        assert files_mod.current_user() is files_mod.current_user()
+        assert len(chamadas) == 1
+        # troca de usuário na sessão não reaproveita o cache
+        session["user"] = {"id": user_admin.id, "email": user_admin.email}
+        assert files_mod.current_user().id == user_admin.id
@@ -0,0 +1,68 @@
+# tests/test_migrations.py
+# -*- coding: utf-8 -*-
+import os
+import subprocess
+import sys
+
+import pytest
+from sqlalchemy import create_engine, inspect
+
+pytest.importorskip("flask_migrate")
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _flask(db_path, *args):
+    env = dict(os.environ, FLASK_APP="oraculoicms_app.wsgi", APP_ENV="testing",
+               DISABLE_SHEETS="1", DISABLE_SCHEDULER="1",
+               SQLALCHEMY_DATABASE_URI=f"sqlite:///{db_path}", DATABASE_URL=f"sqlite:///{db_path}")
+    res = subprocess.run([sys.executable, "-m", "flask", *args], cwd=RAIZ, env=env,
+                         capture_output=True, text=True, timeout=120)
+    assert res.returncode == 0, res.stderr[-2000:]
+
+
+def _diferencas(db_path):
+    from alembic.autogenerate import compare_metadata
+    from alembic.migration import MigrationContext
+    from oraculoicms_app.extensions import db
+    import oraculoicms_app.models  # noqa: F401
+
+    engine = create_engine(f"sqlite:///{db_path}")
+    try:
+        with engine.connect() as conn:
+            difs = compare_metadata(MigrationContext.configure(conn, opts={"compare_type": True}), db.metadata)
+    finally:
+        engine.dispose()
+    # fora do metadata: tabelas do FTS5 e os índices de prefixo (só Postgres)
+    return [d for d in difs if not (
+        (d[0] == "remove_table" and d[1].name.startswith(("nfe_items_fts", "alembic_version")))
+        or (d[0] == "add_index" and d[1].name.endswith("_prefixo"))
+    )]
+
+
+def test_upgrade_em_banco_novo_reproduz_os_modelos(tmp_path):
+    db_path = tmp_path / "novo.sqlite"
+    _flask(db_path, "db", "upgrade")
+
+    assert _diferencas(db_path) == []
+    engine = create_engine(f"sqlite:///{db_path}")
+    try:
+        nomes = inspect(engine).get_table_names()
+    finally:
+        engine.dispose()
+    assert "nfe_items_fts" in nomes  # DDL de texto vem da migração, não do after_create
+
+    _flask(db_path, "db", "downgrade", "base")
+    engine = create_engine(f"sqlite:///{db_path}")
+    try:
+        assert inspect(engine).get_table_names() == ["alembic_version"]
+    finally:
+        engine.dispose()
+
+
+def test_upgrade_em_banco_do_init_db(tmp_path):
+    db_path = tmp_path / "init_db.sqlite"
+    _flask(db_path, "init-db")
+    _flask(db_path, "db", "upgrade")  # nada a criar: só o que falta
+
+    assert _diferencas(db_path) == []
@@ -0,0 +1,121 @@
+from decimal import Decimal
+from types import SimpleNamespace
+
+import pandas as pd
+import pytest
+
+from calc import MotorCalculo
+from oraculoicms_app.services import payload_service as ps
+
+
+def _item(n, ncm="09030091"):
+    return SimpleNamespace(
+        nItem=str(n), cProd=f"P{n}", xProd="ITEM", ncm=ncm, cst="060", cfop="6102", cest="1234567",
+        qCom=Decimal("2"), vUnCom=Decimal("50"), vProd=Decimal("100"), vFrete=Decimal("0"),
+        vIPI=Decimal("0"), vOutro=Decimal("0"), vICMSDeson=Decimal("0"),
+        pMVAST=Decimal("50"), vBCST=Decimal("139.50"), vICMSST=Decimal("27.90"), pICMSST=Decimal("20"),
+    )
+
+
+class _NFE:
+    def __init__(self, itens):
+        self._itens = itens
+
+    def header(self):
+        return {"uf_origem": "sp", "uf_destino": "am"}
+
+    def itens(self):
+        return self._itens
+
+
+def _motor():
+    df = pd.DataFrame([{"NCM": "0903.00.91", "CEST": "", "UF": "AM", "MVA %": "50", "APLICA_ST": "1"}])
+    return MotorCalculo({"planilha": df})
+
+
+class _SoMemoria:
+    """Motor de terceiros: só expõe calcula_st com .memoria/.icms_st_devido."""
+
+    def __init__(self, motor):
+        self.motor = motor
+
+    def calcula_st(self, it, uf_origem, uf_destino, usar_multiplicador=True):
+        r = self.motor.calcula_st(it, uf_origem, uf_destino, usar_multiplicador)
+        return SimpleNamespace(icms_st_devido=r.icms_st_devido, memoria=r.memoria)
+
+
+def test_payload_compacto_e_versionado():
+    payload = ps.montar_payload(_NFE([_item(1), _item(2, ncm="11111111")]), _motor())
+    assert payload["v"] == ps.ALG_VERSION
+    assert (payload["uf_origem"], payload["uf_destino"]) == ("SP", "AM")
+    assert [l["idx"] for l in payload["linhas"]] == ["1", "2"]
+
+    linha = payload["linhas"][0]
+    for alias in ps._ALIASES:
+        assert alias not in linha
+    assert linha["base_st"] == pytest.approx(139.5)
+    assert linha["mva_percent"] == pytest.approx(50.0)
+    assert linha["divergente"] is False
+    assert payload["linhas"][1]["divergente"] is True   # sem ST calculado, NF destacou
+    assert payload["total_nf_st"] == pytest.approx(55.80)
+
+
+def test_payload_igual_via_resultado_compacto_ou_memoria():
+    itens = [_item(1), _item(2, ncm="11111111")]
+    a = ps.montar_payload(_NFE(itens), _motor())
+    b = ps.montar_payload(_NFE(itens), _SoMemoria(_motor()))
+    assert a == b
+
+
+def test_linhas_para_template_gera_aliases_e_aceita_legado():
+    payload = ps.montar_payload(_NFE([_item(1)]), _motor())
+    ctx = ps.contexto_resultado(payload)
+    l = ctx["linhas"][0]
+    assert l["valor_icms_st"] == l["icms_st"]
+    assert l["mva_percentual"] == l["mva_percent"]
+    assert l["multiplicador"] == l["mult_sefaz"]
+    assert l["valor_operacao"] == l["venda_desc_icms"]
+    assert "valor_icms_st" not in payload["linhas"][0]   # payload original intacto
+
+    legado = {"uf_origem": "SP", "uf_destino": "AM", "total_st": 1.0,
+              "linhas": [{"idx": 1, "icms_st": 1.0, "valor_icms_st": 1.0, "base_st": 2.0}]}
+    ctx = ps.contexto_resultado(legado)
+    assert ctx["total_nf_st"] == 0.0
+    assert ctx["linhas"][0]["nf_icms_st"] == 0.0
+    assert ctx["linhas"][0]["divergente"] is False
+
+
+def _nfe_grande(n):
+    dets = "".join(f"""
+      <det nItem="{i}"><prod>
+        <cProd>{i:05d}</cProd><xProd>Item {i}</xProd><NCM>{"09030091" if i % 3 else "39269090"}</NCM>
+        <CEST>{"1234567" if i % 5 == 0 else ""}</CEST><CFOP>6102</CFOP>
+        <qCom>{1 + i % 7}.0000</qCom><vUnCom>{10 + (i * 37) % 1000}.{i % 100:02d}</vUnCom>
+      </prod><imposto>
+        <ICMS><ICMS10><CST>10</CST><pMVAST>50.00</pMVAST><vBCST>1.00</vBCST><vICMSST>0.20</vICMSST></ICMS10></ICMS>
+      </imposto></det>""" for i in range(1, n + 1))
+    return f"""<?xml version="1.0" encoding="UTF-8"?>
+<NFe xmlns="http://www.portalfiscal.inf.br/nfe"><infNFe Id="NFeGrande">
+  <ide><nNF>9</nNF><serie>1</serie></ide>
+  <emit><enderEmit><UF>SP</UF></enderEmit></emit><dest><enderDest><UF>AM</UF></enderDest></dest>
+  {dets}
+  <total><ICMSTot><vFrete>1234.57</vFrete><vOutro>99.99</vOutro></ICMSTot></total>
+</infNFe></NFe>""".encode("utf-8")
+
+
+def test_payload_paralelo_identico_ao_sequencial():
+    from xml_parser import NFEXML
+
+    xml = _nfe_grande(301)
+    sequencial = ps.build_st_payload(xml, NFEXML, _motor(), min_itens=0)
+    paralelo = ps.build_st_payload(xml, NFEXML, _motor(), min_itens=100, workers=3)
+    assert len(paralelo["linhas"]) == 301
+    assert [l["idx"] for l in paralelo["linhas"]] == [str(i) for i in range(1, 302)]
+    assert paralelo == sequencial
+
+    motor = _motor()
+    assert ps.montar_payload_paralelo(NFEXML(xml), motor, workers=2, fatia=7) == sequencial
+    pool = ps._POOL
+    assert ps.montar_payload_paralelo(NFEXML(xml), motor, workers=2) == sequencial
+    assert ps._POOL is pool  # mesmo motor: pool reaproveitado
+    ps.encerrar_pool()
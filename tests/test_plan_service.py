@@ -0,0 +1,40 @@
+from sqlalchemy import event
+
+from oraculoicms_app.extensions import db
+from oraculoicms_app.services import plan_service as ps
+
+
+def test_plano_em_cache_e_invalidado_ao_gravar(db_session, plan_basic):
+    ps.invalidar_planos()
+    p = ps.plano(plan_basic.slug)
+    assert p.max_files == plan_basic.max_files and p.slug == plan_basic.slug
+
+    consultas = []
+    ouvir = lambda *a, **k: consultas.append(a[2])
+    event.listen(db.engine, "before_cursor_execute", ouvir)
+    try:
+        assert ps.plano(plan_basic.slug) is p and ps.plano("nao-existe") is None
+    finally:
+        event.remove(db.engine, "before_cursor_execute", ouvir)
+    assert consultas == []  # sem ir ao banco
+
+    anterior = plan_basic.max_files
+    plan_basic.max_files = (anterior or 0) + 7
+    db_session.commit()
+    try:
+        assert ps.plano(plan_basic.slug).max_files == (anterior or 0) + 7
+    finally:
+        plan_basic.max_files = anterior
+        db_session.commit()
+
+
+def test_plano_inativo_ou_inexistente(db_session, plan_basic):
+    assert ps.plano(None) is None and ps.plano("nao-existe") is None
+    plan_basic.active = False
+    db_session.commit()
+    try:
+        assert ps.plano(plan_basic.slug, ativo=True) is None
+        assert ps.plano(plan_basic.slug) is not None
+    finally:
+        plan_basic.active = True
+        db_session.commit()
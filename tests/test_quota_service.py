@@ -0,0 +1,81 @@
+import datetime as dt
+from types import SimpleNamespace
+
+import pytest
+
+from oraculoicms_app.extensions import db
+from oraculoicms_app.models.file import UserFile
+from oraculoicms_app.models.user_quota import UserQuota
+from oraculoicms_app.services import quota_service as qs
+
+
+def _plano(arquivos=0, mb=0, mes=0):
+    return SimpleNamespace(max_files=arquivos, max_storage_mb=mb, max_uploads_month=mes)
+
+
+def _cota(user_id):
+    return UserQuota.query.filter_by(user_id=user_id).populate_existing().first()
+
+
+@pytest.fixture
+def limpar_cota(db_session, user_normal):
+    yield user_normal
+    db_session.rollback()
+    UserFile.query.filter_by(user_id=user_normal.id).delete()
+    UserQuota.query.filter_by(user_id=user_normal.id).delete()
+    db_session.commit()
+
+
+def test_reserva_cria_cota_e_respeita_limites(limpar_cota):
+    uid = limpar_cota.id
+    plano = _plano(arquivos=2, mb=1)
+    assert qs.reservar_upload(uid, 1000, plano) == (True, "")  # primeiro upload cria a linha
+    assert qs.reservar_upload(uid, 1000, plano) == (True, "")
+    ok, msg = qs.reservar_upload(uid, 1000, plano)
+    assert not ok and msg == "Limite de arquivos simultâneos excedido (2/2)."
+    db.session.commit()
+    q = _cota(uid)
+    assert (q.files_count, q.storage_bytes, q.month_uploads) == (2, 2000, 2)
+
+    ok, msg = qs.reservar_upload(uid, 2 * 1024 * 1024, _plano(mb=1))
+    assert not ok and msg.startswith("Limite de armazenamento do plano excedido")
+
+
+def test_reserva_vira_o_mes_e_aplica_limite_mensal(limpar_cota):
+    uid = limpar_cota.id
+    db.session.add(UserQuota(user_id=uid, files_count=0, storage_bytes=0, month_uploads=5, month_ref="1900-01"))
+    db.session.commit()
+    plano = _plano(mes=1)
+    assert qs.reservar_upload(uid, 10, plano) == (True, "")  # mês novo: contador zerado antes de somar
+    assert qs.reservar_upload(uid, 10, plano) == (False, "Limite mensal de uploads excedido (1/1).")
+    db.session.commit()
+    q = _cota(uid)
+    assert (q.month_ref, q.month_uploads) == (qs.mes_atual(), 1)
+
+
+def test_liberar_nao_fica_negativo(limpar_cota):
+    uid = limpar_cota.id
+    qs.reservar_upload(uid, 100)
+    qs.liberar(uid, 500)
+    qs.liberar(uid, 500)
+    db.session.commit()
+    q = _cota(uid)
+    assert (q.files_count, q.storage_bytes) == (0, 0)
+
+
+def test_reconciliar_recalcula_a_partir_dos_arquivos(limpar_cota):
+    uid = limpar_cota.id
+    db.session.add(UserQuota(user_id=uid, files_count=9, storage_bytes=99, month_uploads=3, month_ref="1900-01"))
+    db.session.add_all([
+        UserFile(user_id=uid, filename="a.xml", storage_path="/tmp/a", size_bytes=100),
+        UserFile(user_id=uid, filename="b.xml", storage_path="/tmp/b", size_bytes=50),
+        UserFile(user_id=uid, filename="c.xml", storage_path="/tmp/c", size_bytes=70,
+                 deleted_at=dt.datetime.utcnow()),
+    ])
+    db.session.commit()
+
+    r = qs.reconciliar_cotas()
+    assert r["corrigidas"] >= 1 and r["meses_virados"] >= 1
+    q = _cota(uid)
+    assert (q.files_count, q.storage_bytes, q.month_uploads, q.month_ref) == (2, 150, 0, qs.mes_atual())
+    assert qs.reconciliar_cotas()["corrigidas"] == 0
@@ -0,0 +1,66 @@
+import datetime as dt
+
+import pytest
+
+from oraculoicms_app.models.file import NFESummary, UserFile
+from oraculoicms_app.services import recalc_service
+from oraculoicms_app.services.calc_service import get_motor
+from tests.test_files_extra import make_minimal_nfe_xml
+
+
+@pytest.fixture
+def acervo(db_session, user_normal, tmp_path):
+    antigo = dt.datetime(2020, 1, 1)
+    arquivos, summaries = [], []
+    for i in range(5):
+        xml = tmp_path / f"n{i}.xml"
+        if i != 4:  # o último XML "sumiu" do disco
+            xml.write_bytes(make_minimal_nfe_xml(chave=f"NFeAcervo{i}"))
+        arquivos.append(UserFile(user_id=user_normal.id, filename=xml.name, storage_path=str(xml),
+                                 size_bytes=1, md5=f"{i}" * 32))
+    db_session.add_all(arquivos); db_session.commit()
+    for i, uf in enumerate(arquivos):
+        summaries.append(NFESummary(user_file_id=uf.id, chave=f"NFeAcervo{i}", emissao=dt.datetime(2024, 1 + i, 1),
+                                    calc_version="st-v3" if i == 0 else "st-v2", calc_at=antigo))
+    db_session.add_all(summaries); db_session.commit()
+    yield [s.id for s in summaries]
+    db_session.rollback()
+    NFESummary.query.filter(NFESummary.user_file_id.in_([a.id for a in arquivos])).delete(synchronize_session=False)
+    UserFile.query.filter(UserFile.id.in_([a.id for a in arquivos])).delete(synchronize_session=False)
+    db_session.commit()
+
+
+def _calculados(db_session, ids):
+    db_session.expire_all()
+    return {s.id: s for s in NFESummary.query.filter(NFESummary.id.in_(ids))}
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_recalcular_acervo_em_lotes(app, db_session, acervo, workers):
+    progresso = []
+    with app.app_context():
+        # restringe às notas do fixture (o banco de testes é compartilhado)
+        cond = recalc_service.filtro_acervo(apenas_desatualizadas=True) + [NFESummary.id.in_(acervo)]
+        st = recalc_service.recalcular_acervo(get_motor(), cond, workers=workers, lote=2,
+                                              progresso=progresso.append)
+
+    assert (st["total"], st["processadas"], st["recalculadas"], st["falhas"]) == (4, 4, 3, 1)
+    assert [p["processadas"] for p in progresso] == [2, 4]
+    s = _calculados(db_session, acervo)
+    assert [s[i].calc_version for i in acervo] == ["st-v3"] * 4 + ["st-v2"]
+    assert s[acervo[0]].calc_at == dt.datetime(2020, 1, 1)  # já estava na versão atual
+    assert all(s[i].calc_itens == 1 and s[i].calc_blob for i in acervo[1:4])
+
+
+def test_cli_recalcular_notas_filtra_usuario_e_periodo(app, db_session, acervo, user_normal):
+    res = app.test_cli_runner().invoke(args=[
+        "recalcular-notas", "--usuario", user_normal.email, "--desde", "2024-02-01", "--ate", "2024-04-01",
+        "--workers", "1",
+    ])
+    assert res.exit_code == 0, res.output
+    assert "2/2 notas" in res.output and "Concluído: 2 recalculadas, 0 falhas" in res.output
+    s = _calculados(db_session, acervo)
+    assert [s[i].calc_version for i in acervo] == ["st-v3", "st-v3", "st-v3", "st-v2", "st-v2"]
+
+    res = app.test_cli_runner().invoke(args=["recalcular-notas", "--usuario", "ninguem@example.com"])
+    assert res.exit_code != 0 and "usuário não encontrado" in res.output
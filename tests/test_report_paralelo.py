@@ -0,0 +1,97 @@
+import io
+import os
+import re
+import time
+import tracemalloc
+
+import pytest
+
+import report
+
+pypdf = pytest.importorskip("pypdf")
+
+
+def _notas(n, itens=12):
+    for k in range(n):
+        yield {
+            "titulo": f"NF {k}",
+            "uf_origem": "SP",
+            "uf_destino": "AM",
+            "linhas": [{"ncm": "09030091", "cfop": "6102", "cst": "060", "vProd": 100.0 + i,
+                        "mva_tipo": "MVA Padrão", "mva_percent": 50.0, "base_st": 139.5,
+                        "icms_st": 27.9 + k + i / 100} for i in range(itens)],
+        }
+
+
+def _textos(pdf: bytes):
+    return [p.extract_text() for p in pypdf.PdfReader(io.BytesIO(pdf)).pages]
+
+
+def _gerar(**kw) -> bytes:
+    buff = io.BytesIO()
+    report.gerar_pdf_consolidado(_notas(7), buff, **kw)
+    return buff.getvalue()
+
+
+def _sem_data(texto: str):
+    # o rodapé da concatenação vem depois do conteúdo no fluxo de texto: compara as linhas
+    return sorted(re.sub(r"Gerado em \S+ \S+", "Gerado em", texto).splitlines())
+
+
+def test_partes_levam_fechamento_so_na_ultima():
+    partes = list(report._partes(_notas(6), 3))
+    assert [len(p) for p, _ in partes] == [3, 3]
+    assert partes[0][1] is None
+    n, total = partes[1][1]
+    assert n == 6 and total == pytest.approx(sum(report._total_nota(x) for x in _notas(6)))
+    assert list(report._partes(iter(()), 3)) == [([], (0, 0.0))]
+
+
+def test_paralelo_igual_ao_serial_com_numeracao_global():
+    serial = _textos(_gerar())
+    paralelo = _textos(_gerar(workers=2, notas_por_parte=2))
+
+    assert len(paralelo) == len(serial) > 7
+    assert [_sem_data(t) for t in paralelo] == [_sem_data(t) for t in serial]
+    for n, texto in enumerate(paralelo, start=1):
+        assert texto.count("Página") == 1 and f"Página {n}" in texto
+    assert "Total ICMS-ST (7 notas)" in paralelo[-1]
+
+
+def test_concatenacao_nao_acumula_paginas_em_memoria(tmp_path):
+    path, paginas = report._render_parte((list(_notas(4, itens=40)), None, str(tmp_path), None))
+
+    def pico(copias):
+        tracemalloc.start()
+        try:
+            report._concatenar([path] * copias, str(tmp_path / f"saida{copias}.pdf"), numerar=True)
+            return tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+
+    pico5, pico40 = pico(5), pico(40)
+    # 8x as páginas; só a xref (offsets) cresce com o total
+    assert pico40 < 2 * pico5
+
+    lido = pypdf.PdfReader(str(tmp_path / "saida40.pdf"))
+    assert len(lido.pages) == 40 * paginas
+    assert f"Página {40 * paginas}" in lido.pages[-1].extract_text()
+
+
+@pytest.mark.skipif(not os.getenv("BENCH"), reason="benchmark: rode com BENCH=1")
+def test_benchmark_pdf_paralelo_vs_serial(tmp_path):
+    workers = max(2, min(4, os.cpu_count() or 1))
+
+    t0 = time.perf_counter()
+    report.gerar_pdf_consolidado(_notas(200, itens=40), str(tmp_path / "serial.pdf"))
+    t_serial = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    report.gerar_pdf_consolidado(_notas(200, itens=40), str(tmp_path / "paralelo.pdf"),
+                                 workers=workers, notas_por_parte=10)
+    t_par = time.perf_counter() - t0
+
+    paginas = len(pypdf.PdfReader(str(tmp_path / "paralelo.pdf")).pages)
+    assert paginas == len(pypdf.PdfReader(str(tmp_path / "serial.pdf")).pages)
+    print(f"\nPDF consolidado 200 notas / {paginas} páginas: serial {t_serial:.2f}s | "
+          f"{workers} processos {t_par:.2f}s | {t_serial / t_par:.1f}x")
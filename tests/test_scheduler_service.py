@@ -0,0 +1,140 @@
+import datetime as dt
+import json
+
+import pytest
+
+from oraculoicms_app.models import Setting
+from oraculoicms_app.models.file import NFESummary, UserFile
+from oraculoicms_app.services import scheduler_service as ss
+from oraculoicms_app.services.sheets_service import bump_rules_stamp, rules_stamp
+from tests.test_files_extra import make_minimal_nfe_xml
+
+
+@pytest.fixture
+def jobs_ctx(app, db_session, monkeypatch, tmp_path):
+    monkeypatch.setitem(app.config, "SCHEDULER_LOCK_DIR", str(tmp_path / "locks"))
+    stamp_anterior = app.extensions.get("rules_stamp")
+    yield db_session
+    db_session.rollback()
+    Setting.query.filter(Setting.group.in_([ss.JOBS_GROUP, "regras"])).delete(synchronize_session=False)
+    db_session.commit()
+    app.extensions["rules_stamp"] = stamp_anterior
+
+
+def test_leader_lock_exclusivo_por_job(jobs_ctx):
+    with ss.leader_lock("x") as lider:
+        assert lider is True
+        with ss.leader_lock("x") as outro:
+            assert outro is False
+        with ss.leader_lock("y") as outro_job:
+            assert outro_job is True
+    with ss.leader_lock("x") as de_novo:
+        assert de_novo is True
+
+
+def test_executar_job_registra_metricas_e_respeita_lider(jobs_ctx):
+    assert ss.executar_job("teste", lambda: "feito") == "feito"
+    with ss.leader_lock("teste"):
+        assert ss.executar_job("teste", lambda: "não roda") is None
+
+    def _falha():
+        raise RuntimeError("boom")
+
+    ss.executar_job("teste_erro", _falha)
+    jobs = {j["nome"]: j for j in ss.ultimas_execucoes()}
+    assert jobs["teste"]["status"] == "OK" and jobs["teste"]["mensagem"] == "feito"
+    assert jobs["teste"]["duracao_ms"] >= 0 and jobs["teste"]["host"]
+    assert jobs["teste_erro"]["status"] == "ERRO" and "boom" in jobs["teste_erro"]["mensagem"]
+
+
+def test_executar_job_pula_se_outro_worker_rodou_no_intervalo(jobs_ctx):
+    rodou = []
+    job = lambda: rodou.append(1) or "feito"
+    hora = dt.timedelta(hours=1)
+    assert ss.executar_job("intervalo", job, intervalo=hora) == "feito"
+    assert ss.executar_job("intervalo", job, intervalo=hora) is None  # gatilho de outro worker
+    assert rodou == [1]
+
+    # última execução há mais de um intervalo (menos a folga do gatilho): roda de novo
+    ss.registrar_execucao("intervalo", "OK", dt.datetime.utcnow() - dt.timedelta(minutes=59, seconds=30), 1, "x")
+    assert ss.executar_job("intervalo", job, intervalo=hora) == "feito"
+    assert ss.executar_job("intervalo", job) == "feito"  # sem intervalo: só a trava
+    assert rodou == [1, 1, 1]
+
+
+def test_atualizar_regras_recalcula_so_quando_regras_mudaram(jobs_ctx, monkeypatch):
+    import updater
+
+    recalculos = []
+    monkeypatch.setattr(ss, "recalcular_notas", lambda: recalculos.append(1) or "recalculado")
+    monkeypatch.setattr(updater, "run_update_am",
+                        lambda: {"status": "OK", "mensagem": "Atualizado (0 linhas)", "alterado": False})
+    assert ss.atualizar_regras() == "Atualizado (0 linhas)" and recalculos == []
+    monkeypatch.setattr(updater, "run_update_am", lambda: {"status": "OK", "mensagem": "x", "alterado": True})
+    assert ss.atualizar_regras() == "x; recalculado" and recalculos == [1]
+
+
+def test_recarregar_regras_so_quando_carimbo_muda(jobs_ctx, monkeypatch):
+    chamadas = []
+    monkeypatch.setattr(ss, "reload_matrices", lambda: chamadas.append("reload") or ss.current_app.extensions.__setitem__("rules_stamp", rules_stamp()))
+    monkeypatch.setattr(ss, "rebuild_motor", lambda: chamadas.append("motor"))
+
+    bump_rules_stamp("v1")
+    assert ss.recarregar_regras() == "Regras recarregadas"
+    assert ss.recarregar_regras() is None
+    assert chamadas == ["reload", "motor"]
+
+
+def test_recalcular_notas_desatualizadas(jobs_ctx, user_normal, tmp_path):
+    db_session = jobs_ctx
+    xml = tmp_path / "n.xml"
+    xml.write_bytes(make_minimal_nfe_xml(chave="NFeRecalc"))
+    uf = UserFile(user_id=user_normal.id, filename="n.xml", storage_path=str(xml), size_bytes=1, md5="r" * 32)
+    sumido = UserFile(user_id=user_normal.id, filename="x.xml", storage_path=str(tmp_path / "x.xml"),
+                      size_bytes=1, md5="s" * 32)
+    db_session.add_all([uf, sumido]); db_session.commit()
+    antigo = dt.datetime(2020, 1, 1)
+    s1 = NFESummary(user_file_id=uf.id, chave="NFeRecalc", calc_version="st-v2", calc_at=antigo)
+    s2 = NFESummary(user_file_id=sumido.id, chave="NFeSumido", calc_version="st-v2", calc_at=antigo)
+    db_session.add_all([s1, s2]); db_session.commit()
+    try:
+        assert ss.recalcular_notas() == "Sem carimbo de regras"
+        bump_rules_stamp("v2")
+        assert ss.recalcular_notas() == "1 recalculadas, 1 falhas"
+        db_session.expire_all()
+        s1 = db_session.get(NFESummary, s1.id)
+        assert s1.calc_version == "st-v3" and s1.calc_itens == 1 and s1.calc_at > antigo
+        assert ss.recalcular_notas() == "0 recalculadas, 0 falhas"
+    finally:
+        db_session.rollback()
+        NFESummary.query.filter(NFESummary.user_file_id.in_([uf.id, sumido.id])).delete(synchronize_session=False)
+        UserFile.query.filter(UserFile.id.in_([uf.id, sumido.id])).delete(synchronize_session=False)
+        db_session.commit()
+
+
+def test_init_scheduler_registra_jobs(app, monkeypatch):
+    class _Fake:
+        running = False
+
+        def __init__(self):
+            self.jobs = {}
+
+        def add_job(self, fn, trigger, id, **kw):
+            self.jobs[id] = (trigger, kw)
+
+        def start(self):
+            self.running = True
+
+    fake = _Fake()
+    monkeypatch.setattr(ss, "scheduler", fake)
+    monkeypatch.setitem(app.config, "TESTING", True)
+    ss.init_scheduler(app)
+    assert fake.jobs == {}
+
+    monkeypatch.setitem(app.config, "TESTING", False)
+    monkeypatch.delenv("DISABLE_SCHEDULER", raising=False)
+    ss.init_scheduler(app)
+    assert set(fake.jobs) == {ss.JOB_ATUALIZAR, ss.JOB_RECALCULAR, ss.JOB_RECARREGAR, ss.JOB_COTAS,
+                              ss.JOB_AUDITORIA}
+    assert "day='1'" in str(fake.jobs[ss.JOB_ATUALIZAR][0]) and "hour='3'" in str(fake.jobs[ss.JOB_ATUALIZAR][0])
+    assert fake.running
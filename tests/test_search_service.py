@@ -0,0 +1,125 @@
+import datetime as dt
+
+import pytest
+
+from oraculoicms_app.extensions import db
+from oraculoicms_app.models.file import NFEItem, NFESummary, UserFile
+from oraculoicms_app.services.search_service import buscar_notas, indexar_itens, remover_itens
+
+
+class _NFE:
+    def __init__(self, *produtos):
+        self._produtos = [{"nItem": str(i), "cProd": c, "xProd": x, "NCM": n}
+                          for i, (c, x, n) in enumerate(produtos, start=1)]
+
+    def produtos(self):
+        return self._produtos
+
+
+@pytest.fixture
+def notas(db_session, user_normal, user_admin):
+    criados = []
+
+    def _nota(user, chave, numero, emit, dest, emissao, produtos):
+        uf = UserFile(user_id=user.id, filename=f"{chave}.xml", storage_path="/tmp/x")
+        db_session.add(uf); db_session.commit()
+        s = NFESummary(user_file_id=uf.id, chave=chave, numero=numero, emit_cnpj=emit, dest_cnpj=dest,
+                       emissao=emissao)
+        db_session.add(s); db_session.commit()
+        indexar_itens(s, user.id, _NFE(*produtos))
+        criados.append((uf, s))
+        return s
+
+    a = _nota(user_normal, "13240912345678000199550010000012341000012345", "1234",
+              "12345678000199", "98765432000155", dt.datetime(2024, 9, 1),
+              [("CAF01", "Café Torrado e Moído 500g", "09012100"), ("ACU02", "Açúcar Cristal 1kg", "17019900")])
+    b = _nota(user_normal, "13241011111111000111550010000056781000056789", "5678",
+              "11111111000111", "98765432000155", dt.datetime(2024, 10, 1),
+              [("BIS03", "Biscoito recheado chocolate", "19053100")])
+    c = _nota(user_admin, "13241022222222000122550010000012341000099999", "1234",
+              "22222222000122", "98765432000155", dt.datetime(2024, 10, 2),
+              [("CAF01", "Café Torrado", "09012100")])
+    yield user_normal, a, b, c
+    for uf, s in criados:
+        remover_itens(s.id)
+        db_session.delete(s)
+        db_session.delete(uf)
+    db_session.commit()
+
+
+def test_busca_por_campos_da_nota_e_produtos(notas):
+    user, a, b, c = notas
+    ids = lambda termo: [s.id for s in buscar_notas(user.id, termo)]
+
+    assert ids("1324091234") == [a.id]                      # prefixo da chave
+    assert ids("12.345.678/0001-99") == [a.id]              # CNPJ do emitente com pontuação
+    assert ids("98765432000155") == [b.id, a.id]            # destinatário; mais recentes primeiro
+    assert ids("1234") == [a.id]                            # número (nota do outro usuário fica de fora)
+    assert ids("000001234") == [a.id]
+    assert ids("0901") == [a.id]                            # prefixo do NCM dos itens
+    assert ids("cafe torr") == [a.id]                       # descrição: sem acento, prefixo, todas as palavras
+    assert ids("chocolate") == [b.id]
+    assert ids("café chocolate") == []
+    assert ids("BIS03") == [b.id]                           # código do produto
+    assert ids("") == [] and ids("inexistente") == []
+
+
+def test_reindexar_e_remover_itens_atualiza_indice_de_texto(notas):
+    user, a, b, _ = notas
+    assert indexar_itens(a, user.id, _NFE(("X", "Leite condensado", "04029900"))) == 0  # já indexada
+    assert indexar_itens(a, user.id, _NFE(("X", "Leite condensado", "04029900")), refazer=True) == 1
+    assert [s.id for s in buscar_notas(user.id, "leite")] == [a.id]
+    assert buscar_notas(user.id, "cafe") == []
+
+    remover_itens(b.id)
+    db.session.commit()
+    assert buscar_notas(user.id, "chocolate") == []
+    assert NFEItem.query.filter_by(summary_id=b.id).count() == 0
+
+
+def test_rota_buscar(logged_client_user, notas):
+    r = logged_client_user.get("/buscar?q=biscoito")
+    assert r.status_code == 200
+    html = r.get_data(as_text=True)
+    assert "13241011111111000111550010000056781000056789" in html
+    assert "13240912345678000199550010000012341000012345" not in html
+    assert logged_client_user.get("/buscar").status_code == 200
+
+
+@pytest.mark.skipif(not __import__("os").getenv("BENCH"), reason="benchmark: rode com BENCH=1")
+def test_bench_busca_acervo_grande(db_session, user_normal):
+    import time
+
+    n = 100_000
+    uf = UserFile(user_id=user_normal.id, filename="bench.xml", storage_path="/tmp/x")
+    db_session.add(uf); db_session.commit()
+    ufs = [{"user_id": user_normal.id, "filename": f"b{i}.xml", "storage_path": "/tmp/x"} for i in range(n)]
+    db_session.execute(UserFile.__table__.insert(), ufs)
+    primeiro = uf.id + 1
+    db_session.execute(NFESummary.__table__.insert(), [
+        {"user_file_id": primeiro + i, "chave": f"1324{i:040d}", "numero": str(i), "emit_cnpj": f"{i:014d}",
+         "dest_cnpj": "98765432000155", "emissao": dt.datetime(2020, 1, 1) + dt.timedelta(minutes=i)}
+        for i in range(n)
+    ])
+    sids = [r[0] for r in db_session.query(NFESummary.id).filter(NFESummary.user_file_id >= primeiro)]
+    produtos = ("Café torrado", "Açúcar cristal", "Biscoito recheado", "Leite integral", "Arroz tipo 1")
+    db_session.execute(NFEItem.__table__.insert(), [
+        {"summary_id": sid, "user_id": user_normal.id, "n_item": k, "cprod": f"P{j % 5000}",
+         "xprod": f"{produtos[(j + k) % 5]} lote {j % 997}", "ncm": f"{(j * 7 + k) % 100000000:08d}"}
+        for j, sid in enumerate(sids) for k in range(3)
+    ])
+    db_session.commit()
+    if db_session.get_bind().dialect.name == "sqlite":
+        db_session.execute(db.text("ANALYZE"))  # estatísticas do planner (no Postgres: autovacuum)
+    try:
+        for termo in ("1324000000000000000000000000000000000004242", "00000000004242", "4242",
+                      "0003", "biscoito lote 13", "P4242"):
+            t0 = time.perf_counter()
+            achadas = buscar_notas(user_normal.id, termo)
+            ms = (time.perf_counter() - t0) * 1000
+            print(f"\nbusca {termo!r} em {n} notas: {len(achadas)} notas, {ms:.1f} ms")
+    finally:
+        db_session.execute(NFEItem.__table__.delete().where(NFEItem.user_id == user_normal.id))
+        db_session.execute(NFESummary.__table__.delete().where(NFESummary.user_file_id >= uf.id))
+        db_session.execute(UserFile.__table__.delete().where(UserFile.user_id == user_normal.id))
+        db_session.commit()
@@ -1,4 +1,5 @@
 import pandas as pd
+import pytest
 from sqlalchemy import delete
 
 from oraculoicms_app.models.matrix import Source, STRegra
@@ -59,3 +60,74 @@ def test_reload_matrices_reads_latest_data(app, db_session):
         assert len(df_sources.index) == 1
         assert df_sources.loc[0, "NOME"] == "Nova Fonte"
         assert df_sources.loc[0, "ATIVO"] == 0
+
+
+def test_sources_log_fora_das_matrizes_e_ultima_entrada(app, db_session):
+    from datetime import datetime
+    from oraculoicms_app.models.matrix import SourceLog
+    from oraculoicms_app.services.sheets_service import latest_source_log, count_source_logs
+
+    with app.app_context():
+        db_session.execute(delete(SourceLog))
+        db_session.commit()
+        assert latest_source_log() is None and count_source_logs() == 0
+
+        db_session.add_all([
+            SourceLog(executado_em=datetime(2024, 3, 1), uf="AM", nome="B", status="ERRO", linhas=0),
+            SourceLog(executado_em=datetime(2024, 1, 1), uf="AM", nome="A", status="OK", linhas=5),
+        ])
+        db_session.commit()
+        try:
+            assert "sources_log" not in reload_matrices()
+            ultimo = latest_source_log()
+            assert ultimo["status"] == "ERRO" and ultimo["executado_em"].startswith("2024-03-01")
+            assert count_source_logs() == 2
+        finally:
+            db_session.execute(delete(SourceLog))
+            db_session.commit()
+
+
+def test_snapshot_do_motor_usado_so_com_mesmo_carimbo(app, db_session, monkeypatch, tmp_path):
+    from calc import MotorCalculo
+    from oraculoicms_app.services import sheets_service as ss
+    from oraculoicms_app.services.calc_service import init_motor, rebuild_motor
+    from oraculoicms_app.services.sheets_service import bump_rules_stamp
+
+    monkeypatch.setitem(app.config, "ENGINE_SNAPSHOT", True)
+    monkeypatch.setitem(app.config, "ENGINE_SNAPSHOT_DIR", str(tmp_path))
+    original = ss._load_matrices
+    with app.app_context():
+        db_session.add(STRegra(ncm="87654321", ativo=True, st_aplica=True))
+        db_session.commit()
+        try:
+            bump_rules_stamp("v1")
+            init_sheets(app)
+            init_motor(app)
+            assert (tmp_path / "motor.pkl").exists()
+
+            # mesmo carimbo: nenhum SELECT nas tabelas de regras
+            monkeypatch.setattr(ss, "_load_matrices", lambda: pytest.fail("não deveria consultar o banco"))
+            init_sheets(app)
+            motor = app.extensions["motor"]
+            init_motor(app)
+            assert app.extensions["motor"] is motor
+            assert isinstance(motor, MotorCalculo) and "87654321" in motor._indice
+
+            # carimbo novo: snapshot descartado, rebuild e regravação
+            bump_rules_stamp("v2")
+            chamadas = []
+            monkeypatch.setattr(ss, "_load_matrices", lambda: chamadas.append(1) or original())
+            init_sheets(app)
+            init_motor(app)
+            assert chamadas == [1]
+            assert app.extensions["motor"] is not motor
+            rebuild_motor()
+            monkeypatch.setattr(ss, "_load_matrices", lambda: pytest.fail("snapshot v2 deveria valer"))
+            init_sheets(app)
+        finally:
+            db_session.execute(delete(STRegra))
+            db_session.commit()
+            monkeypatch.setattr(ss, "_load_matrices", original)
+            monkeypatch.setitem(app.config, "ENGINE_SNAPSHOT", False)
+            init_sheets(app)
+            init_motor(app)
@@ -1,6 +1,11 @@
+import io
+
+import openpyxl
 import pandas as pd
 import pytest
 
+from oraculoicms_app import extensions  # noqa: F401  (app antes do updater: import circular)
+import updater
 from updater import normalize_st_am, parse_st_am_html
 
 
@@ -50,3 +55,70 @@ def test_normalize_st_am_handles_substituicao_column():
     assert primeira["ATIVO"] == 1
     assert segunda["ST_APLICA"] == 0
     assert segunda["ATIVO"] == 0
+
+
+def _html_grande(n_lixo=500, n_ncm=50):
+    yield "<html><body>"
+    for t in range(n_lixo):
+        yield "<table><tr><th>Menu</th><th>Link</th></tr>"
+        yield "".join(f"<tr><td>item {t}.{i}</td><td>{'x' * 80}</td></tr>" for i in range(20))
+        yield "</table>"
+    yield "<table><tr><th>NCM/SH</th><th>CEST</th></tr>"
+    yield "".join(f"<tr><td>{i:08d}</td><td></td></tr>" for i in range(n_ncm))
+    yield "</table></body></html>"
+
+
+def test_parse_st_am_html_stream_em_pedacos_igual_ao_html_inteiro():
+    html = """
+    <table><tr><th>NCM</th></tr><tr><td>1</td></tr></table>
+    <table><tr><th>Outra</th></tr><tr><td>a</td></tr><tr><td>b</td></tr><tr><td>c</td></tr></table>
+    <table><tr><th>NCM/SH</th><th>CEST</th></tr><tr><td>12.34</td><td>1</td></tr><tr><td>56.78</td><td></td></tr></table>
+    <table><tr><th>NCM</th><th>X</th></tr><tr><td>99</td><td>1</td></tr><tr><td>98</td><td>2</td></tr></table>
+    """
+    pedacos = [html[i:i + 7] for i in range(0, len(html), 7)]  # corta no meio das tags
+    df = updater.parse_st_am_html_stream(pedacos)
+    pd.testing.assert_frame_equal(df, parse_st_am_html(html))
+    assert list(df.columns) == ["NCM/SH", "CEST"]   # empate: a primeira maior tabela
+    assert list(df["NCM/SH"]) == ["12.34", "56.78"]
+
+
+def test_extrator_descarta_tabelas_sem_ncm_ao_fechar():
+    ext = updater._TableExtractor(manter=updater._tem_ncm)
+    for chunk in _html_grande(n_lixo=50, n_ncm=3):
+        ext.feed(chunk)
+    assert len(ext.tables) == 1 and len(ext.tables[0]) == 4
+
+
+def test_parse_html_stream_memoria_nao_cresce_com_a_fonte():
+    import tracemalloc
+
+    tracemalloc.start()
+    df = updater.parse_st_am_html_stream(_html_grande())   # ~1 MB de HTML, nunca inteiro em memória
+    _, pico = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    assert len(df.index) == 50
+    assert pico < 300_000
+
+
+def test_parse_html_stream_cai_para_cp1252():
+    html = "<table><tr><th>NCM</th><th>Descrição</th></tr><tr><td>1234</td><td>Ação</td></tr></table>"
+    df = updater.parse_html_stream(io.BytesIO(html.encode("cp1252")))
+    assert df.loc[0, "DESCRIÇÃO"] == "Ação"
+
+
+def test_parse_xlsx_stream_read_only_igual_read_excel():
+    wb = openpyxl.Workbook()
+    ws = wb.active
+    ws.append(["NCM/SH", "CEST", "MVA"])
+    ws.append(["1234.56.78", "01.001.00", 35.5])
+    ws.append([None, None, None])
+    ws.append(["8765.43.21", None, 40])
+    buf = io.BytesIO()
+    wb.save(buf)
+
+    df = updater.parse_xlsx_stream(io.BytesIO(buf.getvalue()))
+    esperado = pd.read_excel(io.BytesIO(buf.getvalue()), engine="openpyxl")
+    esperado.columns = [str(c).strip().upper() for c in esperado.columns]
+    assert list(df.columns) == list(esperado.columns)
+    assert list(df["NCM/SH"]) == list(esperado["NCM/SH"].dropna())
+    assert list(df["MVA"]) == [35.5, 40]
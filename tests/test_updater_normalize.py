@@ -0,0 +1,85 @@
+import os
+import random
+import time
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from oraculoicms_app import extensions  # noqa: F401  (app antes do updater: import circular)
+import updater
+
+
+def _st_linha_a_linha(df: pd.DataFrame) -> pd.DataFrame:
+    """Implementação anterior (apply por linha), usada como oráculo."""
+    df = df.copy()
+    df.columns = [str(c).strip().upper() for c in df.columns]
+    ncm_col = updater._find_column(df, "NCM")
+    cest_col = updater._find_column(df, "CEST")
+    regime_col = updater._find_column(df, "REGIME") or updater._find_column(df, "SUBSTITU")
+    st = pd.DataFrame()
+    st["NCM"] = df[ncm_col].apply(updater._normalize_ncm)
+    st["CEST"] = df[cest_col].apply(updater._normalize_cest) if cest_col else ""
+    st["ST_APLICA"] = df.apply(
+        lambda row: 1 if updater._interpret_st_flag(row.get(regime_col) if regime_col else None) else 0,
+        axis=1,
+    )
+    st["ATIVO"] = st["ST_APLICA"].apply(lambda v: 1 if v else 0)
+    st["CST_INCLUIR"] = ""
+    st["CST_EXCLUIR"] = "40,41,50"
+    st["CFOP_INI"] = ""
+    st["CFOP_FIM"] = ""
+    st = st[st["NCM"].astype(str).str.strip() != ""].copy()
+    return st[["ATIVO", "NCM", "CEST", "CST_INCLUIR", "CST_EXCLUIR", "CFOP_INI", "CFOP_FIM", "ST_APLICA"]]
+
+
+_FLAGS = [
+    "Sim", "SIM", "Não", "NAO SE APLICA", "Substituição Tributária", "Sujeito à ST", "Isento",
+    "", "  ", None, np.nan, 1, 0, 1.0, 0.0, True, False, "1", "0", "s", "n", "Sujeita", "não sujeito",
+]
+_NCMS = ["12.34.56.78", "1234.56.78", "12345678", 12345678, 12345678.0, 1234567.0, "  ex 01 ", "abc  def", "", None, np.nan]
+_CESTS = ["01.001.00", "0100100", "", None, np.nan, 100100, 100100.0, "CEST: 28.038.00"]
+
+
+def _tabela(n, seed=0, regime="SUBSTITUIÇÃO TRIBUTÁRIA"):
+    rnd = random.Random(seed)
+    return pd.DataFrame({
+        "NCM/SH": [rnd.choice(_NCMS) if rnd.random() < 0.3 else f"{rnd.randrange(10**8):08d}" for _ in range(n)],
+        "CEST": [rnd.choice(_CESTS) for _ in range(n)],
+        regime: [rnd.choice(_FLAGS) for _ in range(n)],
+        "DESCRIÇÃO": ["x"] * n,
+    })
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_normalize_vetorizado_igual_ao_linha_a_linha(seed):
+    df = _tabela(2000, seed)
+    pd.testing.assert_frame_equal(updater.normalize_st_am(df)["st_regras"], _st_linha_a_linha(df))
+
+
+def test_normalize_vetorizado_sem_cest_e_sem_regime():
+    df = pd.DataFrame({"NCM": ["1234.56.78", "", None, 8765]})
+    pd.testing.assert_frame_equal(updater.normalize_st_am(df)["st_regras"], _st_linha_a_linha(df))
+
+
+def test_classifica_st_flags_coluna_numerica_com_nan():
+    col = pd.Series([1.0, 0.0, np.nan, 2.0])
+    assert updater._classifica_st_flags(col).tolist() == [updater._interpret_st_flag(v) for v in col]
+
+
+@pytest.mark.skipif(not os.getenv("BENCH"), reason="benchmark: rode com BENCH=1")
+def test_benchmark_normalize_st_am_100k():
+    df = _tabela(100_000, seed=42)
+
+    t0 = time.perf_counter()
+    novo = updater.normalize_st_am(df)["st_regras"]
+    t_vet = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    ref = _st_linha_a_linha(df)
+    t_ref = time.perf_counter() - t0
+
+    pd.testing.assert_frame_equal(novo, ref)
+    print(f"\nnormalize_st_am 100k linhas: vetorizado {t_vet * 1000:.0f} ms | "
+          f"linha a linha {t_ref * 1000:.0f} ms | {t_ref / t_vet:.1f}x")
+    assert t_vet < t_ref
@@ -0,0 +1,269 @@
+import http.server
+import threading
+
+import pandas as pd
+import pytest
+import requests
+
+from oraculoicms_app.models.matrix import STRegra, Source, SourceLog
+import updater
+
+
+HTML = """<html><body>
+<table><tr><td>menu</td></tr></table>
+<table>
+  <tr><th>NCM/SH</th><th>CEST</th><th>Substituição Tributária</th></tr>
+  <tr><td>11.11.11.11</td><td></td><td>Sim</td></tr>
+  <tr><td>22.22.22.22</td><td></td><td>Sim</td></tr>
+</table></body></html>"""
+
+
+def parser_plugin(fh) -> pd.DataFrame:
+    """Plugin externo (``<módulo>:parser_plugin``)."""
+    ncms = fh.read().decode().split()
+    return pd.DataFrame({"NCM": ncms, "SUBSTITUICAO": ["SIM"] * len(ncms)})
+
+
+@pytest.fixture
+def limpo(app, db_session, monkeypatch, tmp_path):
+    monkeypatch.setitem(app.config, "UPDATER_CACHE_DIR", str(tmp_path / "fetch_cache"))
+    monkeypatch.setitem(app.config, "UPDATER_LOCAL_DIR", str(tmp_path))
+
+    def _limpar():
+        db_session.rollback()
+        STRegra.query.delete()
+        Source.query.delete()
+        SourceLog.query.filter_by(uf="AM").delete()
+        db_session.commit()
+
+    _limpar()
+    yield db_session
+    _limpar()
+
+
+@pytest.fixture
+def servidor_http(monkeypatch):
+    """Stand-in HTTP local: serve o HTML acima em /tabela.html."""
+    monkeypatch.setattr(requests, "get", requests.api.get)  # conftest troca por um fake
+
+    estado = {"html": HTML, "etag": '"v1"', "corpos": 0, "condicionais": 0}
+
+    class _H(http.server.BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path != "/tabela.html" or estado.get("falhar"):
+                self.send_error(404)
+                return
+            if self.headers.get("If-None-Match"):
+                estado["condicionais"] += 1
+                if estado["etag"] and self.headers["If-None-Match"] == estado["etag"]:
+                    self.send_response(304)
+                    self.end_headers()
+                    return
+            body = estado["html"].encode("utf-8")
+            estado["corpos"] += 1
+            self.send_response(200)
+            if estado["etag"]:
+                self.send_header("ETag", estado["etag"])
+            self.send_header("Content-Type", "text/html; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *a):
+            pass
+
+    srv = http.server.ThreadingHTTPServer(("127.0.0.1", 0), _H)
+    threading.Thread(target=srv.serve_forever, daemon=True).start()
+    srv.estado = estado
+    srv.url = f"http://127.0.0.1:{srv.server_address[1]}"
+    yield srv
+    srv.shutdown()
+    srv.server_close()
+
+
+def _fonte(db_session, nome, url, parser=None, tipo=None, prioridade=None, ativo=True, uf="AM"):
+    db_session.add(Source(ativo=ativo, uf=uf, nome=nome, url=url, parser=parser, tipo=tipo, prioridade=prioridade))
+    db_session.commit()
+
+
+def test_resolve_parser_registro_e_plugin(app, monkeypatch):
+    assert updater.resolve_parser("HTML") is updater.parse_html_stream
+    assert updater.resolve_parser("csv") is updater.parse_csv_stream
+    with pytest.raises(ValueError):
+        updater.resolve_parser("nao-existe")
+    # plugin só se estiver liberado (em código ou na config)
+    with pytest.raises(ValueError, match="não permitido"):
+        updater.resolve_parser(f"{__name__}:parser_plugin")
+    with pytest.raises(ValueError, match="não permitido"):
+        updater.resolve_parser("pickle:load")
+    monkeypatch.setitem(app.config, "UPDATER_PARSER_PLUGINS", f"outro:x, {__name__}:parser_plugin")
+    with app.app_context():
+        assert updater.resolve_parser(f"{__name__}:parser_plugin") is parser_plugin
+    monkeypatch.setattr(updater, "PARSER_PLUGINS", {f"{__name__}:parser_plugin"})
+    assert updater.resolve_parser(f"{__name__}:parser_plugin") is parser_plugin
+
+
+def test_parser_nao_permitido_nao_baixa_e_vai_para_o_log(limpo, monkeypatch):
+    baixados = []
+    monkeypatch.setattr(updater, "_baixar", lambda *a, **k: baixados.append(a) or (None, "", 0, {}))
+    _fonte(limpo, "Hostil", "http://hostil/payload", parser="pickle:load", prioridade=1)
+
+    res = updater.run_update_sources("AM", timeout=1)
+    assert res["status"] == "ERRO" and baixados == []
+    log = SourceLog.query.filter_by(uf="AM", nome="Hostil").one()
+    assert log.status == "ERRO" and "não permitido" in log.mensagem
+
+
+def test_url_local_so_dentro_do_diretorio_liberado(limpo, app, tmp_path, monkeypatch):
+    baixados = []
+    monkeypatch.setattr(updater, "_baixar", lambda *a, **k: baixados.append(a) or (None, "", 0, {}))
+    fora = tmp_path.parent / "segredo.csv"
+    _fonte(limpo, "Caminho", str(fora), tipo="csv", prioridade=1)
+    _fonte(limpo, "Arquivo", fora.as_uri(), tipo="csv", prioridade=2)
+    _fonte(limpo, "Escape", str(tmp_path / ".." / "segredo.csv"), tipo="csv", prioridade=3)
+    _fonte(limpo, "FTP", "ftp://host/st.csv", tipo="csv", prioridade=4)
+
+    res = updater.run_update_sources("AM", timeout=1)
+    assert res["status"] == "ERRO" and baixados == []
+    logs = {l.nome: l for l in SourceLog.query.filter_by(uf="AM").all()}
+    assert all("não permitid" in logs[n].mensagem for n in ("Caminho", "Arquivo", "Escape", "FTP"))
+
+    updater.validar_url(str(tmp_path / "st.csv"))
+    updater.validar_url("https://sefaz/st.csv")
+    monkeypatch.setitem(app.config, "UPDATER_LOCAL_DIR", "")
+    with pytest.raises(ValueError):
+        updater.validar_url(str(tmp_path / "st.csv"))
+
+
+def test_fontes_ativas_ordena_por_prioridade_e_filtra(limpo):
+    _fonte(limpo, "Sem prioridade", "/x.csv", tipo="csv")
+    _fonte(limpo, "B", "/b.html", prioridade=2)
+    _fonte(limpo, "A", "/a.xlsx", parser="p-desconhecido", tipo="xlsx", prioridade=1)
+    _fonte(limpo, "Inativa", "/i.csv", prioridade=1, ativo=False)
+    _fonte(limpo, "Outra UF", "/sp.csv", prioridade=1, uf="SP")
+
+    fontes = updater.fontes_ativas("AM")
+    assert [f.nome for f in fontes] == ["A", "B", "Sem prioridade"]
+    assert [f.parser for f in fontes] == ["xlsx", "html", "csv"]
+
+
+def test_fontes_ativas_usa_padrao_da_uf_sem_cadastro(limpo):
+    assert updater.fontes_ativas("AM") == list(updater.DEFAULT_SOURCES["AM"])
+    assert updater.fontes_ativas("PA") == []
+
+
+def test_run_update_sources_merge_por_prioridade_offline(limpo, tmp_path, servidor_http, monkeypatch):
+    monkeypatch.setattr(updater, "PARSER_PLUGINS", {f"{__name__}:parser_plugin"})
+    csv = tmp_path / "st.csv"
+    # 11111111 não tem ST aqui, mas a fonte HTML (prioridade 1) diz que tem
+    csv.write_text("NCM;CEST;SUBSTITUIÇÃO TRIBUTÁRIA\n11.11.11.11;;Não\n33.33.33.33;;Sim\n", encoding="utf-8")
+    plugin = tmp_path / "lista.txt"
+    plugin.write_text("44444444")
+
+    _fonte(limpo, "HTML local", servidor_http.url + "/tabela.html", parser="html", prioridade=1)
+    _fonte(limpo, "CSV", csv.as_uri(), tipo="csv", prioridade=2)
+    _fonte(limpo, "Plugin", str(plugin), parser=f"{__name__}:parser_plugin", prioridade=3)
+    _fonte(limpo, "Quebrada", servidor_http.url + "/404.html", parser="html", prioridade=4)
+
+    res = updater.run_update_sources("AM", max_workers=2, timeout=5)
+    assert res["status"] == "OK"
+    assert "falhas: Quebrada" in res["mensagem"]
+
+    regras = {r.ncm: r.st_aplica for r in STRegra.query.all()}
+    assert regras == {"11111111": True, "22222222": True, "33333333": True, "44444444": True}
+
+    logs = {l.nome: l for l in SourceLog.query.filter_by(uf="AM").all()}
+    assert logs["HTML local"].status == "OK" and logs["HTML local"].linhas == 2
+    assert logs["Quebrada"].status == "ERRO"
+    assert logs["ST AM – consolidado"].status == "OK"
+
+
+def test_fonte_boa_que_falha_nao_muda_as_regras(limpo, tmp_path, servidor_http):
+    csv = tmp_path / "st.csv"
+    csv.write_text("NCM;CEST;SUBSTITUIÇÃO TRIBUTÁRIA\n11.11.11.11;;Não\n33.33.33.33;;Sim\n", encoding="utf-8")
+    _fonte(limpo, "HTML local", servidor_http.url + "/tabela.html", parser="html", prioridade=1)
+    _fonte(limpo, "CSV", str(csv), tipo="csv", prioridade=2)
+    assert updater.run_update_sources("AM", timeout=5)["status"] == "OK"
+
+    def _regras():
+        return {(r.id, r.ncm, r.st_aplica) for r in STRegra.query.all()}
+
+    antes = _regras()
+    assert ("11111111", True) in {(n, st) for _, n, st in antes}
+
+    # a fonte de prioridade 1 cai: entra a última cópia boa do cache
+    servidor_http.estado["falhar"] = True
+    res = updater.run_update_sources("AM", timeout=5)
+    assert res["status"] == "OK" and res["alterado"] is False
+    assert "falhas: HTML local (última cópia)" in res["mensagem"]
+    assert _regras() == antes
+
+    # sem cópia em cache de uma fonte que já funcionou: nada é gravado
+    vazio = updater.FetchCache(str(tmp_path / "vazio"))
+    res = updater.run_update_sources("AM", timeout=5, cache=vazio)
+    assert res["status"] == "ERRO" and "HTML local" in res["mensagem"]
+    assert _regras() == antes
+    assert SourceLog.query.filter_by(uf="AM", nome="ST AM – consolidado").order_by(SourceLog.id.desc()).first().status == "ERRO"
+
+
+def test_coletar_fontes_respeita_timeout(monkeypatch):
+    evento = threading.Event()
+
+    def _lento(url, timeout, headers=None):
+        evento.wait(2)
+        return None, "", 0, {}
+
+    monkeypatch.setattr(updater, "_baixar", _lento)
+    lenta = updater.Fonte("Lenta", "AM", "http://lenta", "csv", 1)
+    (coleta,) = updater.coletar_fontes([lenta], timeout=0.1)
+    evento.set()
+    assert coleta.tabelas is None and coleta.erro.startswith("timeout")
+
+
+def test_coleta_condicional_e_cache(limpo, servidor_http, monkeypatch):
+    parses = []
+    original = updater.PARSERS["html"]
+    monkeypatch.setitem(updater.PARSERS, "html", lambda b: parses.append(1) or original(b))
+    _fonte(limpo, "HTML local", servidor_http.url + "/tabela.html", parser="html", prioridade=1)
+    estado = servidor_http.estado
+
+    r1 = updater.run_update_sources("AM", timeout=5)
+    (c1,) = r1["fontes"]
+    assert r1["mensagem"].startswith("Atualizado") and r1["alterado"] is True
+    assert c1.bytes > 0 and not c1.inalterada and len(parses) == 1
+
+    # ETag igual -> 304: nada baixado, sem parse, sem escrita
+    r2 = updater.run_update_sources("AM", timeout=5)
+    (c2,) = r2["fontes"]
+    assert estado["condicionais"] == 1 and estado["corpos"] == 1
+    assert c2.inalterada and c2.bytes == 0 and c2.versao == c1.versao
+    assert r2["mensagem"] == "Sem alterações" and r2["alterado"] is False and len(parses) == 1
+
+    # servidor sem ETag devolve o mesmo conteúdo: o sha256 evita o parse
+    estado["etag"] = None
+    (c3,) = updater.run_update_sources("AM", timeout=5)["fontes"]
+    assert c3.inalterada and c3.bytes > 0 and len(parses) == 1
+
+    # conteúdo novo -> parse e escrita
+    estado["html"] = HTML.replace("22.22.22.22", "55.55.55.55")
+    r4 = updater.run_update_sources("AM", timeout=5)
+    assert len(parses) == 2 and r4["mensagem"].startswith("Atualizado")
+    assert {r.ncm for r in STRegra.query.all()} == {"11111111", "55555555"}
+
+    logs = (SourceLog.query.filter_by(uf="AM", nome="HTML local")
+            .order_by(SourceLog.id).all())
+    assert [l.bytes > 0 for l in logs] == [True, False, True, True]
+    assert all(l.latencia_ms is not None for l in logs)
+
+
+def test_fonte_inalterada_entra_no_merge_pelo_cache(limpo, tmp_path, servidor_http):
+    csv = tmp_path / "st.csv"
+    csv.write_text("NCM;SUBSTITUIÇÃO TRIBUTÁRIA\n33.33.33.33;Sim\n", encoding="utf-8")
+    _fonte(limpo, "HTML local", servidor_http.url + "/tabela.html", parser="html", prioridade=1)
+    _fonte(limpo, "CSV", str(csv), tipo="csv", prioridade=2)
+    updater.run_update_sources("AM", timeout=5)
+
+    csv.write_text("NCM;SUBSTITUIÇÃO TRIBUTÁRIA\n44.44.44.44;Sim\n", encoding="utf-8")
+    html, csv_c = updater.run_update_sources("AM", timeout=5)["fontes"]
+    assert html.inalterada and not csv_c.inalterada
+    assert {r.ncm for r in STRegra.query.all()} == {"11111111", "22222222", "44444444"}
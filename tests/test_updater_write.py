@@ -0,0 +1,106 @@
+import pandas as pd
+import pytest
+
+from oraculoicms_app.models.matrix import Mva, STRegra, Source, SourceLog
+import updater
+
+
+@pytest.fixture
+def tabelas_limpas(app, db_session, monkeypatch, tmp_path):
+    monkeypatch.setitem(app.config, "UPDATER_CACHE_DIR", str(tmp_path / "fetch_cache"))
+    monkeypatch.setitem(app.config, "UPDATER_LOCAL_DIR", str(tmp_path))
+
+    def _limpar():
+        db_session.rollback()
+        Mva.query.delete()
+        STRegra.query.delete()
+        Source.query.delete()
+        SourceLog.query.filter_by(uf="AM").delete()
+        db_session.commit()
+
+    _limpar()
+    yield db_session
+    _limpar()
+
+
+def _tabelas(st_rows, mva_rows=()):
+    st = pd.DataFrame(st_rows, columns=["NCM", "CEST", "ST_APLICA"])
+    st["ATIVO"] = 1
+    out = {"st_regras": st}
+    if mva_rows:
+        out["mva"] = pd.DataFrame(mva_rows, columns=["NCM", "MVA"])
+    return out
+
+
+def test_write_aplica_so_a_diferenca(tabelas_limpas):
+    stats = updater.write_to_database(_tabelas(
+        [("11111111", "", 1), ("22222222", "0100100", 1), ("33333333", "", 0)],
+        [("11111111", 35.0)],
+    ))
+    assert stats["st_regras"] == {"inseridas": 3, "atualizadas": 0, "removidas": 0}
+    assert stats["mva"]["inseridas"] == 1
+    ids = {r.ncm: r.id for r in STRegra.query.all()}
+
+    # mesma carga: nada muda
+    stats = updater.write_to_database(_tabelas(
+        [("11111111", "", 1), ("22222222", "0100100", 1), ("33333333", "", 0)],
+        [("11111111", 35.0)],
+    ))
+    assert stats["st_regras"] == {"inseridas": 0, "atualizadas": 0, "removidas": 0}
+    assert stats["mva"] == {"inseridas": 0, "atualizadas": 0, "removidas": 0}
+
+    # 1 alterada, 1 removida, 1 nova (duplicata da nova é ignorada)
+    stats = updater.write_to_database(_tabelas(
+        [("11111111", "", 0), ("22222222", "0100100", 1), ("44444444", "", 1), ("44444444", "", 0)],
+        [("11111111", 40.123456)],
+    ))
+    assert stats["st_regras"] == {"inseridas": 1, "atualizadas": 1, "removidas": 1}
+    assert stats["mva"]["atualizadas"] == 1
+
+    regras = {r.ncm: r for r in STRegra.query.all()}
+    assert set(regras) == {"11111111", "22222222", "44444444"}
+    assert regras["11111111"].id == ids["11111111"] and regras["11111111"].st_aplica is False
+    assert regras["22222222"].id == ids["22222222"] and regras["22222222"].cest == "0100100"
+    assert regras["44444444"].st_aplica is True
+    assert float(Mva.query.one().mva) == pytest.approx(40.1235)
+
+
+def test_run_update_pula_escrita_quando_versao_igual(tabelas_limpas, monkeypatch, tmp_path):
+    csv = tmp_path / "st.csv"
+    csv.write_text("NCM;CEST;SUBSTITUIÇÃO TRIBUTÁRIA\n12.34.56.78;;Sim\n", encoding="utf-8")
+    tabelas_limpas.add(Source(ativo=True, uf="AM", nome="Local", url=str(csv), tipo="csv", prioridade=1))
+    tabelas_limpas.commit()
+
+    chamadas = []
+    original = updater.write_to_database
+    monkeypatch.setattr(updater, "write_to_database", lambda t: chamadas.append(1) or original(t))
+
+    updater.run_update_am()
+    updater.run_update_am()
+
+    assert len(chamadas) == 1
+    logs = SourceLog.query.filter_by(uf="AM", nome="ST AM – consolidado").order_by(SourceLog.id).all()
+    assert [l.status for l in logs] == ["OK", "OK"]
+    assert logs[0].versao == logs[1].versao
+    assert logs[1].mensagem.startswith("Sem alterações")
+    assert STRegra.query.count() == 1
+
+
+def test_prune_sources_log_mantem_ultima_ok_por_fonte(tabelas_limpas):
+    from datetime import datetime, timedelta
+
+    velho = datetime.now() - timedelta(days=400)
+    tabelas_limpas.add_all([
+        SourceLog(executado_em=velho, uf="AM", nome="A", status="OK", versao="v1"),
+        SourceLog(executado_em=velho + timedelta(days=1), uf="AM", nome="A", status="OK", versao="v2"),
+        SourceLog(executado_em=velho + timedelta(days=2), uf="AM", nome="A", status="ERRO"),
+        SourceLog(executado_em=velho, uf="AM", nome="B", status="ERRO"),
+        SourceLog(executado_em=datetime.now(), uf="AM", nome="B", status="ERRO"),
+    ])
+    tabelas_limpas.commit()
+
+    assert updater.prune_sources_log(90) == 3
+    tabelas_limpas.commit()
+    restantes = SourceLog.query.filter_by(uf="AM").order_by(SourceLog.id).all()
+    assert [(l.nome, l.status, l.versao) for l in restantes] == [("A", "OK", "v2"), ("B", "ERRO", None)]
+    assert updater.prune_sources_log(0) == 0
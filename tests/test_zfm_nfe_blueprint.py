@@ -303,9 +303,18 @@ def test_calcular_com_cache_aproveita_calc_json(logged_client_user, monkeypatch,
 
 
 def test_calcular_tenta_indexar_quando_ha_upload(logged_client_user, monkeypatch,url):
-    # NFEXML básico
-    monkeypatch.setattr(nfe_mod, "NFEXML", _fake_nfexml_factory())
+    # NFEXML básico (conta os parses feitos pela rota)
+    parses = []
+
+    class _Contado(_fake_nfexml_factory()):
+        def __init__(self, xml_bytes):
+            parses.append(xml_bytes)
+            super().__init__(xml_bytes)
+
+    monkeypatch.setattr(nfe_mod, "NFEXML", _Contado)
     monkeypatch.setattr(nfe_mod, "get_motor", _fake_get_motor)
+    indexadas = []
+    monkeypatch.setattr(nfe_mod, "indexar_itens", lambda s, uid, nfe: indexadas.append(nfe))
 
     # mock upsert para ser chamado quando houver UserFile com md5
     called = {"ok": False}
@@ -328,19 +337,63 @@ def test_calcular_tenta_indexar_quando_ha_upload(logged_client_user, monkeypatch
     }, content_type="multipart/form-data")
     assert resp.status_code == 200
     assert called["ok"] is True
+    assert len(parses) == 1 and len(indexadas) == 1  # índice e cálculo sobre o mesmo parse
 
 
 # ----------------------------
-# /nfe/exportar-pdf
+# /nfe/exportar-pdf/<file_id>
 # ----------------------------
+def test_exportar_pdf_do_resultado_salvo_usa_cache(logged_client_user, url, app, monkeypatch, tmp_path):
+    from oraculoicms_app.services.calc_store import store_payload
 
+    monkeypatch.setitem(app.config, "ARTIFACT_CACHE", True)
+    monkeypatch.setitem(app.config, "ARTIFACT_CACHE_DIR", str(tmp_path))
+    with logged_client_user.session_transaction() as sess:
+        uid = sess["user"]["id"]
+    uf = _cria_userfile_cache_para(uid, _xml_minimo_ok())
+    s = NFESummary(user_file_id=uf.id, chave="PDF-EXP", numero="77", serie="1")
+    store_payload(s, {"uf_origem": "SP", "uf_destino": "AM", "total_st": 27.9, "total_nf_st": 0.0,
+                      "linhas": [{"idx": "1", "ncm": "09030091", "cfop": "6102", "cst": "060",
+                                  "vProd": 100.0, "mva_tipo": "MVA Padrão", "mva_percent": 50.0,
+                                  "base_st": 139.5, "icms_st": 27.9}]})
+    db.session.add(s); db.session.commit()
 
-
-def test_exportar_pdf_payload_invalido_redirect(logged_client_user,url):
-    resp = logged_client_user.post(url("nfe.exportar_pdf"), data={
-        "data": "{invalid json"
-    }, follow_redirects=True)
-    assert resp.status_code == 200  # redirecionou com flash
+    renders = []
+    original = nfe_mod.gerar_pdf_nota
+    monkeypatch.setattr(nfe_mod, "gerar_pdf_nota", lambda *a, **k: renders.append(1) or original(*a, **k))
+    try:
+        r1 = logged_client_user.get(url("nfe.exportar_pdf", file_id=uf.id))
+        r2 = logged_client_user.get(url("nfe.exportar_pdf", file_id=uf.id))
+        assert r1.status_code == r2.status_code == 200
+        assert r1.mimetype == "application/pdf" and r1.get_data().startswith(b"%PDF")
+        assert r1.get_data() == r2.get_data()
+        assert renders == [1]  # segundo download saiu do cache
+        assert len(list(tmp_path.rglob("*.pdf"))) == 1
+
+        # entrada apagada por outro worker entre obter() e a leitura: vira falta, não 500
+        monkeypatch.setattr(nfe_mod.artifact_cache, "obter", lambda *a, **k: str(tmp_path / "sumiu.pdf"))
+        r3 = logged_client_user.get(url("nfe.exportar_pdf", file_id=uf.id))
+        assert r3.status_code == 200 and r3.get_data().startswith(b"%PDF") and renders == [1, 1]
+    finally:
+        db.session.rollback()
+        NFESummary.query.filter_by(id=s.id).delete()
+        UserFile.query.filter_by(id=uf.id).delete()
+        db.session.commit()
+
+
+def test_exportar_pdf_sem_calculo_redirect(logged_client_user, url):
+    with logged_client_user.session_transaction() as sess:
+        uid = sess["user"]["id"]
+    uf = _cria_userfile_cache_para(uid, _xml_minimo_ok())
+    s = NFESummary(user_file_id=uf.id, chave="PDF-SEM")
+    db.session.add(s); db.session.commit()
+    try:
+        resp = logged_client_user.get(url("nfe.exportar_pdf", file_id=uf.id))
+        assert resp.status_code == 302
+    finally:
+        NFESummary.query.filter_by(id=s.id).delete()
+        UserFile.query.filter_by(id=uf.id).delete()
+        db.session.commit()
 
 
 # ----------------------------
@@ -382,10 +435,10 @@ def test_config_view_ok(logged_client_admin, monkeypatch,url):
         {"ATIVO": "1", "UF": "AM", "NOME": "Fonte X", "URL": "http://x", "TIPO": "csv", "PARSER": "p", "PRIORIDADE": "1"},
         {"ATIVO": "0", "UF": "SP", "NOME": "Fonte Y", "URL": "http://y", "TIPO": "html", "PARSER": "p2", "PRIORIDADE": "2"},
     ])
-    df_log = pd.DataFrame([
-        {"EXECUTADO_EM": "2024-01-01T00:00:00", "STATUS": "OK", "MENSAGEM": "ok", "LINHAS": 10}
-    ])
-    monkeypatch.setattr(nfe_mod, "get_matrices", lambda: {"sources": df_sources, "sources_log": df_log})
+    monkeypatch.setattr(nfe_mod, "get_matrices", lambda: {"sources": df_sources})
+    monkeypatch.setattr(nfe_mod, "latest_source_log", lambda: {
+        "executado_em": "2024-01-01 00:00:00", "status": "OK", "mensagem": "ok", "linhas": 10,
+    })
 
     resp = logged_client_admin.get(url("nfe.config_view"))
     assert resp.status_code == 200
@@ -393,6 +446,7 @@ def test_config_view_ok(logged_client_admin, monkeypatch,url):
     assert "Banco de dados" in body
     assert "Fonte X" in body
     assert "Última atualização automática" in body
+    assert "Cache de PDFs" in body
 
 
 def test_config_tables_view_ok(logged_client_admin, monkeypatch, url):
@@ -408,10 +462,10 @@ def test_config_tables_view_ok(logged_client_admin, monkeypatch, url):
             "ST_APLICA": "1",
         }
     ])
-    df_log = pd.DataFrame([
-        {"EXECUTADO_EM": "2024-01-01T00:00:00", "STATUS": "OK", "MENSAGEM": "ok", "LINHAS": 10}
-    ])
-    monkeypatch.setattr(nfe_mod, "get_matrices", lambda: {"st_regras": df_st, "sources_log": df_log})
+    monkeypatch.setattr(nfe_mod, "get_matrices", lambda: {"st_regras": df_st})
+    monkeypatch.setattr(nfe_mod, "latest_source_log", lambda: {
+        "executado_em": "2024-01-01 00:00:00", "status": "OK", "mensagem": "ok", "linhas": 10,
+    })
 
     resp = logged_client_admin.get(url("nfe.config_tables_view"))
     assert resp.status_code == 200
@@ -508,10 +562,8 @@ def test_debug_sheets_ok(client, monkeypatch,url):
     df_sources = pd.DataFrame([
         {"ATIVO": "1", "UF": "AM", "NOME": "Fonte"}
     ])
-    df_logs = pd.DataFrame([
-        {"EXECUTADO_EM": "2024-01-01T00:00:00", "STATUS": "OK"}
-    ])
-    monkeypatch.setattr(nfe_mod, "get_matrices", lambda: {"sources": df_sources, "sources_log": df_logs})
+    monkeypatch.setattr(nfe_mod, "get_matrices", lambda: {"sources": df_sources})
+    monkeypatch.setattr(nfe_mod, "count_source_logs", lambda: 1)
 
     r = client.get(url("nfe.debug_sheets"))
     assert r.status_code == 200
@@ -1,30 +1,37 @@
+import codecs
 import io
 import hashlib
+import importlib
+import json
+import os
 import re
-from datetime import datetime
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from dataclasses import dataclass
+from datetime import datetime, timedelta
 from decimal import Decimal
+from typing import BinaryIO, Callable, Iterable, Iterator
+from urllib.parse import urlparse
+from urllib.request import url2pathname
 
+import numpy as np
+import openpyxl
 import pandas as pd
 import requests
+from flask import current_app, has_app_context
 from html.parser import HTMLParser
-from sqlalchemy import delete
+from sqlalchemy import bindparam, delete, func, insert, select, update
 
 from oraculoicms_app.extensions import db
-from oraculoicms_app.models.matrix import Mva, Multiplicador, STRegra, SourceLog
+from oraculoicms_app.models.matrix import Mva, Multiplicador, STRegra, Source, SourceLog
 
 SEFAZ_AM_HTML = "https://sistemas.sefaz.am.gov.br/get/Normas.do?metodo=viewDoc&uuidDoc=84be7172-451e-4ca0-802e-1a0303e5f0b2"
 SEFAZ_AM_XLSX = "https://online.sefaz.am.gov.br/sinf2004/DI/Tabela%20ST%20-%20Atualizada%20pela%20Lei%206108-22.xlsx"
 
 
 # ---------- helpers ----------
-def _version_hash(df: pd.DataFrame) -> str:
-    if df is None or df.empty:
-        return ""
-    m = hashlib.sha256()
-    m.update(pd.util.hash_pandas_object(df.fillna(""), index=True).values)
-    return m.hexdigest()[:16]
-
-
 def _compact_text(text) -> str:
     if text is None:
         return ""
@@ -65,17 +72,19 @@ def is_truthy(value) -> bool:
     return text in {"1", "TRUE", "T", "SIM", "S", "Y", "YES", "ON"}
 
 
+_RE_FLAG_NAO = re.compile(r"NA[OÕ]")          # NAO / NÃO (inclui "NÃO SE APLICA")
+_RE_FLAG_SIM = re.compile(r"SUBSTIT|SUJEITO")
+
+
 def _interpret_st_flag(value) -> bool:
     if is_truthy(value):
         return True
     text = _compact_text(value).upper()
     if not text:
         return False
-    if any(term in text for term in ("NAO", "NÃO", "NAO SE APLICA", "NÃO SE APLICA")):
+    if _RE_FLAG_NAO.search(text):
         return False
-    if "SUBSTIT" in text or "SUJEITO" in text:
-        return True
-    return False
+    return bool(_RE_FLAG_SIM.search(text))
 
 
 def _clean_numeric(value):
@@ -84,6 +93,57 @@ def _clean_numeric(value):
     return Decimal(str(value)) if value != "" else None
 
 
+# ---------- versões vetorizadas (normalize_st_am) ----------
+_RE_NAO_DIGITO = re.compile(r"\D")
+_RE_ESPACOS = re.compile(r"\s+")
+
+
+def _por_valor_distinto(col: pd.Series, fn: Callable[[pd.Series], pd.Series]) -> pd.Series:
+    """Aplica ``fn`` (vetorizada, sobre ``str(valor)``) só aos textos distintos; NA vira ""."""
+    # fatora o texto, não o valor: 12345678 e 12345678.0 são iguais no hash mas não no str()
+    codes, uniques = pd.factorize(col.astype(str).to_numpy(dtype=object))
+    out = fn(pd.Series(uniques, dtype=object)).to_numpy(dtype=object)[codes]
+    out[col.isna().to_numpy()] = ""
+    return pd.Series(out, index=col.index, dtype=object)
+
+
+def _digitos_ou_texto(texto: pd.Series) -> pd.Series:
+    digitos = texto.str.replace(_RE_NAO_DIGITO, "", regex=True)
+    vazios = digitos == ""
+    if vazios.any():
+        digitos[vazios] = texto[vazios].str.replace(_RE_ESPACOS, " ", regex=True).str.strip()
+    return digitos
+
+
+def _normalize_ncm_series(col: pd.Series) -> pd.Series:
+    """``_normalize_ncm`` coluna inteira: dígitos ou, sem dígitos, o texto compactado."""
+    return _por_valor_distinto(col, _digitos_ou_texto)
+
+
+def _normalize_cest_series(col: pd.Series) -> pd.Series:
+    """``_normalize_cest`` coluna inteira."""
+    return _por_valor_distinto(col, lambda texto: texto.str.replace(_RE_NAO_DIGITO, "", regex=True))
+
+
+def _classifica_st_flags(col: pd.Series) -> np.ndarray:
+    """
+    ``_interpret_st_flag`` coluna inteira.  A coluna de regime tem poucos
+    valores distintos ("Sim", "Não", "Substituição tributária"...): cada
+    um é classificado uma vez e o resultado é espalhado por índice.
+    """
+    codes, uniques = pd.factorize(col, use_na_sentinel=True)
+    por_valor = np.fromiter((_interpret_st_flag(v) for v in uniques), dtype=bool, count=len(uniques))
+    out = np.zeros(len(codes), dtype=bool)
+    validos = codes >= 0
+    out[validos] = por_valor[codes[validos]]
+    if not validos.all():
+        # None/NaN não são fatorados; a regra escalar decide (None -> False)
+        valores = col.to_numpy(dtype=object)
+        for i in np.flatnonzero(~validos):
+            out[i] = _interpret_st_flag(valores[i])
+    return out
+
+
 # ---------- fetch & normalize ----------
 def fetch_st_am_html() -> str:
     resp = requests.get(SEFAZ_AM_HTML, timeout=60)
@@ -94,12 +154,20 @@ def fetch_st_am_html() -> str:
 
 
 class _TableExtractor(HTMLParser):
-    def __init__(self) -> None:
+    """
+    Extrai as tabelas do HTML.  Com ``manter`` (predicado sobre a 1ª linha)
+    trabalha em streaming: tabela recusada é descartada linha a linha e só a
+    maior tabela aceita até agora fica em ``tables``.
+    """
+
+    def __init__(self, manter: Callable[[list[str]], bool] | None = None) -> None:
         super().__init__()
         self.tables: list[list[list[str]]] = []
+        self._manter = manter
         self._in_table = False
         self._in_row = False
         self._capture_cell = False
+        self._skip_table = False
         self._current_table: list[list[str]] = []
         self._current_row: list[str] = []
         self._buffer = ""
@@ -124,66 +192,78 @@ class _TableExtractor(HTMLParser):
 
     def handle_endtag(self, tag):
         if self._capture_cell and tag in {"td", "th"}:
-            text = _compact_text(self._buffer)
-            self._current_row.append(text)
+            if not self._skip_table:
+                self._current_row.append(_compact_text(self._buffer))
             self._capture_cell = False
+            self._buffer = ""
         elif self._in_row and tag == "tr":
-            if any(cell for cell in self._current_row):
-                self._current_table.append(self._current_row)
+            if not self._skip_table and any(cell for cell in self._current_row):
+                if not self._current_table and self._manter and not self._manter(self._current_row):
+                    self._skip_table = True
+                else:
+                    self._current_table.append(self._current_row)
+            self._current_row = []
             self._in_row = False
         elif self._in_table and tag == "table":
             self._close_table()
 
     def _close_table(self):
         if self._current_table:
-            self.tables.append(self._current_table)
+            if self._manter is None:
+                self.tables.append(self._current_table)
+            elif not self.tables or len(self._current_table) > len(self.tables[0]):
+                self.tables = [self._current_table]
         self._in_table = False
         self._in_row = False
         self._capture_cell = False
+        self._skip_table = False
         self._current_table = []
         self._current_row = []
         self._buffer = ""
 
 
-def parse_st_am_html(html: str) -> pd.DataFrame:
-    parser = _TableExtractor()
-    parser.feed(html)
-    tables: list[pd.DataFrame] = []
+def _tem_ncm(header: list[str]) -> bool:
+    return any("NCM" in str(h).upper() for h in header)
 
-    for raw_table in parser.tables:
-        if not raw_table:
-            continue
-        header = raw_table[0]
-        if not any("NCM" in str(h).upper() for h in header):
+
+def _tabela_para_df(raw_table: list[list[str]]) -> pd.DataFrame | None:
+    header = raw_table[0]
+    normalized_header = [str(h).strip() for h in header]
+    mapped_rows = []
+    for raw_row in raw_table[1:]:
+        if all(not _compact_text(cell) for cell in raw_row):
             continue
-        normalized_header = [str(h).strip() for h in header]
-        mapped_rows = []
-        for raw_row in raw_table[1:]:
-            if all(not _compact_text(cell) for cell in raw_row):
-                continue
-            values = raw_row[: len(normalized_header)]
-            if len(values) < len(normalized_header):
-                values += [""] * (len(normalized_header) - len(values))
-            mapped_rows.append(dict(zip(normalized_header, values)))
+        values = raw_row[: len(normalized_header)]
+        if len(values) < len(normalized_header):
+            values += [""] * (len(normalized_header) - len(values))
+        mapped_rows.append(dict(zip(normalized_header, values)))
+    if not mapped_rows:
+        return None
+    df = pd.DataFrame(mapped_rows)
+    df.columns = [str(c).strip().upper() for c in df.columns]
+    return df
 
-        if mapped_rows:
-            df = pd.DataFrame(mapped_rows)
-            df.columns = [str(c).strip().upper() for c in df.columns]
-            tables.append(df)
 
-    if not tables:
+def parse_st_am_html_stream(chunks: Iterable[str]) -> pd.DataFrame:
+    """Como ``parse_st_am_html``, consumindo o HTML em pedaços (memória ~ maior tabela NCM)."""
+    parser = _TableExtractor(manter=_tem_ncm)
+    for chunk in chunks:
+        parser.feed(chunk)
+    parser.close()
+    df = _tabela_para_df(parser.tables[0]) if parser.tables else None
+    if df is None:
         raise ValueError("Nenhuma tabela de NCM encontrada no HTML da SEFAZ/AM.")
+    return df
+
 
-    tables.sort(key=lambda frame: len(frame.index), reverse=True)
-    return tables[0]
+def parse_st_am_html(html: str) -> pd.DataFrame:
+    return parse_st_am_html_stream((html,))
 
 
 def fetch_st_am_xlsx() -> pd.DataFrame:
     r = requests.get(SEFAZ_AM_XLSX, timeout=60)
     r.raise_for_status()
-    df = pd.read_excel(io.BytesIO(r.content), engine="openpyxl")
-    df.columns = [str(c).strip().upper() for c in df.columns]
-    return df
+    return parse_xlsx_stream(io.BytesIO(r.content))
 
 
 def normalize_st_am(df: pd.DataFrame) -> dict:
@@ -196,7 +276,6 @@ def normalize_st_am(df: pd.DataFrame) -> dict:
     cest_col = _find_column(df, "CEST")
     mva_col = _find_column(df, "MVA")
     regime_col = _find_column(df, "REGIME") or _find_column(df, "SUBSTITU")
-    aplica_col = _find_column(df, "SUBSTITU") if not regime_col else None
 
     tables: dict[str, pd.DataFrame] = {}
 
@@ -212,20 +291,13 @@ def normalize_st_am(df: pd.DataFrame) -> dict:
         tables["multiplicadores"] = multiplicadores
 
     st = pd.DataFrame()
-    st["NCM"] = df[ncm_col].apply(_normalize_ncm)
-    st["CEST"] = df[cest_col].apply(_normalize_cest) if cest_col else ""
-
-    def _extract_aplica(row):
-        if regime_col:
-            value = row.get(regime_col)
-        elif aplica_col:
-            value = row.get(aplica_col)
-        else:
-            value = None
-        return 1 if _interpret_st_flag(value) else 0
-
-    st["ST_APLICA"] = df.apply(_extract_aplica, axis=1)
-    st["ATIVO"] = st["ST_APLICA"].apply(lambda v: 1 if v else 0)
+    st["NCM"] = _normalize_ncm_series(df[ncm_col])
+    st["CEST"] = _normalize_cest_series(df[cest_col]) if cest_col else ""
+    if regime_col:
+        st["ST_APLICA"] = _classifica_st_flags(df[regime_col]).astype("int64")
+    else:
+        st["ST_APLICA"] = 0
+    st["ATIVO"] = st["ST_APLICA"]
     st["CST_INCLUIR"] = ""
     st["CST_EXCLUIR"] = "40,41,50"
     st["CFOP_INI"] = ""
@@ -250,91 +322,696 @@ def normalize_st_am(df: pd.DataFrame) -> dict:
 
 
 # ---------- writer & runner ----------
-def write_to_database(tables: dict):
-    with db.session.begin():
-        if "mva" in tables:
-            df = tables["mva"].fillna("")
-            db.session.execute(delete(Mva))
-            for row in df.to_dict(orient="records"):
-                db.session.add(Mva(
-                    ncm=str(row.get("NCM", "")),
-                    segmento=row.get("SEGMENTO") or None,
-                    mva=_clean_numeric(row.get("MVA")) or Decimal("0"),
-                ))
-
-        if "multiplicadores" in tables:
-            df = tables["multiplicadores"].fillna("")
-            db.session.execute(delete(Multiplicador))
-            for row in df.to_dict(orient="records"):
-                db.session.add(Multiplicador(
-                    ncm=str(row.get("NCM", "")),
-                    regiao=row.get("REGIAO") or None,
-                    multiplicador=_clean_numeric(row.get("MULT")) or Decimal("0"),
-                ))
-
-        if "st_regras" in tables:
-            df = tables["st_regras"].fillna("")
-            db.session.execute(delete(STRegra))
-            for row in df.to_dict(orient="records"):
-                db.session.add(STRegra(
-                    ativo=is_truthy(row.get("ATIVO")),
-                    ncm=str(row.get("NCM", "")),
-                    cest=row.get("CEST") or None,
-                    cst_incluir=row.get("CST_INCLUIR") or None,
-                    cst_excluir=row.get("CST_EXCLUIR") or None,
-                    cfop_ini=row.get("CFOP_INI") or None,
-                    cfop_fim=row.get("CFOP_FIM") or None,
-                    st_aplica=is_truthy(row.get("ST_APLICA")),
-                ))
+_BATCH = 1000
+_Q4 = Decimal("0.0001")  # Numeric(10, 4)
+
+
+def _dec4(value) -> Decimal:
+    return (_clean_numeric(value) or Decimal("0")).quantize(_Q4)
+
+
+def _mva_row(row: dict) -> dict:
+    return {
+        "ncm": str(row.get("NCM", "")),
+        "segmento": row.get("SEGMENTO") or None,
+        "mva": _dec4(row.get("MVA")),
+    }
+
+
+def _mult_row(row: dict) -> dict:
+    return {
+        "ncm": str(row.get("NCM", "")),
+        "regiao": row.get("REGIAO") or None,
+        "multiplicador": _dec4(row.get("MULT")),
+    }
+
+
+def _st_row(row: dict) -> dict:
+    return {
+        "ativo": is_truthy(row.get("ATIVO")),
+        "ncm": str(row.get("NCM", "")),
+        "cest": row.get("CEST") or None,
+        "cst_incluir": row.get("CST_INCLUIR") or None,
+        "cst_excluir": row.get("CST_EXCLUIR") or None,
+        "cfop_ini": row.get("CFOP_INI") or None,
+        "cfop_fim": row.get("CFOP_FIM") or None,
+        "st_aplica": is_truthy(row.get("ST_APLICA")),
+    }
+
+
+# tabela normalizada -> (modelo, colunas-chave, colunas de valor, conversor de linha)
+_DIFF_SPECS = {
+    "mva": (Mva, ("ncm", "segmento"), ("mva",), _mva_row),
+    "multiplicadores": (Multiplicador, ("ncm", "regiao"), ("multiplicador",), _mult_row),
+    "st_regras": (
+        STRegra,
+        ("ncm", "cest"),
+        ("ativo", "cst_incluir", "cst_excluir", "cfop_ini", "cfop_fim", "st_aplica"),
+        _st_row,
+    ),
+}
+
+
+def _key(rec: dict, key_cols) -> tuple:
+    return tuple(rec.get(c) or "" for c in key_cols)
+
+
+def _diff_table(conn, model, key_cols, value_cols, desired: list[dict]):
+    """
+    Compara as linhas desejadas com o banco pela chave.
+    Retorna (inserts, updates, delete_ids).  Chaves repetidas: vale a
+    primeira ocorrência (mesma regra "primeira linha ganha" do motor).
+    """
+    table = model.__table__
+    cols = [table.c.id] + [table.c[c] for c in key_cols + value_cols]
+    atuais: dict[tuple, dict] = {}
+    delete_ids: list[int] = []
+    for r in conn.execute(select(*cols).order_by(table.c.id)).mappings():
+        k = _key(r, key_cols)
+        if k in atuais:
+            delete_ids.append(r["id"])  # duplicata antiga
+        else:
+            atuais[k] = dict(r)
 
+    inserts, updates, vistos = [], [], set()
+    for rec in desired:
+        k = _key(rec, key_cols)
+        if k in vistos:
+            continue
+        vistos.add(k)
+        atual = atuais.get(k)
+        if atual is None:
+            inserts.append(rec)
+        elif any(atual[c] != rec[c] for c in value_cols):
+            upd = {c: rec[c] for c in value_cols}
+            upd["_id"] = atual["id"]
+            updates.append(upd)
+
+    delete_ids.extend(a["id"] for k, a in atuais.items() if k not in vistos)
+    return inserts, updates, delete_ids
+
+
+def _bulk_insert(conn, table, rows: list[dict]) -> None:
+    if conn.dialect.name == "postgresql" and conn.dialect.driver == "psycopg":
+        # COPY ... FROM STDIN: bem mais rápido que INSERT em massa no Postgres
+        now = datetime.utcnow()
+        cols = list(rows[0].keys())
+        sql = f"COPY {table.name} ({', '.join(cols)}, created_at, updated_at) FROM STDIN"
+        cur = conn.connection.cursor()
+        try:
+            with cur.copy(sql) as cp:
+                for r in rows:
+                    cp.write_row([r[c] for c in cols] + [now, now])
+        finally:
+            cur.close()
+        return
+    for i in range(0, len(rows), _BATCH):
+        conn.execute(insert(table), rows[i:i + _BATCH])
+
+
+def _apply_diff(conn, model, inserts, updates, delete_ids) -> None:
+    table = model.__table__
+    if delete_ids:
+        stmt = delete(table).where(table.c.id == bindparam("_id"))
+        for i in range(0, len(delete_ids), _BATCH):
+            conn.execute(stmt, [{"_id": x} for x in delete_ids[i:i + _BATCH]])
+    if updates:
+        # SET vem das chaves dos parâmetros (updated_at via onupdate)
+        stmt = update(table).where(table.c.id == bindparam("_id"))
+        for i in range(0, len(updates), _BATCH):
+            conn.execute(stmt, updates[i:i + _BATCH])
+    if inserts:
+        _bulk_insert(conn, table, inserts)
+
+
+def write_to_database(tables: dict) -> dict:
+    """
+    Sincroniza mva/multiplicadores/st_regras com as tabelas normalizadas
+    aplicando só a diferença (insert/update/delete em lote), numa única
+    transação.  Leitores nunca veem a tabela vazia no meio da carga.
+    Retorna {tabela: {"inseridas", "atualizadas", "removidas"}}.
+    """
+    stats: dict[str, dict] = {}
+    try:
+        conn = db.session.connection()
+        for name, (model, key_cols, value_cols, to_row) in _DIFF_SPECS.items():
+            if name not in tables:
+                continue
+            df = tables[name].fillna("")
+            desired = [to_row(row) for row in df.to_dict(orient="records")]
+            inserts, updates, delete_ids = _diff_table(conn, model, key_cols, value_cols, desired)
+            _apply_diff(conn, model, inserts, updates, delete_ids)
+            stats[name] = {
+                "inseridas": len(inserts),
+                "atualizadas": len(updates),
+                "removidas": len(delete_ids),
+            }
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    return stats
 
-def run_update_am():
-    dt_now = datetime.now()
-    status = "ERRO"
-    msg = ""
-    n = 0
-    version = ""
-    nome = "ST AM – HTML"
 
-    html_error: Exception | None = None
+def _resumo_stats(stats: dict) -> str:
+    return "; ".join(
+        f"{t}: +{s['inseridas']} ~{s['atualizadas']} -{s['removidas']}" for t, s in stats.items()
+    )
+
+
+def _last_ok_version(uf: str, nome: str) -> str | None:
+    """Versão da última atualização bem-sucedida (SourceLog OK) com esse nome."""
+    try:
+        return db.session.execute(
+            select(SourceLog.versao)
+            .where(
+                SourceLog.uf == uf,
+                SourceLog.nome == nome,
+                SourceLog.status == "OK",
+                SourceLog.versao.isnot(None),
+            )
+            .order_by(SourceLog.executado_em.desc(), SourceLog.id.desc())
+            .limit(1)
+        ).scalar()
+    except Exception:
+        db.session.rollback()
+        return None
+
+
+# ---------- fontes: parsers, coleta e runner ----------
+PARSERS: dict[str, Callable[[BinaryIO], pd.DataFrame]] = {}
+
+
+def register_parser(*nomes: str):
+    """
+    Registra um parser sob um ou mais nomes (``Source.parser``).  O parser
+    recebe um arquivo binário posicionado no início (seekable) e devolve
+    um DataFrame com o cabeçalho em maiúsculas.
+    """
+    def deco(fn):
+        for nome in nomes:
+            PARSERS[nome.lower()] = fn
+        return fn
+    return deco
+
+
+_CHUNK = 64 * 1024
+_ENCODINGS = ("utf-8", "cp1252", "latin-1")
+
+
+def _chunks_texto(fh: BinaryIO, encoding: str) -> Iterator[str]:
+    dec = codecs.getincrementaldecoder(encoding)()
+    while chunk := fh.read(_CHUNK):
+        yield dec.decode(chunk)
+    yield dec.decode(b"", final=True)
+
+
+@register_parser("html", "htm", "st_am_html")
+def parse_html_stream(fh: BinaryIO) -> pd.DataFrame:
+    # utf-8 primeiro; se quebrar no meio, recomeça do início com cp1252/latin-1
+    for enc in _ENCODINGS:
+        fh.seek(0)
+        try:
+            return parse_st_am_html_stream(_chunks_texto(fh, enc))
+        except UnicodeDecodeError:
+            continue
+    raise ValueError("HTML com codificação desconhecida.")
+
+
+@register_parser("xlsx", "xls", "st_am_xlsx")
+def parse_xlsx_stream(fh: BinaryIO) -> pd.DataFrame:
+    """1ª planilha em modo read-only do openpyxl (linha a linha, sem carregar o workbook)."""
+    wb = openpyxl.load_workbook(fh, read_only=True, data_only=True)
+    try:
+        rows = wb.worksheets[0].iter_rows(values_only=True)
+        header = next(rows, None) or ()
+        cols = [
+            str(c).strip().upper() if c is not None else f"UNNAMED: {i}"
+            for i, c in enumerate(header)
+        ]
+        data = [
+            row[: len(cols)] for row in rows
+            if any(v is not None and v != "" for v in row)
+        ]
+    finally:
+        wb.close()
+    return pd.DataFrame.from_records(data, columns=cols)
+
+
+@register_parser("csv")
+def parse_csv_stream(fh: BinaryIO) -> pd.DataFrame:
+    for enc in _ENCODINGS:
+        fh.seek(0)
+        texto = io.TextIOWrapper(fh, encoding=enc, newline="")
+        try:
+            df = pd.read_csv(texto, sep=None, engine="python", dtype=str)
+        except UnicodeDecodeError:
+            continue
+        finally:
+            texto.detach()
+        df.columns = [str(c).strip().upper() for c in df.columns]
+        return df
+    raise ValueError("CSV com codificação desconhecida.")
+
+
+# Plugins ``pacote.modulo:funcao`` liberados em código; a config
+# ``UPDATER_PARSER_PLUGINS`` (separados por vírgula) acrescenta outros.
+# ``Source.parser`` é editável pelo admin: nada fora daqui é importado.
+PARSER_PLUGINS: set[str] = set()
+
+
+def _plugins_permitidos() -> set[str]:
+    extra = current_app.config.get("UPDATER_PARSER_PLUGINS", "") if has_app_context() else ""
+    return PARSER_PLUGINS | {p.strip() for p in (extra or "").split(",") if p.strip()}
+
+
+def resolve_parser(nome: str | None) -> Callable[[BinaryIO], pd.DataFrame]:
+    """Nome registrado (``html``, ``xlsx``, ``csv``...) ou plugin ``pacote.modulo:funcao`` liberado."""
+    chave = (nome or "").strip()
+    fn = PARSERS.get(chave.lower())
+    if fn is not None:
+        return fn
+    if ":" in chave:
+        if chave not in _plugins_permitidos():
+            raise ValueError(f"Parser não permitido: {nome!r} (libere em UPDATER_PARSER_PLUGINS)")
+        modulo, _, attr = chave.partition(":")
+        return getattr(importlib.import_module(modulo), attr)
+    raise ValueError(f"Parser desconhecido: {nome!r}")
+
+
+@dataclass(frozen=True)
+class Fonte:
+    """Cópia de ``Source`` usada fora da sessão (threads de coleta)."""
+    nome: str
+    uf: str | None
+    url: str
+    parser: str
+    prioridade: int = 0
+
+
+DEFAULT_SOURCES = {
+    "AM": (
+        Fonte("ST AM – HTML", "AM", SEFAZ_AM_HTML, "html", 1),
+        Fonte("ST AM – XLSX", "AM", SEFAZ_AM_XLSX, "xlsx", 2),
+    ),
+}
+
+
+def _parser_da_fonte(src: Source) -> str:
+    """``Source.parser``; se não for conhecido, ``Source.tipo`` ou a extensão da URL."""
+    nome = (src.parser or "").strip()
+    if nome.lower() in PARSERS or ":" in nome:
+        return nome
+    tipo = (src.tipo or "").strip()
+    if tipo.lower() in PARSERS:
+        return tipo
+    ext = os.path.splitext(urlparse(src.url or "").path)[1].lstrip(".")
+    return ext if ext.lower() in PARSERS else (nome or tipo or ext)
+
+
+def fontes_ativas(uf: str) -> list[Fonte]:
+    """Sources ativas da UF (ou sem UF) por prioridade; padrões da UF se não houver nenhuma."""
+    rows = db.session.execute(
+        select(Source).where(
+            Source.ativo.is_(True),
+            Source.url.isnot(None),
+            (Source.uf == uf) | Source.uf.is_(None),
+        ).order_by(Source.id)
+    ).scalars().all()
+    fontes = [
+        Fonte(r.nome or r.url, r.uf or uf, r.url, _parser_da_fonte(r), r.prioridade or 0)
+        for r in rows
+        if (r.url or "").strip()
+    ]
+    if not fontes:
+        fontes = list(DEFAULT_SOURCES.get(uf, ()))
+    # sem prioridade vai para o fim; empate mantém a ordem de cadastro
+    return sorted(fontes, key=lambda f: (f.prioridade <= 0, f.prioridade))
+
+
+class FetchCache:
+    """
+    Cache local das coletas, um par de arquivos por URL em ``diretorio``:
+    ``<chave>.json`` (ETag, Last-Modified, sha256 do conteúdo, versão, linhas)
+    e ``<chave>.pkl`` (tabelas já normalizadas).  Permite requisições
+    condicionais e evita parse/normalização quando o conteúdo não mudou.
+    """
+
+    def __init__(self, diretorio: str):
+        self.diretorio = diretorio
+        os.makedirs(diretorio, exist_ok=True)
+
+    def _path(self, url: str, ext: str) -> str:
+        chave = hashlib.sha1(url.encode("utf-8")).hexdigest()
+        return os.path.join(self.diretorio, f"{chave}.{ext}")
+
+    def meta(self, url: str) -> dict:
+        """Metadados da última coleta (vazio se não há tabelas em cache)."""
+        try:
+            with open(self._path(url, "json"), encoding="utf-8") as fh:
+                meta = json.load(fh)
+        except (OSError, ValueError):
+            return {}
+        return meta if os.path.exists(self._path(url, "pkl")) else {}
+
+    def tabelas(self, url: str) -> dict:
+        return pd.read_pickle(self._path(url, "pkl"))
+
+    def _gravar(self, path: str, escrever) -> None:
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        escrever(tmp)
+        os.replace(tmp, path)
+
+    def salvar(self, url: str, meta: dict, tabelas: dict | None = None) -> None:
+        if tabelas is not None:
+            self._gravar(self._path(url, "pkl"), lambda tmp: pd.to_pickle(tabelas, tmp))
+
+        def _json(tmp):
+            with open(tmp, "w", encoding="utf-8") as fh:
+                json.dump(meta, fh)
+        self._gravar(self._path(url, "json"), _json)
+
+
+_SPOOL_MAX = 8 * 1024 * 1024
+
+
+def _caminho_local(url: str) -> str | None:
+    """Caminho de uma fonte local (``file://`` ou caminho puro); None se for remota."""
+    if url.startswith("file://"):
+        return url2pathname(urlparse(url).path)
+    return None if "://" in url else url
+
+
+def validar_url(url: str) -> None:
+    """
+    Recusa (``ValueError``) URLs de fonte que o updater não deve abrir: só
+    http(s); arquivo local apenas dentro de ``UPDATER_LOCAL_DIR`` (fixtures e
+    espelhos; vazio = nenhum).  A URL das fontes é editável no admin.
+    """
+    local = _caminho_local(url)
+    if local is None:
+        if urlparse(url).scheme.lower() not in ("http", "https"):
+            raise ValueError(f"URL não permitida: {url!r} (use http ou https)")
+        return
+    base = current_app.config.get("UPDATER_LOCAL_DIR", "") if has_app_context() else ""
+    raiz = os.path.realpath(base) if base else ""
+    if not raiz or os.path.commonpath([os.path.realpath(local), raiz]) != raiz:
+        raise ValueError(f"Arquivo local não permitido: {url!r} (fora de UPDATER_LOCAL_DIR)")
+
+
+def _abrir_local(url: str) -> BinaryIO:
+    return open(_caminho_local(url), "rb")
+
+
+def _baixar(url: str, timeout: float, headers: dict | None = None) -> tuple[BinaryIO | None, str, int, dict]:
+    """
+    HTTP(S) via requests em streaming; ``file://`` ou caminho local para
+    fixtures/espelhos (já conferidos por ``validar_url``).  O conteúdo vai para um arquivo temporário (em disco
+    acima de 8 MB) enquanto o sha256 é calculado.
+    Devolve (arquivo no início, sha256, bytes, headers); arquivo ``None`` = 304.
+    """
+    sha = hashlib.sha256()
+    if "://" not in url or url.startswith("file://"):
+        fh = _abrir_local(url)
+        n = 0
+        while chunk := fh.read(_CHUNK):
+            sha.update(chunk)
+            n += len(chunk)
+        fh.seek(0)
+        return fh, sha.hexdigest(), n, {}
+
+    with requests.get(url, timeout=timeout, headers=headers or None, stream=True) as resp:
+        if resp.status_code == 304:
+            return None, "", 0, dict(resp.headers)
+        resp.raise_for_status()
+        fh = tempfile.SpooledTemporaryFile(max_size=_SPOOL_MAX)
+        n = 0
+        for chunk in resp.iter_content(_CHUNK):
+            sha.update(chunk)
+            fh.write(chunk)
+            n += len(chunk)
+        fh.seek(0)
+        return fh, sha.hexdigest(), n, dict(resp.headers)
+
+
+@dataclass
+class Coleta:
+    fonte: Fonte
+    ok: bool = False
+    tabelas: dict | None = None
+    linhas: int = 0
+    versao: str = ""
+    erro: str = ""
+    inalterada: bool = False   # 304 ou mesmo sha256: tabelas vêm do cache
+    bytes: int = 0
+    latencia_ms: int = 0
+    cache: FetchCache | None = None
+
+    def carregar_tabelas(self) -> dict:
+        if self.tabelas is None and self.ok and self.cache is not None:
+            self.tabelas = self.cache.tabelas(self.fonte.url)
+        return self.tabelas or {}
+
+
+def _coletar(fonte: Fonte, timeout: float, cache: FetchCache | None = None,
+             parser: Callable[[BinaryIO], pd.DataFrame] | None = None) -> Coleta:
+    """Baixa, faz o parse e normaliza uma fonte (roda em thread, sem sessão)."""
+    coleta = Coleta(fonte, cache=cache)
+    inicio = time.perf_counter()
     try:
-        html = fetch_st_am_html()
-        df_raw = parse_st_am_html(html)
-        version = _version_hash(df_raw)
-        tables = normalize_st_am(df_raw)
-        write_to_database(tables)
-        status = "OK"
-        msg = "Atualizado via HTML SEFAZ/AM"
-        n = len(df_raw.index)
-    except Exception as err_html:
-        html_error = err_html
-        nome = "ST AM – XLSX"
+        meta = cache.meta(fonte.url) if cache is not None else {}
+        headers = {}
+        if meta.get("etag"):
+            headers["If-None-Match"] = meta["etag"]
+        if meta.get("last_modified"):
+            headers["If-Modified-Since"] = meta["last_modified"]
+
+        arquivo, sha, coleta.bytes, resp_headers = _baixar(fonte.url, timeout, headers)
         try:
-            df_raw = fetch_st_am_xlsx()
-            version = _version_hash(df_raw)
-            tables = normalize_st_am(df_raw)
-            write_to_database(tables)
+            if arquivo is None:
+                sha = meta.get("sha256")
+
+            if meta and sha == meta.get("sha256"):
+                coleta.inalterada = True
+                coleta.linhas, coleta.versao = meta.get("linhas", 0), meta.get("versao", "")
+                novo = dict(meta,
+                            etag=resp_headers.get("ETag") or meta.get("etag"),
+                            last_modified=resp_headers.get("Last-Modified") or meta.get("last_modified"))
+                if novo != meta:
+                    cache.salvar(fonte.url, novo)
+            else:
+                if arquivo is None:
+                    raise ValueError("304 sem conteúdo em cache")
+                df = (parser or resolve_parser(fonte.parser))(arquivo)
+                coleta.tabelas = normalize_st_am(df)
+                coleta.linhas, coleta.versao = len(df.index), sha[:16]
+                del df
+                if cache is not None:
+                    cache.salvar(fonte.url, {
+                        "url": fonte.url,
+                        "etag": resp_headers.get("ETag"),
+                        "last_modified": resp_headers.get("Last-Modified"),
+                        "sha256": sha,
+                        "versao": coleta.versao,
+                        "linhas": coleta.linhas,
+                    }, coleta.tabelas)
+        finally:
+            if arquivo is not None:
+                arquivo.close()
+        coleta.ok = True
+    except Exception as err:
+        coleta.erro = str(err) or type(err).__name__
+    coleta.latencia_ms = int((time.perf_counter() - inicio) * 1000)
+    return coleta
+
+
+def coletar_fontes(
+    fontes: list[Fonte],
+    max_workers: int = 4,
+    timeout: float = 60,
+    cache: FetchCache | None = None,
+) -> list[Coleta]:
+    """Coleta as fontes em paralelo (no máx. ``max_workers``), na ordem de ``fontes``."""
+    if not fontes:
+        return []
+    # URL e parser conferidos aqui (com app context): fonte recusada nem é baixada
+    parsers: dict[int, Callable[[BinaryIO], pd.DataFrame]] = {}
+    recusadas: dict[int, Coleta] = {}
+    for i, f in enumerate(fontes):
+        try:
+            validar_url(f.url)
+            parsers[i] = resolve_parser(f.parser)
+        except Exception as err:
+            recusadas[i] = Coleta(f, erro=str(err))
+    workers = max(1, min(max_workers, len(fontes)))
+    pool = ThreadPoolExecutor(max_workers=workers)
+    futures = {i: pool.submit(_coletar, f, timeout, cache, parsers[i]) for i, f in enumerate(fontes) if i in parsers}
+    # limite total: ``timeout`` por lote de ``workers`` fontes
+    lotes = -(-max(len(futures), 1) // workers)
+    done, _ = wait(list(futures.values()), timeout=timeout * lotes)
+    pool.shutdown(wait=False, cancel_futures=True)
+    return [
+        recusadas[i] if i in recusadas
+        else futures[i].result() if futures[i] in done
+        else Coleta(fonte, erro=f"timeout ({timeout:g}s)", latencia_ms=int(timeout * lotes * 1000))
+        for i, fonte in enumerate(fontes)
+    ]
+
+
+def merge_tabelas(coletas: list[Coleta]) -> dict:
+    """Concatena as tabelas normalizadas por prioridade (a 1ª ocorrência da chave vale)."""
+    partes: dict[str, list[pd.DataFrame]] = {}
+    for c in coletas:
+        for nome, df in c.carregar_tabelas().items():
+            partes.setdefault(nome, []).append(df)
+    return {nome: pd.concat(dfs, ignore_index=True) for nome, dfs in partes.items()}
+
+
+def _com_ultima_copia(uf: str, coletas: list[Coleta], cache: FetchCache | None) -> tuple[list[Coleta], list[str]]:
+    """
+    Coletas para o merge, na ordem de prioridade: fonte que falhou entra com
+    as últimas tabelas boas do ``FetchCache`` (senão o diff apagaria as regras
+    só dela, e uma fonte de prioridade menor ganharia as chaves dela).
+    Devolve também as fontes que falharam sem cópia em cache mas já tiveram
+    coleta OK: sem elas a gravação não é segura.
+    """
+    merge, sem_copia = [], []
+    for c in coletas:
+        if c.ok:
+            merge.append(c)
+            continue
+        meta = cache.meta(c.fonte.url) if cache is not None else {}
+        if meta:
+            merge.append(Coleta(c.fonte, ok=True, inalterada=True, linhas=meta.get("linhas", 0),
+                                versao=meta.get("versao", ""), cache=cache))
+        elif _last_ok_version(uf, c.fonte.nome) is not None:
+            sem_copia.append(c.fonte.nome)
+    return merge, sem_copia
+
+
+def _log(uf: str, nome: str, status: str, mensagem: str, linhas: int, versao: str,
+         quando=None, bytes: int | None = None, latencia_ms: int | None = None) -> None:
+    db.session.add(SourceLog(
+        executado_em=quando or datetime.now(),
+        uf=uf,
+        nome=nome,
+        status=status,
+        mensagem=mensagem,
+        linhas=linhas,
+        versao=versao,
+        bytes=bytes,
+        latencia_ms=latencia_ms,
+    ))
+
+
+def prune_sources_log(retencao_dias: int = 90) -> int:
+    """
+    Retenção do ``sources_log``: apaga entradas com mais de ``retencao_dias``,
+    exceto a última OK de cada (uf, nome) — base do "Sem alterações" e do
+    histórico mínimo por fonte.  Sem commit; devolve o nº de linhas apagadas.
+    """
+    if not retencao_dias or retencao_dias <= 0:
+        return 0
+    limite = datetime.now() - timedelta(days=retencao_dias)
+    ultimas_ok = (
+        select(func.max(SourceLog.id))
+        .where(SourceLog.status == "OK")
+        .group_by(SourceLog.uf, SourceLog.nome)
+    )
+    res = db.session.execute(
+        delete(SourceLog).where(SourceLog.executado_em < limite, SourceLog.id.not_in(ultimas_ok))
+    )
+    return res.rowcount or 0
+
+
+def _fetch_cache() -> FetchCache | None:
+    if not has_app_context():
+        return None
+    diretorio = current_app.config.get("UPDATER_CACHE_DIR") or os.path.join(
+        current_app.instance_path, "fetch_cache"
+    )
+    try:
+        return FetchCache(diretorio)
+    except OSError:
+        return None
+
+
+def run_update_sources(
+    uf: str = "AM",
+    max_workers: int | None = None,
+    timeout: float | None = None,
+    cache: FetchCache | None = None,
+) -> dict:
+    """
+    Atualiza as regras da UF a partir das fontes ativas (``sources``).
+    Cada fonte gera um ``SourceLog`` (com bytes e latência); o consolidado
+    (``ST <UF> – consolidado``) guarda a versão combinada e a gravação é
+    pulada se ela não mudou.  Com o ``FetchCache`` as requisições são
+    condicionais: fonte inalterada não é baixada nem normalizada de novo.
+    Fonte que falhar entra no merge com a última cópia boa do cache; se não
+    houver cópia de uma fonte que já funcionou, nada é gravado (ERRO).
+    """
+    cfg = current_app.config if has_app_context() else {}
+    max_workers = max_workers or int(cfg.get("UPDATER_MAX_WORKERS", 4))
+    timeout = timeout or float(cfg.get("UPDATER_TIMEOUT", 60))
+    cache = cache or _fetch_cache()
+    nome_consolidado = f"ST {uf} – consolidado"
+
+    dt_now = datetime.now()
+    coletas = coletar_fontes(fontes_ativas(uf), max_workers=max_workers, timeout=timeout, cache=cache)
+    ok = [c for c in coletas if c.ok]
+    falhas = [c for c in coletas if not c.ok]
+
+    status, msg, versao, linhas = "ERRO", "", "", 0
+    alterado = False  # regras gravadas mudaram (carimbo novo): o chamador recalcula as notas
+    try:
+        merge, sem_copia = _com_ultima_copia(uf, coletas, cache) if ok else ([], [])
+        linhas = sum(c.linhas for c in merge)
+        if not ok:
+            msg = "; ".join(f"{c.fonte.nome}: {c.erro}" for c in coletas) or "Nenhuma fonte ativa"
+        elif sem_copia:
+            msg = "Gravação suspensa, fontes com falha e sem cópia em cache: " + ", ".join(sem_copia)
+        else:
+            m = hashlib.sha256()
+            for c in merge:
+                m.update(f"{c.fonte.nome}={c.versao};".encode("utf-8"))
+            versao = m.hexdigest()[:16]
+            if versao == _last_ok_version(uf, nome_consolidado):
+                msg = "Sem alterações"
+            else:
+                stats = write_to_database(merge_tabelas(merge))
+                msg = "Atualizado (" + _resumo_stats(stats) + ")"
+                if any(sum(st.values()) for st in stats.values()):
+                    from oraculoicms_app.services.sheets_service import bump_rules_stamp
+                    bump_rules_stamp(versao)
+                    alterado = True
             status = "OK"
-            msg = "Atualizado via XLSX SEFAZ/AM (fallback)"
-            if html_error:
-                msg += f"; HTML: {html_error}"
-            n = len(df_raw.index)
-        except Exception as err_xlsx:
-            status = "ERRO"
-            msg = f"HTML: {html_error}; XLSX: {err_xlsx}"
-            n = 0
-            version = ""
+            if falhas:
+                no_merge = {id(c.fonte) for c in merge}
+                msg += "; falhas: " + ", ".join(
+                    c.fonte.nome + (" (última cópia)" if id(c.fonte) in no_merge else "") for c in falhas
+                )
+    except Exception as err:
+        status, msg = "ERRO", str(err)
 
     try:
-        with db.session.begin():
-            db.session.add(SourceLog(
-                executado_em=dt_now,
-                uf="AM",
-                nome=nome,
-                status=status,
-                mensagem=msg,
-                linhas=n,
-                versao=version,
-            ))
+        for c in coletas:
+            if c.ok:
+                detalhe = f"{c.linhas} linhas" + (" (inalterada)" if c.inalterada else "")
+            else:
+                detalhe = c.erro
+            _log(uf, c.fonte.nome, "OK" if c.ok else "ERRO", detalhe, c.linhas, c.versao,
+                 dt_now, bytes=c.bytes, latencia_ms=c.latencia_ms)
+        _log(uf, nome_consolidado, status, msg, linhas, versao, dt_now,
+             bytes=sum(c.bytes for c in coletas),
+             latencia_ms=max((c.latencia_ms for c in coletas), default=0))
+        prune_sources_log(int(cfg.get("SOURCES_LOG_RETENTION_DAYS", 90)))
+        db.session.commit()
     except Exception:
         db.session.rollback()
+
+    return {"status": status, "mensagem": msg, "versao": versao, "alterado": alterado, "fontes": coletas}
+
+
+def run_update_am():
+    return run_update_sources("AM")
@@ -147,89 +147,107 @@ class NFEXML:
         return {k: f(k) for k in keys}
 
     # ------------------------------- Itens -------------------------------------
-    def itens(self) -> List[NFItem]:
-        dets = self._findall("det")
-        tmp: List[Dict[str, Any]] = []
-        soma_vprod = Decimal("0")
+    # Em duas fases:
+    #   1) ``_ler_det`` — leitura de cada <det>, independente dos demais;
+    #   2) ``montar_itens`` — rateio de frete/outros, que depende das somas da nota.
+    # Cada item recebe q2(total * vProd/soma): o rateio de um item não depende
+    # dos vizinhos.
+
+    def _dets(self) -> List[ET.Element]:
+        return self._findall("det")
+
+    def n_itens(self) -> int:
+        return len(self._dets())
+
+    def _ler_det(self, det: ET.Element) -> Dict[str, Any]:
+        prod = det.find(self._mkpath("prod"))
+        imposto = det.find(self._mkpath("imposto"))
+
+        nItem = det.attrib.get("nItem", "").strip()
+        cProd = self._txt(prod, "cProd")
+        xProd = self._txt(prod, "xProd")
+        ncm   = self._txt(prod, "NCM")
+        cfop  = self._txt(prod, "CFOP")
+        uCom  = self._txt(prod, "uCom")
+        uTrib = self._txt(prod, "uTrib")
+        cEAN  = self._txt(prod, "cEAN")
+        cEANTrib = self._txt(prod, "cEANTrib")
+        cest  = self._txt(prod, "CEST")
+
+        qCom  = D(self._txt(prod, "qCom", "0"))
+        vUnCom= D(self._txt(prod, "vUnCom", "0"))
+        vProd = q2(qCom * vUnCom)
+
+        # ICMS
+        cst = ""
+        vICMSDeson = Decimal("0")
+        pMVAST = Decimal("0")
+        pICMSST = Decimal("0")
+        vBCST = Decimal("0")
+        vICMSST = Decimal("0")
+        vBCSTRet = Decimal("0")
+        vICMSSTRet = Decimal("0")
+        icms = imposto.find(self._mkpath("ICMS")) if imposto is not None else None
+        if icms is not None:
+            for child in list(icms):
+                cst = self._txt(child, "CST") or self._txt(child, "CSOSN") or ""
+                vICMSDeson = D(self._txt(child, "vICMSDeson", "0"))
+                pMVAST = D(self._txt(child, "pMVAST", "0"))
+                pICMSST = D(self._txt(child, "pICMSST", "0"))
+                vBCST = D(self._txt(child, "vBCST", "0"))
+                vICMSST = D(self._txt(child, "vICMSST", "0"))
+                vBCSTRet = D(self._txt(child, "vBCSTRet", "0"))
+                vICMSSTRet = D(self._txt(child, "vICMSSTRet", "0"))
+                break
+
+        vIPI = Decimal("0")
+        ipi = imposto.find(self._mkpath("IPI")) if imposto is not None else None
+        if ipi is not None:
+            vIPI = D(self._txt(ipi, "IPITrib/vIPI", "0"))
+
+        vFrete_item = D(self._txt(prod, "vFrete", "0"))
 
-        for det in dets:
-            prod = det.find(self._mkpath("prod"))
-            imposto = det.find(self._mkpath("imposto"))
-
-            nItem = det.attrib.get("nItem", "").strip()
-            cProd = self._txt(prod, "cProd")
-            xProd = self._txt(prod, "xProd")
-            ncm   = self._txt(prod, "NCM")
-            cfop  = self._txt(prod, "CFOP")
-            uCom  = self._txt(prod, "uCom")
-            uTrib = self._txt(prod, "uTrib")
-            cEAN  = self._txt(prod, "cEAN")
-            cEANTrib = self._txt(prod, "cEANTrib")
-            cest  = self._txt(prod, "CEST")
-
-            qCom  = D(self._txt(prod, "qCom", "0"))
-            vUnCom= D(self._txt(prod, "vUnCom", "0"))
-            vProd = q2(qCom * vUnCom)
-
-            # ICMS
-            cst = ""
-            vICMSDeson = Decimal("0")
-            pMVAST = Decimal("0")
-            pICMSST = Decimal("0")
-            vBCST = Decimal("0")
-            vICMSST = Decimal("0")
-            vBCSTRet = Decimal("0")
-            vICMSSTRet = Decimal("0")
-            icms = imposto.find(self._mkpath("ICMS")) if imposto is not None else None
-            if icms is not None:
-                for child in list(icms):
-                    cst = self._txt(child, "CST") or self._txt(child, "CSOSN") or ""
-                    vICMSDeson = D(self._txt(child, "vICMSDeson", "0"))
-                    pMVAST = D(self._txt(child, "pMVAST", "0"))
-                    pICMSST = D(self._txt(child, "pICMSST", "0"))
-                    vBCST = D(self._txt(child, "vBCST", "0"))
-                    vICMSST = D(self._txt(child, "vICMSST", "0"))
-                    vBCSTRet = D(self._txt(child, "vBCSTRet", "0"))
-                    vICMSSTRet = D(self._txt(child, "vICMSSTRet", "0"))
-                    break
-
-            vIPI = Decimal("0")
-            ipi = imposto.find(self._mkpath("IPI")) if imposto is not None else None
-            if ipi is not None:
-                vIPI = D(self._txt(ipi, "IPITrib/vIPI", "0"))
-
-            vFrete_item = D(self._txt(prod, "vFrete", "0"))
-
-            tmp.append({
-                "nItem": nItem, "cProd": cProd, "xProd": xProd,
-                "ncm": ncm, "cfop": cfop, "cst": cst,
-                "qCom": qCom, "vUnCom": vUnCom, "vProd": vProd,
-                "vIPI": vIPI, "vICMSDeson": vICMSDeson,
-                "vFrete_item": vFrete_item,
-                "uCom": uCom, "uTrib": uTrib, "cEAN": cEAN, "cEANTrib": cEANTrib, "cest": cest,
-                "pMVAST": pMVAST, "pICMSST": pICMSST,
-                "vBCST": q2(vBCST), "vICMSST": q2(vICMSST),
-                "vBCSTRet": q2(vBCSTRet), "vICMSSTRet": q2(vICMSSTRet),
-            })
-            soma_vprod += vProd
+        return {
+            "nItem": nItem, "cProd": cProd, "xProd": xProd,
+            "ncm": ncm, "cfop": cfop, "cst": cst,
+            "qCom": qCom, "vUnCom": vUnCom, "vProd": vProd,
+            "vIPI": vIPI, "vICMSDeson": vICMSDeson,
+            "vFrete_item": vFrete_item,
+            "uCom": uCom, "uTrib": uTrib, "cEAN": cEAN, "cEANTrib": cEANTrib, "cest": cest,
+            "pMVAST": pMVAST, "pICMSST": pICMSST,
+            "vBCST": q2(vBCST), "vICMSST": q2(vICMSST),
+            "vBCSTRet": q2(vBCSTRet), "vICMSSTRet": q2(vICMSSTRet),
+        }
 
-        # rateio frete/outros
+    def ler_dets(self, inicio: int = 0, fim: Optional[int] = None) -> List[Dict[str, Any]]:
+        """Fase 1 para os <det> no intervalo [inicio, fim) (todos por padrão)."""
+        return [self._ler_det(det) for det in self._dets()[inicio:fim]]
+
+    def rateio(self, tmp: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """Somas da nota que o rateio precisa (sobre *todos* os itens lidos, em ordem)."""
         icmstot = self._find("total/ICMSTot")
-        vFrete_total = self._num(icmstot, "vFrete") if icmstot is not None else Decimal("0")
-        vOutro_total = self._num(icmstot, "vOutro") if icmstot is not None else Decimal("0")
+        return {
+            "soma_vprod": sum((r["vProd"] for r in tmp), Decimal("0")),
+            "usar_frete_item": sum((r["vFrete_item"] for r in tmp), Decimal("0")) > 0,
+            "vFrete_total": self._num(icmstot, "vFrete") if icmstot is not None else Decimal("0"),
+            "vOutro_total": self._num(icmstot, "vOutro") if icmstot is not None else Decimal("0"),
+        }
 
-        soma_frete_item = sum((r["vFrete_item"] for r in tmp), Decimal("0"))
-        usar_frete_item = soma_frete_item > 0
+    @staticmethod
+    def montar_itens(tmp: List[Dict[str, Any]], rateio: Dict[str, Any]) -> List[NFItem]:
+        """Fase 2: rateio frete/outros e ``NFItem`` final de cada linha lida."""
+        soma_vprod = rateio["soma_vprod"]
+        vFrete_total = rateio["vFrete_total"]
+        vOutro_total = rateio["vOutro_total"]
+        usar_frete_item = rateio["usar_frete_item"]
 
         itens: List[NFItem] = []
         for r in tmp:
+            prop = (r["vProd"]/soma_vprod) if soma_vprod > 0 else Decimal("0")
             if usar_frete_item:
                 vFrete_i = q2(r["vFrete_item"])
             else:
-                prop = (r["vProd"]/soma_vprod) if soma_vprod > 0 else Decimal("0")
                 vFrete_i = q2(vFrete_total * prop)
-
-            prop = (r["vProd"]/soma_vprod) if soma_vprod > 0 else Decimal("0")
             vOutro_i = q2(vOutro_total * prop)
 
             itens.append(NFItem(
@@ -244,6 +262,23 @@ class NFEXML:
             ))
         return itens
 
+    def itens(self) -> List[NFItem]:
+        tmp = self.ler_dets()
+        return self.montar_itens(tmp, self.rateio(tmp))
+
+    def produtos(self) -> List[Dict[str, str]]:
+        """Só identificação dos produtos (nItem, cProd, xProd, NCM), sem impostos nem rateio."""
+        out = []
+        for det in self._dets():
+            prod = det.find(self._mkpath("prod"))
+            out.append({
+                "nItem": det.attrib.get("nItem", "").strip(),
+                "cProd": self._txt(prod, "cProd"),
+                "xProd": self._txt(prod, "xProd"),
+                "NCM": self._txt(prod, "NCM"),
+            })
+        return out
+
     # extras usados no template (se quiser usar depois)
     def transporte(self) -> Dict[str, Any]:
         transp = self._find("transp")